@@ -11,8 +11,10 @@ import { useConfirm } from "@/context/ConfirmContext";
 import { useToast } from "@/context/ToastContext";
 import { useAuth } from "@/context/AuthContext";
 import {
+  type BroadcastProgress,
   broadcastNotification,
   cancelScheduledNotification,
+  fetchBroadcastProgress,
   fetchNotifications,
   fetchScheduledNotifications,
   processScheduledNotifications,
@@ -56,6 +58,7 @@ export default function NotificationsPage() {
   });
   const [sending, setSending] = useState(false);
   const [schedBusy, setSchedBusy] = useState(false);
+  const [progress, setProgress] = useState<BroadcastProgress | null>(null);
 
   useEffect(() => {
     getFilterMeta()
@@ -74,6 +77,31 @@ export default function NotificationsPage() {
     [page, typeFilter, readFilter],
   );
 
+  // Large broadcasts run in chunks on workers; poll until they finish.
+  useEffect(() => {
+    if (!progress || progress.status !== "sending") return;
+    const timer = setTimeout(() => {
+      fetchBroadcastProgress(progress.broadcast_id)
+        .then((p) => {
+          setProgress(p);
+          if (p.status === "sent") {
+            toast.success(
+              `Notification created for ${p.created} user(s)${
+                p.push_configured ? ` · ${p.pushed} push delivered` : " · push not configured on server"
+              }`,
+            );
+            reload();
+            refreshNavBadges();
+          } else if (p.status === "failed") {
+            toast.error(p.error_message || "Broadcast failed");
+          }
+        })
+        .catch(() => setProgress({ ...progress }));
+    }, 2000);
+    return () => clearTimeout(timer);
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [progress]);
+
   const scheduled = useAsyncData(
     () => fetchScheduledNotifications({ per_page: 20, status: "all" }),
     [],
@@ -139,6 +167,9 @@ export default function NotificationsPage() {
       if (result.scheduled) {
         toast.success(result.message || "Notification scheduled");
         scheduled.reload();
+      } else if (result.status === "sending" && result.broadcast_id) {
+        toast.success(result.message);
+        setProgress(result as BroadcastProgress);
       } else {
         toast.success(
           `${result.message}${
@@ -184,7 +215,9 @@ export default function NotificationsPage() {
     setSchedBusy(true);
     try {
       const r = await processScheduledNotifications();
-      toast.success(`Processed ${r.processed} · sent ${r.sent} · failed ${r.failed}`);
+      toast.success(
+        `Processed ${r.processed} · sent ${r.sent} · started ${r.started} · resumed ${r.resumed} · failed ${r.failed}`,
+      );
       scheduled.reload();
       reload();
       refreshNavBadges();
@@ -342,6 +375,11 @@ export default function NotificationsPage() {
                   ? "Schedule notification"
                   : "Send notification"}
             </button>
+            {progress?.status === "sending" ? (
+              <p className="mt-2 text-xs text-surface-muted">
+                Sending… {progress.percent}% · {progress.created}/{progress.total} created · {progress.pushed} push
+              </p>
+            ) : null}
           </section>
           ) : null}
 
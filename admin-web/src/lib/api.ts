@@ -143,21 +143,33 @@ export async function broadcastNotification(payload: {
   notification_type?: string;
   send_push?: boolean;
   scheduled_at?: string;
-}): Promise<{
-  message: string;
-  created?: number;
-  pushed?: number;
-  push_configured?: boolean;
-  audience?: string;
-  scheduled?: boolean;
-  scheduled_notification?: ScheduledNotificationItem;
-}> {
+}): Promise<
+  { message: string; scheduled?: boolean; scheduled_notification?: ScheduledNotificationItem } & Partial<BroadcastProgress>
+> {
   return apiRequest("/api/admin/notifications/broadcast", {
     method: "POST",
     body: JSON.stringify(payload),
   });
 }
 
+export interface BroadcastProgress {
+  broadcast_id: number;
+  status: string;
+  audience: string;
+  total: number;
+  created: number;
+  pushed: number;
+  push_configured: boolean;
+  chunks_total: number;
+  chunks_done: number;
+  percent: number;
+  error_message?: string | null;
+}
+
+export async function fetchBroadcastProgress(id: number): Promise<BroadcastProgress> {
+  return apiRequest(`/api/admin/notifications/broadcasts/${id}/progress`);
+}
+
 export interface ScheduledNotificationItem {
   id: number;
   title: string;
@@ -198,7 +210,9 @@ export async function cancelScheduledNotification(
 export async function processScheduledNotifications(): Promise<{
   processed: number;
   sent: number;
+  started: number;
   failed: number;
+  resumed: number;
 }> {
   return apiRequest("/api/admin/notifications/scheduled/process", {
     method: "POST",
@@ -7,15 +7,18 @@ from dotenv import load_dotenv
 from flask import Flask
 from flask_cors import CORS
 from werkzeug.middleware.proxy_fix import ProxyFix
-from sqlalchemy.pool import NullPool
 
 from .config import config, get_app_env, validate_required_secrets
+from .db_pool import production_engine_options
 from .extensions import db, jwt, mail, migrate, socketio
 from .legacy_schema import ensure_minimal_schema_compat
+from .listing_facets import install_listing_facet_tracking
 from .logging_utils import configure_logging, install_api_error_handlers, install_request_id_and_access_log
+from .media_paths import install_image_path_resolution
 from .monitoring import init_monitoring
 from .routes import register_blueprints
 from .routes.auth import init_jwt_callbacks
+from .saved_search_index import install_saved_search_index_tracking
 from .socketio_handlers import register_socketio_handlers
 
 
@@ -238,17 +241,19 @@ def create_app():
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
 
-    # For production Postgres (psycopg v3), disable SQLAlchemy's QueuePool and
-    # use NullPool instead to avoid threading.Condition notify() issues like
-    # "cannot notify on un-acquired lock" on some PaaS platforms.
+    # Production Postgres: pooled connections (DB_POOL_MODE=queue|pgbouncer|null).
+    # A startup self-check falls back to NullPool if QueuePool hits the
+    # "cannot notify on un-acquired lock" Condition bug in this runtime.
     uri_lower = (app.config.get("SQLALCHEMY_DATABASE_URI") or "").strip().lower()
     if env_name == "production" and uri_lower.startswith("postgresql"):
-        engine_opts = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
-        engine_opts.setdefault("poolclass", NullPool)
-        engine_opts.setdefault("pool_pre_ping", True)
-        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_opts
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = production_engine_options(
+            app.config.get("SQLALCHEMY_ENGINE_OPTIONS")
+        )
 
     db.init_app(app)
+    install_listing_facet_tracking()
+    install_image_path_resolution()
+    install_saved_search_index_tracking()
     # Migrations live at repo root (migrations/), not inside kk/
     repo_root = os.path.dirname(app.root_path)
     migrations_dir = os.path.join(repo_root, "migrations")
@@ -0,0 +1,269 @@
+"""Short-lived cache of the facts every chat send and socket event re-checks.
+
+A text message used to resolve the receiver by public_id, scan ``message``
+for a prior thread, query ``blocked_user``, reload sender and receiver for the
+emit and refresh the receiver again for its FCM token. Those facts change
+rarely, so they are cached here and shared by ``kk.routes.chat`` and
+``kk.socketio_handlers``:
+
+- ``ChatIdentity`` snapshots (id, public_id, names, FCM token) by user id and
+  public_id.
+- Whether two users block each other (either direction), per unordered pair.
+- The conversation for a (car, user, user) thread and chat-room membership.
+  Only positive answers are cached; a thread never "un-exists" except when an
+  account or listing is purged, and :func:`kk.chat_conversations.record_message`
+  falls back to a lookup when a cached conversation id no longer updates.
+
+Lookups hit a per-request memo (``flask.g``) first, then Redis for
+``CHAT_CACHE_TTL_S`` seconds (default 30; ``0`` disables the shared tier)
+through :class:`kk.ttl_store.TTLStore`. ORM writes to
+``User``, ``BlockedUser`` and ``Conversation`` drop the affected keys when
+flushed and again after commit. Bulk ``UPDATE``/``DELETE`` statements bypass
+those events and age out with the TTL.
+"""
+
+from __future__ import annotations
+
+import os
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from flask import g, has_app_context
+from sqlalchemy import and_, event, or_
+from sqlalchemy.orm import Session, object_session
+
+from .models import BlockedUser, Conversation, User, db
+from .ttl_store import TTLStore
+
+_STORE = TTLStore("chatc:", max_entries=4096)
+_MISSING = object()
+
+
+@dataclass(frozen=True)
+class ChatIdentity:
+    """What chat code needs about a user; stands in for ``User`` on the hot path."""
+
+    id: int
+    public_id: str
+    first_name: str | None = None
+    last_name: str | None = None
+    username: str | None = None
+    firebase_token: str | None = None
+    is_active: bool = True
+
+    @classmethod
+    def from_user(cls, user: Any) -> "ChatIdentity":
+        return cls(
+            id=user.id,
+            public_id=user.public_id,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            username=user.username,
+            firebase_token=user.firebase_token,
+            is_active=bool(user.is_active),
+        )
+
+
+def _ttl_s() -> int:
+    try:
+        return max(0, int(os.getenv("CHAT_CACHE_TTL_S", "30") or 30))
+    except ValueError:
+        return 30
+
+
+def _memo() -> dict | None:
+    if not has_app_context():
+        return None
+    memo = g.get("_chat_cache")
+    if memo is None:
+        memo = g._chat_cache = {}
+    return memo
+
+
+def _get(key: str) -> Any:
+    memo = _memo()
+    if memo is not None and key in memo:
+        return memo[key]
+    if _ttl_s() <= 0:
+        return _MISSING
+    value = _STORE.get(key, _MISSING)
+    if memo is not None and value is not _MISSING:
+        memo[key] = value
+    return value
+
+
+def _set(key: str, value: Any) -> None:
+    memo = _memo()
+    if memo is not None:
+        memo[key] = value
+    ttl = _ttl_s()
+    if ttl > 0:
+        _STORE.set(key, value, ttl)
+
+
+def _delete(keys: set[str]) -> None:
+    if not keys:
+        return
+    memo = _memo()
+    if memo is not None:
+        for key in keys:
+            memo.pop(key, None)
+    _STORE.delete(keys)
+
+
+def clear_memory_cache() -> None:
+    _STORE.clear_memory()
+    memo = _memo()
+    if memo is not None:
+        memo.clear()
+
+
+def _pair(a: int, b: int) -> str:
+    return f"{min(a, b)}:{max(a, b)}"
+
+
+# ---------------------------------------------------------------------------
+# Identity
+# ---------------------------------------------------------------------------
+
+
+def remember_identity(user: Any) -> ChatIdentity | None:
+    """Cache a snapshot of a ``User`` the caller already loaded (e.g. the current user)."""
+    if user is None or getattr(user, "id", None) is None:
+        return None
+    ident = user if isinstance(user, ChatIdentity) else ChatIdentity.from_user(user)
+    _set(f"uid:{ident.id}", asdict(ident))
+    _set(f"upub:{ident.public_id}", ident.id)
+    return ident
+
+
+def get_identity(*, user_id: int | None = None, public_id: str | None = None) -> ChatIdentity | None:
+    """Snapshot of a user by id or public_id, or None when there is no such user."""
+    if user_id is None and public_id:
+        cached = _get(f"upub:{public_id}")
+        if cached is _MISSING:
+            return remember_identity(User.query.filter_by(public_id=public_id).first())
+        user_id = cached
+    if user_id is None:
+        return None
+    cached = _get(f"uid:{user_id}")
+    if cached is _MISSING:
+        return remember_identity(db.session.get(User, user_id))
+    return ChatIdentity(**cached)
+
+
+# ---------------------------------------------------------------------------
+# Blocks, threads, membership
+# ---------------------------------------------------------------------------
+
+
+def users_blocked(user_a_id: int, user_b_id: int) -> bool:
+    """True when either user blocked the other."""
+    key = f"block:{_pair(user_a_id, user_b_id)}"
+    cached = _get(key)
+    if cached is not _MISSING:
+        return bool(cached)
+    blocked = (
+        BlockedUser.query.filter(
+            or_(
+                and_(BlockedUser.blocker_id == user_a_id, BlockedUser.blocked_id == user_b_id),
+                and_(BlockedUser.blocker_id == user_b_id, BlockedUser.blocked_id == user_a_id),
+            )
+        ).first()
+        is not None
+    )
+    _set(key, blocked)
+    return blocked
+
+
+def remember_thread(conv: Conversation) -> None:
+    _set(
+        f"thread:{conv.car_id}:{_pair(conv.buyer_id, conv.seller_id)}",
+        {"id": conv.id, "buyer_id": conv.buyer_id, "seller_id": conv.seller_id},
+    )
+
+
+def forget_thread(car_id: int, user_a_id: int, user_b_id: int) -> None:
+    _delete({f"thread:{car_id}:{_pair(user_a_id, user_b_id)}"})
+
+
+def thread_for(car_id: int, user_a_id: int, user_b_id: int) -> dict | None:
+    """``{"id", "buyer_id", "seller_id"}`` of the conversation between two users on a listing."""
+    cached = _get(f"thread:{car_id}:{_pair(user_a_id, user_b_id)}")
+    if cached is not _MISSING:
+        return cached
+    from .chat_conversations import find_conversation
+
+    conv = find_conversation(car_id, user_a_id, user_b_id)
+    if conv is None:
+        return None
+    remember_thread(conv)
+    return {"id": conv.id, "buyer_id": conv.buyer_id, "seller_id": conv.seller_id}
+
+
+def is_chat_member(car_id: int, user_id: int) -> bool:
+    """True when the user is a party to any conversation on the listing."""
+    key = f"member:{car_id}:{user_id}"
+    if _get(key) is True:
+        return True
+    member = (
+        db.session.query(Conversation.id)
+        .filter(
+            Conversation.car_id == car_id,
+            or_(Conversation.buyer_id == user_id, Conversation.seller_id == user_id),
+        )
+        .first()
+        is not None
+    )
+    if member:
+        _set(key, True)
+    return member
+
+
+# ---------------------------------------------------------------------------
+# Invalidation
+# ---------------------------------------------------------------------------
+
+
+def _queue(target: Any, keys: set[str]) -> None:
+    _delete(keys)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("chat_cache_stale", set()).update(keys)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(_mapper, _connection, target) -> None:
+    _queue(target, {f"uid:{target.id}", f"upub:{target.public_id}"})
+
+
+@event.listens_for(BlockedUser, "after_insert")
+@event.listens_for(BlockedUser, "after_delete")
+def _block_changed(_mapper, _connection, target) -> None:
+    _queue(target, {f"block:{_pair(target.blocker_id, target.blocked_id)}"})
+
+
+@event.listens_for(Conversation, "after_delete")
+def _conversation_deleted(_mapper, _connection, target) -> None:
+    _queue(
+        target,
+        {
+            f"thread:{target.car_id}:{_pair(target.buyer_id, target.seller_id)}",
+            f"member:{target.car_id}:{target.buyer_id}",
+            f"member:{target.car_id}:{target.seller_id}",
+        },
+    )
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session) -> None:
+    # Again after commit: a concurrent reader may have re-cached the old row mid-transaction.
+    stale = session.info.pop("chat_cache_stale", None)
+    if stale:
+        _delete(stale)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session) -> None:
+    session.info.pop("chat_cache_stale", None)
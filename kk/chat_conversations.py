@@ -0,0 +1,279 @@
+"""Materialized chat inbox: one ``Conversation`` row per (listing, buyer, seller).
+
+``GET /api/chats`` used to read the caller's last 500 messages and fold them
+into threads in Python, which both cost a large scan on every inbox open and
+silently dropped older threads for busy dealers. The inbox is now a single
+keyset query over ``conversation`` ordered by ``(last_message_at, id)``.
+
+Every writer calls into this module before its own ``commit()`` so the row
+changes in the same transaction as the message:
+
+- send   -> :func:`record_message` (upsert, move ``last_message``, bump the
+  receiver's unread counter)
+- edit   -> :func:`record_message_edited`
+- delete -> :func:`record_message_deleted` (an unread message stops counting)
+- read   -> :func:`mark_conversations_read`
+
+Counters are updated with SQL expressions (``col = col + 1``), so concurrent
+sends to the same thread do not lose increments. Known threads are looked up
+through ``kk.chat_cache`` and updated by primary key.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Iterable
+
+from sqlalchemy import and_, case, or_, select
+from sqlalchemy.exc import IntegrityError
+
+from . import chat_cache
+from .models import BlockedUser, Car, Conversation, Message, db
+from .time_utils import utcnow
+
+logger = logging.getLogger(__name__)
+
+
+def _buyer_seller(seller_id: int | None, sender_id: int, receiver_id: int) -> tuple[int, int]:
+    """The listing owner is the seller; a thread always starts buyer -> seller."""
+    if seller_id == sender_id:
+        return receiver_id, sender_id
+    if seller_id == receiver_id:
+        return sender_id, receiver_id
+    # Listing changed hands after the thread started: keep the first orientation.
+    return sender_id, receiver_id
+
+
+def find_conversation(car_id: int, user_a: int, user_b: int) -> Conversation | None:
+    return Conversation.query.filter(
+        Conversation.car_id == car_id,
+        or_(
+            and_(Conversation.buyer_id == user_a, Conversation.seller_id == user_b),
+            and_(Conversation.buyer_id == user_b, Conversation.seller_id == user_a),
+        ),
+    ).first()
+
+
+def _get_or_create(car: Car | None, car_id: int, sender_id: int, receiver_id: int, at) -> Conversation:
+    conv = find_conversation(car_id, sender_id, receiver_id)
+    if conv is not None:
+        return conv
+    buyer_id, seller_id = _buyer_seller(getattr(car, "seller_id", None), sender_id, receiver_id)
+    conv = Conversation(
+        car_id=car_id,
+        buyer_id=buyer_id,
+        seller_id=seller_id,
+        last_message_at=at,
+        buyer_unread=0,
+        seller_unread=0,
+    )
+    try:
+        # Savepoint: a concurrent first message may have inserted the same thread.
+        with db.session.begin_nested():
+            db.session.add(conv)
+    except IntegrityError:
+        conv = find_conversation(car_id, sender_id, receiver_id)
+        if conv is None:
+            raise
+    return conv
+
+
+def _unread_column(thread: dict, receiver_id: int):
+    return Conversation.buyer_unread if receiver_id == thread["buyer_id"] else Conversation.seller_unread
+
+
+def _update_thread(thread: dict, msg: Message, values: dict) -> bool:
+    """One ``UPDATE`` by primary key; False when the cached row is gone."""
+    # The participant columns guard against an id reused after a purge or rebuild.
+    updated = Conversation.query.filter(
+        Conversation.id == thread["id"],
+        Conversation.car_id == msg.car_id,
+        Conversation.buyer_id == thread["buyer_id"],
+        Conversation.seller_id == thread["seller_id"],
+    ).update(values, synchronize_session=False)
+    if updated:
+        return True
+    chat_cache.forget_thread(msg.car_id, msg.sender_id, msg.receiver_id)
+    return False
+
+
+def record_message(msg: Message, car: Car | None = None) -> int | None:
+    """Upsert the thread for a new message; returns its id. Call before the sender's ``commit()``.
+
+    A known thread (``kk.chat_cache``) costs a single UPDATE; only the first
+    message of a thread reads and inserts.
+    """
+    if not msg.car_id:
+        return None
+    if msg.id is None or msg.created_at is None:
+        db.session.flush()
+    at = msg.created_at or utcnow()
+    thread = chat_cache.thread_for(msg.car_id, msg.sender_id, msg.receiver_id)
+    if thread is not None:
+        newer = or_(Conversation.last_message_at.is_(None), Conversation.last_message_at <= at)
+        values = {
+            Conversation.last_message_id: case((newer, msg.id), else_=Conversation.last_message_id),
+            Conversation.last_message_at: case((newer, at), else_=Conversation.last_message_at),
+            Conversation.updated_at: utcnow(),
+        }
+        if not msg.is_read:
+            col = _unread_column(thread, msg.receiver_id)
+            values[col] = col + 1
+        if _update_thread(thread, msg, values):
+            return thread["id"]
+
+    car = car if car is not None else db.session.get(Car, msg.car_id)
+    conv = _get_or_create(car, msg.car_id, msg.sender_id, msg.receiver_id, at)
+    if conv.last_message_id is None or conv.last_message_at is None or at >= conv.last_message_at:
+        conv.last_message_id = msg.id
+        conv.last_message_at = at
+    if not msg.is_read:
+        if msg.receiver_id == conv.buyer_id:
+            conv.buyer_unread = Conversation.buyer_unread + 1
+        else:
+            conv.seller_unread = Conversation.seller_unread + 1
+    conv.updated_at = utcnow()
+    db.session.flush()
+    chat_cache.remember_thread(conv)
+    return conv.id
+
+
+def record_message_edited(msg: Message) -> None:
+    """Touch the thread so clients polling ``updated_at`` refresh the preview."""
+    if not msg.car_id:
+        return
+    thread = chat_cache.thread_for(msg.car_id, msg.sender_id, msg.receiver_id)
+    if thread is not None:
+        _update_thread(thread, msg, {Conversation.updated_at: utcnow()})
+
+
+def record_message_deleted(msg: Message) -> None:
+    """A deleted message that was never read no longer counts as unread."""
+    if not msg.car_id:
+        return
+    thread = chat_cache.thread_for(msg.car_id, msg.sender_id, msg.receiver_id)
+    if thread is None:
+        return
+    values = {Conversation.updated_at: utcnow()}
+    if not msg.is_read:
+        col = _unread_column(thread, msg.receiver_id)
+        values[col] = case((col > 0, col - 1), else_=0)
+    _update_thread(thread, msg, values)
+
+
+def mark_conversations_read(car_id: int, viewer_id: int) -> None:
+    """Zero the viewer's unread counters on this listing (mirrors the message read flags)."""
+    now = utcnow()
+    Conversation.query.filter(
+        Conversation.car_id == car_id,
+        Conversation.buyer_id == viewer_id,
+        Conversation.buyer_unread != 0,
+    ).update({"buyer_unread": 0, "updated_at": now}, synchronize_session=False)
+    Conversation.query.filter(
+        Conversation.car_id == car_id,
+        Conversation.seller_id == viewer_id,
+        Conversation.seller_unread != 0,
+    ).update({"seller_unread": 0, "updated_at": now}, synchronize_session=False)
+
+
+def viewer_has_unread(car_id: int, viewer_id: int) -> bool:
+    """Cheap pre-check for read marking: any counter on the viewer's side of this listing."""
+    return (
+        db.session.query(Conversation.id)
+        .filter(
+            Conversation.car_id == car_id,
+            or_(
+                and_(Conversation.buyer_id == viewer_id, Conversation.buyer_unread > 0),
+                and_(Conversation.seller_id == viewer_id, Conversation.seller_unread > 0),
+            ),
+        )
+        .first()
+        is not None
+    )
+
+
+def inbox_query(user_id: int):
+    """Threads visible to ``user_id`` (peers they blocked are hidden), unordered."""
+    blocked = select(BlockedUser.blocked_id).where(BlockedUser.blocker_id == user_id)
+    return Conversation.query.filter(
+        or_(
+            and_(Conversation.buyer_id == user_id, Conversation.seller_id.not_in(blocked)),
+            and_(Conversation.seller_id == user_id, Conversation.buyer_id.not_in(blocked)),
+        )
+    )
+
+
+def inbox_page(user_id: int, limit: int, after: tuple | None = None, options: tuple = ()):
+    """Newest-first page of threads; ``after`` is the ``(last_message_at, id)`` of the previous page's last row.
+
+    ``options`` are loader options for the page's related rows. Returns ``(rows, has_more)``.
+    """
+    q = inbox_query(user_id).options(*options)
+    if after is not None:
+        at, conv_id = after
+        q = q.filter(
+            or_(
+                Conversation.last_message_at < at,
+                and_(Conversation.last_message_at == at, Conversation.id < conv_id),
+            )
+        )
+    rows = (
+        q.order_by(Conversation.last_message_at.desc(), Conversation.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    return rows[:limit], len(rows) > limit
+
+
+def _fold(rows: Iterable) -> dict:
+    threads: dict[tuple[int, int, int], dict] = {}
+    for msg_id, car_id, sender_id, receiver_id, created_at, is_read, is_deleted, seller_id in rows:
+        pair = (car_id, min(sender_id, receiver_id), max(sender_id, receiver_id))
+        t = threads.get(pair)
+        if t is None:
+            buyer, seller = _buyer_seller(seller_id, sender_id, receiver_id)
+            t = threads[pair] = {
+                "car_id": car_id,
+                "buyer_id": buyer,
+                "seller_id": seller,
+                "last_message_id": msg_id,
+                "last_message_at": created_at,
+                "buyer_unread": 0,
+                "seller_unread": 0,
+            }
+        t["last_message_id"] = msg_id
+        t["last_message_at"] = created_at or t["last_message_at"]
+        if not is_read and not is_deleted:
+            t["buyer_unread" if receiver_id == t["buyer_id"] else "seller_unread"] += 1
+    return threads
+
+
+def rebuild_conversations() -> int:
+    """Recreate every row from ``message`` (legacy DB upgrade / repair). Returns the thread count."""
+    rows = db.session.execute(
+        select(
+            Message.id,
+            Message.car_id,
+            Message.sender_id,
+            Message.receiver_id,
+            Message.created_at,
+            Message.is_read,
+            Message.is_deleted,
+            Car.seller_id,
+        )
+        .join(Car, Car.id == Message.car_id)
+        .order_by(Message.created_at.asc(), Message.id.asc())
+        .execution_options(yield_per=2000)
+    )
+    threads = _fold(rows)
+    now = utcnow()
+    Conversation.query.delete(synchronize_session=False)
+    if threads:
+        db.session.execute(
+            Conversation.__table__.insert(),
+            [{**t, "last_message_at": t["last_message_at"] or now, "created_at": now, "updated_at": now} for t in threads.values()],
+        )
+    db.session.commit()
+    chat_cache.clear_memory_cache()
+    logger.info("rebuilt %d chat conversations", len(threads))
+    return len(threads)
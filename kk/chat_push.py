@@ -0,0 +1,503 @@
+"""Chat push notifications delivered off the request path.
+
+Chat sends (HTTP and Socket.IO) used to call ``send_push`` right after their
+commit, so every reply waited on an FCM round-trip and, under the threading
+async mode, a slow FCM call held a worker thread. :func:`queue_chat_push` now
+only records the message; delivery happens later:
+
+- With a broker and Redis, messages are appended to a Redis list per
+  (receiver, sender, listing) and the first one schedules the
+  ``kk.tasks.chat_tasks.deliver_chat_push`` task ``CHAT_PUSH_COALESCE_S``
+  seconds later (default 3).
+- Otherwise the list lives in this process and a timer hands it to a small
+  thread pool (``CHAT_PUSH_WORKERS``, default 2) after the same window.
+
+Either way a burst from one sender becomes a single push ("3 new messages"),
+and nothing is queued while the receiver has the chat open (``kk.presence``).
+A token whose last push failed backs off for an exponentially growing window
+(``CHAT_PUSH_BACKOFF_S`` doubling up to ``CHAT_PUSH_BACKOFF_MAX_S``): its
+messages are put back and delivered when the window ends. Only tokens FCM
+reports as invalid (pruned from the user) have their messages dropped;
+messages older than the pending TTL are dropped as stale. :func:`chat_push_stats` reports queue
+depth and delivery latency for ``/health/chat-push``.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from flask import current_app, has_app_context
+
+from . import presence
+from .config import env_float
+from .push import fcm_is_configured
+from .push_fanout import send_each_and_prune
+from .redis_client import get_redis
+from .tasks.celery_app import broker_configured
+
+logger = logging.getLogger(__name__)
+
+_PENDING_PREFIX = "chatpush:pending:"
+# Keys with a pending list; shared depth is the LLEN sum over these, so lists
+# that expire or get drained can't leave a counter behind.
+_KEYS_SET = "chatpush:keys"
+_BACKOFF_PREFIX = "chatpush:backoff:"
+_FAILS_PREFIX = "chatpush:fails:"
+_INVALID_PREFIX = "chatpush:invalid:"
+# Undelivered lists (e.g. a lost task) expire instead of piling up.
+_PENDING_TTL_S = 15 * 60
+_FAILS_TTL_S = 60 * 60
+
+_local_lock = threading.Lock()
+_local_pending: dict[str, list[dict]] = {}
+_local_backoff: dict[str, tuple[int, float]] = {}
+# token key -> until; tokens FCM rejected as unregistered/invalid.
+_local_invalid: dict[str, float] = {}
+_LOCAL_BACKOFF_MAX = 10_000
+
+_pool: ThreadPoolExecutor | None = None
+_pool_pid: int | None = None
+_pool_lock = threading.Lock()
+
+
+def _coalesce_s() -> float:
+    return max(0.0, env_float("CHAT_PUSH_COALESCE_S", 3.0))
+
+
+def _workers() -> int:
+    try:
+        return max(1, int(os.getenv("CHAT_PUSH_WORKERS", "2") or 2))
+    except ValueError:
+        return 2
+
+
+class _PushStats:
+    """Per-process delivery counters and enqueue-to-send latency."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts: dict[str, int] = {}
+            self.latency_ms_total = 0.0
+            self.latency_ms_max = 0.0
+            self.deliveries = 0
+
+    def incr(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def record_latency(self, latency_ms: float) -> None:
+        with self._lock:
+            self.deliveries += 1
+            self.latency_ms_total += latency_ms
+            self.latency_ms_max = max(self.latency_ms_max, latency_ms)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            out: dict[str, Any] = {
+                name: self.counts.get(name, 0)
+                for name in (
+                    "enqueued",
+                    "coalesced",
+                    "sent",
+                    "failed",
+                    "invalid",
+                    "deferred_backoff",
+                    "dropped_invalid",
+                    "dropped_stale",
+                    "skipped_viewing",
+                )
+            }
+            out["latency_ms_avg"] = round(self.latency_ms_total / self.deliveries, 3) if self.deliveries else None
+            out["latency_ms_max"] = round(self.latency_ms_max, 3)
+            return out
+
+
+_stats = _PushStats()
+
+
+# ---------------------------------------------------------------------------
+# Enqueue
+# ---------------------------------------------------------------------------
+
+
+def queue_chat_push(receiver: Any, sender: Any, car_public_id: str, body: str) -> bool:
+    """
+    Queue a chat push for ``receiver`` (needs ``id`` and ``firebase_token``).
+
+    Returns False when the receiver has no device token or has the thread with
+    ``sender`` on this listing open on a live socket (``kk.presence``). Never raises: push is
+    best-effort and must not fail the send that already committed.
+    """
+    token = (getattr(receiver, "firebase_token", None) or "").strip()
+    if not token:
+        return False
+    try:
+        if presence.is_viewing(
+            getattr(receiver, "public_id", None), car_public_id, getattr(sender, "public_id", None)
+        ):
+            _stats.incr("skipped_viewing")
+            return False
+    except Exception:
+        logger.exception("chat push presence check failed")
+    sender_name = f"{sender.first_name or ''} {sender.last_name or ''}".strip() or "Someone"
+    key = f"{receiver.id}:{sender.id}:{car_public_id}"
+    item = {
+        "token": token,
+        "sender_name": sender_name,
+        "sender_id": sender.public_id,
+        "car_id": car_public_id,
+        "body": (body or "")[:200],
+        "at": time.time(),
+    }
+    _stats.incr("enqueued")
+    try:
+        r = get_redis() if broker_configured() else None
+        if r is not None and _enqueue_redis(r, key, item):
+            return True
+        _enqueue_local(key, item)
+        return True
+    except Exception:
+        logger.exception("chat push enqueue failed for %s", key)
+        return False
+
+
+def _enqueue_redis(r, key: str, item: dict) -> bool:
+    try:
+        pipe = r.pipeline()
+        pipe.rpush(_PENDING_PREFIX + key, json.dumps(item, separators=(",", ":")))
+        pipe.expire(_PENDING_PREFIX + key, _PENDING_TTL_S)
+        pipe.sadd(_KEYS_SET, key)
+        pipe.expire(_KEYS_SET, _PENDING_TTL_S)
+        length = pipe.execute()[0]
+    except Exception as exc:
+        logger.warning("chat push redis enqueue failed, using local queue: %s", exc)
+        return False
+    if length != 1:
+        # A delivery for this burst is already scheduled.
+        return True
+    try:
+        from .tasks.chat_tasks import deliver_chat_push
+
+        deliver_chat_push.apply_async((key,), countdown=_coalesce_s())
+    except Exception as exc:
+        logger.warning("chat push: Celery dispatch failed, delivering from this process: %s", exc)
+        _schedule_local(key, _current_app(), _coalesce_s())
+    return True
+
+
+def _enqueue_local(key: str, item: dict) -> None:
+    with _local_lock:
+        bucket = _local_pending.get(key)
+        if bucket is not None:
+            bucket.append(item)
+            return
+        _local_pending[key] = [item]
+    _schedule_local(key, _current_app(), _coalesce_s())
+
+
+def _current_app():
+    return current_app._get_current_object() if has_app_context() else None
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=_workers(), thread_name_prefix="chat-push")
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _schedule_local(key: str, app, delay_s: float) -> None:
+    def run():
+        if app is None:
+            deliver(key)
+            return
+        with app.app_context():
+            deliver(key)
+
+    if delay_s <= 0:
+        _get_pool().submit(run)
+        return
+    timer = threading.Timer(delay_s, lambda: _get_pool().submit(run))
+    timer.daemon = True
+    timer.start()
+
+
+# ---------------------------------------------------------------------------
+# Delivery
+# ---------------------------------------------------------------------------
+
+
+def _drain(key: str) -> tuple[list[dict], bool]:
+    """Pop everything queued under ``key``; the flag is True when it came from Redis."""
+    with _local_lock:
+        items = _local_pending.pop(key, None)
+    if items:
+        return items, False
+    r = get_redis()
+    if r is None:
+        return [], False
+    try:
+        pipe = r.pipeline()
+        pipe.lrange(_PENDING_PREFIX + key, 0, -1)
+        pipe.delete(_PENDING_PREFIX + key)
+        pipe.srem(_KEYS_SET, key)
+        raw = pipe.execute()[0] or []
+    except Exception as exc:
+        logger.warning("chat push redis drain failed for %s: %s", key, exc)
+        return [], False
+    return [json.loads(x) for x in raw], True
+
+
+def _requeue(key: str, items: list[dict], shared: bool, delay_s: float) -> None:
+    """
+    Put ``items`` back ahead of anything queued since the drain and make sure
+    a delivery runs after ``delay_s``. When newer messages already scheduled a
+    delivery, that one picks these up (and defers again if still backing off).
+    """
+    delay_s = max(delay_s, _coalesce_s())
+    if shared:
+        r = get_redis()
+        if r is not None:
+            try:
+                pipe = r.pipeline()
+                pipe.lpush(_PENDING_PREFIX + key, *[json.dumps(i, separators=(",", ":")) for i in reversed(items)])
+                pipe.expire(_PENDING_PREFIX + key, _PENDING_TTL_S)
+                pipe.sadd(_KEYS_SET, key)
+                pipe.expire(_KEYS_SET, _PENDING_TTL_S)
+                length = pipe.execute()[0]
+            except Exception as exc:
+                logger.warning("chat push redis requeue failed, using local queue: %s", exc)
+            else:
+                if length == len(items):
+                    try:
+                        from .tasks.chat_tasks import deliver_chat_push
+
+                        deliver_chat_push.apply_async((key,), countdown=delay_s)
+                    except Exception as exc:
+                        logger.warning("chat push: Celery dispatch failed, delivering from this process: %s", exc)
+                        _schedule_local(key, _current_app(), delay_s)
+                return
+    with _local_lock:
+        bucket = _local_pending.get(key)
+        if bucket is not None:
+            bucket[:0] = items
+            return
+        _local_pending[key] = list(items)
+    _schedule_local(key, _current_app(), delay_s)
+
+
+def _compose(items: list[dict]) -> tuple[str, str, str, dict]:
+    last = items[-1]
+    count = len(items)
+    if count == 1:
+        title = f"New message from {last['sender_name']}"
+        body = last["body"]
+    else:
+        title = f"New messages from {last['sender_name']}"
+        body = f"{count} new messages"
+    data = {"car_id": last["car_id"], "sender_id": last["sender_id"], "type": "chat_message", "count": count}
+    return last["token"], title, body, data
+
+
+def deliver(key: str) -> dict:
+    """Send one push for everything queued under ``key`` (called by the task or the local pool)."""
+    items, shared = _drain(key)
+    if not items:
+        return {"sent": 0, "messages": 0}
+    fresh = [i for i in items if time.time() - i["at"] < _PENDING_TTL_S]
+    if len(fresh) < len(items):
+        _stats.incr("dropped_stale", len(items) - len(fresh))
+        items = fresh
+        if not items:
+            return {"sent": 0, "messages": 0}
+    token = items[-1]["token"]
+    if not fcm_is_configured():
+        return {"sent": 0, "messages": len(items)}
+    if _is_invalid(token):
+        _stats.incr("dropped_invalid", len(items))
+        return {"sent": 0, "messages": len(items), "invalid": True}
+    wait_s = _backoff_remaining_s(token)
+    if wait_s > 0:
+        _stats.incr("deferred_backoff")
+        _requeue(key, items, shared, wait_s)
+        return {"sent": 0, "messages": len(items), "backoff": True}
+
+    if len(items) > 1:
+        _stats.incr("coalesced", len(items) - 1)
+    token, title, body, data = _compose(items)
+    result = send_each_and_prune([(token, title, body, data)])
+    if result.sent:
+        _stats.incr("sent")
+        _clear_backoff(token)
+    elif result.invalid_tokens:
+        # FCM says the token is gone (and it was pruned from the user): drop.
+        _stats.incr("invalid")
+        _mark_invalid(token)
+        return {"sent": 0, "messages": len(items), "invalid": True}
+    else:
+        _stats.incr("failed")
+        delay_s = _record_failure(token)
+        logger.info("chat push failed (token=%s…), retrying in %.0fs", token[:12], delay_s)
+        _requeue(key, items, shared, delay_s)
+        return {"sent": 0, "messages": len(items), "backoff": True}
+    _stats.record_latency((time.time() - min(i["at"] for i in items)) * 1000.0)
+    return {"sent": result.sent, "messages": len(items)}
+
+
+# ---------------------------------------------------------------------------
+# Per-token backoff
+# ---------------------------------------------------------------------------
+
+
+def _token_key(token: str) -> str:
+    return hashlib.sha1(token.encode("utf-8")).hexdigest()[:20]
+
+
+def _backoff_delay_s(fails: int) -> float:
+    base = max(0.0, env_float("CHAT_PUSH_BACKOFF_S", 5.0))
+    cap = max(0.0, env_float("CHAT_PUSH_BACKOFF_MAX_S", 600.0))
+    return min(cap, base * (2 ** max(0, fails - 1)))
+
+
+def _backoff_remaining_s(token: str) -> float:
+    """Seconds left in ``token``'s backoff window (0 when it may be sent to)."""
+    tk = _token_key(token)
+    r = get_redis()
+    if r is not None:
+        try:
+            return max(0.0, int(r.pttl(_BACKOFF_PREFIX + tk) or 0) / 1000.0)
+        except Exception as exc:
+            logger.warning("chat push backoff check failed: %s", exc)
+    with _local_lock:
+        row = _local_backoff.get(tk)
+    return max(0.0, row[1] - time.time()) if row else 0.0
+
+
+def _record_failure(token: str) -> float:
+    """Count a failed send for ``token``; returns the new backoff window in seconds."""
+    tk = _token_key(token)
+    r = get_redis()
+    if r is not None:
+        try:
+            fails = int(r.incr(_FAILS_PREFIX + tk))
+            r.expire(_FAILS_PREFIX + tk, _FAILS_TTL_S)
+            delay_s = _backoff_delay_s(fails)
+            r.set(_BACKOFF_PREFIX + tk, "1", px=max(1, int(delay_s * 1000)))
+            return delay_s
+        except Exception as exc:
+            logger.warning("chat push backoff update failed: %s", exc)
+    with _local_lock:
+        fails = _local_backoff.get(tk, (0, 0.0))[0] + 1
+        delay_s = _backoff_delay_s(fails)
+        _local_backoff[tk] = (fails, time.time() + delay_s)
+        if len(_local_backoff) > _LOCAL_BACKOFF_MAX:
+            now = time.time()
+            for stale in [k for k, (_f, until) in _local_backoff.items() if until <= now]:
+                _local_backoff.pop(stale, None)
+    return delay_s
+
+
+def _mark_invalid(token: str) -> None:
+    """Remember a token FCM rejected so messages still queued for it are dropped."""
+    tk = _token_key(token)
+    r = get_redis()
+    if r is not None:
+        try:
+            r.set(_INVALID_PREFIX + tk, "1", ex=_PENDING_TTL_S)
+        except Exception as exc:
+            logger.warning("chat push invalid-token update failed: %s", exc)
+    with _local_lock:
+        now = time.time()
+        _local_invalid[tk] = now + _PENDING_TTL_S
+        if len(_local_invalid) > _LOCAL_BACKOFF_MAX:
+            for stale in [k for k, until in _local_invalid.items() if until <= now]:
+                _local_invalid.pop(stale, None)
+        _local_backoff.pop(tk, None)
+
+
+def _is_invalid(token: str) -> bool:
+    tk = _token_key(token)
+    r = get_redis()
+    if r is not None:
+        try:
+            if r.exists(_INVALID_PREFIX + tk):
+                return True
+        except Exception as exc:
+            logger.warning("chat push invalid-token check failed: %s", exc)
+    with _local_lock:
+        until = _local_invalid.get(tk)
+    return bool(until and until > time.time())
+
+
+def _clear_backoff(token: str) -> None:
+    tk = _token_key(token)
+    r = get_redis()
+    if r is not None:
+        try:
+            r.delete(_BACKOFF_PREFIX + tk, _FAILS_PREFIX + tk)
+        except Exception as exc:
+            logger.warning("chat push backoff clear failed: %s", exc)
+    with _local_lock:
+        _local_backoff.pop(tk, None)
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+
+def chat_push_stats() -> dict[str, Any]:
+    """Queue depth (shared when Redis is up) plus this process's delivery counters and latency."""
+    with _local_lock:
+        local_depth = sum(len(items) for items in _local_pending.values())
+    shared_depth = None
+    r = get_redis()
+    if r is not None:
+        try:
+            shared_depth = _shared_depth(r)
+        except Exception:
+            shared_depth = None
+    return {
+        "queue_depth": {"local": local_depth, "shared": shared_depth},
+        "coalesce_s": _coalesce_s(),
+        **_stats.snapshot(),
+        "pid": os.getpid(),
+    }
+
+
+def _shared_depth(r) -> int:
+    """Messages in the live Redis lists; keys whose list expired are pruned from the set."""
+    keys = [k.decode() if isinstance(k, bytes) else k for k in r.smembers(_KEYS_SET) or ()]
+    if not keys:
+        return 0
+    pipe = r.pipeline()
+    for key in keys:
+        pipe.llen(_PENDING_PREFIX + key)
+    lengths = [int(n or 0) for n in pipe.execute()]
+    gone = [key for key, n in zip(keys, lengths) if n == 0]
+    if gone:
+        # An enqueue racing this re-adds its key on the next push.
+        r.srem(_KEYS_SET, *gone)
+    return sum(lengths)
+
+
+def debug_reset_chat_push() -> None:
+    """Test helper: drop local buckets, backoff and invalid-token state, and counters."""
+    with _local_lock:
+        _local_pending.clear()
+        _local_backoff.clear()
+        _local_invalid.clear()
+    _stats.reset()
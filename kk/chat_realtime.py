@@ -14,11 +14,19 @@ messages. Authorization and delivery now follow these rules:
 from __future__ import annotations
 
 import logging
+from typing import Any
 
-from sqlalchemy import and_, or_
+from sqlalchemy import update
+from sqlalchemy.orm import lazyload
 
+from . import chat_cache, presence
+from .chat_cache import ChatIdentity
+from .chat_conversations import mark_conversations_read, viewer_has_unread
+from .config import env_float
 from .extensions import socketio
-from .models import BlockedUser, Car, Message, User, db
+from .models import Car, Conversation, Message, User, db
+from .redis_client import get_redis
+from .tasks.celery_app import broker_configured
 
 logger = logging.getLogger(__name__)
 
@@ -47,68 +55,43 @@ def resolve_car_for_chat(car_id_raw: str) -> Car | None:
 
 
 def chat_users_blocked(user_a_id: int, user_b_id: int) -> bool:
-    return (
-        BlockedUser.query.filter(
-            or_(
-                and_(
-                    BlockedUser.blocker_id == user_a_id,
-                    BlockedUser.blocked_id == user_b_id,
-                ),
-                and_(
-                    BlockedUser.blocker_id == user_b_id,
-                    BlockedUser.blocked_id == user_a_id,
-                ),
-            )
-        ).first()
-        is not None
-    )
+    return chat_cache.users_blocked(user_a_id, user_b_id)
 
 
-def chat_receiver_allowed(me: User, car: Car, receiver: User) -> bool:
+def chat_receiver_allowed(me: User, car: Car, receiver: User | ChatIdentity) -> bool:
     """Buyer may message seller; otherwise an existing thread on this listing is required."""
     if receiver.id == car.seller_id and me.id != car.seller_id:
         return True
-    prior = (
-        Message.query.filter(
-            Message.car_id == car.id,
-            or_(
-                and_(Message.sender_id == me.id, Message.receiver_id == receiver.id),
-                and_(Message.sender_id == receiver.id, Message.receiver_id == me.id),
-            ),
-        )
-        .limit(1)
-        .first()
-    )
-    return prior is not None
+    return chat_cache.thread_for(car.id, me.id, receiver.id) is not None
 
 
 def resolve_allowed_chat_receiver(
     me: User, car: Car, receiver_public: str | None
-) -> User | None:
+) -> ChatIdentity | None:
     """
     Resolve a chat peer for this listing.
 
     Rejects arbitrary ``receiver_id`` targets and either-direction blocks.
+    Returns a cached :class:`~kk.chat_cache.ChatIdentity` rather than a ``User``.
     """
     receiver = None
     raw = (receiver_public or "").strip()
     if raw:
-        receiver = User.query.filter_by(public_id=raw).first()
+        receiver = chat_cache.get_identity(public_id=raw)
     if receiver is None:
         if car.seller_id != me.id:
-            receiver = db.session.get(User, car.seller_id)
+            receiver = chat_cache.get_identity(user_id=car.seller_id)
         else:
             last = (
-                Message.query.filter(
-                    Message.car_id == car.id,
-                    or_(Message.sender_id == me.id, Message.receiver_id == me.id),
+                Conversation.query.filter(
+                    Conversation.car_id == car.id,
+                    Conversation.seller_id == me.id,
                 )
-                .order_by(Message.created_at.desc())
+                .order_by(Conversation.last_message_at.desc(), Conversation.id.desc())
                 .first()
             )
             if last:
-                other_id = last.receiver_id if last.sender_id == me.id else last.sender_id
-                receiver = db.session.get(User, other_id)
+                receiver = chat_cache.get_identity(user_id=last.buyer_id)
     if receiver is None or receiver.id == me.id:
         return None
     if not chat_receiver_allowed(me, car, receiver):
@@ -130,18 +113,10 @@ def user_can_access_chat_room(user: User, car: Car) -> bool:
         return False
     if car.seller_id == user.id:
         return True
-    return (
-        Message.query.filter(
-            Message.car_id == car.id,
-            or_(Message.sender_id == user.id, Message.receiver_id == user.id),
-        )
-        .limit(1)
-        .first()
-        is not None
-    )
+    return chat_cache.is_chat_member(car.id, user.id)
 
 
-def emit_to_user_rooms(event_name: str, payload: dict, *users: User | None) -> None:
+def emit_to_user_rooms(event_name: str, payload: dict, *users: User | ChatIdentity | None) -> None:
     """Emit a Socket.IO event to each unique authenticated user room."""
     seen: set[str] = set()
     for user in users:
@@ -159,32 +134,129 @@ def emit_to_user_rooms(event_name: str, payload: dict, *users: User | None) -> N
             )
 
 
+def drop_presence_subscriptions(a: User, b: User) -> None:
+    """
+    After a block, take each user's sockets out of the other's ``presence:``
+    room so neither keeps receiving the other's online/offline events. The
+    Socket.IO manager forwards ``leave_room`` for sockets on other workers.
+    """
+    server = getattr(socketio, "server", None)
+    if server is None:
+        return
+    for watcher, watched in ((a, b), (b, a)):
+        room = presence.room_for_presence(watched.public_id)
+        try:
+            for sid in presence.socket_ids(watcher.public_id):
+                server.leave_room(sid, room, namespace="/")
+        except Exception:
+            logger.exception("Failed to drop presence subscription %s -> %s", watcher.public_id, room)
+
+
 def emit_message_to_participants(
     event_name: str,
     payload: dict,
     *,
     message: Message | None = None,
-    sender: User | None = None,
-    receiver: User | None = None,
+    sender: User | ChatIdentity | None = None,
+    receiver: User | ChatIdentity | None = None,
 ) -> None:
     """
     Deliver chat message events only to the two conversation participants.
 
-    Prefer explicit sender/receiver when already loaded; otherwise resolve from
-    the Message row.
+    Prefer explicit sender/receiver when already loaded; otherwise resolve the
+    Message row's participants through ``kk.chat_cache``.
     """
     resolved_sender = sender
     resolved_receiver = receiver
     if message is not None:
         if resolved_sender is None:
-            resolved_sender = message.sender or db.session.get(User, message.sender_id)
+            resolved_sender = chat_cache.get_identity(user_id=message.sender_id)
         if resolved_receiver is None:
-            resolved_receiver = message.receiver or db.session.get(
-                User, message.receiver_id
-            )
+            resolved_receiver = chat_cache.get_identity(user_id=message.receiver_id)
     emit_to_user_rooms(event_name, payload, resolved_sender, resolved_receiver)
 
 
+def message_payloads(
+    msgs: list[Message],
+    car: Car,
+    *,
+    users: dict[int, Any] | None = None,
+    parents: dict[int, Message] | None = None,
+) -> list[dict]:
+    """
+    ``Message.to_dict()`` for a batch without per-row relationship loads.
+
+    ``users`` (id -> ``User`` / ``ChatIdentity``) and ``parents`` (quoted
+    messages by id) may be passed when the caller already has them; anything
+    missing is fetched with one lean query per kind.
+    """
+    parents = {**(parents or {}), **{m.id: m for m in msgs}}
+    parent_ids = {m.reply_to_id for m in msgs if m.reply_to_id and m.reply_to_id not in parents}
+    if parent_ids:
+        for p in (
+            Message.query.options(lazyload(Message.reply_to))
+            .filter(Message.id.in_(parent_ids))
+            .all()
+        ):
+            parents[p.id] = p
+
+    users = dict(users or {})
+    user_ids = {uid for m in msgs for uid in (m.sender_id, m.receiver_id)}
+    user_ids.update(parents[m.reply_to_id].sender_id for m in msgs if m.reply_to_id in parents)
+    missing = user_ids - set(users)
+    if missing:
+        users.update(
+            (row.id, row)
+            for row in db.session.query(
+                User.id, User.public_id, User.first_name, User.last_name, User.username
+            ).filter(User.id.in_(missing))
+        )
+
+    def _name(u):
+        return f"{u.first_name} {u.last_name}".strip() if u else None
+
+    out = []
+    for m in msgs:
+        sender = users.get(m.sender_id)
+        receiver = users.get(m.receiver_id)
+        parent = parents.get(m.reply_to_id) if m.reply_to_id else None
+        reply_preview = None
+        if parent is not None:
+            parent_sender = users.get(parent.sender_id)
+            reply_preview = {
+                "id": parent.public_id,
+                "sender_id": parent_sender.public_id if parent_sender else None,
+                "sender_name": f"{parent_sender.first_name} {parent_sender.last_name}" if parent_sender else None,
+                "content": Message.reply_preview_content(parent),
+                "message_type": parent.message_type,
+                "is_deleted": parent.is_deleted,
+            }
+        out.append(
+            {
+                "id": m.public_id,
+                "sender_id": sender.public_id if sender else None,
+                "receiver_id": receiver.public_id if receiver else None,
+                "car_id": car.public_id if m.car_id else None,
+                "reply_to_message_id": parent.public_id if parent else None,
+                "reply_to_message": reply_preview,
+                "content": "This message was deleted" if m.is_deleted else m.content,
+                "message_type": m.message_type,
+                "attachment_url": None if m.is_deleted else m.attachment_url,
+                "attachments": [] if m.is_deleted else m.attachments,
+                "listing_preview": None if m.is_deleted else m.listing_preview,
+                "is_read": m.is_read,
+                "is_deleted": m.is_deleted,
+                "edited_at": m.edited_at.isoformat() if m.edited_at else None,
+                "created_at": m.created_at.isoformat() if m.created_at else None,
+                "sender_name": _name(sender),
+                "sender_username": sender.username if sender else None,
+                "receiver_name": _name(receiver),
+                "receiver_username": receiver.username if receiver else None,
+            }
+        )
+    return out
+
+
 def mark_messages_read_for_viewer(car: Car, viewer: User) -> dict:
     """
     Mark unread inbound messages as read and notify counterparties (M-14).
@@ -219,6 +291,7 @@ def mark_messages_read_for_viewer(car: Car, viewer: User) -> dict:
         {"is_read": True},
         synchronize_session=False,
     )
+    mark_conversations_read(car.id, viewer.id)
     db.session.commit()
 
     payload = {
@@ -228,3 +301,78 @@ def mark_messages_read_for_viewer(car: Car, viewer: User) -> dict:
     }
     emit_to_user_rooms("messages_read", payload, *senders)
     return {"marked": len(message_ids), "message_ids": message_ids}
+
+
+def _read_coalesce_s() -> float:
+    return max(0.0, env_float("CHAT_READ_COALESCE_S", 2.0))
+
+
+def mark_read_batch(car_id: int, viewer_id: int) -> dict:
+    """
+    Mark everything unread to ``viewer_id`` on the listing read in one UPDATE.
+
+    The UPDATE is conditional (``is_read = false``) and returns the rows it
+    flipped, so concurrent or repeated runs never emit a receipt twice.
+    """
+    rows = db.session.execute(
+        update(Message)
+        .where(
+            Message.car_id == car_id,
+            Message.receiver_id == viewer_id,
+            Message.is_read.is_(False),
+            Message.is_deleted.is_(False),
+        )
+        .values(is_read=True)
+        .returning(Message.id, Message.public_id, Message.sender_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    mark_conversations_read(car_id, viewer_id)
+    db.session.commit()
+    if not rows:
+        return {"marked": 0, "message_ids": []}
+
+    rows.sort(key=lambda r: r.id)
+    message_ids = [r.public_id or str(r.id) for r in rows]
+    sender_ids = {r.sender_id for r in rows if r.sender_id}
+    senders = User.query.filter(User.id.in_(sender_ids)).all() if sender_ids else []
+    car = db.session.get(Car, car_id)
+    viewer = db.session.get(User, viewer_id)
+    payload = {
+        "car_id": car.public_id if car else None,
+        "reader_id": viewer.public_id if viewer else None,
+        "message_ids": message_ids,
+    }
+    emit_to_user_rooms("messages_read", payload, *senders)
+    return {"marked": len(message_ids), "message_ids": message_ids}
+
+
+def schedule_mark_read(car: Car, viewer: User) -> bool:
+    """
+    Queue :func:`mark_read_batch` after a history fetch instead of running it in the request.
+
+    Skipped when the viewer's conversation counters show nothing unread. With a
+    broker, fetches within ``CHAT_READ_COALESCE_S`` share one delayed task (Redis
+    claim); without one the batch runs inline. Returns True when work was queued or run.
+    """
+    if car is None or viewer is None or not viewer_has_unread(car.id, viewer.id):
+        return False
+    if broker_configured():
+        delay = _read_coalesce_s()
+        r = get_redis()
+        if r is not None and delay > 0:
+            try:
+                claim = f"chatread:pending:{car.id}:{viewer.id}"
+                if not r.set(claim, "1", nx=True, px=max(1, int(delay * 1000))):
+                    return True
+            except Exception as exc:
+                logger.warning("chat read claim failed: %s", exc)
+        try:
+            from .tasks.chat_tasks import mark_chat_read
+
+            mark_chat_read.apply_async((car.id, viewer.id), countdown=delay)
+            return True
+        except Exception as exc:
+            logger.warning("chat read: Celery dispatch failed, marking inline: %s", exc)
+    mark_read_batch(car.id, viewer.id)
+    return True
+
@@ -45,6 +45,22 @@ def validate_required_secrets(env: str | None = None) -> None:
     validate_redis_required(env_name)
 
 
+def env_int(name: str, default: int) -> int:
+    """Integer env var ``name``; ``default`` when it is unset, empty or malformed."""
+    try:
+        return int(os.environ.get(name) or default)
+    except ValueError:
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """Float env var ``name``; ``default`` when it is unset, empty or malformed."""
+    try:
+        return float(os.environ.get(name) or default)
+    except ValueError:
+        return default
+
+
 def _env_flag(name: str) -> bool:
     return (os.environ.get(name) or "").strip().lower() in ("1", "true", "yes", "on")
 
@@ -0,0 +1,193 @@
+"""SQLAlchemy connection pooling for production Postgres.
+
+Production used to force ``NullPool`` because some PaaS setups hit
+``RuntimeError: cannot notify on un-acquired lock`` inside QueuePool's
+``threading.Condition`` (a monkey-patched / mixed threading runtime). With
+NullPool every request paid a fresh TLS handshake to Neon.
+
+:func:`production_engine_options` now builds a pooled configuration:
+
+- ``DB_POOL_MODE=queue`` (default): :class:`InstrumentedQueuePool` sized from
+  gunicorn threads per worker (``GUNICORN_THREADS``; the pool is per process,
+  so the fleet holds ``workers x (size + overflow)`` at most).
+- ``DB_POOL_MODE=pgbouncer``: same pool, plus psycopg server-side prepared
+  statements disabled so a PgBouncer / Neon ``-pooler`` endpoint in
+  transaction mode is safe.
+- ``DB_POOL_MODE=null``: the old behaviour.
+
+Before choosing QueuePool, :func:`queue_pool_self_check` hammers a tiny pool
+with contended checkouts (no database involved) and falls back to NullPool
+only if the Condition bug reproduces in this runtime. Checkout/wait counters
+are served by ``GET /health/db``.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Any
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+from .config import env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+
+class _PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.checkouts = 0
+            self.waits = 0
+            self.wait_ms_total = 0.0
+            self.wait_ms_max = 0.0
+            self.timeouts = 0
+
+    def record(self, wait_ms: float, *, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            # Sub-millisecond checkouts came straight from the idle queue.
+            if wait_ms >= 1.0:
+                self.waits += 1
+            self.wait_ms_total += wait_ms
+            self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "wait_ms_avg": round(self.wait_ms_total / self.checkouts, 3) if self.checkouts else None,
+                "wait_ms_max": round(self.wait_ms_max, 3),
+            }
+
+
+_stats = _PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            _stats.record(0.0, timed_out=True)
+            raise
+        _stats.record((time.perf_counter() - started) * 1000.0)
+        return conn
+
+
+class _SelfCheckConnection:
+    """Stand-in DB-API connection: the check exercises pool locking only."""
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def queue_pool_self_check(threads: int = 8, rounds: int = 200) -> str | None:
+    """
+    Contend a size-1 QueuePool from several threads (every checkout waits on
+    the pool Condition and every return notifies it).
+
+    Returns None when the pool behaves, otherwise the error that a
+    production QueuePool would hit (e.g. "cannot notify on un-acquired lock").
+    """
+    pool = QueuePool(_SelfCheckConnection, pool_size=1, max_overflow=0, timeout=10)
+    errors: list[str] = []
+
+    def worker():
+        try:
+            for _ in range(rounds):
+                conn = pool.connect()
+                conn.close()
+        except Exception as exc:  # pragma: no cover - runtime-specific
+            errors.append(f"{exc.__class__.__name__}: {exc}")
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join(timeout=30)
+    if any(t.is_alive() for t in workers):
+        errors.append("QueuePool self-check deadlocked")
+    pool.dispose()
+    return errors[0] if errors else None
+
+
+def production_engine_options(existing: dict | None = None) -> dict:
+    """Engine options for production Postgres (see module docstring)."""
+    opts = dict(existing or {})
+    opts.setdefault("pool_pre_ping", True)
+    mode = (os.environ.get("DB_POOL_MODE") or "queue").strip().lower()
+
+    if mode == "pgbouncer":
+        connect_args = dict(opts.get("connect_args") or {})
+        # Transaction pooling hands each transaction a different server
+        # session; psycopg must not rely on named prepared statements.
+        connect_args.setdefault("prepare_threshold", None)
+        opts["connect_args"] = connect_args
+
+    if mode == "null" or "poolclass" in opts:
+        opts.setdefault("poolclass", NullPool)
+        return opts
+
+    failure = queue_pool_self_check()
+    if failure:
+        logger.error("QueuePool self-check failed (%s); falling back to NullPool", failure)
+        opts["poolclass"] = NullPool
+        return opts
+
+    threads = max(1, env_int("GUNICORN_THREADS", 4))
+    pool_size = max(1, env_int("DB_POOL_SIZE", threads))
+    max_overflow = max(0, env_int("DB_MAX_OVERFLOW", threads))
+    opts.update(
+        poolclass=InstrumentedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=env_float("DB_POOL_TIMEOUT_S", 10.0),
+        # Neon / PaaS proxies drop idle connections after a few minutes.
+        pool_recycle=env_int("DB_POOL_RECYCLE_S", 300),
+        pool_use_lifo=True,
+    )
+    workers = max(1, env_int("WEB_CONCURRENCY", 1))
+    logger.info(
+        "DB pool: %s size=%d overflow=%d per process (up to %d connections across %d workers)",
+        mode,
+        pool_size,
+        max_overflow,
+        workers * (pool_size + max_overflow),
+        workers,
+    )
+    return opts
+
+
+def pool_stats(engine) -> dict[str, Any]:
+    """Current pool occupancy plus checkout/wait counters for this process."""
+    pool = engine.pool
+    out: dict[str, Any] = {"pool": pool.__class__.__name__, "pid": os.getpid()}
+    if isinstance(pool, QueuePool):
+        out.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+    if isinstance(pool, InstrumentedQueuePool):
+        out.update(_stats.snapshot())
+    return out
@@ -8,6 +8,8 @@ import threading
 import time
 from typing import Any
 
+from .redis_client import get_redis
+
 logger = logging.getLogger(__name__)
 
 _LOCK = threading.Lock()
@@ -15,15 +17,6 @@ _MEMORY: dict[str, tuple[float, int, Any]] = {}
 _DEFAULT_TTL_S = 24 * 60 * 60
 
 
-def _redis():
-    try:
-        from .security import _redis_client
-
-        return _redis_client()
-    except Exception:
-        return None
-
-
 def _mem_get(key: str) -> tuple[int, Any] | None:
     now = time.time()
     with _LOCK:
@@ -55,7 +48,7 @@ def remember_response(
     key = f"idem:{scope}:{actor_id}:{idem_key.strip()}"
     if not idem_key.strip():
         return
-    r = _redis()
+    r = get_redis()
     if r is not None:
         try:
             payload = json.dumps(
@@ -81,7 +74,7 @@ def replay_response(
     if not cleaned:
         return None
     key = f"idem:{scope}:{actor_id}:{cleaned}"
-    r = _redis()
+    r = get_redis()
     if r is not None:
         try:
             raw = r.get(key)
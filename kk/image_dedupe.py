@@ -0,0 +1,122 @@
+"""Content-addressed cache for processed listing photos.
+
+Clients retry uploads and sellers re-upload the same photos when editing a
+listing; each time the bytes were decoded, plate-detected, blurred, resized and
+stored again as a new ``processed_<timestamp>_...`` object. Uploads are now
+keyed by the SHA-256 of the incoming bytes:
+
+- ``imgdedupe:out:<sha>:<variant>`` -> the stored result (URL, size, renditions,
+  preview). ``variant`` fingerprints the processing settings, so changing
+  max size, quality, blur or renditions never returns stale output.
+- ``imgdedupe:plates:<sha>:<detector>:<w>x<h>`` -> detector boxes for the probe,
+  kept separately so a re-upload with other output settings still skips detection.
+
+Entries live in a :class:`kk.ttl_store.TTLStore` (``IMAGE_DEDUPE_TTL_S``,
+default 30 days). Stored objects are never deleted
+when a listing photo is removed, so a cached URL stays valid; local paths are
+still checked on disk before reuse.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+from typing import Any, Dict, List, Sequence
+
+from .license_plate_blur import PlateBox, PlateDetector
+from .ttl_store import TTLStore
+
+_STORE = TTLStore("imgdedupe:", max_entries=2048)
+_DEFAULT_TTL_S = 30 * 24 * 60 * 60
+
+
+def dedupe_enabled() -> bool:
+    return (os.getenv("IMAGE_DEDUPE_ENABLED", "1") or "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _ttl_s() -> int:
+    try:
+        return int(os.getenv("IMAGE_DEDUPE_TTL_S", str(_DEFAULT_TTL_S)) or _DEFAULT_TTL_S)
+    except ValueError:
+        return _DEFAULT_TTL_S
+
+
+def content_hash(raw_bytes: bytes) -> str:
+    return hashlib.sha256(raw_bytes).hexdigest()
+
+
+def _get(key: str) -> Any | None:
+    return _STORE.get(key)
+
+
+def _set(key: str, value: Any) -> None:
+    _STORE.set(key, value, _ttl_s())
+
+
+def clear_memory_cache() -> None:
+    _STORE.clear_memory()
+
+
+def _stored_object_exists(url: str) -> bool:
+    """Remote URLs are trusted; local ``uploads/...`` paths must still be on disk."""
+    if not url or url.startswith("http://") or url.startswith("https://") or not url.startswith("uploads/"):
+        return bool(url)
+    from flask import current_app
+
+    upload_root = (current_app.config.get("UPLOAD_FOLDER") or "").strip()
+    if not upload_root:
+        return False
+    return os.path.isfile(os.path.join(os.path.dirname(os.path.abspath(upload_root)), url))
+
+
+def lookup_processed(digest: str, variant: str) -> Dict[str, Any] | None:
+    """Cached result for these bytes and settings, or None (miss / stored object gone)."""
+    hit = _get(f"out:{digest}:{variant}")
+    if not isinstance(hit, dict):
+        return None
+    urls = [hit.get("rel_path") or ""]
+    for by_width in (hit.get("renditions") or {}).values():
+        urls.extend(by_width.values())
+    if not all(_stored_object_exists(u) for u in urls):
+        return None
+    return hit
+
+
+def remember_processed(digest: str, variant: str, result: Dict[str, Any]) -> None:
+    _set(f"out:{digest}:{variant}", result)
+
+
+class CachedPlateDetector(PlateDetector):
+    """Wraps a detector for one upload; successful results are cached by content hash."""
+
+    def __init__(self, inner: PlateDetector, digest: str) -> None:
+        self.inner = inner
+        self.digest = digest
+        self.name = getattr(inner, "name", "detector")
+
+    def is_configured(self) -> bool:
+        return self.inner.is_configured()
+
+    def detect_with_meta(self, image_bytes: bytes):
+        return self.inner.detect_with_meta(image_bytes)
+
+    def detect_images_with_meta(self, images: Sequence[Any]):
+        results: List[Any] = []
+        for im in images:
+            key = f"plates:{self.digest}:{self.name}:{im.size[0]}x{im.size[1]}"
+            hit = _get(key)
+            if isinstance(hit, dict):
+                boxes = [PlateBox(x1=b[0], y1=b[1], x2=b[2], y2=b[3], confidence=b[4]) for b in hit.get("boxes") or []]
+                results.append((boxes, {**(hit.get("meta") or {}), "detect_cache": "hit"}))
+                continue
+            boxes, meta = self.inner.detect_images_with_meta([im])[0]
+            if meta.get("detect_status") == "ok":
+                _set(
+                    key,
+                    {
+                        "boxes": [[b.x1, b.y1, b.x2, b.y2, b.confidence] for b in boxes],
+                        "meta": {k: v for k, v in meta.items() if k in ("detect_status", "predictions", "backend")},
+                    },
+                )
+            results.append((boxes, meta))
+        return results
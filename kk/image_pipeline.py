@@ -0,0 +1,155 @@
+"""Single-decode image pipeline for uploaded photos.
+
+An upload used to be decoded and re-encoded up to five times: HEIC -> JPEG q92,
+EXIF normalize -> q95 for plate inference, ``cv2.imdecode`` / ``imencode`` q92
+around the blur, Pillow thumbnail -> q80, and a final re-open for the inline
+preview. Each pass cost CPU, held another full-size bitmap and lost quality.
+
+:class:`ImagePipeline` decodes once (JPEG scaled down during decode via
+``Image.draft``), applies EXIF orientation once, blurs plates in place on the
+same pixel buffer, and encodes once per output size.
+"""
+
+from __future__ import annotations
+
+import logging
+from io import BytesIO
+from typing import Any, Dict
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+_heif_registered = False
+
+
+def _register_heif() -> None:
+    global _heif_registered
+    if _heif_registered:
+        return
+    _heif_registered = True
+    try:
+        import pillow_heif  # type: ignore
+
+        pillow_heif.register_heif_opener()
+    except Exception:
+        pass
+
+
+_FORMATS = {
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+    ".png": "PNG",
+    ".webp": "WEBP",
+    ".avif": "AVIF",
+}
+
+
+def format_for_ext(ext: str) -> str:
+    """Pillow format for an output extension (JPEG for anything unknown, e.g. HEIC)."""
+    ext = (ext or "").strip().lower()
+    if ext and not ext.startswith("."):
+        ext = f".{ext}"
+    return _FORMATS.get(ext, "JPEG")
+
+
+class ImagePipeline:
+    """One decoded, upright RGB image; encode it at any number of sizes."""
+
+    def __init__(self, image: Image.Image, *, source_format: str | None = None) -> None:
+        self.image = image
+        self.source_format = source_format
+
+    @classmethod
+    def decode(cls, raw_bytes: bytes, *, max_dim: int | None = None) -> "ImagePipeline":
+        """
+        Decode ``raw_bytes`` once (JPEG, PNG, WebP, HEIC/HEIF when pillow-heif is installed).
+
+        With ``max_dim`` JPEG decoding uses DCT scaling to the smallest power-of-two
+        reduction that still covers ``max_dim`` on both sides. Raises on undecodable input.
+        """
+        _register_heif()
+        im = Image.open(BytesIO(raw_bytes))
+        source_format = im.format
+        if max_dim and source_format == "JPEG":
+            # Orientation is applied later, so ask for a square bound.
+            im.draft("RGB", (max_dim, max_dim))
+        im = ImageOps.exif_transpose(im)
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        else:
+            im.load()
+        return cls(im, source_format=source_format)
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.image.size
+
+    def resized(self, max_dim: int | None) -> Image.Image:
+        """The image scaled to fit ``max_dim`` (no copy when it already fits)."""
+        if not max_dim or max(self.image.size) <= max_dim:
+            return self.image
+        out = self.image.copy()
+        out.thumbnail((max_dim, max_dim), Image.Resampling.LANCZOS)
+        return out
+
+    def encode(
+        self,
+        *,
+        max_dim: int | None = None,
+        fmt: str = "JPEG",
+        quality: int = 80,
+    ) -> bytes:
+        im = self.resized(max_dim)
+        fmt = fmt.upper()
+        buf = BytesIO()
+        if fmt == "JPEG":
+            im.save(buf, format="JPEG", quality=quality, optimize=True)
+        elif fmt == "WEBP":
+            im.save(buf, format="WEBP", quality=quality, method=4)
+        elif fmt == "AVIF":
+            im.save(buf, format="AVIF", quality=quality)
+        else:
+            im.save(buf, format=fmt)
+        return buf.getvalue()
+
+    def blur_plates(self, detector, *, expand_ratio: float = 0.0, detect_max_dim: int = 1600) -> Dict[str, Any]:
+        """
+        Detect plates and blur them in place. Returns blur metadata (``status``, ``plates``, ``applied``).
+
+        The detector gets the current pixels (downscaled to ``detect_max_dim``; HTTP
+        backends encode them as JPEG) and boxes are mapped back, so they always match
+        this buffer's orientation.
+        """
+        try:
+            import cv2  # type: ignore  # noqa: F401
+            import numpy as np  # type: ignore
+
+            from .license_plate_blur import apply_plate_blur
+        except Exception as e:
+            return {"status": "opencv_missing", "error": str(e)}
+
+        width = self.image.size[0]
+        probe = self.resized(detect_max_dim)
+        scale = width / float(probe.size[0])
+        detect_images = getattr(detector, "detect_images_with_meta", None)
+        if detect_images is not None:
+            boxes, det_meta = detect_images([probe])[0]
+        else:
+            buf = BytesIO()
+            probe.save(buf, format="JPEG", quality=90)
+            boxes, det_meta = detector.detect_with_meta(buf.getvalue())
+        if not boxes:
+            if det_meta.get("detect_status") in ("detect_failed", "bad_response"):
+                return {**det_meta, "status": "detect_failed"}
+            return {**det_meta, "status": "no_plates", "plates": 0}
+        if scale != 1.0:
+            boxes = [b.scaled(scale) for b in boxes]
+
+        arr = np.array(self.image)
+        applied = apply_plate_blur(arr, boxes, expand_ratio=expand_ratio)
+        if applied == 0:
+            return {**det_meta, "status": "no_valid_rois", "plates": len(boxes), "applied": 0}
+        self.image = Image.fromarray(arr)
+        return {**det_meta, "status": "blurred", "plates": len(boxes), "applied": applied}
+
@@ -0,0 +1,156 @@
+"""Multi-resolution renditions of listing photos.
+
+Feed cards and chat avatars used to download the same <=1200 px JPEG as the
+gallery. Each ``CarImage`` now gets smaller derivatives encoded at upload time
+from the already-decoded pixels (:class:`kk.image_pipeline.ImagePipeline`):
+WebP at every width in ``IMAGE_RENDITION_WIDTHS`` (plus any extra format in
+``IMAGE_RENDITION_FORMATS``, e.g. ``avif``) and a JPEG fallback. They are
+stored on ``CarImage.renditions`` as the srcset map serializers return::
+
+    {"webp": {"240": url, "480": url, "1200": url},
+     "jpeg": {"240": url, "480": url, "1200": <image_url>}}
+
+``{}`` marks a row whose source could not be read, so the backfill
+(``kk.tasks.image_tasks.backfill_image_renditions``) does not retry it forever.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from typing import Any
+
+from flask import current_app
+from sqlalchemy import select
+
+from .models import CarImage, db
+
+logger = logging.getLogger(__name__)
+
+_CONTENT_TYPES = {"webp": "image/webp", "avif": "image/avif", "jpeg": "image/jpeg"}
+_EXTENSIONS = {"webp": "webp", "avif": "avif", "jpeg": "jpg"}
+
+
+def renditions_enabled() -> bool:
+    return (os.getenv("IMAGE_RENDITIONS_ENABLED", "1") or "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def rendition_widths() -> tuple[int, ...]:
+    raw = os.getenv("IMAGE_RENDITION_WIDTHS", "240,480,1200") or "240,480,1200"
+    widths = sorted({int(w) for w in raw.split(",") if w.strip().isdigit() and int(w) > 0})
+    return tuple(widths) or (240, 480, 1200)
+
+
+def rendition_formats() -> tuple[str, ...]:
+    raw = os.getenv("IMAGE_RENDITION_FORMATS", "webp") or "webp"
+    formats = [f.strip().lower() for f in raw.split(",")]
+    return tuple(f for f in dict.fromkeys(formats) if f in ("webp", "avif")) or ("webp",)
+
+
+def rendition_signature() -> str:
+    """Settings that determine the rendition set (widths, formats, quality)."""
+    quality = os.getenv("IMAGE_RENDITION_QUALITY", "75") or "75"
+    return f"{','.join(map(str, rendition_widths()))};{','.join(rendition_formats())};q{quality}"
+
+
+def build_renditions(pipeline, *, stem: str, main_url: str, main_dim: int) -> dict[str, dict[str, str]]:
+    """
+    Encode and persist every rendition of ``pipeline``'s pixels.
+
+    ``main_url`` (the stored JPEG, ``main_dim`` px) doubles as the largest JPEG fallback,
+    so JPEG is only encoded for widths below it.
+    """
+    from .media_processing import persist_image_bytes
+
+    quality = int(os.getenv("IMAGE_RENDITION_QUALITY", "75") or "75")
+    out: dict[str, dict[str, str]] = {}
+    for fmt in (*rendition_formats(), "jpeg"):
+        urls: dict[str, str] = {}
+        for width in rendition_widths():
+            if fmt == "jpeg" and width >= main_dim:
+                urls[str(width)] = main_url
+                continue
+            body = pipeline.encode(max_dim=width, fmt=fmt.upper(), quality=quality)
+            urls[str(width)] = persist_image_bytes(
+                body,
+                object_filename=f"{stem}_w{width}.{_EXTENSIONS[fmt]}",
+                content_type=_CONTENT_TYPES[fmt],
+            )
+        out[fmt] = urls
+    return out
+
+
+def image_srcset(img: CarImage | None) -> dict[str, dict[str, str]] | None:
+    """The stored srcset map for ``img`` (None until renditions exist)."""
+    renditions = getattr(img, "renditions", None) if img is not None else None
+    return renditions or None
+
+
+def _read_source_bytes(img: CarImage) -> bytes | None:
+    """Bytes of the stored JPEG: local static file or public URL (R2/CDN)."""
+    from .media_paths import STATIC_ROOTS, image_display_url
+
+    url = image_display_url(img) or (img.image_url or "")
+    if url.startswith("http://") or url.startswith("https://"):
+        import requests
+
+        resp = requests.get(url, timeout=(5, 30))
+        if resp.status_code != 200:
+            return None
+        return resp.content
+    if not url:
+        return None
+    rel = url.lstrip("/")
+    roots = list(STATIC_ROOTS)
+    upload_root = (current_app.config.get("UPLOAD_FOLDER") or "").strip()
+    if upload_root and rel.startswith("uploads/"):
+        roots.insert(0, os.path.dirname(os.path.abspath(upload_root)))
+    for root in roots:
+        path = os.path.join(root, rel)
+        if os.path.isfile(path):
+            with open(path, "rb") as fp:
+                return fp.read()
+    return None
+
+
+def generate_renditions_for_image(img: CarImage) -> dict[str, Any]:
+    """Build renditions for an existing row from its stored image ({} when unreadable)."""
+    from .image_pipeline import ImagePipeline
+
+    try:
+        raw = _read_source_bytes(img)
+    except Exception:
+        logger.warning("renditions backfill: cannot fetch car_image %s", img.id, exc_info=True)
+        raw = None
+    if not raw:
+        return {}
+    try:
+        pipeline = ImagePipeline.decode(raw, max_dim=max(rendition_widths()))
+    except Exception:
+        return {}
+    base = os.path.splitext(os.path.basename((img.image_url or "").split("?", 1)[0]))[0] or f"car_image_{img.id}"
+    return build_renditions(pipeline, stem=base, main_url=img.image_url, main_dim=max(pipeline.size))
+
+
+def backfill_image_renditions(*, after_id: int = 0, batch_size: int = 50) -> tuple[int, int | None]:
+    """
+    Generate renditions for one keyset batch of rows that have none.
+
+    Returns (rows processed, last id) -- last id is None when nothing is left.
+    """
+    rows = db.session.scalars(
+        select(CarImage)
+        .where(CarImage.id > after_id, CarImage.renditions.is_(None))
+        .order_by(CarImage.id)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        return 0, None
+    for img in rows:
+        try:
+            img.renditions = generate_renditions_for_image(img)
+        except Exception:
+            logger.exception("renditions backfill failed for car_image %s", img.id)
+            img.renditions = {}
+        db.session.commit()
+    return len(rows), rows[-1].id
@@ -13,6 +13,8 @@ import re
 import time
 from typing import Any
 
+from .redis_client import get_redis
+
 logger = logging.getLogger(__name__)
 
 # Celery default ids are UUIDs; also allow hex tokens used by some backends.
@@ -29,15 +31,6 @@ def is_valid_task_id(task_id: str) -> bool:
     return bool(raw and _TASK_ID_RE.match(raw))
 
 
-def _redis_client():
-    try:
-        from .security import _redis_client as redis_client
-
-        return redis_client()
-    except Exception:
-        return None
-
-
 def register_job_owner(
     task_id: str,
     owner_public_id: str,
@@ -50,7 +43,7 @@ def register_job_owner(
     if not tid or not owner or not is_valid_task_id(tid):
         return
 
-    r = _redis_client()
+    r = get_redis()
     if r is not None:
         try:
             r.setex(f"{_OWNER_KEY_PREFIX}{tid}", int(ttl_s), owner)
@@ -68,7 +61,7 @@ def get_registered_job_owner(task_id: str) -> str | None:
     if not tid or not is_valid_task_id(tid):
         return None
 
-    r = _redis_client()
+    r = get_redis()
     if r is not None:
         try:
             val = r.get(f"{_OWNER_KEY_PREFIX}{tid}")
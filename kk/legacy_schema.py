@@ -171,6 +171,8 @@ def ensure_minimal_schema_compat(app, db) -> None:
                     ('"order"', "INTEGER DEFAULT 0"),
                     ("created_at", "DATETIME"),
                     ("kind", "TEXT DEFAULT 'listing'"),
+                    ("resolved_url", "TEXT"),
+                    ("renditions", "JSON"),
                 ):
                     _add_ci(col, typ)
 
@@ -189,12 +191,32 @@ def ensure_minimal_schema_compat(app, db) -> None:
                     ("duration", "INTEGER"),
                     ('"order"', "INTEGER DEFAULT 0"),
                     ("created_at", "DATETIME"),
+                    ("width", "INTEGER"),
+                    ("height", "INTEGER"),
+                    ("codec", "VARCHAR(32)"),
+                    ("size_bytes", "BIGINT"),
+                    ("preview_url", "TEXT"),
+                    ("processing_status", "VARCHAR(16)"),
                 ):
                     _add_cv(col, typ)
 
                 conn.commit()
+
+                # Materialized chat inbox (kk.chat_conversations): create and fill once.
+                build_conversations = False
+                if _cols("message") and not _cols("conversation"):
+                    from .models import Conversation
+
+                    Conversation.__table__.create(bind=conn, checkfirst=True)
+                    conn.commit()
+                    build_conversations = True
             finally:
                 conn.close()
+
+            if build_conversations:
+                from .chat_conversations import rebuild_conversations
+
+                rebuild_conversations()
     except Exception:
         # Best-effort; do not block app startup
         pass
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import abc
 import base64
 import json
 import logging
@@ -7,8 +8,10 @@ import os
 import re
 import subprocess
 import sys
+import threading
 from dataclasses import dataclass
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from io import BytesIO
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 
 import requests
 
@@ -107,6 +110,15 @@ class PlateBox:
 			y1, y2 = y2, y1
 		return PlateBox(x1=x1, y1=y1, x2=x2, y2=y2, confidence=self.confidence)
 
+	def scaled(self, factor: float) -> "PlateBox":
+		return PlateBox(
+			x1=int(round(self.x1 * factor)),
+			y1=int(round(self.y1 * factor)),
+			x2=int(round(self.x2 * factor)),
+			y2=int(round(self.y2 * factor)),
+			confidence=self.confidence,
+		)
+
 	def expand(self, ratio: float) -> "PlateBox":
 		w = max(0, self.x2 - self.x1)
 		h = max(0, self.y2 - self.y1)
@@ -121,7 +133,42 @@ class PlateBox:
 		)
 
 
-class RoboflowPlateDetector:
+DetectResult = Tuple[List[PlateBox], Dict[str, Any]]
+
+
+class PlateDetector(abc.ABC):
+	"""
+	Plate detection backend.
+
+	Backends implement ``is_configured`` and must implement ``detect_with_meta`` (encoded image bytes);
+	``detect_images_with_meta`` takes decoded PIL images and is what the upload pipeline
+	calls -- override it when the backend can use pixels directly or batch.
+	"""
+
+	name = "base"
+
+	def is_configured(self) -> bool:
+		return False
+
+	@abc.abstractmethod
+	def detect_with_meta(self, image_bytes: bytes) -> DetectResult:
+		"""Boxes plus backend metadata for one encoded image."""
+
+	def detect_images_with_meta(self, images: Sequence[Any]) -> List[DetectResult]:
+		results: List[DetectResult] = []
+		for im in images:
+			buf = BytesIO()
+			im.save(buf, format="JPEG", quality=90)
+			results.append(self.detect_with_meta(buf.getvalue()))
+		return results
+
+	def detect(self, image_bytes: bytes) -> List[PlateBox]:
+		"""Backward-compatible wrapper."""
+		boxes, _ = self.detect_with_meta(image_bytes)
+		return boxes
+
+
+class RoboflowPlateDetector(PlateDetector):
 	"""
 	Roboflow Hosted API client for plate bounding boxes.
 
@@ -130,6 +177,8 @@ class RoboflowPlateDetector:
 	  https://serverless.roboflow.com/<project>/<version>?api_key=...
 	"""
 
+	name = "roboflow"
+
 	def __init__(
 		self,
 		*,
@@ -225,68 +274,202 @@ class RoboflowPlateDetector:
 
 		return boxes, {"detect_status": "ok", "predictions": len(preds), "confidence": self.confidence, "overlap": self.overlap}
 
-	def detect(self, image_bytes: bytes) -> List[PlateBox]:
-		"""Backward-compatible wrapper."""
-		boxes, _ = self.detect_with_meta(image_bytes)
-		return boxes
 
+DEFAULT_ONNX_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "weights", "yolov8l-iraqi-license-plate.onnx")
+
+
+class _PendingDetect:
+	__slots__ = ("blob", "scale", "left", "top", "size", "result", "done")
 
-def _normalize_image_bytes_for_inference(image_bytes: bytes, output_ext: str) -> Tuple[bytes, Dict[str, Any]]:
+	def __init__(self, blob, scale: float, left: int, top: int, size: Tuple[int, int]) -> None:
+		self.blob = blob
+		self.scale = scale
+		self.left = left
+		self.top = top
+		self.size = size
+		self.result: Optional[DetectResult] = None
+		self.done = threading.Event()
+
+
+class OnnxPlateDetector(PlateDetector):
 	"""
-	Normalize EXIF orientation before inference.
+	Local CPU detector for the YOLOv8 plate model exported to ONNX
+	(``tools/export_plate_model_onnx.py`` exports kk/weights/yolov8l-iraqi-license-plate.pt).
 
-	Roboflow web UI typically displays images with EXIF orientation applied; raw byte uploads may not.
-	This function applies EXIF transpose (if Pillow is available) and re-encodes to the same format.
+	Uses onnxruntime when installed, else OpenCV DNN. The model is loaded once per process
+	on first use. Concurrent callers are micro-batched: the thread holding the inference
+	lock runs every pending image (up to ``max_batch``) in one forward pass.
 	"""
-	try:
-		from PIL import Image, ImageOps  # type: ignore
-		from io import BytesIO
-	except Exception as e:
-		return image_bytes, {"normalize_status": "pillow_missing", "normalize_error": _public_error(str(e))}
 
-	try:
-		# Allow PIL to open HEIC (iPhone) if pillow-heif is installed.
+	name = "onnx"
+
+	def __init__(
+		self,
+		*,
+		model_path: str = DEFAULT_ONNX_MODEL_PATH,
+		input_size: int = 640,
+		confidence: float = 0.25,
+		iou: float = 0.45,
+		max_batch: int = 4,
+	) -> None:
+		self.model_path = (model_path or "").strip()
+		self.input_size = int(input_size)
+		self.confidence = float(confidence)
+		self.iou = float(iou)
+		self.max_batch = max(1, int(max_batch))
+		self.backend: Optional[str] = None
+		self._session = None
+		self._input_name = "images"
+		self._net = None
+		self._dynamic_batch = True
+		self._load_lock = threading.Lock()
+		self._run_lock = threading.Lock()
+		self._pending_lock = threading.Lock()
+		self._pending: List[_PendingDetect] = []
+
+	def is_configured(self) -> bool:
+		return bool(self.model_path) and os.path.isfile(self.model_path)
+
+	def _load(self) -> None:
+		if self.backend is not None:
+			return
+		with self._load_lock:
+			if self.backend is not None:
+				return
+			try:
+				import onnxruntime as ort  # type: ignore
+			except ImportError:
+				import cv2  # type: ignore
+
+				self._net = cv2.dnn.readNetFromONNX(self.model_path)
+				self.backend = "opencv"
+			else:
+				session = ort.InferenceSession(self.model_path, providers=["CPUExecutionProvider"])
+				model_input = session.get_inputs()[0]
+				self._input_name = model_input.name
+				self._dynamic_batch = not isinstance(model_input.shape[0], int)
+				self._session = session
+				self.backend = "onnxruntime"
+			logger.info("plate detector: loaded %s via %s", self.model_path, self.backend)
+
+	def _forward(self, blob):
+		if self._session is not None:
+			return self._session.run(None, {self._input_name: blob})[0]
+		self._net.setInput(blob)
+		return self._net.forward()
+
+	def _prepare(self, image) -> _PendingDetect:
+		"""Letterbox to ``input_size`` (gray padding, centered) as an NCHW float blob."""
+		import cv2  # type: ignore
+		import numpy as np  # type: ignore
+
+		if image.mode != "RGB":
+			image = image.convert("RGB")
+		arr = np.asarray(image)
+		height, width = arr.shape[:2]
+		size = self.input_size
+		scale = min(size / width, size / height)
+		new_w, new_h = max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+		if (new_w, new_h) != (width, height):
+			arr = cv2.resize(arr, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+		left, top = (size - new_w) // 2, (size - new_h) // 2
+		canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+		canvas[top : top + new_h, left : left + new_w] = arr
+		blob = canvas.transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+		return _PendingDetect(blob, scale, left, top, (width, height))
+
+	def _boxes(self, pred, item: _PendingDetect) -> List[PlateBox]:
+		"""YOLOv8 head output ``(4 + classes, anchors)`` -> NMS'd boxes in source pixels."""
+		import cv2  # type: ignore
+		import numpy as np  # type: ignore
+
+		pred = np.asarray(pred, dtype=np.float32)
+		if pred.shape[0] < pred.shape[1]:
+			pred = pred.T
+		scores = pred[:, 4:].max(axis=1)
+		keep = scores >= self.confidence
+		pred, scores = pred[keep], scores[keep]
+		if not len(pred):
+			return []
+		x1 = (pred[:, 0] - pred[:, 2] / 2.0 - item.left) / item.scale
+		y1 = (pred[:, 1] - pred[:, 3] / 2.0 - item.top) / item.scale
+		w = pred[:, 2] / item.scale
+		h = pred[:, 3] / item.scale
+		rects = np.stack([x1, y1, w, h], axis=1).tolist()
+		picked = cv2.dnn.NMSBoxes(rects, scores.tolist(), self.confidence, self.iou)
+		width, height = item.size
+		boxes: List[PlateBox] = []
+		for i in np.array(picked).reshape(-1):
+			bx, by, bw, bh = rects[int(i)]
+			boxes.append(
+				PlateBox(
+					x1=int(round(bx)),
+					y1=int(round(by)),
+					x2=int(round(bx + bw)),
+					y2=int(round(by + bh)),
+					confidence=float(scores[int(i)]),
+				).clamp(width=width, height=height)
+			)
+		return boxes
+
+	def _infer(self, batch: List[_PendingDetect]) -> list:
+		import numpy as np  # type: ignore
+
+		if len(batch) > 1 and self._dynamic_batch:
+			try:
+				out = self._forward(np.concatenate([item.blob for item in batch]))
+				if len(out) == len(batch):
+					return list(out)
+			except Exception:
+				logger.info("plate detector: model does not take batches; running images one by one")
+			self._dynamic_batch = False
+		return [self._forward(item.blob)[0] for item in batch]
+
+	def _run_batch(self, batch: List[_PendingDetect]) -> None:
 		try:
-			import pillow_heif  # type: ignore
-			pillow_heif.register_heif_opener()
-		except Exception:
-			pass
+			preds = self._infer(batch)
+			for item, pred in zip(batch, preds):
+				boxes = self._boxes(pred, item)
+				item.result = (boxes, {"detect_status": "ok", "predictions": len(boxes), "backend": self.backend, "batch": len(batch)})
+		except Exception as e:
+			logger.warning("Local plate detection failed: %s", e)
+			for item in batch:
+				item.result = ([], {"detect_status": "detect_failed", "detect_error": str(e)})
+		finally:
+			for item in batch:
+				item.done.set()
+
+	def detect_images_with_meta(self, images: Sequence[Any]) -> List[DetectResult]:
+		if not self.is_configured():
+			return [([], {"detect_status": "not_configured"}) for _ in images]
+		try:
+			self._load()
+			items = [self._prepare(im) for im in images]
+		except Exception as e:
+			logger.warning("Local plate detector unavailable: %s", e)
+			return [([], {"detect_status": "detect_failed", "detect_error": str(e)}) for _ in images]
+
+		with self._pending_lock:
+			self._pending.extend(items)
+		for item in items:
+			while not item.done.is_set():
+				with self._run_lock:
+					if item.done.is_set():
+						break
+					with self._pending_lock:
+						batch = self._pending[: self.max_batch]
+						del self._pending[: self.max_batch]
+					self._run_batch(batch)
+		return [item.result or ([], {"detect_status": "detect_failed"}) for item in items]
+
+	def detect_with_meta(self, image_bytes: bytes) -> DetectResult:
+		from PIL import Image, ImageOps
 
-		ext = (output_ext or "").strip().lower()
-		if not ext.startswith("."):
-			ext = f".{ext}" if ext else ".jpg"
-		fmt = "JPEG"
-		if ext == ".png":
-			fmt = "PNG"
-		elif ext == ".webp":
-			fmt = "WEBP"
-		elif ext in (".jpg", ".jpeg"):
-			fmt = "JPEG"
-		elif ext in (".heic", ".heif"):
-			# HEIC decode only; we output JPEG for inference/saving.
-			fmt = "JPEG"
-			ext = ".jpg"
-
-		im = Image.open(BytesIO(image_bytes))
-		im2 = ImageOps.exif_transpose(im)
-
-		# JPEG cannot store alpha
-		if fmt == "JPEG" and im2.mode not in ("RGB", "L"):
-			im2 = im2.convert("RGB")
-
-		out = BytesIO()
-		save_kwargs: Dict[str, Any] = {}
-		if fmt == "JPEG":
-			save_kwargs.update({"quality": 95, "optimize": True})
-		elif fmt == "PNG":
-			save_kwargs.update({"optimize": True})
-		elif fmt == "WEBP":
-			save_kwargs.update({"quality": 92, "method": 4})
-		im2.save(out, format=fmt, **save_kwargs)
-		return out.getvalue(), {"normalize_status": "normalized", "normalize_format": fmt}
-	except Exception as e:
-		# If anything goes wrong, fall back to original bytes
-		return image_bytes, {"normalize_status": "normalize_failed", "normalize_error": _public_error(str(e))}
+		try:
+			im = ImageOps.exif_transpose(Image.open(BytesIO(image_bytes)))
+		except Exception as e:
+			return [], {"detect_status": "detect_failed", "detect_error": str(e)}
+		return self.detect_images_with_meta([im])[0]
 
 
 def _odd(n: int) -> int:
@@ -303,11 +486,34 @@ def _kernel_for_roi(w: int, h: int) -> int:
 	return _odd(k)
 
 
+def apply_plate_blur(img, boxes: Iterable[PlateBox], *, expand_ratio: float = 0.0) -> int:
+	"""Gaussian-blur each box in place on a decoded HxW(xC) array. Returns boxes applied."""
+	import cv2  # type: ignore
+
+	height, width = img.shape[:2]
+	ratio = min(max(float(expand_ratio), 0.0), 0.5)
+	applied = 0
+	for b in boxes:
+		# Expand then clamp to image bounds
+		b2 = b.expand(ratio).clamp(width=width, height=height)
+		w = b2.x2 - b2.x1
+		h = b2.y2 - b2.y1
+		if w < 6 or h < 6:
+			continue
+		roi = img[b2.y1 : b2.y2, b2.x1 : b2.x2]
+		if roi.size == 0:
+			continue
+		k = _kernel_for_roi(w, h)
+		img[b2.y1 : b2.y2, b2.x1 : b2.x2] = cv2.GaussianBlur(roi, (k, k), 0)
+		applied += 1
+	return applied
+
+
 def blur_license_plates(
 	*,
 	image_bytes: bytes,
 	output_ext: str,
-	detector: RoboflowPlateDetector,
+	detector: PlateDetector,
 	expand_ratio: float = 0.0,
 ) -> Tuple[bytes, Dict[str, Any]]:
 	"""
@@ -315,88 +521,77 @@ def blur_license_plates(
 
 	- If no plates are detected (or any error occurs), returns original bytes.
 	- `expand_ratio` should be 0.10–0.15 to cover plate edges.
-	"""
 
-	# Import lazily so the app can still run even if opencv isn't installed yet.
+	Decodes once (EXIF orientation applied, so boxes match pixels) and encodes once;
+	the upload path uses :class:`kk.image_pipeline.ImagePipeline` directly instead.
+	"""
 	try:
-		import cv2  # type: ignore
-		import numpy as np  # type: ignore
-	except Exception as e:
-		return image_bytes, {"status": "opencv_missing", "error": _public_error(str(e))}
+		from .image_pipeline import ImagePipeline, format_for_ext
 
-	try:
-		# Normalize EXIF orientation *before* detection and decoding, so boxes match pixels.
-		normalized_bytes, norm_meta = _normalize_image_bytes_for_inference(image_bytes, output_ext)
-
-		arr = np.frombuffer(normalized_bytes, dtype=np.uint8)
-		img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-		if img is None:
-			return image_bytes, {**norm_meta, "status": "decode_failed"}
-		height, width = img.shape[:2]
-
-		# Roboflow needs the bytes; we use normalized bytes so orientation matches.
-		boxes, det_meta = detector.detect_with_meta(normalized_bytes)
-		if not boxes:
-			# Distinguish "no plates" from request failures for debugging/observability.
-			if det_meta.get("detect_status") in ("detect_failed", "bad_response"):
-				return image_bytes, {**norm_meta, **det_meta, "status": "detect_failed"}
-			return image_bytes, {**norm_meta, **det_meta, "status": "no_plates", "plates": 0}
-
-		applied = 0
-		ratio = float(expand_ratio)
-		if ratio < 0:
-			ratio = 0.0
-		if ratio > 0.5:
-			ratio = 0.5
-
-		for b in boxes:
-			# Expand then clamp to image bounds
-			b2 = b.expand(ratio).clamp(width=width, height=height)
-			w = b2.x2 - b2.x1
-			h = b2.y2 - b2.y1
-			if w < 6 or h < 6:
-				continue
-			roi = img[b2.y1 : b2.y2, b2.x1 : b2.x2]
-			if roi.size == 0:
-				continue
-			k = _kernel_for_roi(w, h)
-			blurred = cv2.GaussianBlur(roi, (k, k), 0)
-			img[b2.y1 : b2.y2, b2.x1 : b2.x2] = blurred
-			applied += 1
-
-		if applied == 0:
-			return image_bytes, {**norm_meta, **det_meta, "status": "no_valid_rois", "plates": len(boxes), "applied": 0}
-
-		ext = (output_ext or "").strip().lower()
-		if not ext.startswith("."):
-			ext = f".{ext}" if ext else ".jpg"
-		if ext not in (".jpg", ".jpeg", ".png", ".webp"):
-			ext = ".jpg"
-
-		encode_params: List[int] = []
-		if ext in (".jpg", ".jpeg"):
-			encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), 92]
-		elif ext == ".png":
-			encode_params = [int(cv2.IMWRITE_PNG_COMPRESSION), 3]
-		elif ext == ".webp":
-			encode_params = [int(cv2.IMWRITE_WEBP_QUALITY), 90]
-
-		ok, out = cv2.imencode(ext, img, encode_params)
-		if not ok:
-			return image_bytes, {**norm_meta, **det_meta, "status": "encode_failed", "plates": len(boxes), "applied": applied}
-
-		return bytes(out.tobytes()), {**norm_meta, **det_meta, "status": "blurred", "plates": len(boxes), "applied": applied}
+		try:
+			pipeline = ImagePipeline.decode(image_bytes)
+		except Exception as e:
+			return image_bytes, {"status": "decode_failed", "error": _public_error(str(e))}
+
+		meta = pipeline.blur_plates(detector, expand_ratio=expand_ratio)
+		if meta.get("status") != "blurred":
+			if meta.get("status") == "opencv_missing":
+				meta["error"] = _public_error(str(meta.get("error") or ""))
+			return image_bytes, meta
+
+		fmt = format_for_ext(output_ext)
+		quality = {"JPEG": 92, "WEBP": 90}.get(fmt, 90)
+		return pipeline.encode(fmt=fmt, quality=quality), meta
 	except Exception as e:
 		logger.warning("License-plate blurring failed: %s", e, exc_info=True)
 		return image_bytes, {"status": "error", "error": _public_error(str(e))}
 
 
-_DETECTOR_SINGLETON: Optional[RoboflowPlateDetector] = None
+_DETECTOR_SINGLETON: Optional[PlateDetector] = None
+
+
+def onnx_detector_from_env() -> OnnxPlateDetector:
+	"""
+	Local ONNX detector from environment variables:
+	- PLATE_MODEL_PATH (default: kk/weights/yolov8l-iraqi-license-plate.onnx)
+	- PLATE_MODEL_IMGSZ (default: 640; must match the export)
+	- PLATE_CONFIDENCE (default: 0.25), PLATE_IOU (default: 0.45)
+	- PLATE_DETECT_BATCH (default: 4; max images per forward pass)
+	"""
+	return OnnxPlateDetector(
+		model_path=os.getenv("PLATE_MODEL_PATH", "").strip() or DEFAULT_ONNX_MODEL_PATH,
+		input_size=int(os.getenv("PLATE_MODEL_IMGSZ", "640") or "640"),
+		confidence=float(os.getenv("PLATE_CONFIDENCE", "0.25") or "0.25"),
+		iou=float(os.getenv("PLATE_IOU", "0.45") or "0.45"),
+		max_batch=int(os.getenv("PLATE_DETECT_BATCH", "4") or "4"),
+	)
+
+
+def build_plate_detector(backend: Optional[str] = None) -> PlateDetector:
+	"""
+	New detector for ``backend`` (default: PLATE_DETECTOR env): ``onnx``, ``roboflow``,
+	or ``auto`` -- the local model when its file exists, else Roboflow.
+	"""
+	backend = (backend or os.getenv("PLATE_DETECTOR", "auto") or "auto").strip().lower()
+	if backend in ("onnx", "local"):
+		return onnx_detector_from_env()
+	if backend == "roboflow":
+		return roboflow_detector_from_env()
+	local = onnx_detector_from_env()
+	return local if local.is_configured() else roboflow_detector_from_env()
+
+
+def get_plate_detector() -> PlateDetector:
+	"""Per-process singleton from :func:`build_plate_detector` (the local model loads once per worker)."""
+	global _DETECTOR_SINGLETON
+	if _DETECTOR_SINGLETON is None:
+		_DETECTOR_SINGLETON = build_plate_detector()
+	return _DETECTOR_SINGLETON
 
 
-def get_plate_detector() -> RoboflowPlateDetector:
+def roboflow_detector_from_env() -> RoboflowPlateDetector:
 	"""
-	Singleton detector configured from environment variables.
+	Roboflow detector configured from environment variables.
 
 	Environment variables:
 	- ROBOFLOW_API_KEY (required)
@@ -406,11 +601,6 @@ def get_plate_detector() -> RoboflowPlateDetector:
 	- ROBOFLOW_ENDPOINT_BASE (default: https://serverless.roboflow.com)
 	- ROBOFLOW_TIMEOUT_S (default: 60)
 	"""
-
-	global _DETECTOR_SINGLETON
-	if _DETECTOR_SINGLETON is not None:
-		return _DETECTOR_SINGLETON
-
 	api_key = os.getenv("ROBOFLOW_API_KEY", "").strip()
 
 	# Convenience override: allow a single var to specify project+version.
@@ -456,7 +646,7 @@ def get_plate_detector() -> RoboflowPlateDetector:
 	confidence = _to_percent(os.getenv("ROBOFLOW_CONFIDENCE", "0"))
 	overlap = _to_percent(os.getenv("ROBOFLOW_OVERLAP", ""))
 
-	_DETECTOR_SINGLETON = RoboflowPlateDetector(
+	return RoboflowPlateDetector(
 		api_key=api_key,
 		project=project,
 		version=version,
@@ -465,5 +655,4 @@ def get_plate_detector() -> RoboflowPlateDetector:
 		confidence=confidence,
 		overlap=overlap,
 	)
-	return _DETECTOR_SINGLETON
 
@@ -0,0 +1,209 @@
+"""Compact "card" projection of Car rows for list views.
+
+Feed endpoints serialize every row with ``Car.to_dict()`` via
+``_with_media_compat``: all image and video dicts (twice), the full seller
+dict, AI fields and the description, plus ``os.path.isfile`` probes for every
+image. A listing card needs a dozen scalars and one thumbnail.
+
+Clients opt in with ``?view=card`` or ``?fields=a,b,c`` (which implies the
+card view). Card queries ``load_only`` the columns they print and fetch the
+hero image for the whole page in one windowed query. Image URLs go through
+``kk.media_paths.display_url``, the same resolver as the detail view, so only
+rows without a stored resolution hit its cached filesystem check.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Iterable
+
+from sqlalchemy import false, func, or_, select
+from sqlalchemy.orm import load_only
+
+from .media_paths import display_url
+from .models import Car, CarImage, db
+
+# Returned when the client asks for ``view=card`` without ``fields=``.
+CARD_FIELDS: tuple[str, ...] = (
+    "id",
+    "title",
+    "brand",
+    "model",
+    "trim",
+    "year",
+    "mileage",
+    "price",
+    "currency",
+    "location",
+    "city",
+    "condition",
+    "transmission",
+    "fuel_type",
+    "body_type",
+    "status",
+    "is_featured",
+    "views_count",
+    "created_at",
+    "image_url",
+    "image_srcset",
+    "image_width",
+    "image_height",
+    "focus_y",
+)
+
+# Extra scalars a client may request with ``fields=`` (never relations or AI fields).
+_OPTIONAL_FIELDS: tuple[str, ...] = (
+    "engine_type",
+    "drive_type",
+    "color",
+    "title_status",
+    "damaged_parts",
+    "region_specs",
+    "plate_type",
+    "plate_city",
+    "seating",
+    "engine_size",
+    "cylinder_count",
+    "updated_at",
+    "images_count",
+)
+ALLOWED_CARD_FIELDS = frozenset(CARD_FIELDS + _OPTIONAL_FIELDS)
+
+# Card fields that come from the hero image rather than a Car column.
+_IMAGE_FIELDS = frozenset(
+    {"image_url", "image_srcset", "image_width", "image_height", "focus_y", "images_count"}
+)
+# Card field -> Car column(s) it reads, when the names differ.
+_FIELD_COLUMNS: dict[str, tuple[str, ...]] = {
+    "id": ("public_id",),
+    "city": ("location",),
+}
+# Always loaded: primary key, keyset sort keys and the title fallback parts.
+_BASE_COLUMNS: tuple[str, ...] = (
+    "id",
+    "public_id",
+    "is_featured",
+    "created_at",
+    "price",
+    "year",
+    "mileage",
+    "brand",
+    "model",
+    "title",
+)
+
+
+def parse_card_fields(args) -> tuple[str, ...] | None:
+    """Fields for a card response, or ``None`` when the client wants the full payload."""
+    raw = args.get("fields")
+    view = (args.get("view") or "").strip().lower()
+    if raw is None and view != "card":
+        return None
+    requested = [f.strip().lower() for f in (raw or "").split(",") if f.strip()]
+    fields = [f for f in requested if f in ALLOWED_CARD_FIELDS]
+    if not fields:
+        return CARD_FIELDS
+    if "id" not in fields:
+        fields.insert(0, "id")
+    return tuple(dict.fromkeys(fields))
+
+
+def card_query_options(fields: Iterable[str]) -> list:
+    """Loader options for a Car query feeding :func:`serialize_cards`."""
+    columns = set(_BASE_COLUMNS)
+    for field in fields:
+        if field in _IMAGE_FIELDS:
+            continue
+        columns.update(_FIELD_COLUMNS.get(field, (field,)))
+    # Relationships stay lazy and are never touched by serialize_cards.
+    return [load_only(*[getattr(Car, name) for name in sorted(columns)])]
+
+
+def _hero(row, url: str) -> dict[str, Any]:
+    return {
+        "image_url": url,
+        "image_srcset": row.renditions or None,
+        "image_width": row.image_width,
+        "image_height": row.image_height,
+        "focus_y": row.focus_y,
+        "images_count": int(row.n or 0),
+    }
+
+
+def hero_images(car_ids: list[int]) -> dict[int, dict[str, Any]]:
+    """Primary listing (non-damage) photo + listing photo count per car, one query."""
+    if not car_ids:
+        return {}
+    is_listing = or_(
+        CarImage.kind.is_(None),
+        func.lower(func.trim(CarImage.kind)) != "damage",
+    )
+    rank = func.row_number().over(
+        partition_by=CarImage.car_id,
+        order_by=(func.coalesce(CarImage.is_primary, false()).desc(), CarImage.id.asc()),
+    )
+    ranked = (
+        select(
+            CarImage.car_id,
+            CarImage.image_url,
+            CarImage.resolved_url,
+            CarImage.renditions,
+            CarImage.image_width,
+            CarImage.image_height,
+            CarImage.focus_y,
+            rank.label("rn"),
+            func.count().over(partition_by=CarImage.car_id).label("n"),
+        )
+        .where(CarImage.car_id.in_(car_ids), is_listing)
+        .subquery()
+    )
+    heroes: dict[int, dict[str, Any]] = {}
+    unresolved = []
+    for row in db.session.execute(select(ranked).where(ranked.c.rn == 1)).all():
+        heroes[row.car_id] = _hero(row, display_url(row.image_url, row.resolved_url))
+        if not heroes[row.car_id]["image_url"] and row.n > 1:
+            unresolved.append(row.car_id)
+    if unresolved:
+        # The preferred photo's file is gone: take the next one that resolves, as the detail view does.
+        rest = db.session.execute(
+            select(ranked)
+            .where(ranked.c.car_id.in_(unresolved), ranked.c.rn > 1)
+            .order_by(ranked.c.car_id, ranked.c.rn)
+        ).all()
+        for row in rest:
+            if heroes[row.car_id]["image_url"]:
+                continue
+            url = display_url(row.image_url, row.resolved_url)
+            if url:
+                heroes[row.car_id] = _hero(row, url)
+    return heroes
+
+
+def _card_value(car: Car, field: str):
+    if field == "id":
+        return car.public_id or str(car.id)
+    if field == "title":
+        return car.title or f"{car.brand} {car.model} {car.year}".strip()
+    if field == "city":
+        return car.location
+    if field in ("created_at", "updated_at"):
+        value = getattr(car, field)
+        return value.isoformat() if value else None
+    return getattr(car, field)
+
+
+def serialize_cards(cars: list[Car], fields: tuple[str, ...]) -> list[dict[str, Any]]:
+    """Card dicts for ``cars`` (loaded with :func:`card_query_options`)."""
+    images = hero_images([c.id for c in cars]) if _IMAGE_FIELDS.intersection(fields) else {}
+    out = []
+    for car in cars:
+        hero = images.get(car.id) or {}
+        card: dict[str, Any] = {}
+        for field in fields:
+            if field in _IMAGE_FIELDS:
+                card[field] = hero.get(field, 0 if field == "images_count" else None)
+            else:
+                card[field] = _card_value(car, field)
+        if "image_url" in card and card["image_url"] is None:
+            card["image_url"] = ""
+        out.append(card)
+    return out
@@ -0,0 +1,350 @@
+"""Incrementally maintained filter facets with per-value counts.
+
+``/api/filters/facets`` used to run a dozen ``SELECT DISTINCT`` queries plus
+min/max aggregates over ``car`` whenever its cache expired, and every listing
+write threw the whole payload away. Counts now live in
+``listing_facet_count`` and are adjusted in the same transaction as the Car
+write that changes them (SQLAlchemy ``before_flush`` hook), so facet reads are
+one indexed query against a small table and never touch ``car``.
+
+Besides the global facet set (``scope=""``) each public listing also counts
+towards one scope per :data:`SCOPE_DIMENSIONS` value, which is what lets the
+endpoint answer "Toyota in Baghdad: 42" for a single active filter.
+
+Bulk ``Query.update()`` calls bypass the ORM hook; call
+:func:`retract_seller_listings` before them. :func:`rebuild_listing_facets`
+recomputes everything from ``car`` (one-off backfill + nightly drift repair).
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Any
+
+from sqlalchemy import event, func, inspect as sa_inspect, select
+
+from .models import Car, ListingFacetCount, db
+
+logger = logging.getLogger(__name__)
+
+# (payload key, Car attribute, max values returned)
+FACET_FIELDS: tuple[tuple[str, str, int], ...] = (
+    ("brands", "brand", 200),
+    ("models", "model", 500),
+    ("locations", "location", 200),
+    ("body_types", "body_type", 200),
+    ("conditions", "condition", 200),
+    ("transmissions", "transmission", 200),
+    ("drive_types", "drive_type", 200),
+    ("fuel_types", "fuel_type", 200),
+    ("colors", "color", 200),
+    ("title_statuses", "title_status", 200),
+)
+# Numeric facets only feed the *_min / *_max bounds in the payload.
+_NUMERIC_FACETS: tuple[tuple[str, str], ...] = (("years", "year"), ("prices", "price"))
+
+# Filters a facet request may be scoped to: (dimension, request arg names).
+SCOPE_DIMENSIONS: tuple[tuple[str, tuple[str, ...]], ...] = (
+    ("brand", ("brand",)),
+    ("location", ("location", "city")),
+    ("body_type", ("body_type",)),
+)
+
+_PUBLIC_STATUSES = frozenset({"active", "sold"})
+_TRACKED_ATTRS: tuple[str, ...] = (
+    "is_active",
+    "status",
+    *(attr for _key, attr, _limit in FACET_FIELDS),
+    *(attr for _key, attr in _NUMERIC_FACETS),
+)
+_MAX_KEY_LEN = 160
+
+# (scope, facet, value_key) -> [label, num_value, delta]
+Deltas = dict[tuple[str, str, str], list[Any]]
+
+
+def _norm(raw) -> tuple[str, str] | None:
+    label = str(raw if raw is not None else "").strip()
+    if not label:
+        return None
+    return label.lower()[:_MAX_KEY_LEN], label[:_MAX_KEY_LEN]
+
+
+def _is_public(snap: dict[str, Any]) -> bool:
+    if snap.get("is_active") is False:
+        return False
+    status = (snap.get("status") or "active").strip().lower()
+    return status in _PUBLIC_STATUSES
+
+
+def listing_facet_contributions(snap: dict[str, Any] | None) -> list[tuple[str, str, str, str, float | None]]:
+    """Facet rows ``(scope, facet, value_key, label, num_value)`` one listing counts towards."""
+    if not snap or not _is_public(snap):
+        return []
+    base: list[tuple[str, str, str, float | None]] = []
+    for facet, attr, _limit in FACET_FIELDS:
+        n = _norm(snap.get(attr))
+        if n:
+            base.append((facet, n[0], n[1], None))
+    year = snap.get("year")
+    if year is not None:
+        try:
+            y = int(year)
+            base.append(("years", str(y), str(y), float(y)))
+        except (TypeError, ValueError):
+            pass
+    price = snap.get("price")
+    if price is not None:
+        try:
+            p = float(price)
+            base.append(("prices", f"{p:.2f}", f"{p:.2f}", p))
+        except (TypeError, ValueError):
+            pass
+
+    scopes = [""]
+    for dim, _args in SCOPE_DIMENSIONS:
+        n = _norm(snap.get(dim))
+        if n:
+            scopes.append(f"{dim}:{n[0]}"[:_MAX_KEY_LEN])
+    return [(scope, facet, key, label, num) for scope in scopes for facet, key, label, num in base]
+
+
+def accumulate_facet_delta(deltas: Deltas, old: dict | None, new: dict | None) -> None:
+    """Add the facet change for one listing going from ``old`` to ``new`` (None = absent)."""
+    for sign, snap in ((-1, old), (1, new)):
+        for scope, facet, key, label, num in listing_facet_contributions(snap):
+            entry = deltas.setdefault((scope, facet, key), [label, num, 0])
+            entry[2] += sign
+
+
+def _column_default(attr: str):
+    default = Car.__table__.c[attr].default
+    return default.arg if default is not None and default.is_scalar else None
+
+
+def _car_snapshot(car: Car, pending: bool = False) -> dict[str, Any]:
+    snap = {attr: getattr(car, attr, None) for attr in _TRACKED_ATTRS}
+    if pending:
+        # Scalar column defaults (fuel_type, title_status, ...) land at INSERT time.
+        for attr, value in snap.items():
+            if value is None:
+                snap[attr] = _column_default(attr)
+    return snap
+
+
+def _persisted_snapshots(connection, car_ids: list[int]) -> dict[int, dict[str, Any]]:
+    if not car_ids:
+        return {}
+    cols = [getattr(Car, attr) for attr in _TRACKED_ATTRS]
+    rows = connection.execute(select(Car.id, *cols).where(Car.id.in_(car_ids))).all()
+    return {row[0]: dict(zip(_TRACKED_ATTRS, row[1:])) for row in rows}
+
+
+def _tracked_changed(car: Car) -> bool:
+    state = sa_inspect(car)
+    return any(state.attrs[attr].history.has_changes() for attr in _TRACKED_ATTRS)
+
+
+def apply_facet_deltas(connection, deltas: Deltas) -> None:
+    """
+    Upsert ``count = count + delta`` for every non-zero entry.
+
+    Rows are written in ``(scope, facet, value_key)`` order so two writes that
+    touch the same rows (e.g. one listing moving brand X->Y while another moves
+    Y->X) take their row locks in the same order instead of deadlocking.
+    """
+    params = [
+        {
+            "scope": scope,
+            "facet": facet,
+            "value_key": key,
+            "label": label,
+            "num_value": num,
+            "count": delta,
+        }
+        for (scope, facet, key), (label, num, delta) in sorted(deltas.items(), key=lambda item: item[0])
+        if delta
+    ]
+    if not params:
+        return
+    table = ListingFacetCount.__table__
+    dialect = connection.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.scope, table.c.facet, table.c.value_key],
+            set_={"count": table.c.count + stmt.excluded["count"]},
+        )
+        connection.execute(stmt, params)
+        return
+
+    for p in params:
+        res = connection.execute(
+            table.update()
+            .where(
+                table.c.scope == p["scope"],
+                table.c.facet == p["facet"],
+                table.c.value_key == p["value_key"],
+            )
+            .values(count=table.c.count + p["count"])
+        )
+        if not res.rowcount:
+            connection.execute(table.insert().values(**p))
+
+
+_store_ready: dict[str, bool] = {}
+
+
+def _store_available(connection) -> bool:
+    """Skip maintenance (instead of aborting the write) until the migration is applied."""
+    url = str(connection.engine.url)
+    ready = _store_ready.get(url)
+    if ready is None:
+        try:
+            ready = sa_inspect(connection).has_table(ListingFacetCount.__tablename__)
+        except Exception:
+            ready = False
+        if ready:
+            _store_ready[url] = True
+    return bool(ready)
+
+
+def _before_flush(session, _flush_context, _instances) -> None:
+    new_cars = [o for o in session.new if isinstance(o, Car)]
+    deleted_cars = [o for o in session.deleted if isinstance(o, Car) and o.id is not None]
+    dirty_cars = [
+        o
+        for o in session.dirty
+        if isinstance(o, Car) and o.id is not None and _tracked_changed(o)
+    ]
+    if not (new_cars or deleted_cars or dirty_cars):
+        return
+
+    connection = session.connection()
+    if not _store_available(connection):
+        return
+    # Attribute history is incomplete for expired rows, so read the pre-flush
+    # values straight from the database (PK lookups, write path only).
+    persisted = _persisted_snapshots(connection, [c.id for c in (*deleted_cars, *dirty_cars)])
+    deltas: Deltas = {}
+    for car in new_cars:
+        accumulate_facet_delta(deltas, None, _car_snapshot(car, pending=True))
+    for car in deleted_cars:
+        accumulate_facet_delta(deltas, persisted.get(car.id), None)
+    for car in dirty_cars:
+        accumulate_facet_delta(deltas, persisted.get(car.id), _car_snapshot(car))
+    apply_facet_deltas(connection, deltas)
+
+
+def install_listing_facet_tracking() -> None:
+    """Register the flush hook that keeps ``listing_facet_count`` current (idempotent)."""
+    if not event.contains(db.session, "before_flush", _before_flush):
+        event.listen(db.session, "before_flush", _before_flush)
+
+
+def retract_seller_listings(seller_id: int) -> None:
+    """Remove a seller's public listings from the store ahead of a bulk deactivate.
+
+    ``Query.update(..., synchronize_session=False)`` skips the flush hook, so
+    callers hiding listings in bulk must retract them first (same transaction).
+    """
+    connection = db.session.connection()
+    if not _store_available(connection):
+        return
+    cols = [getattr(Car, attr) for attr in _TRACKED_ATTRS]
+    rows = connection.execute(
+        select(*cols).where(Car.seller_id == seller_id, Car.is_active.is_(True))
+    ).all()
+    deltas: Deltas = {}
+    for row in rows:
+        accumulate_facet_delta(deltas, dict(zip(_TRACKED_ATTRS, row)), None)
+    apply_facet_deltas(connection, deltas)
+
+
+def rebuild_listing_facets(batch_size: int = 1000) -> int:
+    """Recompute the whole store from ``car``. Returns the number of public listings counted."""
+    cols = [getattr(Car, attr) for attr in _TRACKED_ATTRS]
+    deltas: Deltas = {}
+    counted = 0
+    rows = db.session.execute(
+        select(*cols).where(Car.is_active.is_(True)).execution_options(yield_per=batch_size)
+    )
+    for row in rows:
+        snap = dict(zip(_TRACKED_ATTRS, row))
+        if _is_public(snap):
+            counted += 1
+        accumulate_facet_delta(deltas, None, snap)
+    db.session.execute(ListingFacetCount.__table__.delete())
+    apply_facet_deltas(db.session.connection(), deltas)
+    db.session.commit()
+    return counted
+
+
+def resolve_facet_scope(args) -> str:
+    """Scope for a facet request: the first single-valued filter among SCOPE_DIMENSIONS."""
+    for dim, names in SCOPE_DIMENSIONS:
+        raw = next((args.get(name) for name in names if (args.get(name) or "").strip()), None)
+        if not raw or "," in raw:
+            continue
+        n = _norm(raw)
+        if n:
+            return f"{dim}:{n[0]}"[:_MAX_KEY_LEN]
+    return ""
+
+
+def read_listing_facets(scope: str = "") -> dict[str, Any]:
+    """Facet payload (distinct labels, per-value counts, year/price bounds) for ``scope``."""
+    numeric = [facet for facet, _attr in _NUMERIC_FACETS]
+    rows = (
+        db.session.query(
+            ListingFacetCount.facet,
+            ListingFacetCount.label,
+            ListingFacetCount.count,
+        )
+        .filter(
+            ListingFacetCount.scope == scope,
+            ListingFacetCount.facet.not_in(numeric),
+            ListingFacetCount.count > 0,
+        )
+        .all()
+    )
+    by_facet: dict[str, list[tuple[str, int]]] = {}
+    for facet, label, count in rows:
+        by_facet.setdefault(facet, []).append((label, int(count)))
+
+    payload: dict[str, Any] = {}
+    counts: dict[str, dict[str, int]] = {}
+    for facet, _attr, limit in FACET_FIELDS:
+        values = sorted(by_facet.get(facet, []), key=lambda r: r[0].lower())[:limit]
+        payload[facet] = [label for label, _count in values]
+        counts[facet] = {label: count for label, count in values}
+
+    # Bounds come from one aggregate (served by ix_listing_facet_count_scope_facet_num)
+    # instead of loading a row per distinct price.
+    bounds = {
+        facet: (lo, hi)
+        for facet, lo, hi in db.session.query(
+            ListingFacetCount.facet,
+            func.min(ListingFacetCount.num_value),
+            func.max(ListingFacetCount.num_value),
+        )
+        .filter(
+            ListingFacetCount.scope == scope,
+            ListingFacetCount.facet.in_(numeric),
+            ListingFacetCount.count > 0,
+        )
+        .group_by(ListingFacetCount.facet)
+    }
+    for facet, prefix in (("years", "year"), ("prices", "price")):
+        lo, hi = bounds.get(facet, (None, None))
+        cast = int if facet == "years" else float
+        payload[f"{prefix}_min"] = cast(lo) if lo is not None else None
+        payload[f"{prefix}_max"] = cast(hi) if hi is not None else None
+
+    payload["counts"] = counts
+    payload["scope"] = scope or None
+    return payload
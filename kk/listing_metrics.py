@@ -6,17 +6,38 @@ Client ``/api/analytics/track/*`` endpoints are easy to game. Prefer:
 - messages: real chat sends from non-sellers
 - favorites: real favorite adds
 - calls / shares: at most once per user per listing per day (best-effort dedupe)
+
+Counter increments (``car.views_count`` and the ``listing_analytics`` columns)
+never touch the database inside a request. They are buffered with HINCRBY in
+one Redis hash (or a per-process accumulator without Redis) and applied in
+batches by :func:`flush_pending_counters` -- one multi-row UPDATE per table,
+on its own connection and transaction -- from the ``flush_listing_counters``
+Celery beat task. Without Redis a process flushes its own accumulator inline;
+because the flush never uses ``db.session``, that cannot commit or roll back
+the caller's request transaction. Readers add :func:`pending_counter_deltas`
+so counts still look live.
+
+Each drained Redis batch carries a flush id that is inserted into
+``listing_counter_flush`` in the same transaction as its UPDATEs, so a worker
+that dies after the commit but before clearing the batch cannot make the next
+run apply it twice.
 """
 
 from __future__ import annotations
 
 import logging
+import os
+import threading
 import time
-from typing import Literal
+import uuid
+from datetime import timedelta
+from typing import Any, Iterable, Literal
 
-from sqlalchemy import update
+from sqlalchemy import case, delete, func, insert, select, update
 
-from .models import Car, ListingAnalytics, User, db
+from .config import env_float
+from .models import Car, ListingAnalytics, ListingCounterFlush, User, db
+from .redis_client import get_redis
 from .time_utils import utcnow
 
 logger = logging.getLogger(__name__)
@@ -31,18 +52,47 @@ _memory_claims: dict[str, float] = {}
 _MEMORY_CLAIMS_MAX = 20_000
 
 _CALL_SHARE_TTL_S = 60 * 60 * 24  # 24h
+_ANON_VIEW_TTL_S = 60 * 10  # one counted anonymous view per IP per listing per 10 min
+
+# Counter name -> column it increments ("views_count" lives on car, the rest on listing_analytics).
+_CAR_COUNTERS = frozenset({"views_count"})
+_COUNTERS = _CAR_COUNTERS | _ALLOWED_FIELDS
+
+_PENDING_KEY = "lm:pending"
+_FLUSHING_KEY = "lm:pending:flushing"
+_FLUSH_ID_KEY = "lm:pending:flushing:id"
+_FLUSH_LOCK_KEY = "lm:flush:lock"
+# Applied flush ids older than this are pruned; a batch is cleared within one beat run of its commit.
+_FLUSH_ID_KEEP = timedelta(days=1)
+
+# Return ``{flush id, flushing hash}``. A leftover batch from a crashed flush is
+# retried as-is under its own id; only when there is none does everything
+# pending move into the flushing hash under the new id ARGV[1].
+_DRAIN_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+  if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {}
+  end
+  redis.call('RENAME', KEYS[1], KEYS[2])
+  redis.call('SET', KEYS[3], ARGV[1])
+end
+local id = redis.call('GET', KEYS[3])
+if not id then
+  id = ARGV[1]
+  redis.call('SET', KEYS[3], id)
+end
+return {id, redis.call('HGETALL', KEYS[2])}
+"""
 
-
-def _redis_client():
-    try:
-        from .security import _redis_client as redis_client
-
-        return redis_client()
-    except Exception:
-        return None
+# Without Redis: per-process deltas, flushed inline every few seconds.
+_local_pending: dict[str, int] = {}
+_local_lock = threading.Lock()
+_local_last_flush = time.monotonic()
 
 
 def _purge_memory_claims() -> None:
+    if len(_memory_claims) <= _MEMORY_CLAIMS_MAX:
+        return
     now = time.time()
     expired = [k for k, exp in _memory_claims.items() if exp <= now]
     for k in expired:
@@ -65,9 +115,17 @@ def claim_unique_engagement(
 
     Uses Redis SET NX when available; otherwise an in-process map.
     """
-    key = f"analytics:claim:{int(user_id)}:{int(car_id)}:{action}"
+    return _claim_once(f"analytics:claim:{int(user_id)}:{int(car_id)}:{action}", ttl_s)
+
+
+def claim_anonymous_view(ip: str, car_id: int, ttl_s: int = _ANON_VIEW_TTL_S) -> bool:
+    """Return True once per (client IP, car) within ``ttl_s``, shared across workers via Redis."""
+    return _claim_once(f"views:anon:{ip or 'anon'}:{int(car_id)}", ttl_s)
+
+
+def _claim_once(key: str, ttl_s: int) -> bool:
     ttl = max(60, int(ttl_s))
-    r = _redis_client()
+    r = get_redis()
     if r is not None:
         try:
             # SET NX EX — first claim wins.
@@ -104,26 +162,204 @@ def get_car_for_analytics(listing_id: str) -> Car | None:
     return None
 
 
+def buffer_counter(car_id: int, counter: str, n: int = 1) -> None:
+    """Queue ``n`` increments of ``counter`` for ``car_id``; applied by :func:`flush_pending_counters`."""
+    if counter not in _COUNTERS:
+        raise ValueError(f"unsupported counter: {counter}")
+    field = f"{counter}:{int(car_id)}"
+    r = get_redis()
+    if r is not None:
+        try:
+            r.hincrby(_PENDING_KEY, field, int(n))
+            return
+        except Exception:
+            logger.exception("counter buffer Redis failed for %s", field)
+
+    global _local_last_flush
+    with _local_lock:
+        _local_pending[field] = _local_pending.get(field, 0) + int(n)
+        due = time.monotonic() - _local_last_flush >= env_float("COUNTER_LOCAL_FLUSH_S", 10.0)
+        if due:
+            _local_last_flush = time.monotonic()
+    if due:
+        # No shared buffer for the Celery worker to drain: this process flushes its own.
+        try:
+            flush_pending_counters(redis_client=None)
+        except Exception:
+            logger.exception("inline counter flush failed")
+
+
 def bump_listing_metric(car: Car, field: MetricField) -> None:
-    """Atomically increment a ListingAnalytics counter (creates row if needed)."""
+    """Buffer one increment of a ListingAnalytics counter (row created at flush time if needed)."""
     if field not in _ALLOWED_FIELDS:
         raise ValueError(f"unsupported metric: {field}")
     if not car or not getattr(car, "id", None):
         return
+    buffer_counter(car.id, field)
+
+
+def _parse_deltas(raw: dict[str, Any]) -> dict[str, dict[int, int]]:
+    out: dict[str, dict[int, int]] = {}
+    for field, n in raw.items():
+        counter, _, car_id = str(field).rpartition(":")
+        try:
+            delta = int(n)
+            cid = int(car_id)
+        except (TypeError, ValueError):
+            continue
+        if counter in _COUNTERS and delta:
+            out.setdefault(counter, {})[cid] = out.get(counter, {}).get(cid, 0) + delta
+    return out
+
+
+def pending_counter_deltas(car_ids: Iterable[int], counters: Iterable[str]) -> dict[str, dict[int, int]]:
+    """Buffered-but-unflushed increments per counter per car id (one Redis round trip)."""
+    ids = [int(c) for c in car_ids if c]
+    names = list(counters)
+    if not ids or not names:
+        return {}
+    fields = [f"{counter}:{cid}" for counter in names for cid in ids]
+    raw: dict[str, int] = {}
+    with _local_lock:
+        for field in fields:
+            if _local_pending.get(field):
+                raw[field] = _local_pending[field]
+    r = get_redis()
+    if r is not None:
+        try:
+            pipe = r.pipeline(transaction=False)
+            pipe.hmget(_PENDING_KEY, fields)
+            pipe.hmget(_FLUSHING_KEY, fields)
+            pending, flushing = pipe.execute()
+            for field, a, b in zip(fields, pending, flushing):
+                extra = int(a or 0) + int(b or 0)
+                if extra:
+                    raw[field] = raw.get(field, 0) + extra
+        except Exception:
+            logger.exception("pending counter read failed")
+    return _parse_deltas(raw)
+
+
+def merge_pending_views(rows: list[dict], cars: list[Car]) -> list[dict]:
+    """Add unflushed view increments to serialized listings (``rows`` parallel to ``cars``)."""
+    if not rows or "views_count" not in rows[0]:
+        return rows
+    pending = pending_counter_deltas([c.id for c in cars], ("views_count",)).get("views_count") or {}
+    if pending:
+        for row, car in zip(rows, cars):
+            if car.id in pending:
+                row["views_count"] = int(row.get("views_count") or 0) + pending[car.id]
+    return rows
+
+
+def merge_pending_analytics(rows: list[dict], car_ids: list[int]) -> list[dict]:
+    """Add unflushed increments to ``ListingAnalytics.to_dict()`` rows (parallel to ``car_ids``)."""
+    pending = pending_counter_deltas(car_ids, sorted(_ALLOWED_FIELDS))
+    if pending:
+        for row, car_id in zip(rows, car_ids):
+            for field, per_car in pending.items():
+                if car_id in per_car:
+                    row[field] = int(row.get(field) or 0) + per_car[car_id]
+    return rows
+
+
+def _apply_deltas(deltas: dict[str, dict[int, int]], flush_id: str | None = None) -> int:
+    """
+    Apply deltas with one UPDATE per table; returns the number of counters applied.
+
+    Runs on a connection of its own (committed or rolled back here), so a flush
+    triggered from inside a request leaves that request's session untouched.
+    With ``flush_id`` the id is recorded in the same transaction, and a batch
+    whose id is already recorded is skipped (returns 0).
+    """
+    applied = 0
+    with db.engine.begin() as conn:
+        if flush_id is not None:
+            seen = conn.scalar(select(ListingCounterFlush.flush_id).where(ListingCounterFlush.flush_id == flush_id))
+            if seen is not None:
+                return 0
+            now = utcnow()
+            conn.execute(delete(ListingCounterFlush).where(ListingCounterFlush.applied_at < now - _FLUSH_ID_KEEP))
+            conn.execute(insert(ListingCounterFlush).values(flush_id=flush_id, applied_at=now))
+        views = deltas.get("views_count") or {}
+        if views:
+            conn.execute(
+                update(Car)
+                .where(Car.id.in_(list(views)))
+                .values(views_count=func.coalesce(Car.views_count, 0) + case(views, value=Car.id, else_=0))
+            )
+            applied += len(views)
+
+        analytics = {k: v for k, v in deltas.items() if k in _ALLOWED_FIELDS and v}
+        if analytics:
+            ids = sorted({cid for per_car in analytics.values() for cid in per_car})
+            have = set(conn.scalars(select(ListingAnalytics.car_id).where(ListingAnalytics.car_id.in_(ids))))
+            missing = [cid for cid in ids if cid not in have]
+            if missing:
+                live = conn.scalars(select(Car.id).where(Car.id.in_(missing))).all()
+                if live:
+                    conn.execute(insert(ListingAnalytics), [{"car_id": cid} for cid in live])
+            values: dict[str, Any] = {
+                field: func.coalesce(getattr(ListingAnalytics, field), 0)
+                + case(per_car, value=ListingAnalytics.car_id, else_=0)
+                for field, per_car in analytics.items()
+            }
+            values["updated_at"] = utcnow()
+            conn.execute(update(ListingAnalytics).where(ListingAnalytics.car_id.in_(ids)).values(**values))
+            applied += sum(len(v) for v in analytics.values())
+    return applied
+
+
+def _flush_local() -> int:
+    with _local_lock:
+        raw = dict(_local_pending)
+        _local_pending.clear()
+    if not raw:
+        return 0
+    try:
+        return _apply_deltas(_parse_deltas(raw))
+    except Exception:
+        with _local_lock:
+            for field, n in raw.items():
+                _local_pending[field] = _local_pending.get(field, 0) + n
+        raise
 
-    a = ListingAnalytics.query.filter_by(car_id=car.id).first()
-    if not a:
-        a = ListingAnalytics(car_id=car.id)
-        db.session.add(a)
-        db.session.flush()
 
-    col = getattr(ListingAnalytics, field)
-    db.session.execute(
-        update(ListingAnalytics)
-        .where(ListingAnalytics.car_id == car.id)
-        .values(**{field: col + 1, "updated_at": utcnow()})
-    )
-    db.session.commit()
+_UNSET: Any = object()
+
+
+def flush_pending_counters(redis_client: Any = _UNSET) -> int:
+    """
+    Apply buffered counter increments to the database.
+
+    Drains the shared Redis hash (guarded by a short lock so two beat runs never
+    double-apply) and this process's local accumulator. On a database error the
+    Redis deltas stay in the flushing hash and are retried by the next run; a
+    retry of a batch whose transaction did commit only clears it.
+    """
+    applied = _flush_local()
+    r = get_redis() if redis_client is _UNSET else redis_client
+    if r is None:
+        return applied
+    token = f"{os.getpid()}:{time.monotonic()}"
+    if not r.set(_FLUSH_LOCK_KEY, token, nx=True, ex=120):
+        return applied
+    try:
+        raw = r.eval(_DRAIN_LUA, 3, _PENDING_KEY, _FLUSHING_KEY, _FLUSH_ID_KEY, uuid.uuid4().hex) or []
+        if raw:
+            flush_id, flat = raw
+            drained = dict(zip(flat[0::2], flat[1::2]))
+            applied += _apply_deltas(_parse_deltas(drained), flush_id=str(flush_id))
+            r.delete(_FLUSHING_KEY, _FLUSH_ID_KEY)
+    finally:
+        if r.get(_FLUSH_LOCK_KEY) == token:
+            r.delete(_FLUSH_LOCK_KEY)
+    return applied
+
+
+def clear_pending_counters_for_tests() -> None:
+    with _local_lock:
+        _local_pending.clear()
 
 
 def record_trusted_view(user: User, listing_id: str) -> dict:
@@ -179,10 +415,6 @@ def record_buyer_message(car: Car, sender: User) -> None:
         bump_listing_metric(car, "messages")
     except Exception:
         logger.exception("Failed to bump messages metric for car_id=%s", getattr(car, "id", None))
-        try:
-            db.session.rollback()
-        except Exception:
-            pass
 
 
 def record_favorite_add(car: Car, user: User) -> None:
@@ -195,7 +427,3 @@ def record_favorite_add(car: Car, user: User) -> None:
         bump_listing_metric(car, "favorites")
     except Exception:
         logger.exception("Failed to bump favorites metric for car_id=%s", getattr(car, "id", None))
-        try:
-            db.session.rollback()
-        except Exception:
-            pass
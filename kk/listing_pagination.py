@@ -0,0 +1,205 @@
+"""Keyset (cursor) pagination for public listing feeds.
+
+``GET /api/cars`` historically used ``query.paginate()``: a ``COUNT(*)`` over
+the filtered set plus ``OFFSET`` that grows with every page the home feed
+scrolls. Cursor mode instead seeks past the last row of the previous page
+using the sort key tuple, so page 40 costs the same as page 1.
+
+Cursors are opaque URL-safe base64 JSON. Sorts without a stable key tuple
+(``random``, ``recommended``, ``relevance``) fall back to an offset carried
+inside the cursor so clients never have to special-case them.
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, literal, or_
+
+from .models import Car
+
+_CURSOR_VERSION = 1
+_MAX_CURSOR_LEN = 512
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client-supplied cursor cannot be decoded."""
+
+
+def _featured_key():
+    # Raw columns (NOT NULL since m6n7o8p9q0r1) so ix_car_active_featured_created_at
+    # can serve both the ORDER BY and the seek predicate.
+    return Car.is_featured
+
+
+def _created_key():
+    return Car.created_at
+
+
+# sort_by -> [(key name, expression factory, descending)]. Every spec ends with
+# ``id`` so ties are broken deterministically and no row is skipped or repeated.
+_KEYSET_SORTS: dict[str, list[tuple[str, object, bool]]] = {
+    "newest": [
+        ("featured", _featured_key, True),
+        ("created_at", _created_key, True),
+        ("id", lambda: Car.id, True),
+    ],
+    "price_asc": [
+        ("featured", _featured_key, True),
+        ("price", lambda: Car.price, False),
+        ("created_at", _created_key, True),
+        ("id", lambda: Car.id, True),
+    ],
+    "price_desc": [
+        ("featured", _featured_key, True),
+        ("price", lambda: Car.price, True),
+        ("created_at", _created_key, True),
+        ("id", lambda: Car.id, True),
+    ],
+    "year_desc": [
+        ("featured", _featured_key, True),
+        ("year", lambda: Car.year, True),
+        ("created_at", _created_key, True),
+        ("id", lambda: Car.id, True),
+    ],
+    "year_asc": [
+        ("featured", _featured_key, True),
+        ("year", lambda: Car.year, False),
+        ("created_at", _created_key, True),
+        ("id", lambda: Car.id, True),
+    ],
+    "mileage_asc": [
+        ("featured", _featured_key, True),
+        ("mileage", lambda: Car.mileage, False),
+        ("created_at", _created_key, True),
+        ("id", lambda: Car.id, True),
+    ],
+    "mileage_desc": [
+        ("featured", _featured_key, True),
+        ("mileage", lambda: Car.mileage, True),
+        ("created_at", _created_key, True),
+        ("id", lambda: Car.id, True),
+    ],
+}
+# Default (no sort_by) matches ``newest``.
+_KEYSET_SORTS[""] = _KEYSET_SORTS["newest"]
+
+
+def supports_keyset(sort_by: str) -> bool:
+    return (sort_by or "") in _KEYSET_SORTS
+
+
+def encode_cursor(payload: dict) -> str:
+    body = dict(payload)
+    body["v"] = _CURSOR_VERSION
+    raw = json.dumps(body, separators=(",", ":"), default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str | None) -> dict | None:
+    """Return the decoded cursor dict, ``None`` for an empty cursor (first page)."""
+    raw = (cursor or "").strip()
+    if not raw:
+        return None
+    if len(raw) > _MAX_CURSOR_LEN:
+        raise InvalidCursor("cursor too long")
+    try:
+        padded = raw + "=" * (-len(raw) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception as exc:
+        raise InvalidCursor("malformed cursor") from exc
+    if not isinstance(data, dict) or data.get("v") != _CURSOR_VERSION:
+        raise InvalidCursor("unsupported cursor")
+    return data
+
+
+def _key_value(name: str, car: Car):
+    if name == "featured":
+        return bool(car.is_featured)
+    if name == "created_at":
+        return car.created_at.isoformat()
+    return getattr(car, name)
+
+
+def _parse_key_value(name: str, raw):
+    if name == "featured":
+        return bool(raw)
+    if name == "created_at":
+        try:
+            return datetime.fromisoformat(str(raw))
+        except (TypeError, ValueError) as exc:
+            raise InvalidCursor("bad created_at in cursor") from exc
+    if name == "price":
+        try:
+            return float(raw)
+        except (TypeError, ValueError) as exc:
+            raise InvalidCursor("bad price in cursor") from exc
+    try:
+        return int(raw)
+    except (TypeError, ValueError) as exc:
+        raise InvalidCursor(f"bad {name} in cursor") from exc
+
+
+def _seek_predicate(spec, values):
+    """Row-value comparison ``(k1, k2, ...) > (v1, v2, ...)`` with per-key direction."""
+    # Bind through ``literal`` so booleans compare with < / > instead of IS.
+    bound = [literal(v, type_=key().type) for v, (_n, key, _d) in zip(values, spec)]
+    clauses = []
+    for i, (_name, key, desc) in enumerate(spec):
+        expr = key()
+        prefix = [spec[j][1]() == bound[j] for j in range(i)]
+        step = expr < bound[i] if desc else expr > bound[i]
+        clauses.append(and_(*prefix, step) if prefix else step)
+    return or_(*clauses)
+
+
+def paginate_keyset(query, sort_by: str, cursor: dict | None, per_page: int):
+    """Fetch one page in cursor mode.
+
+    ``query`` must already be filtered but **not** ordered. Returns
+    ``(items, next_cursor_or_None)``; one extra row is read to decide
+    whether a next page exists, so no ``COUNT(*)`` is needed.
+    """
+    sort_by = sort_by or ""
+    spec = _KEYSET_SORTS[sort_by]
+    if cursor is not None:
+        if (cursor.get("s") or "") != sort_by or "k" not in cursor:
+            raise InvalidCursor("cursor does not match sort_by")
+        raw_values = cursor.get("k")
+        if not isinstance(raw_values, list) or len(raw_values) != len(spec):
+            raise InvalidCursor("cursor key length mismatch")
+        values = [_parse_key_value(name, raw) for (name, _k, _d), raw in zip(spec, raw_values)]
+        query = query.filter(_seek_predicate(spec, values))
+
+    order = [key().desc() if desc else key().asc() for _name, key, desc in spec]
+    rows = query.order_by(*order).limit(per_page + 1).all()
+    has_next = len(rows) > per_page
+    items = rows[:per_page]
+    next_cursor = None
+    if has_next and items:
+        last = items[-1]
+        next_cursor = encode_cursor(
+            {"s": sort_by, "k": [_key_value(name, last) for name, _k, _d in spec]}
+        )
+    return items, next_cursor
+
+
+def paginate_offset_cursor(ordered_query, sort_by: str, cursor: dict | None, per_page: int):
+    """Cursor mode for sorts without a stable key tuple (offset inside the cursor)."""
+    offset = 0
+    if cursor is not None:
+        if (cursor.get("s") or "") != (sort_by or ""):
+            raise InvalidCursor("cursor does not match sort_by")
+        try:
+            offset = max(0, int(cursor.get("o") or 0))
+        except (TypeError, ValueError) as exc:
+            raise InvalidCursor("bad offset in cursor") from exc
+    rows = ordered_query.offset(offset).limit(per_page + 1).all()
+    has_next = len(rows) > per_page
+    items = rows[:per_page]
+    next_cursor = (
+        encode_cursor({"s": sort_by or "", "o": offset + len(items)}) if has_next else None
+    )
+    return items, next_cursor
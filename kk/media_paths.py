@@ -0,0 +1,146 @@
+"""Resolve stored listing image paths once, not on every response.
+
+``CarImage.image_url`` holds whatever the upload path or a legacy import
+wrote: an absolute R2/CDN URL, ``uploads/car_photos/<name>``, or an older
+``uploads/<name>`` whose file actually lives under ``car_photos``. Rendering
+used to ``os.path.isfile`` up to four candidates per image per response.
+
+The resolved path is now stored in ``CarImage.resolved_url`` when the row is
+written (mapper hook, so every attach path is covered) and backfilled for
+old rows by ``python -m kk.scripts.backfill_image_paths``. A miss is stored
+as NULL, never as "", so an image whose file lands after the row is written
+still shows up: unresolved rows fall back to a process-level
+positive/negative cache with TTL. Card and detail serializers both go
+through :func:`display_url`.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+
+from sqlalchemy import event, or_, select, update
+
+from .models import CarImage, db
+
+_KK_ROOT = os.path.dirname(os.path.abspath(__file__))
+# Same roots Flask serves /static from: kk/static and repo-root static/.
+STATIC_ROOTS: tuple[str, ...] = (
+    os.path.join(_KK_ROOT, "static"),
+    os.path.abspath(os.path.join(_KK_ROOT, "..", "static")),
+)
+PLACEHOLDER_REL = "uploads/car_photos/placeholder.jpg"
+
+# Files rarely disappear; misses are re-checked sooner in case an upload lands late.
+_POSITIVE_TTL_S = float(os.environ.get("STATIC_PATH_CACHE_TTL_S", "600"))
+_NEGATIVE_TTL_S = float(os.environ.get("STATIC_PATH_CACHE_MISS_TTL_S", "60"))
+_CACHE_MAX = 20_000
+
+_exists_cache: dict[str, tuple[float, bool]] = {}
+_exists_lock = threading.Lock()
+
+
+def _is_absolute_url(rel: str) -> bool:
+    return rel.startswith("http://") or rel.startswith("https://")
+
+
+def static_exists(rel: str) -> bool:
+    """Whether ``rel`` exists under a static root (cached per process)."""
+    if not rel:
+        return False
+    norm = rel.lstrip("/").replace("\\", "/")
+    now = time.monotonic()
+    with _exists_lock:
+        hit = _exists_cache.get(norm)
+        if hit is not None and hit[0] > now:
+            return hit[1]
+    found = any(os.path.isfile(os.path.join(root, norm)) for root in STATIC_ROOTS)
+    with _exists_lock:
+        if len(_exists_cache) >= _CACHE_MAX:
+            _exists_cache.clear()
+        _exists_cache[norm] = (now + (_POSITIVE_TTL_S if found else _NEGATIVE_TTL_S), found)
+    return found
+
+
+def clear_static_path_cache() -> None:
+    with _exists_lock:
+        _exists_cache.clear()
+
+
+def resolve_image_rel(rel: str | None) -> str:
+    """
+    Resolve a stored image path to a servable one ("" when no file exists).
+
+    Absolute URLs pass through. If the DB stored ``uploads/<name>``, fall back
+    to ``uploads/car_photos/<name>``.
+    """
+    raw = (rel or "").strip()
+    if not raw:
+        return ""
+    if _is_absolute_url(raw):
+        return raw
+    norm = raw.lstrip("/").replace("\\", "/")
+    if static_exists(norm):
+        return norm
+    alt = f"uploads/car_photos/{os.path.basename(norm)}"
+    if static_exists(alt):
+        return alt
+    return ""
+
+
+def display_url(image_url: str | None, resolved_url: str | None) -> str:
+    """
+    The one place a listing image URL is chosen ("" when the file is missing).
+
+    Stored resolution when there is one; otherwise the cached filesystem check,
+    so a miss is re-checked after ``STATIC_PATH_CACHE_MISS_TTL_S``.
+    """
+    if resolved_url:
+        return resolved_url
+    return resolve_image_rel(image_url or "")
+
+
+def image_display_url(img: CarImage) -> str:
+    """:func:`display_url` for a loaded ``CarImage``."""
+    return display_url(getattr(img, "image_url", None), getattr(img, "resolved_url", None))
+
+
+def _set_resolved_url(_mapper, _connection, target: CarImage) -> None:
+    state = db.inspect(target)
+    if not target.resolved_url or state.attrs.image_url.history.has_changes():
+        # NULL, not "", on a miss: display_url keeps re-checking with the TTL cache.
+        target.resolved_url = resolve_image_rel(target.image_url) or None
+
+
+def install_image_path_resolution() -> None:
+    """Resolve ``CarImage.resolved_url`` whenever a row is inserted or its path changes."""
+    for name in ("before_insert", "before_update"):
+        if not event.contains(CarImage, name, _set_resolved_url):
+            event.listen(CarImage, name, _set_resolved_url)
+
+
+def backfill_resolved_image_urls(batch_size: int = 500, *, force: bool = False) -> int:
+    """
+    Fill ``resolved_url`` for unresolved rows (all rows with ``force``). Returns
+    rows visited; files still missing stay NULL (older runs stored "" for them).
+    """
+    updated = 0
+    last_id = 0
+    while True:
+        q = select(CarImage.id, CarImage.image_url).where(CarImage.id > last_id)
+        if not force:
+            q = q.where(or_(CarImage.resolved_url.is_(None), CarImage.resolved_url == ""))
+        rows = db.session.execute(q.order_by(CarImage.id).limit(batch_size)).all()
+        if not rows:
+            break
+        for image_id, image_url in rows:
+            db.session.execute(
+                update(CarImage)
+                .where(CarImage.id == image_id)
+                .values(resolved_url=resolve_image_rel(image_url) or None)
+            )
+        db.session.commit()
+        updated += len(rows)
+        last_id = rows[-1][0]
+    return updated
@@ -1,10 +1,13 @@
 from __future__ import annotations
 
 import base64
+import hashlib
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from typing import Tuple
+from typing import BinaryIO, NamedTuple, Sequence, Tuple, Union
 
 from flask import current_app
 
@@ -64,6 +67,16 @@ def persist_jpeg_bytes(out_bytes: bytes, *, object_filename: str) -> str:
     """
     Persist optimized JPEG bytes to R2 (preferred) or local UPLOAD_FOLDER.
 
+    Returns a public HTTPS URL when R2_PUBLIC_URL is set, otherwise a relative
+    ``uploads/car_photos/...`` path for local/static serving.
+    """
+    return persist_image_bytes(out_bytes, object_filename=object_filename, content_type="image/jpeg")
+
+
+def persist_image_bytes(out_bytes: bytes, *, object_filename: str, content_type: str) -> str:
+    """
+    Persist encoded image bytes (any format) to R2 (preferred) or local UPLOAD_FOLDER.
+
     Returns a public HTTPS URL when R2_PUBLIC_URL is set, otherwise a relative
     ``uploads/car_photos/...`` path for local/static serving.
     """
@@ -85,7 +98,7 @@ def persist_jpeg_bytes(out_bytes: bytes, *, object_filename: str) -> str:
             r2_put_bytes(
                 key=bucket_key,
                 body=out_bytes,
-                content_type="image/jpeg",
+                content_type=content_type,
             )
             if public_base:
                 return f"{public_base}/{bucket_key}"
@@ -137,109 +150,255 @@ def blur_image_bytes(raw_bytes: bytes, ext: str, *, skip_blur: bool = False) ->
 
     out_bytes = raw_bytes
     try:
-        enabled = (os.getenv("PLATE_BLUR_ENABLED", "1").strip() != "0")
-        if enabled:
-            from .license_plate_blur import blur_license_plates, get_plate_detector
-
-            detector = get_plate_detector()
-            if detector.is_configured():
-                expand = float(os.getenv("PLATE_BLUR_EXPAND", "0") or "0")
-                out_bytes, _meta = blur_license_plates(
-                    image_bytes=raw_bytes,
-                    output_ext=ext,
-                    detector=detector,
-                    expand_ratio=expand,
-                )
+        detector = _plate_detector()
+        if detector is not None:
+            from .license_plate_blur import blur_license_plates
+
+            expand = float(os.getenv("PLATE_BLUR_EXPAND", "0") or "0")
+            out_bytes, _meta = blur_license_plates(
+                image_bytes=raw_bytes,
+                output_ext=ext,
+                detector=detector,
+                expand_ratio=expand,
+            )
     except Exception:
         # Best-effort: never fail the upload on blur issues.
         out_bytes = raw_bytes
     return out_bytes
 
 
-def process_and_store_image(file_storage, inline_base64: bool, *, skip_blur: bool = False):
+def _plate_detector():
+    """Configured plate detector, or None when blurring is disabled / unconfigured."""
+    if os.getenv("PLATE_BLUR_ENABLED", "1").strip() == "0":
+        return None
+    from .license_plate_blur import get_plate_detector
+
+    detector = get_plate_detector()
+    return detector if detector.is_configured() else None
+
+
+class ProcessedImage(NamedTuple):
+    rel_path: str
+    preview: str | None = None
+    renditions: dict | None = None
+    width: int | None = None
+    height: int | None = None
+
+
+def process_listing_image(
+    raw_bytes: bytes,
+    original_filename: str,
+    *,
+    inline_base64: bool = False,
+    skip_blur: bool = False,
+    renditions: bool = False,
+) -> ProcessedImage:
     """
-    Save one uploaded image into `kk/static/uploads/car_photos/` as an optimized JPEG.
+    Decode once, orient, blur plates, resize and encode one image held in memory, then persist.
 
-    Returns: (relative_path_under_static, optional_inline_base64_preview)
+    With ``renditions`` the smaller WebP/JPEG derivatives (``kk.image_renditions``) are
+    encoded from the same decoded pixels and stored too. Bytes already processed with the
+    same settings return the stored result without any work (``kk.image_dedupe``).
+    Needs an app context.
     """
-    filename = generate_secure_filename(file_storage.filename)
-    timestamp = utcnow().strftime("%Y%m%d_%H%M%S_%f")
+    from .image_dedupe import CachedPlateDetector, content_hash, dedupe_enabled, lookup_processed, remember_processed
+    from .image_pipeline import ImagePipeline
+    from .image_renditions import build_renditions, renditions_enabled
 
-    temp_rel = f"temp/processed_{timestamp}_{filename}"
-    temp_abs = os.path.join(current_app.config["UPLOAD_FOLDER"], temp_rel)
-    os.makedirs(os.path.dirname(temp_abs), exist_ok=True)
-    file_storage.save(temp_abs)
+    filename = generate_secure_filename(original_filename or "upload.jpg")
+    timestamp = utcnow().strftime("%Y%m%d_%H%M%S_%f")
+    base_name = os.path.splitext(filename)[0]
+    stem = f"processed_{timestamp}_{base_name}"
+    final_filename = f"{stem}.jpg"
 
-    try:
-        b64 = None
-        base_name = os.path.splitext(filename)[0]
-        final_filename = f"processed_{timestamp}_{base_name}.jpg"
-
-        with open(temp_abs, "rb") as fp:
-            raw_bytes = fp.read()
-
-        ext = (os.path.splitext(filename)[1] or ".jpg").lower()
-        if ext in (".heic", ".heif"):
-            raw_bytes, converted = heic_to_jpeg(raw_bytes)
-            if converted:
-                ext = ".jpg"
-
-        out_bytes = blur_image_bytes(raw_bytes, ext, skip_blur=skip_blur)
-
-        # Optionally keep original alongside the blurred output (off by default for privacy).
-        if os.getenv("PLATE_BLUR_KEEP_ORIGINAL", "0").strip() == "1":
-            try:
-                original_name = f"original_{final_filename}"
-                original_abs = os.path.join(current_app.root_path, "static", "uploads", "car_photos", original_name)
-                with open(original_abs, "wb") as f:
-                    f.write(raw_bytes)
-            except Exception:
-                pass
-
-        # Downscale/compress (best-effort).
+    # Optionally keep original alongside the blurred output (off by default for privacy).
+    if os.getenv("PLATE_BLUR_KEEP_ORIGINAL", "0").strip() == "1":
         try:
-            from PIL import Image
-
-            im = Image.open(BytesIO(out_bytes))
-            if im.mode not in ("RGB", "L"):
-                im = im.convert("RGB")
-            max_dim = int(os.getenv("UPLOAD_IMAGE_MAX_DIM", "1200") or "1200")
-            if max(im.size) > max_dim:
-                im.thumbnail((max_dim, max_dim), Image.Resampling.LANCZOS)
-            buf = BytesIO()
-            quality = int(os.getenv("UPLOAD_IMAGE_JPEG_QUALITY", "80") or "80")
-            im.save(buf, format="JPEG", quality=quality, optimize=True)
-            out_bytes = buf.getvalue()
+            original_name = f"original_{final_filename}"
+            original_abs = os.path.join(current_app.root_path, "static", "uploads", "car_photos", original_name)
+            with open(original_abs, "wb") as f:
+                f.write(raw_bytes)
         except Exception:
             pass
 
-        # Persist the optimized bytes: prefer Cloudflare R2 when configured,
-        # otherwise fall back to local filesystem under /static/uploads.
-        final_rel = persist_jpeg_bytes(out_bytes, object_filename=final_filename)
-
-        if inline_base64:
-            try:
-                from PIL import Image
-
-                im2 = Image.open(BytesIO(out_bytes))
-                if im2.mode not in ("RGB", "L"):
-                    im2 = im2.convert("RGB")
-                prev_dim = int(os.getenv("INLINE_PREVIEW_MAX_DIM", "420") or "420")
-                if max(im2.size) > prev_dim:
-                    im2.thumbnail((prev_dim, prev_dim), Image.Resampling.LANCZOS)
-                buf2 = BytesIO()
-                prev_q = int(os.getenv("INLINE_PREVIEW_JPEG_QUALITY", "60") or "60")
-                im2.save(buf2, format="JPEG", quality=prev_q, optimize=True)
-                encoded = base64.b64encode(buf2.getvalue()).decode("utf-8")
-                b64 = f"data:image/jpeg;base64,{encoded}"
-            except Exception:
-                b64 = None
-
-        return final_rel, b64
-    finally:
+    max_dim = int(os.getenv("UPLOAD_IMAGE_MAX_DIM", "1200") or "1200")
+    quality = int(os.getenv("UPLOAD_IMAGE_JPEG_QUALITY", "80") or "80")
+    expand = float(os.getenv("PLATE_BLUR_EXPAND", "0") or "0")
+    want_renditions = renditions and renditions_enabled()
+    detector = None
+    if not skip_blur:
         try:
-            if temp_abs and os.path.exists(temp_abs):
-                os.remove(temp_abs)
+            detector = _plate_detector()
         except Exception:
-            pass
+            logger.warning("plate detector unavailable for %s", filename, exc_info=True)
+
+    # Identical bytes + identical settings: reuse the stored result (client retries, re-uploads).
+    digest = variant = None
+    if dedupe_enabled():
+        digest = content_hash(raw_bytes)
+        variant = _processing_variant(max_dim, quality, detector, expand, want_renditions)
+        hit = lookup_processed(digest, variant)
+        if hit is not None and (hit.get("preview") or not inline_base64):
+            return ProcessedImage(
+                hit["rel_path"],
+                hit.get("preview") if inline_base64 else None,
+                hit.get("renditions"),
+                hit.get("width"),
+                hit.get("height"),
+            )
+        if detector is not None:
+            detector = CachedPlateDetector(detector, digest)
+
+    try:
+        pipeline = ImagePipeline.decode(raw_bytes, max_dim=max_dim)
+    except Exception:
+        # Not decodable (validated upstream by magic bytes): store as uploaded.
+        logger.warning("could not decode %s; storing original bytes", filename)
+        return ProcessedImage(persist_jpeg_bytes(raw_bytes, object_filename=final_filename))
+
+    cacheable = True
+    if detector is not None:
+        try:
+            meta = pipeline.blur_plates(detector, expand_ratio=expand)
+            # Never remember output whose plates may not have been blurred.
+            cacheable = meta.get("status") in ("blurred", "no_plates", "no_valid_rois")
+        except Exception:
+            # Best-effort: never fail the upload on blur issues.
+            logger.warning("plate blur failed for %s", filename, exc_info=True)
+            cacheable = False
+
+    main = pipeline.resized(max_dim)
+    out_bytes = pipeline.encode(max_dim=max_dim, quality=quality)
+    # Persist the optimized bytes: prefer Cloudflare R2 when configured,
+    # otherwise fall back to local filesystem under /static/uploads.
+    final_rel = persist_jpeg_bytes(out_bytes, object_filename=final_filename)
+
+    rendition_map = None
+    if want_renditions:
+        try:
+            rendition_map = build_renditions(pipeline, stem=stem, main_url=final_rel, main_dim=max_dim)
+        except Exception:
+            logger.exception("renditions failed for %s", filename)
+            cacheable = False
+
+    b64 = None
+    if inline_base64:
+        prev_dim = int(os.getenv("INLINE_PREVIEW_MAX_DIM", "420") or "420")
+        prev_q = int(os.getenv("INLINE_PREVIEW_JPEG_QUALITY", "60") or "60")
+        encoded = base64.b64encode(pipeline.encode(max_dim=prev_dim, quality=prev_q)).decode("utf-8")
+        b64 = f"data:image/jpeg;base64,{encoded}"
+    result = ProcessedImage(final_rel, b64, rendition_map, main.size[0], main.size[1])
+    if digest is not None and cacheable:
+        remember_processed(digest, variant, result._asdict())
+    return result
+
+
+def _processing_variant(max_dim: int, quality: int, detector, expand: float, renditions: bool) -> str:
+    """Fingerprint of the settings that shape a processed upload (part of the dedupe key)."""
+    from .image_renditions import rendition_signature
+
+    blur = f"{getattr(detector, 'name', 'detector')}:{expand}" if detector is not None else "none"
+    parts = [str(max_dim), str(quality), blur, rendition_signature() if renditions else "-"]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def process_image_bytes(
+    raw_bytes: bytes,
+    original_filename: str,
+    *,
+    inline_base64: bool = False,
+    skip_blur: bool = False,
+) -> Tuple[str, str | None]:
+    """:func:`process_listing_image` without renditions. Returns (stored path or URL, optional preview)."""
+    result = process_listing_image(
+        raw_bytes,
+        original_filename,
+        inline_base64=inline_base64,
+        skip_blur=skip_blur,
+    )
+    return result.rel_path, result.preview
+
 
+def process_and_store_image(file_storage, inline_base64: bool, *, skip_blur: bool = False):
+    """
+    Save one uploaded image into `kk/static/uploads/car_photos/` as an optimized JPEG.
+
+    Returns: (relative_path_under_static, optional_inline_base64_preview)
+    """
+    return process_image_bytes(
+        file_storage.read(),
+        file_storage.filename,
+        inline_base64=inline_base64,
+        skip_blur=skip_blur,
+    )
+
+
+# Per-image work (decode, blur, resize, encode, upload) runs here so a multi-photo
+# upload does not process files one after another on the request thread. Pillow,
+# OpenCV and the socket writes release the GIL; one pool per process bounds the
+# total image work across concurrent requests.
+_image_pool: ThreadPoolExecutor | None = None
+_image_pool_pid: int | None = None
+_image_pool_lock = threading.Lock()
+
+
+def _image_workers() -> int:
+    try:
+        raw = int(os.getenv("UPLOAD_IMAGE_WORKERS", "0") or "0")
+    except ValueError:
+        raw = 0
+    return raw if raw > 0 else min(4, os.cpu_count() or 1)
+
+
+def _get_image_pool() -> ThreadPoolExecutor:
+    global _image_pool, _image_pool_pid
+    with _image_pool_lock:
+        if _image_pool is None or _image_pool_pid != os.getpid():
+            _image_pool = ThreadPoolExecutor(max_workers=_image_workers(), thread_name_prefix="image-upload")
+            _image_pool_pid = os.getpid()
+        return _image_pool
+
+
+def process_images_concurrently(
+    items: Sequence[Tuple[Union[bytes, BinaryIO], str]],
+    *,
+    inline_base64: bool = False,
+    skip_blur: bool = False,
+    renditions: bool = False,
+) -> list[ProcessedImage | BaseException]:
+    """
+    Run :func:`process_listing_image` for ``(source, filename)`` items on the shared pool.
+
+    ``source`` is raw bytes or a readable stream (e.g. a ``FileStorage``); streams
+    are read inside the worker, so only the images being processed are in memory.
+    Results keep input order; an item that failed yields its exception instead of a result.
+    """
+    if not items:
+        return []
+    app = current_app._get_current_object()
+
+    def run(source: Union[bytes, BinaryIO], filename: str):
+        raw_bytes = source if isinstance(source, (bytes, bytearray)) else source.read()
+        with app.app_context():
+            return process_listing_image(
+                raw_bytes,
+                filename,
+                inline_base64=inline_base64,
+                skip_blur=skip_blur,
+                renditions=renditions,
+            )
+
+    if len(items) == 1 or _image_workers() == 1:
+        futures = None
+    else:
+        pool = _get_image_pool()
+        futures = [pool.submit(run, raw, name) for raw, name in items]
+
+    results: list[ProcessedImage | BaseException] = []
+    for i, (raw, name) in enumerate(items):
+        try:
+            results.append(futures[i].result() if futures else run(raw, name))
+        except Exception as e:
+            logger.exception("processing image %s failed", name)
+            results.append(e)
+    return results
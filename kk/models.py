@@ -537,9 +537,9 @@ class Car(db.Model):
     
     # Status and metadata
     is_active = db.Column(db.Boolean, default=True, index=True)
-    is_featured = db.Column(db.Boolean, default=False)
+    is_featured = db.Column(db.Boolean, default=False, nullable=False)
     views_count = db.Column(db.Integer, default=0)
-    created_at = db.Column(db.DateTime, default=utcnow, index=True)
+    created_at = db.Column(db.DateTime, default=utcnow, nullable=False, index=True)
     updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
     
     # AI Analysis fields
@@ -652,6 +652,9 @@ class CarImage(db.Model):
     car_id = db.Column(db.Integer, db.ForeignKey('car.id'), nullable=False, index=True)
     # Full R2/CDN HTTPS URLs exceed VARCHAR(200); keep aligned with car_video.video_url.
     image_url = db.Column(db.String(2048), nullable=False)
+    # Servable path resolved at write time (kk.media_paths); NULL = file missing or not resolved yet,
+    # so display_url re-checks the filesystem (TTL-cached) until the file shows up.
+    resolved_url = db.Column(db.String(2048), nullable=True)
     is_primary = db.Column(db.Boolean, default=False)
     order = db.Column(db.Integer, default=0)
     # "listing" = normal gallery photos; "damage" = crash / damage disclosure (not in main carousel).
@@ -660,12 +663,15 @@ class CarImage(db.Model):
     focus_y = db.Column(db.Float, nullable=True)
     image_width = db.Column(db.Integer, nullable=True)
     image_height = db.Column(db.Integer, nullable=True)
+    # Srcset map of smaller WebP/JPEG derivatives (kk.image_renditions); {} = source unreadable.
+    renditions = db.Column(db.JSON(none_as_null=True), nullable=True)
     created_at = db.Column(db.DateTime, default=utcnow)
     
     def to_dict(self):
         return {
             'id': self.id,
             'image_url': self.image_url,
+            'srcset': self.renditions or None,
             'is_primary': self.is_primary,
             'order': self.order,
             'kind': getattr(self, "kind", None) or "listing",
@@ -684,17 +690,30 @@ class CarVideo(db.Model):
     car_id = db.Column(db.Integer, db.ForeignKey('car.id'), nullable=False, index=True)
     # Full R2/CDN URLs can exceed 200 chars
     video_url = db.Column(db.String(2048), nullable=False)
-    thumbnail_url = db.Column(db.String(2048), nullable=True)
+    thumbnail_url = db.Column(db.String(2048), nullable=True)  # Poster JPEG (first frames, plates blurred)
     duration = db.Column(db.Integer, nullable=True)  # Duration in seconds
     order = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=utcnow)
+    # Filled by the kk.tasks.video_tasks.process_car_video probe (NULL on legacy rows)
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    codec = db.Column(db.String(32), nullable=True)
+    size_bytes = db.Column(db.BigInteger, nullable=True)
+    preview_url = db.Column(db.String(2048), nullable=True)  # Short low-bitrate MP4
+    processing_status = db.Column(db.String(16), nullable=True)  # processing | ready | failed
     
     def to_dict(self):
         return {
             'id': self.id,
             'video_url': self.video_url,
             'thumbnail_url': self.thumbnail_url,
+            'poster_url': self.thumbnail_url,
+            'preview_url': self.preview_url,
             'duration': self.duration,
+            'width': self.width,
+            'height': self.height,
+            'codec': self.codec,
+            'processing_status': self.processing_status,
             'order': self.order
         }
     
@@ -771,6 +790,16 @@ class ListingAnalytics(db.Model):
     def __repr__(self):
         return f'<ListingAnalytics car_id={self.car_id} views={self.views}>'
 
+
+class ListingCounterFlush(db.Model):
+    """A Redis counter batch already applied; written in the same transaction as its UPDATEs."""
+
+    __tablename__ = "listing_counter_flush"
+
+    flush_id = db.Column(db.String(64), primary_key=True)
+    applied_at = db.Column(db.DateTime, nullable=False, default=utcnow, index=True)
+
+
 class Message(db.Model):
     __tablename__ = 'message'
     
@@ -803,29 +832,32 @@ class Message(db.Model):
         db.Index("ix_message_sender_created_at", "sender_id", "created_at"),
     )
     
+    @staticmethod
+    def reply_preview_content(parent):
+        """Short text shown for a quoted message."""
+        if parent.is_deleted:
+            return "This message was deleted"
+        if parent.content:
+            return parent.content
+        if parent.listing_preview:
+            return "[Listing]"
+        if parent.attachments:
+            return f"[{len(parent.attachments)} attachments]"
+        if parent.attachment_url:
+            return "[Attachment]"
+        return ""
+
     def _reply_preview(self):
         parent = self.reply_to
         if parent is None and self.reply_to_id:
             parent = db.session.get(Message, self.reply_to_id)
         if not parent:
             return None
-        if parent.is_deleted:
-            content = "This message was deleted"
-        elif parent.content:
-            content = parent.content
-        elif parent.listing_preview:
-            content = "[Listing]"
-        elif parent.attachments:
-            content = f"[{len(parent.attachments)} attachments]"
-        elif parent.attachment_url:
-            content = "[Attachment]"
-        else:
-            content = ""
         return {
             'id': parent.public_id,
             'sender_id': parent.sender.public_id if parent.sender else None,
             'sender_name': f"{parent.sender.first_name} {parent.sender.last_name}" if parent.sender else None,
-            'content': content,
+            'content': Message.reply_preview_content(parent),
             'message_type': parent.message_type,
             'is_deleted': parent.is_deleted,
         }
@@ -859,6 +891,39 @@ class Message(db.Model):
     def __repr__(self):
         return f'<Message {self.id}>'
 
+class Conversation(db.Model):
+    """One row per (listing, buyer, seller) chat thread; backs ``GET /api/chats``.
+
+    Maintained by ``kk.chat_conversations`` in the same transaction as every
+    message send, edit, delete and read.
+    """
+    __tablename__ = 'conversation'
+
+    id = db.Column(db.Integer, primary_key=True)
+    car_id = db.Column(db.Integer, db.ForeignKey('car.id'), nullable=False, index=True)
+    buyer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    last_message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=True)
+    last_message_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    buyer_unread = db.Column(db.Integer, nullable=False, default=0)
+    seller_unread = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=utcnow)
+    updated_at = db.Column(db.DateTime, default=utcnow)
+
+    car = db.relationship('Car', foreign_keys=[car_id])
+    buyer = db.relationship('User', foreign_keys=[buyer_id])
+    seller = db.relationship('User', foreign_keys=[seller_id])
+    last_message = db.relationship('Message', foreign_keys=[last_message_id])
+
+    __table_args__ = (
+        db.UniqueConstraint('car_id', 'buyer_id', 'seller_id', name='uq_conversation_car_buyer_seller'),
+        db.Index('ix_conversation_buyer_last_message', 'buyer_id', 'last_message_at', 'id'),
+        db.Index('ix_conversation_seller_last_message', 'seller_id', 'last_message_at', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<Conversation car={self.car_id} buyer={self.buyer_id} seller={self.seller_id}>'
+
 class Notification(db.Model):
     __tablename__ = 'notification'
     
@@ -932,6 +997,31 @@ class ScheduledNotification(db.Model):
         return f"<ScheduledNotification {self.id} {self.status}>"
 
 
+class ScheduledNotificationChunk(db.Model):
+    """One keyset range of a broadcast's audience and its delivery state."""
+
+    __tablename__ = "scheduled_notification_chunk"
+
+    id = db.Column(db.Integer, primary_key=True)
+    notification_id = db.Column(
+        db.Integer, db.ForeignKey("scheduled_notification.id", ondelete="CASCADE"), nullable=False
+    )
+    chunk_index = db.Column(db.Integer, nullable=False)
+    after_id = db.Column(db.Integer, nullable=False)  # exclusive lower User.id bound
+    upto_id = db.Column(db.Integer, nullable=False)  # inclusive upper User.id bound
+    state = db.Column(
+        db.String(20), nullable=False, default="pending"
+    )  # pending | storing | stored | pushing | done
+    created_count = db.Column(db.Integer, nullable=False, default=0)
+    pushed_count = db.Column(db.Integer, nullable=False, default=0)
+    # Stamped on dispatch and every transition; the beat task resumes chunks whose stamp went stale.
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint("notification_id", "chunk_index", name="uq_scheduled_notification_chunk"),
+    )
+
+
 class UserAction(db.Model):
     __tablename__ = 'user_action'
     
@@ -1322,3 +1412,30 @@ class CatalogBodyType(db.Model):
     def __repr__(self):
         return f"<CatalogBodyType {self.name}>"
 
+
+
+class ListingFacetCount(db.Model):
+    """Per-value listing counts behind ``/api/filters/facets``.
+
+    Maintained incrementally from Car writes (see ``kk.listing_facets``).
+    ``scope`` is ``""`` for the global facet set or ``"<dimension>:<value>"``
+    (e.g. ``brand:toyota``) for facets narrowed to one active filter.
+    """
+
+    __tablename__ = "listing_facet_count"
+    __table_args__ = (
+        db.UniqueConstraint("scope", "facet", "value_key", name="uq_listing_facet_count"),
+        db.Index("ix_listing_facet_count_scope_facet", "scope", "facet"),
+        db.Index("ix_listing_facet_count_scope_facet_num", "scope", "facet", "num_value"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(160), nullable=False, default="")
+    facet = db.Column(db.String(40), nullable=False)
+    value_key = db.Column(db.String(160), nullable=False)
+    label = db.Column(db.String(160), nullable=False)
+    num_value = db.Column(db.Float, nullable=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ListingFacetCount {self.scope!r} {self.facet}={self.value_key} n={self.count}>"
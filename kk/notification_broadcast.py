@@ -1,15 +1,45 @@
-"""Admin notification broadcast + scheduled delivery."""
+"""Admin notification broadcast + scheduled delivery.
+
+Broadcasts used to run in one loop inside the admin request: up to 5,000
+``User`` rows in memory (everyone past that silently skipped), serial FCM
+sends and a commit every 200 rows, so large audiences hit the gunicorn
+timeout. Every broadcast -- immediate or scheduled -- is now a
+``ScheduledNotification`` row whose audience is split into keyset ranges of
+``BROADCAST_CHUNK_SIZE`` user ids. Each chunk is one Celery task: bulk-insert
+the chunk's notifications, multicast the push, checkpoint.
+
+The plan (``total``, ``push_configured``) lives in
+``ScheduledNotification.result``; each chunk is a
+``ScheduledNotificationChunk`` row whose ``state`` moves
+``pending -> storing -> stored -> pushing -> done``. Every step is a
+conditional UPDATE of that one row, so chunks never wait on each other or on
+the broadcast row, and progress is a ``SUM`` over the chunk rows.
+
+``storing`` is claimed and committed before the insert; the notifications and
+the ``stored`` transition then commit together (and roll back when the claim
+was taken away meanwhile), so a crashed run never duplicates in-app rows. The
+push is claimed the same way (``pushing``) before FCM is called, so a
+duplicate task for the same chunk skips it. ``updated_at`` is stamped on
+dispatch and every transition; the beat task
+(:func:`process_due_scheduled_notifications`) re-dispatches only chunks whose
+own stamp is older than ``BROADCAST_STALL_S``, returning an expired claim to
+the state before it first. Without a Celery broker the chunks run inline, in
+order.
+"""
 
 from __future__ import annotations
 
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Any
 
-from sqlalchemy import or_
+from sqlalchemy import case, func, insert, or_, select, update
 
-from .models import Notification, ScheduledNotification, User, db
-from .push import fcm_is_configured, send_push
+from .config import env_int
+from .models import ScheduledNotification, ScheduledNotificationChunk, User, db
+from .push import fcm_is_configured
+from .push_fanout import bulk_insert_notifications, multicast_and_prune
+from .tasks.celery_app import broker_configured
 from .time_utils import utcnow
 
 logger = logging.getLogger(__name__)
@@ -17,6 +47,10 @@ logger = logging.getLogger(__name__)
 VALID_AUDIENCES = ("all", "dealers", "users", "user")
 
 
+def _chunk_size() -> int:
+    return max(1, env_int("BROADCAST_CHUNK_SIZE", 1000))
+
+
 def _find_user(public_id: str) -> User | None:
     pid = (public_id or "").strip()
     if not pid:
@@ -24,13 +58,12 @@ def _find_user(public_id: str) -> User | None:
     return User.query.filter_by(public_id=pid).first()
 
 
-def resolve_recipients(
+def audience_criteria(
     *,
     audience: str,
     target_user_id: str | None = None,
-    limit: int = 5000,
-) -> tuple[list[User], str | None]:
-    """Return (recipients, error_message)."""
+) -> tuple[list, str | None]:
+    """Return (WHERE criteria on ``User`` for the audience, error_message)."""
     audience = (audience or "all").strip().lower()
     target_user_id = (target_user_id or "").strip() or None
 
@@ -43,29 +76,239 @@ def resolve_recipients(
         user = _find_user(target_user_id)
         if not user:
             return [], "Target user not found"
-        return [user], None
+        return [User.id == user.id], None
 
     if audience == "dealers":
-        recipients = (
-            User.query.filter(
-                User.is_active.is_(True),
-                or_(User.account_type == "dealer", User.dealer_status == "approved"),
-            )
-            .limit(limit)
-            .all()
-        )
-    elif audience == "users":
-        recipients = (
-            User.query.filter(
-                User.is_active.is_(True),
-                User.account_type != "dealer",
-            )
-            .limit(limit)
-            .all()
+        return [
+            User.is_active.is_(True),
+            or_(User.account_type == "dealer", User.dealer_status == "approved"),
+        ], None
+    if audience == "users":
+        return [User.is_active.is_(True), User.account_type != "dealer"], None
+    return [User.is_active.is_(True)], None
+
+
+def _validate_message(title: str, message: str) -> tuple[str, str]:
+    title = (title or "").strip()
+    message = (message or "").strip()
+    if not title or not message:
+        raise ValueError("Title and message are required")
+    if len(title) > 200:
+        raise ValueError("Title must be 200 characters or fewer")
+    return title, message
+
+
+def _plan_chunks(criteria: list) -> tuple[int, list[tuple[int, int]]]:
+    """(recipient count, ``(after, upto]`` keyset ranges of ``BROADCAST_CHUNK_SIZE`` user ids each)."""
+    total, max_id = db.session.execute(select(func.count(User.id), func.max(User.id)).where(*criteria)).one()
+    if not total:
+        return 0, []
+    size = _chunk_size()
+    rn = func.row_number().over(order_by=User.id).label("rn")
+    ranked = select(User.id, rn).where(*criteria).subquery()
+    bounds = list(db.session.scalars(select(ranked.c.id).where(ranked.c.rn % size == 0).order_by(ranked.c.id)))
+    if not bounds or bounds[-1] != max_id:
+        bounds.append(max_id)
+    return int(total), list(zip([0, *bounds[:-1]], bounds))
+
+
+def _dispatch_chunks(row_id: int, indexes: list[int]) -> None:
+    """Fan chunks out to Celery workers; run them inline when there is no broker."""
+    if broker_configured():
+        try:
+            from .tasks.notification_tasks import send_broadcast_chunk
+
+            for index in indexes:
+                send_broadcast_chunk.delay(row_id, index)
+            return
+        except Exception as exc:
+            logger.warning("broadcast %s: Celery dispatch failed, running inline: %s", row_id, exc)
+    for index in indexes:
+        run_broadcast_chunk(row_id, index)
+
+
+def start_broadcast(row: ScheduledNotification, *, source: str = "admin_scheduled") -> dict[str, Any]:
+    """Plan chunks for ``row`` and dispatch them. Raises ValueError for bad audiences."""
+    criteria, err = audience_criteria(audience=row.audience, target_user_id=row.target_user_public_id)
+    if err:
+        raise ValueError(err)
+    total, ranges = _plan_chunks(criteria)
+    now = utcnow()
+    row.status = "sending"
+    row.error_message = None
+    row.result = {
+        "audience": row.audience,
+        "source": source,
+        "push_configured": bool(row.send_push) and fcm_is_configured(),
+        "total": total,
+    }
+    row.updated_at = now
+    if ranges:
+        db.session.execute(
+            insert(ScheduledNotificationChunk),
+            [
+                {"notification_id": row.id, "chunk_index": i, "after_id": after, "upto_id": upto, "updated_at": now}
+                for i, (after, upto) in enumerate(ranges)
+            ],
         )
     else:
-        recipients = User.query.filter(User.is_active.is_(True)).limit(limit).all()
-    return recipients, None
+        _finish(row, 0, 0)
+    db.session.commit()
+    if ranges:
+        _dispatch_chunks(row.id, list(range(len(ranges))))
+        db.session.refresh(row)
+    return broadcast_progress(row)
+
+
+def _lock_row(row_id: int) -> ScheduledNotification | None:
+    return db.session.execute(
+        select(ScheduledNotification)
+        .where(ScheduledNotification.id == row_id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    ).scalar_one_or_none()
+
+
+def _finish(row: ScheduledNotification, created: int, pushed: int) -> None:
+    row.status = "sent"
+    row.sent_at = utcnow()
+    row.result = {
+        **(row.result or {}),
+        "created": created,
+        "pushed": pushed,
+        "message": f"Notification created for {created} user(s)",
+    }
+
+
+def _totals(row_id: int) -> tuple[int, int, int, int]:
+    """``(chunks, chunks_done, created, pushed)`` summed over the broadcast's chunk rows."""
+    chunk = ScheduledNotificationChunk
+    total, done, created, pushed = db.session.execute(
+        select(
+            func.count(chunk.id),
+            func.coalesce(func.sum(case((chunk.state == "done", 1), else_=0)), 0),
+            func.coalesce(func.sum(chunk.created_count), 0),
+            func.coalesce(func.sum(chunk.pushed_count), 0),
+        ).where(chunk.notification_id == row_id)
+    ).one()
+    return int(total), int(done), int(created), int(pushed)
+
+
+def _transition(row_id: int, index: int, state: str, *, expect: tuple[str, ...], **values: Any) -> bool:
+    """
+    Move chunk ``index`` to ``state`` if it is in one of ``expect`` (caller
+    commits). Only that chunk's row is written; returns False when it was not
+    in ``expect``.
+    """
+    chunk = ScheduledNotificationChunk
+    moved = db.session.execute(
+        update(chunk)
+        .where(chunk.notification_id == row_id, chunk.chunk_index == index, chunk.state.in_(expect))
+        .values(state=state, updated_at=utcnow(), **values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    return bool(moved)
+
+
+def _finish_if_done(row_id: int) -> None:
+    """Mark the broadcast sent once every chunk is done (the last chunks may race; the lock settles it)."""
+    total, done, created, pushed = _totals(row_id)
+    if not total or done < total:
+        return
+    row = _lock_row(row_id)
+    if row is not None and row.status == "sending":
+        _finish(row, created, pushed)
+        row.updated_at = utcnow()
+    db.session.commit()
+
+
+def run_broadcast_chunk(row_id: int, index: int) -> dict[str, Any]:
+    """Deliver one chunk of a broadcast (idempotent; safe to re-run after a crash)."""
+    row = db.session.get(ScheduledNotification, row_id)
+    if row is None or row.status != "sending":
+        return {"skipped": "not_sending"}
+    chunk = db.session.execute(
+        select(ScheduledNotificationChunk).where(
+            ScheduledNotificationChunk.notification_id == row_id,
+            ScheduledNotificationChunk.chunk_index == index,
+        )
+    ).scalar_one_or_none()
+    if chunk is None:
+        return {"skipped": "no_chunk"}
+    if chunk.state == "done":
+        return {"skipped": "done"}
+    criteria, err = audience_criteria(audience=row.audience, target_user_id=row.target_user_public_id)
+    if err:
+        return {"skipped": err}
+    recipients = db.session.execute(
+        select(User.id, User.firebase_token)
+        .where(*criteria, User.id > chunk.after_id, User.id <= chunk.upto_id)
+        .order_by(User.id)
+    ).all()
+    data = {"source": (row.result or {}).get("source", "admin_scheduled"), "audience": row.audience}
+
+    if chunk.state == "pending":
+        # Short claim first; the insert below runs without holding any lock another chunk needs.
+        claimed = _transition(row_id, index, "storing", expect=("pending",))
+        db.session.commit()
+        if claimed:
+            bulk_insert_notifications(
+                [
+                    {
+                        "user_id": user_id,
+                        "title": row.title,
+                        "message": row.message,
+                        "notification_type": row.notification_type,
+                        "data": data,
+                    }
+                    for user_id, _ in recipients
+                ]
+            )
+            if not _transition(row_id, index, "stored", expect=("storing",), created_count=len(recipients)):
+                # The claim went stale and was handed to another task: drop this copy.
+                db.session.rollback()
+                return {"skipped": "store_claimed"}
+            db.session.commit()
+
+    pushed = 0
+    if row.send_push and (row.result or {}).get("push_configured"):
+        # Claim the push so a duplicate or resumed task for this chunk cannot send it again.
+        claimed = _transition(row_id, index, "pushing", expect=("stored",))
+        db.session.commit()
+        if not claimed:
+            return {"skipped": "push_claimed"}
+        tokens = [t.strip() for _, t in recipients if t and t.strip()]
+        pushed = multicast_and_prune(
+            tokens,
+            title=row.title,
+            body=row.message,
+            data={"type": row.notification_type, **data},
+        ).sent
+    done = _transition(row_id, index, "done", expect=("stored", "pushing"), pushed_count=pushed)
+    db.session.commit()
+    if not done:
+        return {"skipped": "claimed"}
+    _finish_if_done(row_id)
+    return {"chunk": index, "recipients": len(recipients), "pushed": pushed}
+
+
+def broadcast_progress(row: ScheduledNotification) -> dict[str, Any]:
+    """Progress summary for the admin UI (polled while ``status == "sending"``)."""
+    result = row.result or {}
+    chunks, done, created, pushed = _totals(row.id)
+    return {
+        "broadcast_id": row.id,
+        "status": row.status,
+        "audience": row.audience,
+        "total": int(result.get("total") or 0),
+        "created": created,
+        "pushed": pushed,
+        "push_configured": bool(result.get("push_configured")),
+        "chunks_total": chunks,
+        "chunks_done": done,
+        "percent": 100 if row.status == "sent" else (round(100 * done / chunks) if chunks else 0),
+        "error_message": row.error_message,
+    }
 
 
 def execute_broadcast(
@@ -77,64 +320,42 @@ def execute_broadcast(
     notification_type: str = "admin",
     send_push_flag: bool = True,
     source: str = "admin_broadcast",
+    created_by_user_id: int | None = None,
 ) -> dict[str, Any]:
     """
-    Create in-app notifications (+ optional FCM) for an audience.
+    Start an immediate broadcast: in-app notifications (+ optional FCM) for an audience.
+    Returns the progress summary (final when chunks ran inline).
     Raises ValueError for validation errors.
     """
-    title = (title or "").strip()
-    message = (message or "").strip()
-    notification_type = (notification_type or "admin").strip() or "admin"
+    title, message = _validate_message(title, message)
     audience = (audience or "all").strip().lower()
-
-    if not title or not message:
-        raise ValueError("Title and message are required")
-    if len(title) > 200:
-        raise ValueError("Title must be 200 characters or fewer")
-
-    recipients, err = resolve_recipients(
-        audience=audience, target_user_id=target_user_id
-    )
+    target_user_id = (target_user_id or "").strip() or None
+    _, err = audience_criteria(audience=audience, target_user_id=target_user_id)
     if err:
         raise ValueError(err)
 
-    created = 0
-    pushed = 0
-    push_ready = fcm_is_configured()
-    notif_data = {"source": source, "audience": audience}
-
-    for user in recipients:
-        db.session.add(
-            Notification(
-                user_id=user.id,
-                title=title,
-                message=message,
-                notification_type=notification_type,
-                is_read=False,
-                data=notif_data,
-            )
-        )
-        created += 1
-        if send_push_flag and push_ready:
-            token = (getattr(user, "firebase_token", None) or "").strip()
-            if token and send_push(
-                token,
-                title=title,
-                body=message,
-                data={"type": notification_type, **notif_data},
-            ):
-                pushed += 1
-        if created % 200 == 0:
-            db.session.commit()
-
-    db.session.commit()
-    return {
-        "created": created,
-        "pushed": pushed,
-        "push_configured": push_ready,
-        "audience": audience,
-        "message": f"Notification created for {created} user(s)",
-    }
+    now = utcnow()
+    row = ScheduledNotification(
+        title=title,
+        message=message,
+        audience=audience,
+        target_user_public_id=target_user_id,
+        notification_type=(notification_type or "admin").strip() or "admin",
+        send_push=bool(send_push_flag),
+        scheduled_at=now,
+        status="pending",
+        created_by_user_id=created_by_user_id,
+        created_at=now,
+        updated_at=now,
+    )
+    db.session.add(row)
+    db.session.flush()
+    progress = start_broadcast(row, source=source)
+    if progress["status"] == "sent":
+        progress["message"] = f"Notification created for {progress['created']} user(s)"
+    else:
+        progress["message"] = f"Broadcast to {progress['total']} user(s) started"
+    return progress
 
 
 def parse_scheduled_at(raw) -> datetime:
@@ -169,16 +390,11 @@ def create_scheduled_notification(
     send_push_flag: bool = True,
     created_by_user_id: int | None = None,
 ) -> ScheduledNotification:
-    title = (title or "").strip()
-    message = (message or "").strip()
-    if not title or not message:
-        raise ValueError("Title and message are required")
-    if len(title) > 200:
-        raise ValueError("Title must be 200 characters or fewer")
+    title, message = _validate_message(title, message)
 
     audience = (audience or "all").strip().lower()
     target_user_id = (target_user_id or "").strip() or None
-    _, err = resolve_recipients(audience=audience, target_user_id=target_user_id)
+    _, err = audience_criteria(audience=audience, target_user_id=target_user_id)
     if err:
         raise ValueError(err)
 
@@ -203,8 +419,67 @@ def create_scheduled_notification(
     return row
 
 
+# A stale claim goes back to the state its step started from.
+_RESUME_STATE = {"pending": "pending", "storing": "pending", "stored": "stored", "pushing": "stored"}
+
+
+def _resume_stalled(limit: int) -> list[dict[str, Any]]:
+    """Re-dispatch chunks whose own dispatch or claim went stale (crashed or lost task)."""
+    cutoff = utcnow() - timedelta(seconds=env_int("BROADCAST_STALL_S", 300))
+    sending = (
+        ScheduledNotification.query.filter(ScheduledNotification.status == "sending")
+        .order_by(ScheduledNotification.updated_at.asc())
+        .limit(limit)
+        .all()
+    )
+    chunk = ScheduledNotificationChunk
+    resumed = []
+    for row in sending:
+        if "total" not in (row.result or {}):
+            if row.updated_at and row.updated_at > cutoff:
+                continue
+            # Claimed but crashed before its chunks were planned.
+            start_broadcast(row, source="admin_scheduled")
+            resumed.append({"id": row.id, **broadcast_progress(row)})
+            continue
+        stalled = db.session.execute(
+            select(chunk.chunk_index, chunk.state).where(
+                chunk.notification_id == row.id,
+                chunk.state != "done",
+                chunk.updated_at <= cutoff,
+            )
+        ).all()
+        stale = []
+        for index, state in stalled:
+            # Conditional on the state and stamp just read, so a task that moved meanwhile keeps its chunk.
+            moved = db.session.execute(
+                update(chunk)
+                .where(
+                    chunk.notification_id == row.id,
+                    chunk.chunk_index == index,
+                    chunk.state == state,
+                    chunk.updated_at <= cutoff,
+                )
+                .values(state=_RESUME_STATE[state], updated_at=utcnow())
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if moved:
+                stale.append(index)
+        db.session.commit()
+        if stale:
+            logger.warning("resuming broadcast %s: %d stale chunk(s)", row.id, len(stale))
+            _dispatch_chunks(row.id, sorted(stale))
+        else:
+            # Every chunk may be done with the finishing step lost to a crash.
+            _finish_if_done(row.id)
+        db.session.refresh(row)
+        if stale or row.status != "sending":
+            resumed.append({"id": row.id, "resumed_chunks": len(stale), **broadcast_progress(row)})
+    return resumed
+
+
 def process_due_scheduled_notifications(*, limit: int = 20) -> dict[str, Any]:
-    """Send pending scheduled notifications that are due. Safe to call often."""
+    """Start pending scheduled notifications that are due and resume stalled ones. Safe to call often."""
     now = utcnow()
     due = (
         ScheduledNotification.query.filter(
@@ -216,36 +491,43 @@ def process_due_scheduled_notifications(*, limit: int = 20) -> dict[str, Any]:
         .all()
     )
     sent = 0
+    started = 0
     failed = 0
     results = []
     for row in due:
-        row.status = "sending"
-        row.updated_at = utcnow()
+        # Claim the row so overlapping beat runs / admin page loads start it once.
+        claimed = db.session.execute(
+            update(ScheduledNotification)
+            .where(ScheduledNotification.id == row.id, ScheduledNotification.status == "pending")
+            .values(status="sending", updated_at=utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
         db.session.commit()
+        if not claimed:
+            continue
+        db.session.refresh(row)
         try:
-            out = execute_broadcast(
-                title=row.title,
-                message=row.message,
-                audience=row.audience,
-                target_user_id=row.target_user_public_id,
-                notification_type=row.notification_type,
-                send_push_flag=bool(row.send_push),
-                source="admin_scheduled",
-            )
-            row.status = "sent"
-            row.sent_at = utcnow()
-            row.result = out
-            row.error_message = None
-            row.updated_at = utcnow()
-            db.session.commit()
-            sent += 1
-            results.append({"id": row.id, "status": "sent", **out})
+            out = start_broadcast(row, source="admin_scheduled")
+            if out["status"] == "sent":
+                sent += 1
+            else:
+                started += 1
+            results.append({"id": row.id, **out})
         except Exception as e:
             logger.error("scheduled notification %s failed: %s", row.id, e, exc_info=True)
+            db.session.rollback()
             row.status = "failed"
             row.error_message = str(e)[:500]
             row.updated_at = utcnow()
             db.session.commit()
             failed += 1
             results.append({"id": row.id, "status": "failed", "error": str(e)})
-    return {"processed": len(due), "sent": sent, "failed": failed, "results": results}
+    resumed = _resume_stalled(limit)
+    return {
+        "processed": len(due),
+        "sent": sent,
+        "started": started,
+        "failed": failed,
+        "resumed": len(resumed),
+        "results": results + resumed,
+    }
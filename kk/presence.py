@@ -0,0 +1,314 @@
+"""Who is online, and who has which chat open, for Socket.IO clients.
+
+Every authenticated socket is tracked with a TTL (``PRESENCE_TTL_S``,
+default 90): ``connect`` registers it, ``presence_heartbeat`` (clients send it
+every ~30 s) and ``join_chat`` / ``leave_chat`` refresh it, and ``disconnect``
+drops it. A socket whose worker dies simply stops being refreshed and expires.
+
+With Redis the state is shared by every gunicorn worker:
+
+- ``presence:u:<user>`` -- sorted set of the user's socket ids scored by
+  expiry; the user is online while any score is in the future.
+- ``presence:v:<user>:<car>:<peer>`` -- the same for sockets that have the
+  thread with ``<peer>`` on that listing open (:func:`is_viewing`, used to skip
+  chat pushes). A socket that did not report its peer is not counted.
+- ``presence:s:<sid>`` -- which user and chat a socket belongs to.
+- ``presence:seen:<shard>`` -- last-seen epoch per user, in
+  ``PRESENCE_SHARDS`` hashes (default 16) so a contact-list lookup is one
+  ``HMGET`` per shard in a single round-trip.
+
+Without Redis the same structures live in this process. Online/offline
+transitions are broadcast to ``presence:<user>`` rooms through the Socket.IO
+message queue by ``kk.socketio_handlers``. Only chat partners may look up or
+subscribe to a user (:func:`visible_users`), and a block removes both sides'
+sockets from each other's room (``kk.chat_realtime``).
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Iterable
+
+from sqlalchemy import or_, select
+
+from .models import BlockedUser, Conversation, User, db
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 200
+
+_UNSET = object()
+
+_local_lock = threading.Lock()
+# sid -> (user, car or None, peer or None, expires_at)
+_local_sockets: dict[str, tuple[str, str | None, str | None, float]] = {}
+_local_seen: dict[str, float] = {}
+
+
+def _ttl_s() -> int:
+    try:
+        return max(5, int(os.getenv("PRESENCE_TTL_S", "90") or 90))
+    except ValueError:
+        return 90
+
+
+def _shards() -> int:
+    try:
+        return max(1, int(os.getenv("PRESENCE_SHARDS", "16") or 16))
+    except ValueError:
+        return 16
+
+
+def _user_key(user: str) -> str:
+    return f"presence:u:{user}"
+
+
+def _view_key(user: str, car: str, peer: str) -> str:
+    return f"presence:v:{user}:{car}:{peer}"
+
+
+def _sid_key(sid: str) -> str:
+    return f"presence:s:{sid}"
+
+
+def _seen_key(user: str) -> str:
+    return f"presence:seen:{zlib.crc32(user.encode('utf-8')) % _shards()}"
+
+
+def room_for_presence(user_public_id: str) -> str:
+    return f"presence:{user_public_id}"
+
+
+def _iso(ts: float | None) -> str | None:
+    if not ts:
+        return None
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None).isoformat()
+
+
+# ---------------------------------------------------------------------------
+# Socket lifecycle
+# ---------------------------------------------------------------------------
+
+
+def touch(sid: str, user: str, car: Any = _UNSET, peer: str | None = None) -> bool:
+    """
+    Register or refresh socket ``sid`` for ``user``; ``car`` (a listing public_id
+    or None) and ``peer`` (the other participant's public_id, None when unknown)
+    change which chat the socket has open, omitting ``car`` keeps both.
+
+    Returns True when this made the user go from offline to online.
+    """
+    now = time.time()
+    expires = now + _ttl_s()
+    r = get_redis()
+    if r is not None:
+        try:
+            return _touch_redis(r, sid, user, car, peer, now, expires)
+        except Exception as exc:
+            logger.warning("presence redis update failed: %s", exc)
+    with _local_lock:
+        was_online = _local_online(user, now)
+        prev = _local_sockets.get(sid)
+        if car is _UNSET:
+            car, peer = (prev[1], prev[2]) if prev else (None, None)
+        _local_sockets[sid] = (user, car, peer if car else None, expires)
+        _local_seen[user] = now
+        _prune_local(now)
+    return not was_online
+
+
+def _touch_redis(
+    r, sid: str, user: str, car: Any, peer: str | None, now: float, expires: float
+) -> bool:
+    ttl = _ttl_s()
+    raw = r.get(_sid_key(sid))
+    prev = json.loads(raw) if raw else {}
+    prev_car, prev_peer = prev.get("car"), prev.get("peer")
+    if car is _UNSET:
+        car, peer = prev_car, prev_peer
+    if not car:
+        peer = None
+    pipe = r.pipeline()
+    pipe.zremrangebyscore(_user_key(user), 0, now)
+    pipe.zcard(_user_key(user))
+    pipe.zadd(_user_key(user), {sid: expires})
+    pipe.expire(_user_key(user), ttl * 2)
+    pipe.set(_sid_key(sid), json.dumps({"user": user, "car": car, "peer": peer}), ex=ttl)
+    if prev_car and prev_peer and (prev_car, prev_peer) != (car, peer):
+        pipe.zrem(_view_key(user, prev_car, prev_peer), sid)
+    if car and peer:
+        view = _view_key(user, car, peer)
+        pipe.zremrangebyscore(view, 0, now)
+        pipe.zadd(view, {sid: expires})
+        pipe.expire(view, ttl * 2)
+    pipe.hset(_seen_key(user), user, int(now))
+    online_before = pipe.execute()[1]
+    return not online_before
+
+
+def drop(sid: str) -> tuple[str | None, bool]:
+    """Forget socket ``sid`` (disconnect). Returns ``(user, now_offline)``; user is None when unknown."""
+    now = time.time()
+    r = get_redis()
+    if r is not None:
+        try:
+            raw = r.get(_sid_key(sid))
+            if not raw:
+                return None, False
+            row = json.loads(raw)
+            user, car, peer = row.get("user"), row.get("car"), row.get("peer")
+            pipe = r.pipeline()
+            pipe.zrem(_user_key(user), sid)
+            if car and peer:
+                pipe.zrem(_view_key(user, car, peer), sid)
+            pipe.delete(_sid_key(sid))
+            pipe.hset(_seen_key(user), user, int(now))
+            pipe.zcount(_user_key(user), now, "+inf")
+            return user, not pipe.execute()[-1]
+        except Exception as exc:
+            logger.warning("presence redis drop failed: %s", exc)
+    with _local_lock:
+        row = _local_sockets.pop(sid, None)
+        if row is None:
+            return None, False
+        user = row[0]
+        _local_seen[user] = now
+        return user, not _local_online(user, now)
+
+
+def socket_ids(user: str) -> list[str]:
+    """Live socket ids of ``user`` on every worker."""
+    now = time.time()
+    r = get_redis()
+    if r is not None:
+        try:
+            return [s.decode() if isinstance(s, bytes) else s for s in r.zrangebyscore(_user_key(user), now, "+inf")]
+        except Exception as exc:
+            logger.warning("presence redis lookup failed: %s", exc)
+    with _local_lock:
+        return [sid for sid, (u, _c, _p, exp) in _local_sockets.items() if u == user and exp > now]
+
+
+def current_chat(sid: str) -> str | None:
+    """Listing public_id whose chat socket ``sid`` last reported open."""
+    r = get_redis()
+    if r is not None:
+        try:
+            raw = r.get(_sid_key(sid))
+            return json.loads(raw).get("car") if raw else None
+        except Exception as exc:
+            logger.warning("presence redis lookup failed: %s", exc)
+    with _local_lock:
+        row = _local_sockets.get(sid)
+    return row[1] if row else None
+
+
+def _local_online(user: str, now: float) -> bool:
+    return any(u == user and exp > now for u, _c, _p, exp in _local_sockets.values())
+
+
+def _prune_local(now: float) -> None:
+    if len(_local_sockets) < 1024:
+        return
+    for sid in [s for s, (_u, _c, _p, exp) in _local_sockets.items() if exp <= now]:
+        _local_sockets.pop(sid, None)
+
+
+# ---------------------------------------------------------------------------
+# Lookups
+# ---------------------------------------------------------------------------
+
+
+def is_viewing(user: str, car: str, peer: str) -> bool:
+    """True when ``user`` has a live socket with the listing's thread with ``peer`` open."""
+    if not user or not car or not peer:
+        return False
+    now = time.time()
+    r = get_redis()
+    if r is not None:
+        try:
+            return bool(r.zcount(_view_key(user, car, peer), now, "+inf"))
+        except Exception as exc:
+            logger.warning("presence redis lookup failed: %s", exc)
+    with _local_lock:
+        return any(
+            u == user and c == car and p == peer and exp > now
+            for u, c, p, exp in _local_sockets.values()
+        )
+
+
+def lookup(users: Iterable[str]) -> dict[str, dict]:
+    """``{public_id: {"online": bool, "last_seen": iso | None}}`` in one round-trip."""
+    users = list(dict.fromkeys(u for u in users if u))[:MAX_BATCH]
+    if not users:
+        return {}
+    now = time.time()
+    r = get_redis()
+    if r is not None:
+        try:
+            return _lookup_redis(r, users, now)
+        except Exception as exc:
+            logger.warning("presence redis lookup failed: %s", exc)
+    with _local_lock:
+        online = {u for u, _c, _p, exp in _local_sockets.values() if exp > now}
+        return {u: {"online": u in online, "last_seen": _iso(_local_seen.get(u))} for u in users}
+
+
+def _lookup_redis(r, users: list[str], now: float) -> dict[str, dict]:
+    by_shard: dict[str, list[str]] = {}
+    for user in users:
+        by_shard.setdefault(_seen_key(user), []).append(user)
+    pipe = r.pipeline()
+    for user in users:
+        pipe.zcount(_user_key(user), now, "+inf")
+    for key, members in by_shard.items():
+        pipe.hmget(key, members)
+    results = pipe.execute()
+    online = dict(zip(users, results[: len(users)]))
+    seen: dict[str, Any] = {}
+    for members, values in zip(by_shard.values(), results[len(users) :]):
+        seen.update(zip(members, values))
+    return {
+        u: {"online": bool(online[u]), "last_seen": _iso(float(seen[u])) if seen.get(u) else None}
+        for u in users
+    }
+
+
+def visible_users(viewer: Any, public_ids: Iterable[str]) -> list[str]:
+    """
+    Active users among ``public_ids`` that share a conversation with ``viewer``
+    and where neither side has blocked the other (one indexed query).
+    """
+    ids = list(dict.fromkeys(str(p).strip() for p in public_ids if p))[:MAX_BATCH]
+    if not ids:
+        return []
+    partners = or_(
+        User.id.in_(select(Conversation.seller_id).where(Conversation.buyer_id == viewer.id)),
+        User.id.in_(select(Conversation.buyer_id).where(Conversation.seller_id == viewer.id)),
+    )
+    blocked_me = select(BlockedUser.blocker_id).where(BlockedUser.blocked_id == viewer.id)
+    blocked_by_me = select(BlockedUser.blocked_id).where(BlockedUser.blocker_id == viewer.id)
+    rows = db.session.execute(
+        select(User.public_id).where(
+            User.public_id.in_(ids),
+            User.is_active.is_(True),
+            partners,
+            User.id.not_in(blocked_me),
+            User.id.not_in(blocked_by_me),
+        )
+    ).scalars()
+    return list(rows)
+
+
+def debug_reset_presence() -> None:
+    """Test helper: forget in-process sockets and last-seen times."""
+    with _local_lock:
+        _local_sockets.clear()
+        _local_seen.clear()
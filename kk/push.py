@@ -16,6 +16,7 @@ import logging
 import os
 import tempfile
 from pathlib import Path
+from typing import NamedTuple, Sequence
 
 logger = logging.getLogger(__name__)
 
@@ -214,6 +215,58 @@ def _ensure_firebase():
         return None
 
 
+# FCM ``send_each`` / multicast accept at most 500 messages per call.
+FCM_BATCH_SIZE = 500
+
+# Per-message errors meaning the token will never work again.
+_INVALID_TOKEN_ERRORS = frozenset({"UnregisteredError", "SenderIdMismatchError"})
+
+
+class PushBatchResult(NamedTuple):
+    sent: int
+    failed: int
+    invalid_tokens: list[str]
+
+
+def _android_config(messaging):
+    return messaging.AndroidConfig(priority="high")
+
+
+def _apns_config(messaging, title: str, body: str):
+    return messaging.APNSConfig(
+        headers={
+            "apns-priority": "10",
+            "apns-push-type": "alert",
+        },
+        payload=messaging.APNSPayload(
+            aps=messaging.Aps(
+                alert=messaging.ApsAlert(title=title, body=body),
+                sound="default",
+            ),
+        ),
+    )
+
+
+def _build_message(messaging, token: str, title: str, body: str, data: dict | None):
+    return messaging.Message(
+        notification=messaging.Notification(title=title, body=body),
+        data={k: str(v) for k, v in (data or {}).items()},
+        token=token,
+        android=_android_config(messaging),
+        apns=_apns_config(messaging, title, body),
+    )
+
+
+def _is_invalid_token_error(exc: BaseException | None) -> bool:
+    if exc is None:
+        return False
+    name = type(exc).__name__
+    if name in _INVALID_TOKEN_ERRORS:
+        return True
+    # Malformed tokens come back as INVALID_ARGUMENT naming the registration token.
+    return name == "InvalidArgumentError" and "registration token" in str(exc).lower()
+
+
 def send_push(token: str, *, title: str, body: str, data: dict | None = None) -> bool:
     """Send an FCM push notification to a single device token.
 
@@ -228,26 +281,7 @@ def send_push(token: str, *, title: str, body: str, data: dict | None = None) ->
     try:
         from firebase_admin import messaging  # type: ignore
 
-        data_payload = {k: str(v) for k, v in (data or {}).items()}
-        message = messaging.Message(
-            notification=messaging.Notification(title=title, body=body),
-            data=data_payload,
-            token=token,
-            android=messaging.AndroidConfig(priority="high"),
-            apns=messaging.APNSConfig(
-                headers={
-                    "apns-priority": "10",
-                    "apns-push-type": "alert",
-                },
-                payload=messaging.APNSPayload(
-                    aps=messaging.Aps(
-                        alert=messaging.ApsAlert(title=title, body=body),
-                        sound="default",
-                    ),
-                ),
-            ),
-        )
-        messaging.send(message, app=app)
+        messaging.send(_build_message(messaging, token, title, body, data), app=app)
         return True
     except Exception as exc:
         _last_send_error = exc
@@ -270,6 +304,71 @@ def send_push(token: str, *, title: str, body: str, data: dict | None = None) ->
         return False
 
 
+def _collect_batch(tokens: Sequence[str], batch, totals: list, invalid: list[str]) -> None:
+    for token, resp in zip(tokens, batch.responses):
+        if resp.success:
+            totals[0] += 1
+            continue
+        totals[1] += 1
+        if _is_invalid_token_error(resp.exception):
+            invalid.append(token)
+
+
+def send_push_each(items: Sequence[tuple[str, str, str, dict | None]]) -> PushBatchResult:
+    """Send per-recipient pushes ``(token, title, body, data)`` with ``send_each``, 500 per call.
+
+    Tokens FCM reports as unregistered / invalid are returned for pruning.
+    """
+    app = _ensure_firebase()
+    if app is None or not items:
+        return PushBatchResult(0, len(items), [])
+    from firebase_admin import messaging  # type: ignore
+
+    totals = [0, 0]
+    invalid: list[str] = []
+    for start in range(0, len(items), FCM_BATCH_SIZE):
+        chunk = items[start : start + FCM_BATCH_SIZE]
+        try:
+            batch = messaging.send_each([_build_message(messaging, *item) for item in chunk], app=app)
+        except Exception as exc:
+            logger.warning("FCM send_each failed (%d messages): %s: %s", len(chunk), type(exc).__name__, exc)
+            totals[1] += len(chunk)
+            continue
+        _collect_batch([item[0] for item in chunk], batch, totals, invalid)
+    return PushBatchResult(totals[0], totals[1], invalid)
+
+
+def send_push_multicast(
+    tokens: Sequence[str], *, title: str, body: str, data: dict | None = None
+) -> PushBatchResult:
+    """Send one notification to many tokens (FCM multicast, 500 tokens per call)."""
+    app = _ensure_firebase()
+    if app is None or not tokens:
+        return PushBatchResult(0, len(tokens), [])
+    from firebase_admin import messaging  # type: ignore
+
+    data_payload = {k: str(v) for k, v in (data or {}).items()}
+    totals = [0, 0]
+    invalid: list[str] = []
+    for start in range(0, len(tokens), FCM_BATCH_SIZE):
+        chunk = list(tokens[start : start + FCM_BATCH_SIZE])
+        message = messaging.MulticastMessage(
+            tokens=chunk,
+            notification=messaging.Notification(title=title, body=body),
+            data=data_payload,
+            android=_android_config(messaging),
+            apns=_apns_config(messaging, title, body),
+        )
+        try:
+            batch = messaging.send_each_for_multicast(message, app=app)
+        except Exception as exc:
+            logger.warning("FCM multicast failed (%d tokens): %s: %s", len(chunk), type(exc).__name__, exc)
+            totals[1] += len(chunk)
+            continue
+        _collect_batch(chunk, batch, totals, invalid)
+    return PushBatchResult(totals[0], totals[1], invalid)
+
+
 def last_fcm_send_error() -> BaseException | None:
     return _last_send_error
 
@@ -0,0 +1,104 @@
+"""Bulk fan-out for alert notifications (in-app rows + FCM pushes).
+
+Alert tasks used to load each recipient with ``db.session.get``, send one FCM
+request per user and commit one ``Notification`` per user. These helpers do
+the same work in bulk: one multi-row INSERT for notifications, dedupe rows
+claimed with ``INSERT ... ON CONFLICT DO NOTHING``, pushes sent 500 at a time
+through ``send_each`` / multicast, and tokens FCM reports as dead cleared from
+``User.firebase_token`` in one UPDATE.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Any, Iterable, Sequence
+
+from sqlalchemy import insert, update
+
+from .models import Notification, User, db
+from .push import FCM_BATCH_SIZE, PushBatchResult, send_push_each, send_push_multicast
+
+logger = logging.getLogger(__name__)
+
+
+def chunked(values: Sequence, size: int = FCM_BATCH_SIZE) -> Iterable[Sequence]:
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def insert_ignore_returning(model, rows: list[dict[str, Any]], conflict_cols: Sequence[str], returning):
+    """Bulk INSERT skipping rows that hit ``conflict_cols``; returns the inserted ``returning`` values."""
+    if not rows:
+        return []
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:  # pragma: no cover - production is Postgres, tests SQLite
+        dialect_insert = None
+    if dialect_insert is not None:
+        stmt = (
+            dialect_insert(model)
+            .on_conflict_do_nothing(index_elements=list(conflict_cols))
+            .returning(returning)
+        )
+        return list(db.session.scalars(stmt, rows))
+    inserted = []
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                inserted.append(db.session.scalar(insert(model).returning(returning), row))
+        except Exception:
+            continue
+    return inserted
+
+
+def bulk_insert_notifications(rows: list[dict[str, Any]]) -> None:
+    """One multi-row INSERT of ``Notification`` rows (caller commits)."""
+    if rows:
+        db.session.execute(
+            insert(Notification),
+            [{"is_read": False, **row} for row in rows],
+        )
+
+
+def prune_invalid_tokens(tokens: Iterable[str]) -> int:
+    """Clear device tokens FCM reported as unregistered / invalid. Returns rows updated."""
+    dead = sorted({t for t in tokens if t})
+    if not dead:
+        return 0
+    pruned = 0
+    try:
+        for chunk in chunked(dead):
+            result = db.session.execute(
+                update(User)
+                .where(User.firebase_token.in_(list(chunk)))
+                .values(firebase_token=None)
+                .execution_options(synchronize_session=False)
+            )
+            pruned += result.rowcount or 0
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logger.exception("pruning %d invalid FCM tokens failed", len(dead))
+        return 0
+    if pruned:
+        logger.info("pruned %d invalid FCM tokens", pruned)
+    return pruned
+
+
+def send_each_and_prune(items: Sequence[tuple[str, str, str, dict | None]]) -> PushBatchResult:
+    """Per-recipient pushes in batches of 500; dead tokens are pruned."""
+    result = send_push_each(items)
+    prune_invalid_tokens(result.invalid_tokens)
+    return result
+
+
+def multicast_and_prune(
+    tokens: Sequence[str], *, title: str, body: str, data: dict | None = None
+) -> PushBatchResult:
+    """One message to many tokens in batches of 500; dead tokens are pruned."""
+    result = send_push_multicast(tokens, title=title, body=body, data=data)
+    prune_invalid_tokens(result.invalid_tokens)
+    return result
@@ -1,22 +1,42 @@
 """
-Eventlet-safe Cloudflare R2 helpers.
+Cloudflare R2 (S3-compatible) helpers.
+
+Uploads go through one long-lived, thread-safe boto3 client per process
+(connection pool sized by ``R2_MAX_POOL_CONNECTIONS``), so a photo costs one
+PUT on a warm TLS connection instead of an interpreter start + boto3 import +
+handshake. Bodies are sent straight from memory; no temp files.
 
 boto3 client creation recurses forever under eventlet's SSL monkey-patch
-(RecursionError in ssl.SSLContext.options). Run S3 ops in a clean subprocess
-(same pattern as OTPIQ / Roboflow).
+(RecursionError in ssl.SSLContext.options). When eventlet is active (or
+``R2_CLIENT_MODE=subprocess``) uploads go to a small pool of persistent
+``tools/r2_s3_op.py --serve`` helper processes instead, body bytes streamed
+over the pipe.
+
+Large objects (listing videos) are streamed with :func:`r2_upload_stream`: an
+S3 multipart upload fed part by part, so at most one part is held in memory.
+
+Presigned PUT URLs are SigV4 query signatures computed locally with
+``hmac`` -- no client, network round-trip or process spawn in either mode.
 """
 from __future__ import annotations
 
+import hashlib
+import hmac
 import json
 import logging
 import os
+import queue
 import subprocess
 import sys
-import tempfile
-from typing import Any
+import threading
+from datetime import datetime, timezone
+from typing import Any, Iterable
+from urllib.parse import quote
 
 from flask import current_app
 
+from .config import env_int
+
 logger = logging.getLogger(__name__)
 
 _r2_script_path: str | None = None
@@ -58,36 +78,199 @@ def _cred_payload() -> dict[str, str]:
     }
 
 
-def _run_r2_op(payload: dict[str, Any], *, timeout: float) -> dict[str, Any]:
-    script_path = _get_r2_script_path()
-    if not script_path:
-        raise RuntimeError("r2_s3_op.py missing")
+def _endpoint_host(account_id: str) -> str:
+    return f"{account_id}.r2.cloudflarestorage.com"
 
-    proc = subprocess.run(
-        [sys.executable, script_path],
-        input=json.dumps(payload),
-        capture_output=True,
-        text=True,
-        timeout=timeout,
-        env=os.environ.copy(),
-    )
-    out = (proc.stdout or "").strip()
-    if not out:
-        err = (proc.stderr or "").strip() or f"exit {proc.returncode}"
-        raise RuntimeError(err)
+
+def _use_subprocess() -> bool:
+    """True when uploads must not create an SSL context in this process."""
+    mode = (os.environ.get("R2_CLIENT_MODE") or "auto").strip().lower()
+    if mode == "subprocess":
+        return True
+    if mode == "inprocess":
+        return False
+    patcher = sys.modules.get("eventlet.patcher")
+    if patcher is None:
+        return False
     try:
-        result = json.loads(out)
-    except json.JSONDecodeError as e:
-        raise RuntimeError(f"invalid r2 subprocess response: {e}") from e
+        return bool(patcher.is_monkey_patched("socket"))
+    except Exception:
+        return True
+
+
+# ---------------------------------------------------------------------------
+# In-process pooled client
+# ---------------------------------------------------------------------------
+
+_clients: dict[tuple, Any] = {}
+_clients_lock = threading.Lock()
+
+
+def _s3_client(creds: dict[str, str]):
+    """Shared boto3 S3 client for these credentials (one per process; boto3 clients are thread-safe)."""
+    cache_key = (os.getpid(), creds["account_id"], creds["access_key"], creds["secret_key"], creds["region"])
+    client = _clients.get(cache_key)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(cache_key)
+        if client is None:
+            import boto3
+            from botocore.config import Config
+
+            # A forked child or rotated credentials: drop the old pool.
+            _clients.clear()
+            client = boto3.session.Session().client(
+                "s3",
+                region_name=creds["region"],
+                endpoint_url=f"https://{_endpoint_host(creds['account_id'])}",
+                aws_access_key_id=creds["access_key"],
+                aws_secret_access_key=creds["secret_key"],
+                config=Config(
+                    signature_version="s3v4",
+                    max_pool_connections=env_int("R2_MAX_POOL_CONNECTIONS", 32),
+                    connect_timeout=env_int("R2_CONNECT_TIMEOUT_S", 5),
+                    read_timeout=env_int("R2_READ_TIMEOUT_S", 60),
+                    retries={"max_attempts": 3, "mode": "standard"},
+                    tcp_keepalive=True,
+                ),
+            )
+            _clients[cache_key] = client
+    return client
+
+
+def reset_r2_clients() -> None:
+    """Drop pooled clients and helper processes (tests / credential rotation)."""
+    with _clients_lock:
+        _clients.clear()
+    _helpers.shutdown()
+
+
+# ---------------------------------------------------------------------------
+# Helper-process pool (eventlet fallback)
+# ---------------------------------------------------------------------------
+
+
+class _Helper:
+    """One ``r2_s3_op.py --serve`` process: a JSON header line, then raw body bytes."""
+
+    def __init__(self, script_path: str) -> None:
+        self.pid = os.getpid()
+        self.proc = subprocess.Popen(
+            [sys.executable, script_path, "--serve"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env=os.environ.copy(),
+        )
+
+    def alive(self) -> bool:
+        return self.pid == os.getpid() and self.proc.poll() is None
+
+    def request(self, payload: dict[str, Any], body: bytes, *, timeout: float) -> dict[str, Any]:
+        watchdog = threading.Timer(timeout, self.proc.kill)
+        watchdog.start()
+        try:
+            self.proc.stdin.write(json.dumps({**payload, "body_len": len(body)}).encode() + b"\n")
+            if body:
+                self.proc.stdin.write(body)
+            self.proc.stdin.flush()
+            line = self.proc.stdout.readline()
+        finally:
+            watchdog.cancel()
+        if not line:
+            raise RuntimeError("r2 helper exited")
+        return json.loads(line)
+
+    def close(self) -> None:
+        try:
+            self.proc.kill()
+            self.proc.wait(timeout=5)
+        except Exception:
+            pass
+
+
+class _HelperPool:
+    def __init__(self) -> None:
+        self._idle: queue.LifoQueue[_Helper] = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._spawned = 0
+        self._pid = os.getpid()
+
+    def _reset_after_fork(self) -> None:
+        if self._pid != os.getpid():
+            self._idle = queue.LifoQueue()
+            self._spawned = 0
+            self._pid = os.getpid()
+
+    def acquire(self, *, timeout: float) -> _Helper:
+        with self._lock:
+            self._reset_after_fork()
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            if self._spawned < max(1, env_int("R2_HELPER_PROCS", 2)):
+                script_path = _get_r2_script_path()
+                if not script_path:
+                    raise RuntimeError("r2_s3_op.py missing")
+                self._spawned += 1
+                try:
+                    return _Helper(script_path)
+                except Exception:
+                    self._spawned -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty as e:
+            raise RuntimeError("no r2 helper available") from e
+
+    def release(self, helper: _Helper, *, healthy: bool) -> None:
+        if healthy and helper.alive():
+            self._idle.put(helper)
+            return
+        helper.close()
+        with self._lock:
+            if helper.pid == self._pid:
+                self._spawned -= 1
+
+    def shutdown(self) -> None:
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._spawned = 0
+
+
+_helpers = _HelperPool()
+
+
+def _run_helper_op(payload: dict[str, Any], body: bytes = b"", *, timeout: float) -> dict[str, Any]:
+    helper = _helpers.acquire(timeout=timeout)
+    healthy = False
+    try:
+        result = helper.request(payload, body, timeout=timeout)
+        healthy = True
+    except Exception as e:
+        raise RuntimeError(f"r2 helper failed: {e}") from e
+    finally:
+        _helpers.release(helper, healthy=healthy)
     if not isinstance(result, dict):
-        raise RuntimeError("invalid r2 subprocess response")
+        raise RuntimeError("invalid r2 helper response")
     if result.get("error"):
         raise RuntimeError(str(result["error"]))
     if not result.get("ok"):
-        raise RuntimeError("r2 subprocess failed")
+        raise RuntimeError("r2 helper failed")
     return result
 
 
+# ---------------------------------------------------------------------------
+# Public API
+# ---------------------------------------------------------------------------
+
+
 def r2_put_bytes(
     *,
     key: str,
@@ -95,27 +278,166 @@ def r2_put_bytes(
     content_type: str = "application/octet-stream",
     timeout: float = 120,
 ) -> None:
-    """Upload bytes to R2 under ``key`` (eventlet-safe)."""
+    """Upload bytes to R2 under ``key`` (pooled client, or helper process under eventlet)."""
     if not body:
         raise RuntimeError("Empty file body")
     creds = _cred_payload()
-    fd, path = tempfile.mkstemp(prefix="r2_put_", suffix=".bin")
+    if _use_subprocess():
+        payload = {**creds, "op": "put_object", "key": key, "content_type": content_type}
+        _run_helper_op(payload, body, timeout=timeout)
+        return
+    _s3_client(creds).put_object(
+        Bucket=creds["bucket"],
+        Key=key,
+        Body=body,
+        ContentType=content_type,
+    )
+
+
+def _multipart_op(client, bucket: str, key: str, op: str, body: bytes, fields: dict[str, Any]) -> dict[str, Any]:
+    """One multipart step against a boto3 client (mirrors ``tools/r2_s3_op.py --serve``)."""
+    if op == "create_multipart":
+        resp = client.create_multipart_upload(Bucket=bucket, Key=key, ContentType=fields["content_type"])
+        return {"ok": True, "upload_id": resp["UploadId"]}
+    if op == "upload_part":
+        resp = client.upload_part(
+            Bucket=bucket, Key=key, UploadId=fields["upload_id"], PartNumber=int(fields["part_number"]), Body=body
+        )
+        return {"ok": True, "etag": resp["ETag"]}
+    if op == "complete_multipart":
+        client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=fields["upload_id"], MultipartUpload={"Parts": fields["parts"]}
+        )
+        return {"ok": True}
+    if op == "abort_multipart":
+        client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=fields["upload_id"])
+        return {"ok": True}
+    raise ValueError(f"unknown op: {op}")
+
+
+def _run_multipart_op(op: str, *, key: str, body: bytes = b"", timeout: float, **fields: Any) -> dict[str, Any]:
+    creds = _cred_payload()
+    if _use_subprocess():
+        return _run_helper_op({**creds, "op": op, "key": key, **fields}, body, timeout=timeout)
+    return _multipart_op(_s3_client(creds), creds["bucket"], key, op, body, fields)
+
+
+def r2_upload_stream(
+    *,
+    key: str,
+    chunks: Iterable[bytes],
+    content_type: str = "application/octet-stream",
+    part_size: int | None = None,
+    timeout: float = 180,
+) -> int:
+    """
+    Upload ``chunks`` to R2 under ``key`` as they arrive; returns the total byte count.
+
+    Parts of ``R2_MULTIPART_PART_MB`` (default 8, minimum 5 per S3) are sent as soon as
+    they fill; a body smaller than one part is a single PUT. A failed upload is aborted so
+    no orphaned parts are billed. Exceptions raised by ``chunks`` (e.g. a size cap)
+    propagate after the abort.
+    """
+    part_size = max(part_size or env_int("R2_MULTIPART_PART_MB", 8) * 1024 * 1024, 5 * 1024 * 1024)
+    buf = bytearray()
+    upload_id: str | None = None
+    parts: list[dict[str, Any]] = []
+    total = 0
+
+    def send_part(data: bytes) -> None:
+        nonlocal upload_id
+        if upload_id is None:
+            upload_id = _run_multipart_op(
+                "create_multipart", key=key, content_type=content_type, timeout=timeout
+            )["upload_id"]
+        number = len(parts) + 1
+        etag = _run_multipart_op(
+            "upload_part", key=key, body=data, upload_id=upload_id, part_number=number, timeout=timeout
+        )["etag"]
+        parts.append({"ETag": etag, "PartNumber": number})
+
     try:
-        with os.fdopen(fd, "wb") as fp:
-            fp.write(body)
-        payload = {
-            **creds,
-            "op": "put_object",
-            "key": key,
-            "content_type": content_type,
-            "body_path": path,
-        }
-        _run_r2_op(payload, timeout=timeout)
-    finally:
-        try:
-            os.remove(path)
-        except OSError:
-            pass
+        for chunk in chunks:
+            if not chunk:
+                continue
+            buf.extend(chunk)
+            total += len(chunk)
+            while len(buf) >= part_size:
+                send_part(bytes(buf[:part_size]))
+                del buf[:part_size]
+        if upload_id is None:
+            r2_put_bytes(key=key, body=bytes(buf), content_type=content_type, timeout=timeout)
+            return total
+        if buf:
+            send_part(bytes(buf))
+        _run_multipart_op("complete_multipart", key=key, upload_id=upload_id, parts=parts, timeout=timeout)
+        return total
+    except BaseException:
+        if upload_id is not None:
+            try:
+                _run_multipart_op("abort_multipart", key=key, upload_id=upload_id, timeout=timeout)
+            except Exception:
+                logger.warning("r2 multipart abort failed for %s", key, exc_info=True)
+        raise
+
+
+def _hmac_sha256(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
+
+
+def presign_put_url(
+    *,
+    account_id: str,
+    bucket: str,
+    access_key: str,
+    secret_key: str,
+    key: str,
+    content_type: str,
+    region: str = "auto",
+    expires_in: int = 900,
+    content_length: int | None = None,
+    now: datetime | None = None,
+) -> str:
+    """SigV4 presigned PUT URL (path-style, same as boto3 ``generate_presigned_url``)."""
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    datestamp = now.strftime("%Y%m%d")
+    host = _endpoint_host(account_id)
+    scope = f"{datestamp}/{region}/s3/aws4_request"
+
+    headers = {"content-type": content_type.strip(), "host": host}
+    if content_length is not None:
+        headers["content-length"] = str(int(content_length))
+    signed_headers = ";".join(sorted(headers))
+    canonical_headers = "".join(f"{name}:{headers[name]}\n" for name in sorted(headers))
+
+    query = {
+        "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+        "X-Amz-Credential": f"{access_key}/{scope}",
+        "X-Amz-Date": amz_date,
+        "X-Amz-Expires": str(int(expires_in)),
+        "X-Amz-SignedHeaders": signed_headers,
+    }
+    canonical_query = "&".join(
+        f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in sorted(query.items())
+    )
+    path = "/" + quote(f"{bucket}/{key}", safe="/~")
+    canonical_request = "\n".join(
+        ["PUT", path, canonical_query, canonical_headers, signed_headers, "UNSIGNED-PAYLOAD"]
+    )
+    string_to_sign = "\n".join(
+        [
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+        ]
+    )
+    signing_key = _hmac_sha256(f"AWS4{secret_key}".encode("utf-8"), datestamp)
+    for part in (region, "s3", "aws4_request"):
+        signing_key = _hmac_sha256(signing_key, part)
+    signature = hmac.new(signing_key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"https://{host}{path}?{canonical_query}&X-Amz-Signature={signature}"
 
 
 def r2_presign_put(
@@ -126,19 +448,18 @@ def r2_presign_put(
     content_length: int | None = None,
     timeout: float = 30,
 ) -> str:
-    """Return a presigned PUT URL for R2 (eventlet-safe)."""
+    """Return a presigned PUT URL for R2 (computed locally; ``timeout`` kept for callers)."""
     creds = _cred_payload()
-    payload: dict[str, Any] = {
-        **creds,
-        "op": "presign_put",
-        "key": key,
-        "content_type": content_type,
-        "expires_in": expires_in,
-    }
-    if content_length is not None:
-        payload["content_length"] = content_length
-    result = _run_r2_op(payload, timeout=timeout)
-    url = (result.get("upload_url") or "").strip()
-    if not url:
-        raise RuntimeError("presign returned empty upload_url")
-    return url
+    if not (creds["account_id"] and creds["bucket"] and creds["access_key"] and creds["secret_key"]):
+        raise RuntimeError("R2 is not configured")
+    return presign_put_url(
+        account_id=creds["account_id"],
+        bucket=creds["bucket"],
+        access_key=creds["access_key"],
+        secret_key=creds["secret_key"],
+        region=creds["region"],
+        key=key,
+        content_type=content_type,
+        expires_in=expires_in,
+        content_length=content_length,
+    )
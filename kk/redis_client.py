@@ -0,0 +1,155 @@
+"""Process-wide pooled Redis client.
+
+Rate limits, the response cache, idempotency keys, job ownership, listing
+metrics and OTP throttles used to call ``redis.Redis.from_url`` per use, so a
+single request could open several TCP connections. :func:`get_redis` hands out
+one client per process backed by a shared ``ConnectionPool`` with socket
+timeouts and periodic health checks.
+
+A small circuit breaker stops paying a connect timeout on every call while
+Redis is down: after ``REDIS_BREAKER_FAILURES`` consecutive connection errors
+:func:`get_redis` returns ``None`` for ``REDIS_BREAKER_COOLDOWN_S`` seconds, so
+callers take their existing no-Redis path. The next call after the cooldown
+is a trial; one success closes the breaker.
+
+The pool is rebuilt when the pid changes (gunicorn / Celery prefork children
+must never share the parent's sockets).
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+
+from .config import env_float
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_pid: int | None = None
+_url: str | None = None
+_client = None
+_pubsub_client = None
+
+# Circuit breaker state (per process).
+_failures = 0
+_open_until = 0.0
+
+
+def _redis_url() -> str:
+    return (os.environ.get("REDIS_URL") or "").strip()
+
+
+def _record_failure() -> None:
+    global _failures, _open_until
+    threshold = int(env_float("REDIS_BREAKER_FAILURES", 3))
+    with _lock:
+        _failures += 1
+        if _failures >= threshold and _open_until <= time.monotonic():
+            _open_until = time.monotonic() + env_float("REDIS_BREAKER_COOLDOWN_S", 10.0)
+            logger.warning(
+                "Redis circuit breaker open for %.0fs after %d connection failures",
+                _open_until - time.monotonic(),
+                _failures,
+            )
+
+
+def _record_success() -> None:
+    global _failures, _open_until
+    if _failures:
+        with _lock:
+            if _failures >= int(env_float("REDIS_BREAKER_FAILURES", 3)):
+                logger.info("Redis circuit breaker closed")
+            _failures = 0
+            _open_until = 0.0
+
+
+def breaker_open() -> bool:
+    return time.monotonic() < _open_until
+
+
+def _build_clients(url: str):
+    import redis  # type: ignore
+
+    class _BreakerRedis(redis.Redis):
+        """Feeds connection-level errors into the process circuit breaker."""
+
+        def execute_command(self, *args, **options):
+            try:
+                result = super().execute_command(*args, **options)
+            except (redis.ConnectionError, redis.TimeoutError):
+                _record_failure()
+                raise
+            _record_success()
+            return result
+
+    pool = redis.ConnectionPool.from_url(
+        url,
+        decode_responses=True,
+        max_connections=int(env_float("REDIS_MAX_CONNECTIONS", 50)),
+        socket_connect_timeout=env_float("REDIS_CONNECT_TIMEOUT_S", 1.0),
+        socket_timeout=env_float("REDIS_SOCKET_TIMEOUT_S", 2.0),
+        socket_keepalive=True,
+        health_check_interval=30,
+    )
+    # Subscribers block on read indefinitely; give them their own pool without
+    # a read timeout so an idle channel is not treated as a failure.
+    pubsub_pool = redis.ConnectionPool.from_url(
+        url,
+        decode_responses=True,
+        socket_connect_timeout=env_float("REDIS_CONNECT_TIMEOUT_S", 1.0),
+        socket_keepalive=True,
+        health_check_interval=30,
+    )
+    return _BreakerRedis(connection_pool=pool), redis.Redis(connection_pool=pubsub_pool)
+
+
+def _ensure_clients() -> bool:
+    global _pid, _url, _client, _pubsub_client, _failures, _open_until
+    url = _redis_url()
+    pid = os.getpid()
+    if _client is not None and _pid == pid and _url == url:
+        return True
+    with _lock:
+        if _client is not None and _pid == pid and _url == url:
+            return True
+        try:
+            client, pubsub_client = _build_clients(url)
+        except Exception:
+            logger.exception("Redis client init failed")
+            return False
+        if _pid != pid:
+            # Fresh process: the parent's breaker state says nothing about us.
+            _failures = 0
+            _open_until = 0.0
+        _client, _pubsub_client, _pid, _url = client, pubsub_client, pid, url
+        return True
+
+
+def get_redis():
+    """Shared Redis client for this process, or ``None`` (unset / unavailable / breaker open)."""
+    if not _redis_url():
+        return None
+    if not _ensure_clients():
+        return None
+    if breaker_open():
+        return None
+    return _client
+
+
+def get_redis_pubsub():
+    """Client for long-lived ``pubsub().listen()`` loops (no read timeout, no breaker)."""
+    if not _redis_url() or not _ensure_clients():
+        return None
+    return _pubsub_client
+
+
+def reset_redis_client() -> None:
+    """Drop the cached pool and breaker state (tests, REDIS_URL rotation)."""
+    global _pid, _url, _client, _pubsub_client, _failures, _open_until
+    with _lock:
+        _pid = _url = _client = _pubsub_client = None
+        _failures = 0
+        _open_until = 0.0
@@ -1,103 +1,301 @@
-"""JSON API response caching (Redis when available, in-process fallback).
+"""JSON API response caching: per-process LRU (L1) in front of Redis (L2).
 
-Used for hot read paths: ``/api/catalog/*`` and ``/api/filters/facets``.
+L1 is a thread-safe O(1) LRU bounded by entry count and bytes, with TTL; it
+is the only tier when ``REDIS_URL`` is unset. With Redis, every delete /
+prefix delete / overwrite is broadcast on a pub/sub channel so other workers
+drop their L1 copy, and L1 entries never outlive ``L1_MAX_TTL_S``.
+:func:`cache_stats` exposes per-tier hit/miss/eviction counters.
+
+Used for hot read paths: ``/api/catalog/*``, ``/api/filters/facets`` and the
+approximate listing totals returned by cursor-mode ``/api/cars``.
+
+Hot keys should go through :func:`get_or_compute`, which adds stampede
+protection on top of ``cache_get``/``cache_set``: one recompute per key across
+threads (in-process lock) and gunicorn workers (Redis ``SET NX`` lock),
+stale-while-revalidate, and probabilistic early expiry (XFetch).
 """
 
 from __future__ import annotations
 
 import json
 import logging
+import math
+import os
+import random
+import secrets
+import threading
 import time
-from typing import Any
+from collections import OrderedDict
+from typing import Any, Callable
+
+from .redis_client import get_redis, get_redis_pubsub
 
 logger = logging.getLogger(__name__)
 
 _PREFIX = "api_resp:"
 _CATALOG_PREFIX = f"{_PREFIX}catalog:"
-_FACETS_KEY = f"{_PREFIX}filters:facets:v1"
+_FACETS_PREFIX = f"{_PREFIX}filters:facets:"
+_FACETS_KEY = f"{_FACETS_PREFIX}v2"
+# Single-flight locks; outside the data prefixes so invalidation never drops them.
+_LOCK_PREFIX = f"{_PREFIX}lock:"
 
 # Default TTLs
 CATALOG_TTL_S = 60 * 60  # 1 hour — invalidated on admin catalog writes
-FACETS_TTL_S = 5 * 60  # 5 minutes — also invalidated on listing writes
-
-# Dev / no-Redis fallback: key -> (expires_at_epoch, payload)
-_memory: dict[str, tuple[float, Any]] = {}
-_MEMORY_MAX = 512
+FACETS_TTL_S = 5 * 60  # 5 minutes — client Cache-Control max-age for facets
+# Server-side copy of the facet-store read; the store itself is updated on
+# every listing write, so this only absorbs bursts (no write invalidation).
+FACETS_STORE_CACHE_TTL_S = 30
+LISTING_COUNT_TTL_S = 2 * 60  # approximate feed totals for cursor pagination
+
+# L1: per-process LRU in front of Redis (L2); the only tier when Redis is absent.
+L1_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_L1_MAX_ENTRIES", "2048"))
+L1_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_L1_MAX_BYTES", str(32 * 1024 * 1024)))
+# Upper bound on L1 staleness if a pub/sub invalidation is ever missed.
+L1_MAX_TTL_S = int(os.environ.get("RESPONSE_CACHE_L1_TTL_S", "60"))
+
+_INVALIDATE_CHANNEL = f"{_PREFIX}invalidate"
+
+
+class _LRUCache:
+    """Thread-safe O(1) LRU with per-entry TTL and a bounded (approximate) byte size."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max(1, max_bytes)
+        self._data: OrderedDict[str, tuple[float, int, Any]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> tuple[bool, Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                _stats.incr("l1_misses")
+                return False, None
+            expires_at, _size, value = entry
+            if expires_at <= time.time():
+                self._pop(key)
+                _stats.incr("l1_misses")
+                _stats.incr("l1_expired")
+                return False, None
+            self._data.move_to_end(key)
+            _stats.incr("l1_hits")
+            return True, value
+
+    def set(self, key: str, value: Any, ttl_s: float, size: int) -> None:
+        with self._lock:
+            self._pop(key)
+            if size > self.max_bytes:
+                # Too big for L1; dropping the old entry keeps it from being served stale.
+                return
+            self._data[key] = (time.time() + ttl_s, size, value)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._pop(oldest)
+                _stats.incr("l1_evictions")
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def delete_prefix(self, prefix: str) -> None:
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def usage(self) -> tuple[int, int]:
+        with self._lock:
+            return len(self._data), self._bytes
+
+    def _pop(self, key: str) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: dict[str, int] = {}
+
+    def incr(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + n
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts.clear()
+
+
+_stats = _Stats()
+_l1 = _LRUCache(L1_MAX_ENTRIES, L1_MAX_BYTES)
+
+
+def _full_key(key: str) -> str:
+    return key if key.startswith(_PREFIX) else f"{_PREFIX}{key}"
 
 
 def _redis():
-    try:
-        from .security import _redis_client
+    r = get_redis()
+    if r is not None:
+        _ensure_invalidation_listener()
+    return r
 
-        return _redis_client()
-    except Exception:
-        return None
 
+def _dumps(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), default=str)
 
-def _purge_memory() -> None:
-    now = time.time()
-    expired = [k for k, (exp, _) in _memory.items() if exp <= now]
-    for k in expired:
-        _memory.pop(k, None)
-    if len(_memory) > _MEMORY_MAX:
-        for k in list(_memory.keys())[: int(_MEMORY_MAX * 0.1) or 1]:
-            _memory.pop(k, None)
 
+# ── Cross-worker L1 coherence (Redis pub/sub) ────────────────────────────────
 
-def cache_get(key: str) -> Any | None:
-    """Return cached JSON-compatible value or None."""
-    full = key if key.startswith(_PREFIX) else f"{_PREFIX}{key}"
-    r = _redis()
-    if r is not None:
+_listener_pid: int | None = None
+_listener_guard = threading.Lock()
+_NODE_TOKEN = secrets.token_hex(6)
+
+
+def _node_id() -> str:
+    # pid suffix keeps forked gunicorn workers distinct.
+    return f"{_NODE_TOKEN}:{os.getpid()}"
+
+
+def _publish_invalidation(*, keys: list[str] | None = None, prefix: str | None = None, r=None) -> None:
+    r = r if r is not None else _redis()
+    if r is None:
+        return
+    msg: dict[str, Any] = {"src": _node_id()}
+    if keys:
+        msg["keys"] = keys
+    if prefix:
+        msg["prefix"] = prefix
+    try:
+        r.publish(_INVALIDATE_CHANNEL, _dumps(msg))
+    except Exception:
+        logger.exception("response_cache invalidation publish failed")
+
+
+def _apply_invalidation(raw: str) -> None:
+    try:
+        msg = json.loads(raw)
+    except (TypeError, ValueError):
+        return
+    if not isinstance(msg, dict) or msg.get("src") == _node_id():
+        return
+    for key in msg.get("keys") or []:
+        _l1.delete(str(key))
+    if msg.get("prefix"):
+        _l1.delete_prefix(str(msg["prefix"]))
+    _stats.incr("l1_remote_invalidations")
+
+
+def _listen_invalidations() -> None:
+    backoff = 1.0
+    while True:
         try:
-            raw = r.get(full)
-            if raw is None:
-                return None
-            return json.loads(raw)
+            r = get_redis_pubsub()
+            if r is None:
+                return
+            pubsub = r.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(_INVALIDATE_CHANNEL)
+            backoff = 1.0
+            for message in pubsub.listen():
+                if message.get("type") == "message":
+                    _apply_invalidation(message.get("data"))
         except Exception:
-            logger.exception("response_cache get failed for %s", full)
+            logger.warning("response_cache invalidation listener disconnected", exc_info=True)
+        # Messages may have been missed while disconnected.
+        _l1.clear()
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 30.0)
+
+
+def _ensure_invalidation_listener() -> None:
+    global _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _listener_guard:
+        if _listener_pid == pid:
+            return
+        _listener_pid = pid
+        threading.Thread(
+            target=_listen_invalidations, name="response-cache-invalidation", daemon=True
+        ).start()
+
 
-    _purge_memory()
-    entry = _memory.get(full)
-    if entry is None:
+def cache_get(key: str) -> Any | None:
+    """Return cached JSON-compatible value or None (L1, then Redis)."""
+    full = _full_key(key)
+    hit, value = _l1.get(full)
+    if hit:
+        return value
+
+    r = _redis()
+    if r is None:
         return None
-    exp, value = entry
-    if exp <= time.time():
-        _memory.pop(full, None)
+    try:
+        pipe = r.pipeline(transaction=False)
+        pipe.get(full)
+        pipe.pttl(full)
+        raw, pttl = pipe.execute()
+    except Exception:
+        _stats.incr("l2_errors")
+        logger.exception("response_cache get failed for %s", full)
+        return None
+    if raw is None:
+        _stats.incr("l2_misses")
         return None
+    _stats.incr("l2_hits")
+    value = json.loads(raw)
+    remaining_s = (pttl / 1000.0) if pttl and pttl > 0 else L1_MAX_TTL_S
+    _l1.set(full, value, min(remaining_s, L1_MAX_TTL_S), len(raw))
     return value
 
 
 def cache_set(key: str, value: Any, ttl_s: int) -> None:
-    """Store JSON-compatible value with TTL seconds."""
-    full = key if key.startswith(_PREFIX) else f"{_PREFIX}{key}"
+    """Store JSON-compatible value with TTL seconds (Redis + local L1)."""
+    full = _full_key(key)
     ttl = max(30, int(ttl_s))
+    raw = _dumps(value)
     r = _redis()
     if r is not None:
         try:
-            r.setex(full, ttl, json.dumps(value, separators=(",", ":"), default=str))
-            return
+            r.setex(full, ttl, raw)
+            # Other workers may hold the previous value in L1.
+            _publish_invalidation(keys=[full], r=r)
         except Exception:
+            _stats.incr("l2_errors")
             logger.exception("response_cache set failed for %s", full)
-
-    _purge_memory()
-    _memory[full] = (time.time() + ttl, value)
+        _l1.set(full, value, min(ttl, L1_MAX_TTL_S), len(raw))
+        return
+    _l1.set(full, value, ttl, len(raw))
 
 
 def cache_delete(*keys: str) -> None:
-    full_keys = [k if k.startswith(_PREFIX) else f"{_PREFIX}{k}" for k in keys]
+    full_keys = [_full_key(k) for k in keys]
+    for k in full_keys:
+        _l1.delete(k)
     r = _redis()
     if r is not None and full_keys:
         try:
             r.delete(*full_keys)
         except Exception:
+            _stats.incr("l2_errors")
             logger.exception("response_cache delete failed")
-    for k in full_keys:
-        _memory.pop(k, None)
+        _publish_invalidation(keys=full_keys, r=r)
 
 
 def cache_delete_prefix(prefix: str) -> None:
-    """Delete all keys under prefix (Redis SCAN + memory filter)."""
+    """Delete all keys under prefix (Redis SCAN + L1 filter, broadcast to other workers)."""
     full_prefix = prefix if prefix.startswith(_PREFIX) else f"{_PREFIX}{prefix}"
     r = _redis()
     if r is not None:
@@ -111,11 +309,12 @@ def cache_delete_prefix(prefix: str) -> None:
             if batch:
                 r.delete(*batch)
         except Exception:
+            _stats.incr("l2_errors")
             logger.exception("response_cache prefix delete failed for %s", full_prefix)
 
-    for k in list(_memory.keys()):
-        if k.startswith(full_prefix):
-            _memory.pop(k, None)
+    _l1.delete_prefix(full_prefix)
+    if r is not None:
+        _publish_invalidation(prefix=full_prefix, r=r)
 
 
 def catalog_cache_key(*parts: str) -> str:
@@ -128,16 +327,193 @@ def invalidate_catalog_cache() -> None:
 
 
 def invalidate_filter_facets_cache() -> None:
-    cache_delete(_FACETS_KEY)
+    cache_delete_prefix(_FACETS_PREFIX)
+
+
+def filter_facets_cache_key(scope: str = "") -> str:
+    if not scope:
+        return _FACETS_KEY
+    safe = str(scope).strip().lower().replace(" ", "_")
+    return f"{_FACETS_KEY}:{safe}"
+
+
+# ── Single-flight get_or_compute ────────────────────────────────────────────
+
+# Per-process single-flight: only keys currently being recomputed have an entry,
+# so user-controlled keys (facet scopes, catalog lookups) cannot grow this dict.
+_local_locks: set[str] = set()
+_local_locks_guard = threading.Lock()
+
+_RELEASE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _local_acquire(full: str) -> bool:
+    with _local_locks_guard:
+        if full in _local_locks:
+            return False
+        _local_locks.add(full)
+        return True
+
 
+def _local_release(full: str) -> None:
+    with _local_locks_guard:
+        _local_locks.discard(full)
 
-def filter_facets_cache_key() -> str:
-    return _FACETS_KEY
+
+def _try_acquire(full: str, lock_ttl_s: float) -> str | None:
+    """Non-blocking single-flight lock. Returns a release token or None if held elsewhere."""
+    if not _local_acquire(full):
+        return None
+    r = _redis()
+    if r is None:
+        return ""
+    token = secrets.token_hex(8)
+    try:
+        if r.set(f"{_LOCK_PREFIX}{full}", token, nx=True, px=max(1, int(lock_ttl_s * 1000))):
+            return token
+    except Exception:
+        # Redis hiccup: degrade to per-process single-flight rather than fail the read.
+        logger.exception("response_cache lock failed for %s", full)
+        return ""
+    _local_release(full)
+    return None
+
+
+def _release(full: str, token: str) -> None:
+    if token:
+        r = _redis()
+        if r is not None:
+            try:
+                r.eval(_RELEASE_LUA, 1, f"{_LOCK_PREFIX}{full}", token)
+            except Exception:
+                logger.exception("response_cache unlock failed for %s", full)
+    _local_release(full)
+
+
+def _read_entry(full: str) -> dict | None:
+    entry = cache_get(full)
+    if isinstance(entry, dict) and "v" in entry and "x" in entry:
+        return entry
+    return None
+
+
+def _compute_and_store(full: str, fn: Callable[[], Any], ttl_s: int, stale_ttl_s: int) -> Any:
+    started = time.monotonic()
+    value = fn()
+    entry = {
+        "v": value,
+        "x": time.time() + ttl_s,  # fresh until
+        "d": round(time.monotonic() - started, 4),  # recompute cost, drives early expiry
+    }
+    cache_set(full, entry, ttl_s + stale_ttl_s)
+    return value
+
+
+def _is_fresh(entry: dict, beta: float) -> bool:
+    # XFetch: recompute early with probability rising as expiry approaches,
+    # weighted by how long the value takes to rebuild.
+    delta = float(entry.get("d") or 0.0)
+    jitter = -delta * beta * math.log(1.0 - random.random())
+    return time.time() + jitter < float(entry["x"])
+
+
+def get_or_compute(
+    key: str,
+    fn: Callable[[], Any],
+    ttl_s: int,
+    *,
+    stale_ttl_s: int | None = None,
+    beta: float = 1.0,
+    lock_ttl_s: float = 30.0,
+    wait_s: float = 5.0,
+) -> Any:
+    """
+    Return the cached value for ``key``, calling ``fn()`` at most once per key at a time.
+
+    - Fresh hit: returned as-is (subject to probabilistic early refresh).
+    - Stale hit (within ``stale_ttl_s`` after ``ttl_s``, default one more
+      ``ttl_s``): the lock holder recomputes, everyone else gets the stale value.
+    - Miss: the lock holder computes; others poll for up to ``wait_s`` and
+      compute themselves only if the holder never delivers.
+
+    Values are stored in an envelope, so keys used here must not also be read
+    with :func:`cache_get` directly.
+    """
+    full = _full_key(key)
+    ttl_s = max(1, int(ttl_s))
+    stale_ttl_s = ttl_s if stale_ttl_s is None else max(0, int(stale_ttl_s))
+
+    entry = _read_entry(full)
+    if entry is not None:
+        if _is_fresh(entry, beta):
+            return entry["v"]
+        token = _try_acquire(full, lock_ttl_s)
+        if token is None:
+            return entry["v"]
+        try:
+            return _compute_and_store(full, fn, ttl_s, stale_ttl_s)
+        except Exception:
+            logger.exception("response_cache refresh failed for %s; serving stale", full)
+            return entry["v"]
+        finally:
+            _release(full, token)
+
+    deadline = time.monotonic() + wait_s
+    while True:
+        token = _try_acquire(full, lock_ttl_s)
+        if token is not None:
+            try:
+                # Another flight may have filled the key between our read and the lock.
+                entry = _read_entry(full)
+                if entry is not None:
+                    return entry["v"]
+                return _compute_and_store(full, fn, ttl_s, stale_ttl_s)
+            finally:
+                _release(full, token)
+        time.sleep(0.05)
+        entry = _read_entry(full)
+        if entry is not None:
+            return entry["v"]
+        if time.monotonic() >= deadline:
+            logger.warning("response_cache single-flight wait timed out for %s", full)
+            return fn()
+
+
+def cache_stats() -> dict[str, Any]:
+    """Per-tier hit/miss/eviction counters for this process (plus L1 occupancy)."""
+    counts = _stats.snapshot()
+    entries, size = _l1.usage()
+    l1 = {
+        "hits": counts.get("l1_hits", 0),
+        "misses": counts.get("l1_misses", 0),
+        "evictions": counts.get("l1_evictions", 0),
+        "expired": counts.get("l1_expired", 0),
+        "remote_invalidations": counts.get("l1_remote_invalidations", 0),
+        "entries": entries,
+        "bytes": size,
+        "max_entries": _l1.max_entries,
+        "max_bytes": _l1.max_bytes,
+    }
+    l2 = {
+        "hits": counts.get("l2_hits", 0),
+        "misses": counts.get("l2_misses", 0),
+        "errors": counts.get("l2_errors", 0),
+    }
+    for tier in (l1, l2):
+        lookups = tier["hits"] + tier["misses"]
+        tier["hit_ratio"] = round(tier["hits"] / lookups, 4) if lookups else None
+    return {"l1": l1, "l2": l2, "pid": os.getpid()}
 
 
 def debug_reset_memory_cache() -> None:
-    """Test helper: clear in-process fallback store."""
-    _memory.clear()
+    """Test helper: clear the in-process L1 and counters."""
+    _l1.clear()
+    _stats.reset()
 
 
 def public_cached_json(payload: Any, *, max_age: int):
@@ -32,7 +32,7 @@ from ..models import (
     UserReport,
     db,
 )
-from ..response_cache import invalidate_filter_facets_cache
+from ..listing_facets import retract_seller_listings
 from ..listing_search import apply_listing_text_search
 from ..time_utils import utcnow
 
@@ -1206,7 +1206,6 @@ def update_car_status(car_id: str):
             car.is_featured = bool(data["is_featured"])
         car.updated_at = utcnow()
         db.session.commit()
-        invalidate_filter_facets_cache()
         if admin_user:
             log_user_action(
                 admin_user,
@@ -1268,7 +1267,6 @@ def bulk_update_car_status():
             return jsonify({"message": "No matching listings found", "missing": missing}), 404
 
         db.session.commit()
-        invalidate_filter_facets_cache()
         if admin_user:
             log_user_action(
                 admin_user,
@@ -1359,12 +1357,14 @@ def broadcast_notification():
             target_user_id=target_user_id,
             notification_type=notification_type,
             send_push_flag=send_push_flag,
+            created_by_user_id=admin_user.id if admin_user else None,
         )
         if admin_user:
             log_user_action(
                 admin_user,
                 "admin_broadcast_notification",
-                target_type="notification",
+                target_type="scheduled_notification",
+                target_id=str(result.get("broadcast_id")),
                 metadata={
                     "title": title,
                     "audience": audience,
@@ -1373,7 +1373,9 @@ def broadcast_notification():
                     "send_push": send_push_flag,
                 },
             )
-        return jsonify({**result, "scheduled": False}), 200
+        # Chunks still running on workers: the admin UI polls the progress endpoint.
+        status_code = 200 if result.get("status") == "sent" else 202
+        return jsonify({**result, "scheduled": False}), status_code
     except ValueError as e:
         return jsonify({"message": str(e)}), 400
     except Exception as e:
@@ -1468,6 +1470,25 @@ def process_scheduled_notifications():
         return jsonify({"message": "Failed to process scheduled notifications"}), 500
 
 
+@bp.route("/notifications/broadcasts/<int:item_id>/progress", methods=["GET"])
+@admin_required
+def broadcast_progress(item_id: int):
+    """Chunk progress of an immediate or scheduled broadcast (polled by the admin UI)."""
+    try:
+        denied = _deny("notifications.read")
+        if denied:
+            return denied
+        from ..notification_broadcast import broadcast_progress as progress_of
+
+        row = db.session.get(ScheduledNotification, item_id)
+        if not row:
+            return jsonify({"message": "Broadcast not found"}), 404
+        return jsonify(progress_of(row)), 200
+    except Exception as e:
+        logger.error("admin broadcast_progress error: %s", e, exc_info=True)
+        return jsonify({"message": "Failed to load broadcast progress"}), 500
+
+
 @bp.route("/users/<user_id>/status", methods=["PATCH"])
 @admin_required
 def update_user_status(user_id: str):
@@ -1794,7 +1815,6 @@ def delete_car(car_id: str):
             car.status = "hidden"
         car.updated_at = utcnow()
         db.session.commit()
-        invalidate_filter_facets_cache()
 
         if admin_user:
             log_user_action(
@@ -1831,6 +1851,7 @@ def delete_user(user_id: str):
 
         user.is_active = False
         user.updated_at = utcnow()
+        retract_seller_listings(user.id)
         cars_updated = (
             Car.query.filter_by(seller_id=user.id)
             .filter(Car.is_active.is_(True))
@@ -1871,7 +1892,7 @@ def purge_car(car_id: str):
             return denied
         from ..favorites_cleanup import remove_listing_from_all_favorites
         from ..view_history import remove_listing_from_all_view_history
-        from ..models import ListingAnalytics, ListingReport, SavedSearchAlert
+        from ..models import Conversation, ListingAnalytics, ListingReport, SavedSearchAlert
 
         admin_user = get_current_user()
         car = _find_car(car_id)
@@ -1885,10 +1906,10 @@ def purge_car(car_id: str):
         ListingReport.query.filter_by(car_id=car_pk).delete(synchronize_session=False)
         ListingAnalytics.query.filter_by(car_id=car_pk).delete(synchronize_session=False)
         SavedSearchAlert.query.filter_by(car_id=car_pk).delete(synchronize_session=False)
+        Conversation.query.filter_by(car_id=car_pk).delete(synchronize_session=False)
         Message.query.filter_by(car_id=car_pk).delete(synchronize_session=False)
         db.session.delete(car)
         db.session.commit()
-        invalidate_filter_facets_cache()
 
         if admin_user:
             log_user_action(
@@ -1945,6 +1966,7 @@ def purge_user(user_id: str):
         user.account_type = "user"
         user.updated_at = utcnow()
 
+        retract_seller_listings(user.id)
         cars_updated = (
             Car.query.filter_by(seller_id=user.id)
             .filter(Car.is_active.is_(True))
@@ -2002,10 +2024,10 @@ def system_health():
         redis_ok = None
         if redis_url:
             try:
-                import redis  # type: ignore
+                from ..redis_client import get_redis
 
-                client = redis.from_url(redis_url, socket_connect_timeout=2)
-                redis_ok = bool(client.ping())
+                client = get_redis()
+                redis_ok = bool(client is not None and client.ping())
             except Exception:
                 redis_ok = False
 
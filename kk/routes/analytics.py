@@ -6,6 +6,7 @@ from flask_jwt_extended import jwt_required
 from ..auth import get_current_user
 from ..listing_metrics import (
     get_car_for_analytics,
+    merge_pending_analytics,
     record_call_or_share,
     record_trusted_view,
 )
@@ -60,7 +61,8 @@ def get_listings_analytics():
             db.session.commit()
 
         analytics = ListingAnalytics.query.filter(ListingAnalytics.car_id.in_(car_ids)).all()
-        return jsonify([a.to_dict() for a in analytics]), 200
+        rows = merge_pending_analytics([a.to_dict() for a in analytics], [a.car_id for a in analytics])
+        return jsonify(rows), 200
     except Exception:
         return jsonify({"message": "Failed to get analytics"}), 500
 
@@ -79,7 +81,7 @@ def get_listing_analytics(listing_id: str):
             return jsonify({"message": "Listing not found"}), 404
 
         a = _get_or_create_analytics(car)
-        return jsonify(a.to_dict()), 200
+        return jsonify(merge_pending_analytics([a.to_dict()], [car.id])[0]), 200
     except Exception:
         return jsonify({"message": "Failed to get analytics"}), 500
 
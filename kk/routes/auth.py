@@ -34,6 +34,7 @@ from ..extensions import mail
 from ..models import (
     AdminAccount,
     BlockedUser,
+    Conversation,
     DealerApplication,
     DealerDecision,
     EmailVerification,
@@ -45,6 +46,7 @@ from ..models import (
     UserReport,
     db,
 )
+from ..redis_client import get_redis
 from ..security import check_rate_limit, rate_limit, validate_input_sanitization
 
 bp = Blueprint("auth", __name__)
@@ -177,18 +179,6 @@ def _hash_phone_verification_code(phone_digits: str, code: str) -> str:
     return hmac.new(key, msg=msg, digestmod=hashlib.sha256).hexdigest()
 
 
-def _redis_client():
-    url = (os.environ.get("REDIS_URL") or "").strip()
-    if not url:
-        return None
-    try:
-        import redis  # type: ignore
-
-        return redis.Redis.from_url(url, decode_responses=True)
-    except Exception:
-        return None
-
-
 def _generate_unique_username(prefix: str = "u") -> str:
     # Best-effort unique username generator.
     for _ in range(5):
@@ -403,7 +393,7 @@ def init_jwt_callbacks(jwt) -> None:
             return False
 
         # Prefer Redis in production (O(1) lookup, no DB query per request).
-        r = _redis_client()
+        r = get_redis()
         if r is not None:
             try:
                 return bool(r.exists(f"bl:jti:{jti}"))
@@ -613,7 +603,7 @@ def refresh():
                 return jsonify({"message": "Token has been revoked"}), 401
 
             # Redis mirror (best-effort)
-            r = _redis_client()
+            r = get_redis()
             if r is not None:
                 try:
                     ttl = max(1, exp - int(time.time())) if exp else 3600
@@ -659,7 +649,7 @@ def logout():
         db.session.commit()
 
         # Best-effort Redis mirror for fast blocklist checks
-        r = _redis_client()
+        r = get_redis()
         if r is not None:
             try:
                 exp = int(get_jwt().get("exp") or 0)
@@ -693,7 +683,7 @@ def logout():
                             db.session.commit()
                         except Exception:
                             db.session.rollback()
-                        rr = _redis_client()
+                        rr = get_redis()
                         if rr is not None:
                             try:
                                 ttl = max(1, rexp - int(time.time())) if rexp else 3600
@@ -918,6 +908,11 @@ def delete_account():
         current_user.favorites = []
         current_user.viewed_listings = []
 
+        if "conversation" in table_names:
+            Conversation.query.filter(
+                (Conversation.buyer_id == user_id) | (Conversation.seller_id == user_id),
+            ).delete(synchronize_session=False)
+
         if "message" in table_names:
             Message.query.filter(
                 (Message.sender_id == user_id) | (Message.receiver_id == user_id),
@@ -971,6 +966,11 @@ def delete_account():
             # Re-apply association clears after rollback
             current_user.favorites = []
             current_user.viewed_listings = []
+            if "conversation" in table_names:
+                Conversation.query.filter(
+                    (Conversation.buyer_id == user_id)
+                    | (Conversation.seller_id == user_id),
+                ).delete(synchronize_session=False)
             if "message" in table_names:
                 Message.query.filter(
                     (Message.sender_id == user_id) | (Message.receiver_id == user_id),
@@ -1109,9 +1109,7 @@ def reset_password():
 
         # Per-account limit (in addition to IP decorator) to slow SMS code guessing.
         try:
-            from ..security import _redis_client
-
-            r = _redis_client()
+            r = get_redis()
             if r is not None:
                 ukey = f"rl:reset_password:user:{user.id}:900"
                 n = int(r.incr(ukey) or 0)
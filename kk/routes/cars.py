@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 import os
-import time
 from datetime import datetime
 
 from flask import Blueprint, current_app, jsonify, request
@@ -9,27 +8,41 @@ from flask_jwt_extended import jwt_required, verify_jwt_in_request
 from ..security import rate_limit
 from collections import Counter
 
-from sqlalchemy import case, or_, select, update, func
+from sqlalchemy import case, or_, select, func
 from sqlalchemy.orm import joinedload, selectinload
 
 from ..auth import get_current_user, log_user_action, phone_verification_required_response
 from ..favorites_cleanup import remove_listing_from_all_favorites
 from ..idempotency import remember_response, replay_response
 from ..view_history import remove_listing_from_all_view_history
+from ..listing_cards import card_query_options, parse_card_fields, serialize_cards
+from ..listing_facets import read_listing_facets, resolve_facet_scope
+from ..listing_metrics import buffer_counter, claim_anonymous_view, merge_pending_views
 from ..listing_moderation import initial_listing_status
+from ..listing_pagination import (
+    InvalidCursor,
+    decode_cursor,
+    paginate_keyset,
+    paginate_offset_cursor,
+    supports_keyset,
+)
+from ..image_renditions import image_srcset
 from ..listing_search import apply_listing_text_search
+from ..media_paths import PLACEHOLDER_REL, image_display_url, static_exists
 from ..models import Car, ListingReport, User, db, user_favorites, user_viewed_listings
 from ..response_cache import (
+    FACETS_STORE_CACHE_TTL_S,
     FACETS_TTL_S,
+    LISTING_COUNT_TTL_S,
     cache_get,
     cache_set,
     filter_facets_cache_key,
-    invalidate_filter_facets_cache,
+    get_or_compute,
     public_cached_json,
 )
 from ..retention_dispatch import dispatch_price_drop_alerts, dispatch_saved_search_alerts
 from ..time_utils import utcnow
-from .media import _normalize_car_image_kind, _pick_primary_listing_url
+from .media import _normalize_car_image_kind, _pick_primary_listing_image
 from .user import assert_listing_phones_verified, parse_listing_contact_phones
 
 bp = Blueprint("cars", __name__)
@@ -67,36 +80,6 @@ def _public_listings_filter(query):
     )
 
 
-def _bump_filter_facets_cache() -> None:
-    try:
-        invalidate_filter_facets_cache()
-    except Exception:
-        current_app.logger.exception("filter facets cache invalidate failed")
-
-
-def _distinct_public_values(column, *, limit: int = 200) -> list[str]:
-    rows = (
-        _public_listings_filter(db.session.query(column))
-        .filter(column.isnot(None), column != "")
-        .distinct()
-        .order_by(column.asc())
-        .limit(limit)
-        .all()
-    )
-    out: list[str] = []
-    seen: set[str] = set()
-    for (raw,) in rows:
-        val = str(raw).strip()
-        if not val:
-            continue
-        key = val.lower()
-        if key in seen:
-            continue
-        seen.add(key)
-        out.append(val)
-    return out
-
-
 def _listing_visible_to_viewer(car, viewer) -> bool:
     """Public statuses are visible to everyone; pending/hidden only to owner/admin."""
     status = (car.status or "active").strip().lower()
@@ -267,10 +250,8 @@ def _order_cars_query(query, sort_by: str, *, rank_expr=None):
     return query.order_by(Car.is_featured.desc(), Car.created_at.desc())
 
 
-# Best-effort anonymous view cooldown (in-memory, per process)
-_anon_view_cache: dict[tuple[str, int], float] = {}
-_ANON_VIEW_COOLDOWN_S = 600.0  # 10 minutes
-_ANON_VIEW_CACHE_MAX = 50_000
+# Anonymous view cooldown per IP per listing (claim_anonymous_view: Redis SET NX, in-memory without Redis)
+_ANON_VIEW_COOLDOWN_S = 600  # 10 minutes
 
 
 def _clamp_pagination(page: int, per_page: int) -> tuple[int, int]:
@@ -310,12 +291,12 @@ def _increment_views_best_effort(car: Car, current_user: User | None) -> None:
     """
     Reduce write-amplification:
     - Authenticated users: increment at most once per user per listing (via user_viewed_listings).
-    - Anonymous users: increment at most once per IP per listing per cooldown window (best-effort).
+    - Anonymous users: increment at most once per IP per listing per cooldown window (shared via Redis).
+    The increment itself is buffered and applied in batches (kk.listing_metrics).
     """
     try:
         if not car or not getattr(car, "id", None):
             return
-        now = utcnow()
         if current_user:
             from ..view_history import record_user_listing_view
 
@@ -324,20 +305,9 @@ def _increment_views_best_effort(car: Car, current_user: User | None) -> None:
             )
             if not is_first_view:
                 return
-        else:
-            ip = _client_ip()
-            key = (ip, int(car.id))
-            ts = _anon_view_cache.get(key)
-            now_ts = time.time()
-            if ts is not None and (now_ts - ts) < _ANON_VIEW_COOLDOWN_S:
-                return
-            _anon_view_cache[key] = now_ts
-            if len(_anon_view_cache) > _ANON_VIEW_CACHE_MAX:
-                for k in list(_anon_view_cache.keys())[: int(_ANON_VIEW_CACHE_MAX * 0.1)]:
-                    _anon_view_cache.pop(k, None)
-
-        db.session.execute(update(Car).where(Car.id == car.id).values(views_count=Car.views_count + 1))
-        db.session.commit()
+        elif not claim_anonymous_view(_client_ip(), car.id, ttl_s=_ANON_VIEW_COOLDOWN_S):
+            return
+        buffer_counter(car.id, "views_count")
     except Exception:
         try:
             db.session.rollback()
@@ -345,53 +315,13 @@ def _increment_views_best_effort(car: Car, current_user: User | None) -> None:
             pass
 
 
-def _static_exists(rel: str) -> bool:
-    try:
-        if not rel:
-            return False
-        norm = rel.lstrip("/").replace("\\", "/")
-        static_root = os.path.join(current_app.root_path, "static")
-        repo_static = os.path.abspath(os.path.join(current_app.root_path, "..", "static"))
-        for root in (static_root, repo_static):
-            p = os.path.join(root, norm)
-            if os.path.isfile(p):
-                return True
-        return False
-    except Exception:
-        return False
-
-
-def _resolve_rel(rel: str) -> str:
-    """
-    Resolve stored image path to an existing file.
-    If DB stored 'uploads/<name>', try 'uploads/car_photos/<name>' as a fallback.
-    """
-    try:
-        if not rel:
-            return ""
-        # Cloud / external URLs are already absolute; keep as-is.
-        if rel.startswith("http://") or rel.startswith("https://"):
-            return rel
-        norm = rel.lstrip("/").replace("\\", "/")
-        if _static_exists(norm):
-            return norm
-        base = os.path.basename(norm)
-        alt = os.path.join("uploads", "car_photos", base).replace("\\", "/")
-        if _static_exists(alt):
-            return alt
-        return ""
-    except Exception:
-        return ""
-
-
 def _with_media_compat(car: Car) -> dict:
     d = car.to_dict()
     # Keep per-image metadata (especially `kind`: listing vs damage). Plain string
     # lists made every photo look like a normal gallery image on the client.
     image_objs: list[dict] = []
     for img in car.images or []:
-        rel = getattr(img, "image_url", "") or ""
-        resolved = _resolve_rel(rel)
+        resolved = image_display_url(img)
         if not resolved:
             continue
         kind = _normalize_car_image_kind(getattr(img, "kind", None))
@@ -405,13 +335,14 @@ def _with_media_compat(car: Car) -> dict:
                 "focus_y": getattr(img, "focus_y", None),
                 "image_width": getattr(img, "image_width", None),
                 "image_height": getattr(img, "image_height", None),
+                "srcset": image_srcset(img),
             }
         )
 
-    raw_primary = _pick_primary_listing_url(car)
+    primary_img = _pick_primary_listing_image(car)
     primary_rel = ""
-    if raw_primary:
-        primary_rel = _resolve_rel(raw_primary) or raw_primary
+    if primary_img is not None:
+        primary_rel = image_display_url(primary_img)
     if not primary_rel:
         for row in image_objs:
             if row.get("kind") == "listing":
@@ -419,15 +350,33 @@ def _with_media_compat(car: Car) -> dict:
                 break
     if not primary_rel and image_objs:
         primary_rel = image_objs[0]["image_url"]
-    if not primary_rel and _static_exists("uploads/car_photos/placeholder.jpg"):
-        primary_rel = "uploads/car_photos/placeholder.jpg"
+    if not primary_rel and static_exists(PLACEHOLDER_REL):
+        primary_rel = PLACEHOLDER_REL
     d["image_url"] = primary_rel
+    d["image_srcset"] = image_srcset(primary_img)
     d["images"] = image_objs
     # Match list endpoints: expose plain relative paths so mobile clients can build /static/... URLs.
     d["videos"] = [v.video_url for v in car.videos] if car.videos else []
+    # Poster / duration / preview per video, so clients need not fetch the file for a thumbnail.
+    d["video_items"] = [v.to_dict() for v in car.videos] if car.videos else []
     return d
 
 
+def _feed_load_options(card_fields) -> list:
+    """Loader options for a feed query: lean columns for cards, full media otherwise."""
+    if card_fields is not None:
+        return card_query_options(card_fields)
+    return [selectinload(Car.images), selectinload(Car.videos), joinedload(Car.seller)]
+
+
+def _serialize_feed(cars, card_fields) -> list[dict]:
+    """Card projection when requested (``view=card`` / ``fields=``), else the full dict."""
+    cars = list(cars)
+    if card_fields is not None:
+        return merge_pending_views(serialize_cards(cars, card_fields), cars)
+    return merge_pending_views([_with_media_compat(c) for c in cars], cars)
+
+
 def _safe_int(val, default=None):
     """Parse int from request arg; return default if missing or invalid."""
     if val is None or (isinstance(val, str) and val.strip() == ""):
@@ -474,42 +423,97 @@ def _leading_float(val):
             return None
 
 
+_COUNT_CACHE_IGNORED_ARGS = frozenset(
+    {
+        "cursor",
+        "page",
+        "per_page",
+        "sort_by",
+        "include_total",
+        "prefer_brand",
+        "prefer_body_type",
+        "prefer_min_price",
+        "prefer_max_price",
+    }
+)
+
+
+def _listing_count_cache_key() -> str:
+    """Stable cache key for the filtered listing count (ignores paging/sort args)."""
+    import hashlib
+
+    parts = sorted(
+        (k, v)
+        for k, vals in request.args.lists()
+        if k not in _COUNT_CACHE_IGNORED_ARGS
+        for v in vals
+    )
+    digest = hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()[:24]
+    return f"listings:count:{digest}"
+
+
+def _cursor_total(query) -> int | None:
+    """Cached filtered total for cursor mode; counted only with ``include_total=1``."""
+    key = _listing_count_cache_key()
+    cached = cache_get(key)
+    if isinstance(cached, dict) and "total" in cached:
+        return cached["total"]
+    wants_total = (request.args.get("include_total") or "").strip().lower() in (
+        "1",
+        "true",
+        "yes",
+    )
+    if not wants_total:
+        return None
+    total = query.order_by(None).count()
+    cache_set(key, {"total": int(total)}, LISTING_COUNT_TTL_S)
+    return int(total)
+
+
+def _cursor_page_response(query, sort_by: str, search_rank, per_page: int, card_fields=None):
+    """GET /api/cars in cursor mode: keyset seek, no OFFSET and no COUNT by default."""
+    try:
+        cursor = decode_cursor(request.args.get("cursor"))
+        if supports_keyset(sort_by):
+            items, next_cursor = paginate_keyset(query, sort_by, cursor, per_page)
+        else:
+            ordered = _order_cars_query(query, sort_by, rank_expr=search_rank)
+            items, next_cursor = paginate_offset_cursor(ordered, sort_by, cursor, per_page)
+    except InvalidCursor:
+        return jsonify({"message": "Invalid cursor"}), 400
+
+    cars = _serialize_feed(items, card_fields)
+    return (
+        jsonify(
+            {
+                "cars": cars,
+                "pagination": {
+                    "per_page": per_page,
+                    "next_cursor": next_cursor,
+                    "has_next": next_cursor is not None,
+                    "total": _cursor_total(query),
+                },
+            }
+        ),
+        200,
+    )
+
+
 @bp.route("/api/filters/facets", methods=["GET"])
 def filter_facets():
-    """Cached distinct values for home/search filter dropdowns."""
+    """Distinct values + per-value counts for home/search filter dropdowns.
+
+    Served from the incrementally maintained facet store (never scans ``car``).
+    A single ``brand`` / ``location`` (``city``) / ``body_type`` arg scopes the
+    facets to that filter, e.g. ``?brand=toyota`` -> Toyota listings per city.
+    """
     try:
-        cache_key = filter_facets_cache_key()
-        cached = cache_get(cache_key)
-        if cached is not None:
-            return public_cached_json(cached, max_age=FACETS_TTL_S)
-
-        year_bounds = (
-            _public_listings_filter(
-                db.session.query(func.min(Car.year), func.max(Car.year))
-            ).one()
+        scope = resolve_facet_scope(request.args)
+        payload = get_or_compute(
+            filter_facets_cache_key(scope),
+            lambda: read_listing_facets(scope),
+            FACETS_STORE_CACHE_TTL_S,
         )
-        price_bounds = (
-            _public_listings_filter(
-                db.session.query(func.min(Car.price), func.max(Car.price))
-            ).one()
-        )
-        payload = {
-            "brands": _distinct_public_values(Car.brand),
-            "models": _distinct_public_values(Car.model, limit=500),
-            "locations": _distinct_public_values(Car.location),
-            "body_types": _distinct_public_values(Car.body_type),
-            "conditions": _distinct_public_values(Car.condition),
-            "transmissions": _distinct_public_values(Car.transmission),
-            "drive_types": _distinct_public_values(Car.drive_type),
-            "fuel_types": _distinct_public_values(Car.fuel_type),
-            "colors": _distinct_public_values(Car.color),
-            "title_statuses": _distinct_public_values(Car.title_status),
-            "year_min": int(year_bounds[0]) if year_bounds[0] is not None else None,
-            "year_max": int(year_bounds[1]) if year_bounds[1] is not None else None,
-            "price_min": float(price_bounds[0]) if price_bounds[0] is not None else None,
-            "price_max": float(price_bounds[1]) if price_bounds[1] is not None else None,
-        }
-        cache_set(cache_key, payload, FACETS_TTL_S)
         return public_cached_json(payload, max_age=FACETS_TTL_S)
     except Exception as e:
         current_app.logger.exception("filter_facets failed: %s", e)
@@ -554,14 +558,9 @@ def get_cars():
         plate_type = plate_type_raw if plate_type_raw in _ALLOWED_PLATE_TYPES else None
         plate_city = (request.args.get("plate_city") or request.args.get("plateCity") or "").strip() or None
         text_q = (request.args.get("q") or request.args.get("search") or "").strip()
+        card_fields = parse_card_fields(request.args)
 
-        query = _public_listings_filter(
-            Car.query.options(
-                selectinload(Car.images),
-                selectinload(Car.videos),
-                joinedload(Car.seller),
-            )
-        )
+        query = _public_listings_filter(Car.query.options(*_feed_load_options(card_fields)))
 
         query, search_rank = apply_listing_text_search(query, text_q)
 
@@ -630,10 +629,14 @@ def get_cars():
         sort_by = (request.args.get("sort_by") or "").strip().lower()
         if search_rank is not None and sort_by in ("", "relevance", "rank"):
             sort_by = "relevance"
+
+        if "cursor" in request.args:
+            return _cursor_page_response(query, sort_by, search_rank, per_page, card_fields)
+
         query = _order_cars_query(query, sort_by, rank_expr=search_rank)
 
         pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-        cars = [_with_media_compat(c) for c in pagination.items]
+        cars = _serialize_feed(pagination.items, card_fields)
 
         return (
             jsonify(
@@ -714,13 +717,8 @@ def get_cars_alias():
         drive_type = request.args.get("drive_type")
         engine_type = request.args.get("engine_type")
 
-        query = _public_listings_filter(
-            Car.query.options(
-                selectinload(Car.images),
-                selectinload(Car.videos),
-                joinedload(Car.seller),
-            )
-        )
+        card_fields = parse_card_fields(request.args)
+        query = _public_listings_filter(Car.query.options(*_feed_load_options(card_fields)))
         brands = _split_multi_filter(brand)
         if brands:
             query = query.filter(
@@ -757,6 +755,11 @@ def get_cars_alias():
 
         query = query.order_by(Car.is_featured.desc(), Car.created_at.desc())
         pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        if card_fields is not None:
+            cards = serialize_cards(pagination.items, card_fields)
+            for card, c in zip(cards, pagination.items):
+                card["id"] = c.id
+            return jsonify(cards), 200
         cars = []
         for c in pagination.items:
             d = _with_media_compat(c)
@@ -812,7 +815,7 @@ def get_car(car_id: str):
 
         _increment_views_best_effort(car, current_user)
 
-        car_dict = _with_media_compat(car)
+        car_dict = merge_pending_views([_with_media_compat(car)], [car])[0]
         if not car_dict.get("city") and car_dict.get("location"):
             car_dict["city"] = car_dict["location"]
         return jsonify({"car": car_dict}), 200
@@ -1001,7 +1004,6 @@ def create_car():
 
         db.session.add(car)
         db.session.commit()
-        _bump_filter_facets_cache()
         log_user_action(current_user, "create_listing", "car", car.public_id)
         if car.is_active and (car.status or "active") == "active":
             try:
@@ -1222,7 +1224,6 @@ def update_car(car_id: str):
 
         car.updated_at = utcnow()
         db.session.commit()
-        _bump_filter_facets_cache()
         log_user_action(current_user, "update_listing", "car", car.public_id)
         if "price" in data:
             new_price = float(car.price or 0)
@@ -1270,7 +1271,6 @@ def delete_car(car_id: str):
         car.is_active = False
         car.updated_at = utcnow()
         db.session.commit()
-        _bump_filter_facets_cache()
         log_user_action(current_user, "delete_listing", "car", car.public_id)
         return jsonify({"message": "Car listing deleted successfully"}), 200
     except Exception:
@@ -1295,7 +1295,6 @@ def mark_car_sold(car_id: str):
         car.status = "sold"
         car.updated_at = utcnow()
         db.session.commit()
-        _bump_filter_facets_cache()
         log_user_action(current_user, "mark_listing_sold", "car", car.public_id)
         return jsonify({"message": "Listing marked as sold", "car": car.to_dict()}), 200
     except Exception:
@@ -1334,7 +1333,6 @@ def mark_car_active(car_id: str):
         car.status = "active"
         car.updated_at = utcnow()
         db.session.commit()
-        _bump_filter_facets_cache()
         log_user_action(current_user, "mark_listing_active", "car", car.public_id)
         return jsonify({"message": "Listing marked as available", "car": car.to_dict()}), 200
     except Exception:
@@ -1357,14 +1355,21 @@ def get_my_listings():
         if status not in {"", "active", "sold", "pending", "hidden", "draft"}:
             return jsonify({"message": "Invalid listing status"}), 400
 
+        card_fields = parse_card_fields(request.args)
         query = Car.query.filter_by(seller_id=current_user.id, is_active=True)
+        if card_fields is not None:
+            query = query.options(*card_query_options(card_fields))
         if status:
             query = query.filter(Car.status == status)
         pagination = query.order_by(Car.created_at.desc()).paginate(
             page=page,
             per_page=per_page,
         )
-        cars = [car.to_dict(include_private=True) for car in pagination.items]
+        if card_fields is not None:
+            cars = serialize_cards(pagination.items, card_fields)
+        else:
+            cars = [car.to_dict(include_private=True) for car in pagination.items]
+        merge_pending_views(cars, pagination.items)
         return (
             jsonify(
                 {
@@ -1394,11 +1399,16 @@ def compat_my_listings():
         if not current_user:
             return jsonify({"message": "Unauthorized"}), 401
 
-        cars = (
-            Car.query.filter_by(seller_id=current_user.id, is_active=True)
-            .order_by(Car.created_at.desc())
-            .all()
-        )
+        card_fields = parse_card_fields(request.args)
+        query = Car.query.filter_by(seller_id=current_user.id, is_active=True)
+        if card_fields is not None:
+            query = query.options(*card_query_options(card_fields))
+        cars = query.order_by(Car.created_at.desc()).all()
+        if card_fields is not None:
+            cards = merge_pending_views(serialize_cards(cars, card_fields), cars)
+            for card, car in zip(cards, cars):
+                card["numeric_id"] = car.id
+            return jsonify(cards), 200
         result = []
         for car in cars:
             d = _with_media_compat(car)
@@ -1408,7 +1418,7 @@ def compat_my_listings():
             if not d.get("title"):
                 d["title"] = f"{(car.brand or '').title()} {(car.model or '').title()} {car.year or ''}".strip()
             result.append(d)
-        return jsonify(result), 200
+        return jsonify(merge_pending_views(result, cars)), 200
     except Exception:
         return jsonify({"message": "Failed to get your listings"}), 500
 
@@ -7,21 +7,34 @@ import secrets
 
 from flask import Blueprint, current_app, jsonify, request
 from flask_jwt_extended import jwt_required
-from sqlalchemy import func, or_
-from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import joinedload, lazyload, selectinload
 from werkzeug.exceptions import RequestEntityTooLarge
 
+from .. import presence
 from ..auth import get_current_user, phone_verification_required_response
+from ..chat_cache import ChatIdentity
+from ..chat_push import queue_chat_push
+from ..chat_conversations import (
+    inbox_page,
+    record_message,
+    record_message_deleted,
+    record_message_edited,
+)
 from ..chat_realtime import (
+    drop_presence_subscriptions,
     emit_message_to_participants,
-    mark_messages_read_for_viewer,
+    message_payloads,
     resolve_allowed_chat_receiver,
+    schedule_mark_read,
 )
-from ..models import BlockedUser, Car, Message, User, UserReport, db
+from ..listing_pagination import InvalidCursor, decode_cursor, encode_cursor
+from ..models import BlockedUser, Car, Conversation, Message, User, UserReport, db
 from ..push import fcm_is_configured, fcm_send_error_hint, last_fcm_send_error, send_push
 from ..security import rate_limit, validate_input_sanitization
 from ..time_utils import utcnow
-from .media import _pick_primary_listing_url
+from ..image_renditions import image_srcset
+from .media import _pick_primary_listing_image, _pick_primary_listing_url
 
 bp = Blueprint("chat", __name__)
 
@@ -31,7 +44,7 @@ _CHAT_AUDIO_EXTENSIONS = {".m4a", ".aac", ".mp3", ".wav", ".ogg", ".webm", ".amr
 _CHAT_ATTACHMENT_EXTENSIONS = _CHAT_IMAGE_EXTENSIONS | _CHAT_VIDEO_EXTENSIONS
 
 
-def _resolve_chat_receiver(me: User, car: Car, receiver_public: str | None) -> User | None:
+def _resolve_chat_receiver(me: User, car: Car, receiver_public: str | None) -> ChatIdentity | None:
     return resolve_allowed_chat_receiver(me, car, receiver_public)
 
 
@@ -44,6 +57,33 @@ def _count_buyer_message_metric(car: Car, sender: User) -> None:
         pass
 
 
+def _store_message(msg: Message, car: Car, me: User, receiver, *, push: bool) -> dict:
+    """
+    INSERT the message, update its conversation and commit; returns the API payload.
+
+    The payload and metric fields are taken before the commit so nothing is
+    reloaded afterwards. The push is queued (``kk.chat_push``), never sent inline;
+    the receiver's FCM token comes from ``kk.chat_cache``.
+    """
+    db.session.add(msg)
+    record_message(msg, car)
+    payload = message_payloads(
+        [msg],
+        car,
+        users={me.id: me, receiver.id: receiver},
+        parents={msg.reply_to.id: msg.reply_to} if msg.reply_to_id and msg.reply_to else None,
+    )[0]
+    sender = ChatIdentity.from_user(me)
+    car_public_id = car.public_id
+    push_body = msg.content or ""
+    _count_buyer_message_metric(car, me)
+    db.session.commit()
+
+    if push:
+        queue_chat_push(receiver, sender, car_public_id, push_body)
+    return payload
+
+
 def _first_car_image_rel_path(car: Car | None) -> str | None:
     """Primary listing photo path/URL for chat list avatars (same rules as car list API)."""
     if not car:
@@ -64,6 +104,16 @@ def _first_car_image_rel_path(car: Car | None) -> str | None:
     return norm
 
 
+def _first_car_image_srcset(car: Car | None) -> dict | None:
+    """Srcset map of the chat avatar photo (small renditions for list thumbnails)."""
+    if not car:
+        return None
+    img = _pick_primary_listing_image(car)
+    if img is None and car.images:
+        img = car.images[0]
+    return image_srcset(img)
+
+
 def _upload_chat_attachment(file_storage, *, allowed_extensions: set[str], subdir: str, content_types: dict[str, str]) -> str:
     ext = os.path.splitext(file_storage.filename or "")[1].lower()
     if ext not in allowed_extensions:
@@ -211,132 +261,132 @@ def _emit_message_update(msg: Message, event_name: str, payload: dict) -> None:
         pass
 
 
+_LEGACY_CHAT_LIST_LIMIT = 500
+
+
+def _chat_list_item(conv, me: User) -> dict:
+    m = conv.last_message
+    car = conv.car
+    is_buyer = conv.buyer_id == me.id
+    other = conv.seller if is_buyer else conv.buyer
+    unread = conv.buyer_unread if is_buyer else conv.seller_unread
+
+    car_title = None
+    car_image_url = None
+    car_image_srcset = None
+    if car:
+        car_title = getattr(car, "title", None) or ""
+        if not car_title.strip():
+            car_title = f"{car.brand} {car.model} {car.year}".strip()
+        car_image_url = _first_car_image_rel_path(car)
+        car_image_srcset = _first_car_image_srcset(car)
+
+    return {
+        "conversation_id": int(conv.car_id or 0),
+        "car_id": car.public_id if car else None,
+        "car_title": car_title,
+        "car_brand": car.brand if car else None,
+        "car_model": car.model if car else None,
+        "car_trim": getattr(car, "trim", None) if car else None,
+        "car_year": car.year if car else None,
+        "car_image_url": car_image_url,
+        "car_image_srcset": car_image_srcset,
+        "other_user": {
+            "id": other.public_id if other else None,
+            "name": (f"{other.first_name} {other.last_name}".strip() if other else None),
+        },
+        "last_message": {
+            "id": m.public_id if m else None,
+            "content": m.content if m else None,
+            "message_type": m.message_type if m else None,
+            "created_at": m.created_at.isoformat() if m and m.created_at else None,
+            "sender_id": m.sender.public_id if m and m.sender else None,
+        },
+        "unread_count": int(unread or 0),
+    }
+
+
 @bp.route("/api/chats", methods=["GET"])
 @jwt_required()
 def list_chats():
     """
-    Return a lightweight list of recent conversations for the current user.
+    Return the current user's conversations, most recent first.
 
-    This is a compatibility endpoint (legacy backend previously exposed it).
+    Reads the materialized ``conversation`` table (one indexed query per page).
+    Without ``cursor`` the response is the legacy bare list of the newest
+    conversations; pass ``cursor=`` (empty for the first page) and optional
+    ``per_page`` (default 30, max 100) to get
+    ``{"chats": [...], "next_cursor": ..., "has_next": ...}``.
     """
     try:
         me = get_current_user()
         if not me:
             return jsonify({"message": "Unauthorized"}), 401
 
-        blocked_ids = {
-            b.blocked_id
-            for b in BlockedUser.query.filter_by(blocker_id=me.id).all()
-        }
-
-        q = (
-            Message.query.options(joinedload(Message.sender))
-            .filter(or_(Message.sender_id == me.id, Message.receiver_id == me.id))
-            .order_by(Message.created_at.desc())
-            .limit(500)
-            .all()
+        cursor_mode = "cursor" in request.args
+        after = None
+        if cursor_mode:
+            per_page = min(max(request.args.get("per_page", 30, type=int) or 30, 1), 100)
+            try:
+                cursor = decode_cursor(request.args.get("cursor"))
+                if cursor is not None:
+                    if cursor.get("s") != "chats" or not isinstance(cursor.get("k"), list) or len(cursor["k"]) != 2:
+                        raise InvalidCursor("cursor does not match chats")
+                    after = (datetime.fromisoformat(str(cursor["k"][0])), int(cursor["k"][1]))
+            except (InvalidCursor, TypeError, ValueError):
+                return jsonify({"message": "Invalid cursor"}), 400
+        else:
+            per_page = _LEGACY_CHAT_LIST_LIMIT
+
+        rows, has_next = inbox_page(
+            me.id,
+            per_page,
+            after,
+            options=(
+                selectinload(Conversation.car).selectinload(Car.images),
+                selectinload(Conversation.buyer),
+                selectinload(Conversation.seller),
+                selectinload(Conversation.last_message).joinedload(Message.sender),
+            ),
         )
-        seen = set()
-        conversation_rows = []
-        other_ids = set()
-        car_ids = set()
-        for m in q:
-            other_id = m.receiver_id if m.sender_id == me.id else m.sender_id
-            if other_id in blocked_ids:
-                continue
-            key = (m.car_id or 0, int(other_id))
-            if key in seen:
-                continue
-            seen.add(key)
-            conversation_rows.append((m, other_id))
-            other_ids.add(int(other_id))
-            if m.car_id:
-                car_ids.add(int(m.car_id))
-
-        users_by_id = {
-            u.id: u
-            for u in User.query.filter(User.id.in_(other_ids)).all()
-        } if other_ids else {}
-        cars_by_id = {
-            c.id: c
-            for c in Car.query.options(selectinload(Car.images))
-            .filter(Car.id.in_(car_ids))
-            .all()
-        } if car_ids else {}
-
-        unread_by_key: dict[tuple[int, int], int] = {}
-        if car_ids and other_ids:
-            unread_rows = (
-                db.session.query(
-                    Message.car_id,
-                    Message.sender_id,
-                    func.count(Message.id),
-                )
-                .filter(
-                    Message.receiver_id == me.id,
-                    Message.is_read == False,  # noqa: E712
-                    Message.car_id.in_(car_ids),
-                    Message.sender_id.in_(other_ids),
-                )
-                .group_by(Message.car_id, Message.sender_id)
-                .all()
-            )
-            for car_id, sender_id, cnt in unread_rows:
-                unread_by_key[(int(car_id or 0), int(sender_id))] = int(cnt or 0)
-
-        chats = []
-        for m, other_id in conversation_rows:
-            other = users_by_id.get(int(other_id))
-            car = cars_by_id.get(int(m.car_id)) if m.car_id else None
-            unread = unread_by_key.get((int(m.car_id or 0), int(other_id)), 0) if m.car_id else 0
-
-            car_title = None
-            car_image_url = None
-            if car:
-                car_title = getattr(car, "title", None) or ""
-                if not car_title.strip():
-                    car_title = f"{car.brand} {car.model} {car.year}".strip()
-                car_image_url = _first_car_image_rel_path(car)
-
-            chats.append(
-                {
-                    "conversation_id": int(m.car_id or 0),
-                    "car_id": car.public_id if car else None,
-                    "car_title": car_title,
-                    "car_brand": car.brand if car else None,
-                    "car_model": car.model if car else None,
-                    "car_trim": getattr(car, "trim", None) if car else None,
-                    "car_year": car.year if car else None,
-                    "car_image_url": car_image_url,
-                    "other_user": {
-                        "id": other.public_id if other else None,
-                        "name": (f"{other.first_name} {other.last_name}".strip() if other else None),
-                    },
-                    "last_message": {
-                        "id": m.public_id,
-                        "content": m.content,
-                        "message_type": m.message_type,
-                        "created_at": m.created_at.isoformat() if m.created_at else None,
-                        "sender_id": m.sender.public_id if m.sender else None,
-                    },
-                    "unread_count": int(unread or 0),
-                }
-            )
 
-        return jsonify(chats), 200
+        chats = [_chat_list_item(c, me) for c in rows]
+        if not cursor_mode:
+            return jsonify(chats), 200
+
+        next_cursor = None
+        if has_next and rows:
+            last = rows[-1]
+            next_cursor = encode_cursor({"s": "chats", "k": [last.last_message_at.isoformat(), last.id]})
+        return jsonify({"chats": chats, "next_cursor": next_cursor, "has_next": next_cursor is not None}), 200
     except Exception:
         return jsonify({"message": "Failed to load chats"}), 500
 
 
+def _message_anchor(car: Car, public_id: str):
+    return (
+        db.session.query(Message.id, Message.created_at)
+        .filter(Message.public_id == public_id, Message.car_id == car.id)
+        .first()
+    )
+
+
 @bp.route("/api/chat/<conversation_id>/messages", methods=["GET"])
 @jwt_required()
 def get_messages(conversation_id: str):
-    """Fetch messages for a conversation with optional pagination.
+    """Fetch message history for a conversation.
 
-    Query params:
-        page (int, default 1): Page number (1-indexed).
+    Cursor mode (default), over ``ix_message_car_created_at``:
+        before_id (str, optional): message id; return older messages, newest first.
+        after_id (str, optional): message id; return newer messages, oldest first.
         per_page (int, default 50): Messages per page (max 200).
-        before (str, optional): ISO timestamp – fetch only messages created before this.
+    Without either id the newest page is returned. The response carries
+    ``has_more`` and ``next_before_id`` / ``next_after_id``; there is no total.
+
+    Legacy mode, when ``page`` or ``before`` (ISO timestamp) is given: oldest
+    first with ``page``/``per_page`` offsets, as older app builds expect.
+
+    Read marking is queued (``kk.chat_realtime.schedule_mark_read``), not done here.
     """
     try:
         me = get_current_user()
@@ -347,56 +397,86 @@ def get_messages(conversation_id: str):
         if not car:
             return jsonify({"message": "Listing not found"}), 404
 
-        page = max(int(request.args.get("page", 1)), 1)
-        per_page = min(max(int(request.args.get("per_page", 50)), 1), 200)
-
-        blocked_ids = [
-            b.blocked_id
-            for b in BlockedUser.query.filter_by(blocker_id=me.id).all()
-        ]
+        per_page = min(max(request.args.get("per_page", 50, type=int) or 50, 1), 200)
 
-        base_q = Message.query.filter(
+        blocked = select(BlockedUser.blocked_id).where(BlockedUser.blocker_id == me.id)
+        base_q = Message.query.options(lazyload(Message.reply_to)).filter(
             Message.car_id == car.id,
             or_(Message.sender_id == me.id, Message.receiver_id == me.id),
+            Message.sender_id.not_in(blocked),
         )
-        if blocked_ids:
-            base_q = base_q.filter(~Message.sender_id.in_(blocked_ids))
 
-        before_raw = (request.args.get("before") or "").strip()
-        if before_raw:
-            try:
-                before_dt = datetime.fromisoformat(before_raw.replace("Z", "+00:00"))
-                base_q = base_q.filter(Message.created_at < before_dt)
-            except Exception:
-                pass
-
-        total = base_q.count()
-        msgs = (
-            base_q.options(
-                joinedload(Message.sender),
-                joinedload(Message.receiver),
-                joinedload(Message.car),
-                joinedload(Message.reply_to).joinedload(Message.sender),
+        legacy = "page" in request.args or "before" in request.args
+        body: dict = {"per_page": per_page}
+        if legacy:
+            page = max(request.args.get("page", 1, type=int) or 1, 1)
+            before_raw = (request.args.get("before") or "").strip()
+            if before_raw:
+                try:
+                    before_dt = datetime.fromisoformat(before_raw.replace("Z", "+00:00"))
+                    base_q = base_q.filter(Message.created_at < before_dt)
+                except Exception:
+                    pass
+            rows = (
+                base_q.order_by(Message.created_at.asc(), Message.id.asc())
+                .offset((page - 1) * per_page)
+                .limit(per_page + 1)
+                .all()
             )
-            .order_by(Message.created_at.asc())
-            .offset((page - 1) * per_page)
-            .limit(per_page)
-            .all()
-        )
+            body["page"] = page
+        else:
+            before_id = (request.args.get("before_id") or "").strip()
+            after_id = (request.args.get("after_id") or "").strip()
+            if before_id and after_id:
+                return jsonify({"message": "Use either before_id or after_id"}), 400
+            anchor_id = after_id or before_id
+            anchor = _message_anchor(car, anchor_id) if anchor_id else None
+            if anchor_id and anchor is None:
+                return jsonify({"message": "Unknown message cursor"}), 400
+            if after_id:
+                rows = (
+                    base_q.filter(
+                        or_(
+                            Message.created_at > anchor.created_at,
+                            and_(Message.created_at == anchor.created_at, Message.id > anchor.id),
+                        )
+                    )
+                    .order_by(Message.created_at.asc(), Message.id.asc())
+                    .limit(per_page + 1)
+                    .all()
+                )
+            else:
+                if anchor is not None:
+                    base_q = base_q.filter(
+                        or_(
+                            Message.created_at < anchor.created_at,
+                            and_(Message.created_at == anchor.created_at, Message.id < anchor.id),
+                        )
+                    )
+                rows = (
+                    base_q.order_by(Message.created_at.desc(), Message.id.desc())
+                    .limit(per_page + 1)
+                    .all()
+                )
+
+        has_more = len(rows) > per_page
+        msgs = rows[:per_page]
+        body["has_more"] = has_more
+        if not legacy:
+            last_id = msgs[-1].public_id if (has_more and msgs) else None
+            body["next_after_id" if after_id else "next_before_id"] = last_id
 
-        # Mark messages to me as read and notify senders (read receipts).
+        # Serialize before read marking: its commit would expire every loaded row.
+        body["messages"] = message_payloads(msgs, car)
+
+        # Mark messages to me as read and notify senders (read receipts), off the request path.
         try:
-            mark_messages_read_for_viewer(car, me)
+            schedule_mark_read(car, me)
         except Exception:
             db.session.rollback()
+            current_app.logger.warning("chat read marking failed for car %s", car.public_id, exc_info=True)
 
-        return jsonify({
-            "messages": [m.to_dict() for m in msgs],
-            "page": page,
-            "per_page": per_page,
-            "total": total,
-            "has_more": (page * per_page) < total,
-        }), 200
+        return jsonify(body), 200
     except Exception:
         return jsonify({"message": "Failed to load messages"}), 500
 
@@ -446,28 +526,8 @@ def send_message(conversation_id: str):
             listing_preview=listing_preview if isinstance(listing_preview, dict) else None,
             is_read=False,
         )
-        db.session.add(msg)
-        db.session.commit()
-        db.session.refresh(msg)
-
-        _count_buyer_message_metric(car, me)
-
-        # Best-effort FCM push to receiver's device.
-        try:
-            db.session.refresh(receiver)
-            fcm_token = getattr(receiver, "firebase_token", None)
-            if fcm_token:
-                sender_name = f"{me.first_name} {me.last_name}".strip() or "Someone"
-                send_push(
-                    fcm_token,
-                    title=f"New message from {sender_name}",
-                    body=content[:200],
-                    data={"car_id": car.public_id, "sender_id": me.public_id, "type": "chat_message"},
-                )
-        except Exception:
-            pass
-
-        return jsonify({"success": True, "message": msg.to_dict()}), 201
+        payload = _store_message(msg, car, me, receiver, push=True)
+        return jsonify({"success": True, "message": payload}), 201
     except Exception:
         db.session.rollback()
         return jsonify({"message": "Failed to send message"}), 500
@@ -541,11 +601,8 @@ def send_image_message(conversation_id: str):
             attachment_url=attachment_url,
             is_read=False,
         )
-        db.session.add(msg)
-        db.session.commit()
-        db.session.refresh(msg)
-        _count_buyer_message_metric(car, me)
-        return jsonify({"success": True, "message": msg.to_dict()}), 201
+        payload = _store_message(msg, car, me, receiver, push=False)
+        return jsonify({"success": True, "message": payload}), 201
     except Exception:
         db.session.rollback()
         return jsonify({"message": "Failed to send image message"}), 500
@@ -619,11 +676,8 @@ def send_video_message(conversation_id: str):
             attachment_url=attachment_url,
             is_read=False,
         )
-        db.session.add(msg)
-        db.session.commit()
-        db.session.refresh(msg)
-        _count_buyer_message_metric(car, me)
-        return jsonify({"success": True, "message": msg.to_dict()}), 201
+        payload = _store_message(msg, car, me, receiver, push=False)
+        return jsonify({"success": True, "message": payload}), 201
     except Exception:
         db.session.rollback()
         return jsonify({"message": "Failed to send video message"}), 500
@@ -700,26 +754,8 @@ def send_audio_message(conversation_id: str):
             attachment_url=attachment_url,
             is_read=False,
         )
-        db.session.add(msg)
-        db.session.commit()
-        db.session.refresh(msg)
-        _count_buyer_message_metric(car, me)
-
-        try:
-            db.session.refresh(receiver)
-            fcm_token = getattr(receiver, "firebase_token", None)
-            if fcm_token:
-                sender_name = f"{me.first_name} {me.last_name}".strip() or "Someone"
-                send_push(
-                    fcm_token,
-                    title=f"New message from {sender_name}",
-                    body=content[:200],
-                    data={"car_id": car.public_id, "sender_id": me.public_id, "type": "chat_message"},
-                )
-        except Exception:
-            pass
-
-        return jsonify({"success": True, "message": msg.to_dict()}), 201
+        payload = _store_message(msg, car, me, receiver, push=True)
+        return jsonify({"success": True, "message": payload}), 201
     except Exception:
         db.session.rollback()
         return jsonify({"message": "Failed to send audio message"}), 500
@@ -809,26 +845,8 @@ def send_media_group_message(conversation_id: str):
             listing_preview=listing_preview,
             is_read=False,
         )
-        db.session.add(msg)
-        db.session.commit()
-        db.session.refresh(msg)
-        _count_buyer_message_metric(car, me)
-
-        try:
-            db.session.refresh(receiver)
-            fcm_token = getattr(receiver, "firebase_token", None)
-            if fcm_token:
-                sender_name = f"{me.first_name} {me.last_name}".strip() or "Someone"
-                send_push(
-                    fcm_token,
-                    title=f"New message from {sender_name}",
-                    body=content[:200],
-                    data={"car_id": car.public_id, "sender_id": me.public_id, "type": "chat_message"},
-                )
-        except Exception:
-            pass
-
-        return jsonify({"success": True, "message": msg.to_dict()}), 201
+        payload = _store_message(msg, car, me, receiver, push=True)
+        return jsonify({"success": True, "message": payload}), 201
     except RequestEntityTooLarge:
         db.session.rollback()
         max_mb = _max_upload_mb()
@@ -917,6 +935,7 @@ def edit_chat_message(message_id: str):
                 return jsonify({"message": "content required"}), 400
 
         msg.edited_at = utcnow()
+        record_message_edited(msg)
         db.session.commit()
 
         payload = msg.to_dict()
@@ -943,6 +962,7 @@ def delete_chat_message(message_id: str):
         if msg.is_deleted:
             return jsonify({"success": True, "message": msg.to_dict()}), 200
 
+        record_message_deleted(msg)
         msg.content = ""
         msg.attachment_url = None
         msg.attachments = []
@@ -1000,6 +1020,7 @@ def block_user(user_id: str):
 
         db.session.add(BlockedUser(blocker_id=me.id, blocked_id=target.id))
         db.session.commit()
+        drop_presence_subscriptions(me, target)
         return jsonify({"message": "User blocked"}), 201
     except Exception:
         db.session.rollback()
@@ -1101,6 +1122,21 @@ def register_push_token():
         return jsonify({"message": "Failed to register token"}), 500
 
 
+@bp.route("/api/users/presence", methods=["POST"])
+@jwt_required()
+@rate_limit(max_requests=120, window_minutes=10, per_ip=False)
+def users_presence():
+    """Online state and last-seen time for up to 200 users (e.g. the chat list's peers)."""
+    me = get_current_user()
+    if not me:
+        return jsonify({"message": "Unauthorized"}), 401
+    data = request.get_json(silent=True) or {}
+    user_ids = data.get("user_ids")
+    if not isinstance(user_ids, list):
+        return jsonify({"message": "user_ids must be a list"}), 400
+    return jsonify({"users": presence.lookup(presence.visible_users(me, user_ids))}), 200
+
+
 @bp.route("/api/users/push_status", methods=["GET"])
 @jwt_required()
 def push_status():
@@ -5,6 +5,7 @@ from flask_jwt_extended import jwt_required
 from sqlalchemy import update as sql_update
 
 from ..auth import get_current_user, log_user_action
+from ..listing_cards import card_query_options, parse_card_fields, serialize_cards
 from ..models import Car, db, user_favorites
 from ..time_utils import utcnow
 
@@ -23,6 +24,7 @@ def get_favorites():
         page = max(request.args.get("page", 1, type=int) or 1, 1)
         per_page = min(max(request.args.get("per_page", 20, type=int) or 20, 1), 50)
 
+        card_fields = parse_card_fields(request.args)
         # Order by "favorited at" so newest favorites appear first.
         q = (
             db.session.query(
@@ -36,11 +38,16 @@ def get_favorites():
             )
             .order_by(user_favorites.c.created_at.desc())
         )
+        if card_fields is not None:
+            q = q.options(*card_query_options(card_fields))
         pagination = q.paginate(page=page, per_page=per_page, error_out=False)
 
+        if card_fields is not None:
+            rows = serialize_cards([car for car, _ in pagination.items], card_fields)
+        else:
+            rows = [car.to_dict() for car, _ in pagination.items]
         cars = []
-        for car, fav_at in pagination.items:
-            d = car.to_dict()
+        for d, (_car, fav_at) in zip(rows, pagination.items):
             if fav_at is not None:
                 try:
                     d["favorited_at"] = fav_at.isoformat()
@@ -9,9 +9,17 @@ from flask_jwt_extended import jwt_required
 from werkzeug.utils import safe_join
 
 from ..auth import get_current_user, log_user_action, phone_verification_required_response
-from ..media_processing import process_and_store_image
+from ..media_processing import process_images_concurrently
 from ..models import Car, CarImage, CarVideo, db
 from ..security import generate_secure_filename, validate_file_upload, rate_limit
+from ..video_ingest import (
+    VideoTooLarge,
+    enqueue_video_processing,
+    read_chunks,
+    store_video,
+    video_content_type,
+    video_max_bytes,
+)
 
 bp = Blueprint("media", __name__)
 
@@ -31,22 +39,8 @@ def _r2_public_base() -> str:
     return (current_app.config.get("R2_PUBLIC_URL") or "").strip().rstrip("/")
 
 
-def _r2_ready_for_public_object_urls() -> bool:
-    """Upload objects to R2 and expose them via R2_PUBLIC_URL (custom domain or r2.dev)."""
-    return _r2_configured() and bool(_r2_public_base())
-
-
 def _video_content_type_for_ext(ext: str) -> str:
-    ext = (ext or "").lower()
-    if not ext.startswith("."):
-        ext = "." + ext
-    return {
-        ".mp4": "video/mp4",
-        ".mov": "video/quicktime",
-        ".webm": "video/webm",
-        ".mkv": "video/x-matroska",
-        ".avi": "video/x-msvideo",
-    }.get(ext, "application/octet-stream")
+    return video_content_type(ext)
 
 
 _ALLOWED_IMAGE_CONTENT_TYPES = frozenset(
@@ -117,36 +111,6 @@ def _http_url_owned_by_user(url: str, user_id: int) -> bool:
     )
 
 
-def _upload_video_file_to_r2(file_storage) -> str:
-    """
-    Read validated multipart file, put to R2, return public HTTPS URL for DB storage.
-    Caller must ensure stream is at position 0 or call seek(0) after validation.
-    """
-    public_base = _r2_public_base()
-    if not public_base:
-        raise RuntimeError("R2_PUBLIC_URL is not set")
-
-    raw_name = (file_storage.filename or "video.mp4").strip()
-    ext = os.path.splitext(raw_name)[1].lower() or ".mp4"
-    if ext not in (".mp4", ".mov", ".avi", ".mkv", ".webm"):
-        ext = ".mp4"
-    key = f"car_videos/{secrets.token_hex(16)}{ext}"
-
-    try:
-        file_storage.seek(0)
-    except Exception:
-        pass
-    body = file_storage.read()
-    if not body:
-        raise RuntimeError("Empty file body")
-
-    from ..r2_ops import r2_put_bytes
-
-    ct = _video_content_type_for_ext(ext)
-    r2_put_bytes(key=key, body=body, content_type=ct, timeout=180)
-    return f"{public_base}/{key}"
-
-
 def _get_car_by_any_id(car_id: str):
     car = Car.query.filter_by(public_id=car_id).first()
     if not car and str(car_id).isdigit():
@@ -174,7 +138,7 @@ def _count_listing_images(car: Car) -> int:
         return 0
 
 
-def _pick_primary_listing_url(car: Car):
+def _pick_primary_listing_image(car: Car):
     """Prefer primary among listing photos; never use damage-only rows as hero."""
     try:
         for img in car.images:
@@ -182,15 +146,20 @@ def _pick_primary_listing_url(car: Car):
                 getattr(img, "is_primary", False)
                 and _normalize_car_image_kind(getattr(img, "kind", None)) == "listing"
             ):
-                return img.image_url
+                return img
         for img in car.images:
             if _normalize_car_image_kind(getattr(img, "kind", None)) == "listing":
-                return img.image_url
+                return img
         return None
     except Exception:
         return None
 
 
+def _pick_primary_listing_url(car: Car):
+    img = _pick_primary_listing_image(car)
+    return img.image_url if img is not None else None
+
+
 def _normalize_image_match_key(url: str) -> str:
     """Normalize stored or client image refs for fuzzy equality checks."""
     from urllib.parse import urlparse
@@ -440,6 +409,59 @@ def r2_sign_upload():
         return jsonify({"message": "Failed to generate upload URL"}), 500
 
 
+def _enqueue_car_image_jobs(car: Car, files, *, skip_blur: bool, kind: str, owner):
+    """Save uploads to shared temp storage and hand each to ``process_car_image_file``."""
+    from uuid import uuid4
+
+    from ..job_ownership import register_job_owner
+    from ..tasks.image_tasks import process_car_image_file
+    from ..time_utils import utcnow
+
+    job_ids = []
+    # Decide the primary here, like the synchronous path, rather than in each parallel task.
+    needs_primary = kind == "listing" and _count_listing_images(car) == 0
+    for fs in files:
+        filename = generate_secure_filename(fs.filename)
+        ts = utcnow().strftime("%Y%m%d_%H%M%S_%f")
+        temp_abs = os.path.join(current_app.config["UPLOAD_FOLDER"], f"temp/celery_{ts}_{uuid4().hex}_{filename}")
+        os.makedirs(os.path.dirname(temp_abs), exist_ok=True)
+        fs.save(temp_abs)
+        try:
+            res = process_car_image_file.delay(
+                temp_abs,
+                fs.filename,
+                False,
+                skip_blur,
+                owner_public_id=owner.public_id,
+                car_id=car.id,
+                kind=kind,
+                is_primary=needs_primary,
+            )
+        except Exception:
+            current_app.logger.exception("enqueue car image job failed")
+            try:
+                os.remove(temp_abs)
+            except OSError:
+                pass
+            if not job_ids:
+                return jsonify({"message": "Background processing is unavailable. Upload without async."}), 503
+            break
+        register_job_owner(res.id, owner.public_id)
+        job_ids.append(res.id)
+        needs_primary = False
+
+    log_user_action(owner, "upload_images", "car", car.public_id)
+    return (
+        jsonify(
+            {
+                "message": f"{len(job_ids)} images queued for processing",
+                "job_ids": job_ids,
+            }
+        ),
+        202,
+    )
+
+
 @bp.route("/api/cars/<car_id>/images", methods=["POST"])
 @jwt_required()
 @rate_limit(max_requests=60, window_minutes=60, per_ip=False)
@@ -475,6 +497,7 @@ def upload_car_images(car_id: str):
         skip_blur = bool(requested_skip)
         upload_kind = _normalize_car_image_kind(request.args.get("kind"))
 
+        valid_files = []
         for fs in incoming_files:
             if not fs or not fs.filename:
                 skip_reasons.append("Missing filename")
@@ -488,24 +511,48 @@ def upload_car_images(car_id: str):
             if not is_valid:
                 skip_reasons.append(msg or "Invalid file")
                 continue
+            valid_files.append(fs)
+
+        if valid_files and (request.args.get("async") or "").strip().lower() in ("1", "true", "yes", "on"):
+            return _enqueue_car_image_jobs(
+                car, valid_files, skip_blur=skip_blur, kind=upload_kind, owner=current_user
+            )
 
-            rel_path, _b64 = process_and_store_image(fs, inline_base64=False, skip_blur=skip_blur)
-            listing_n = _count_listing_images(car)
-            is_primary = upload_kind == "listing" and listing_n == 0
+        # Decode / blur / resize / upload run concurrently on the shared image pool;
+        # each file is read by its worker, so in-flight bytes are bounded by the pool size.
+        results = process_images_concurrently(
+            [(fs, fs.filename) for fs in valid_files],
+            skip_blur=skip_blur,
+            renditions=True,
+        )
+        needs_primary = upload_kind == "listing" and _count_listing_images(car) == 0
+        first_error = None
+        for result in results:
+            if isinstance(result, BaseException):
+                first_error = first_error or result
+                skip_reasons.append("Processing failed")
+                continue
             car_image = CarImage(
                 car_id=car.id,
-                image_url=rel_path,
-                is_primary=is_primary,
+                image_url=result.rel_path,
+                is_primary=needs_primary,
                 kind=upload_kind,
+                renditions=result.renditions,
+                image_width=result.width,
+                image_height=result.height,
             )
+            needs_primary = False
             db.session.add(car_image)
-            uploaded_images.append(car_image.to_dict())
+            uploaded_images.append(car_image)
 
         db.session.commit()
 
         if not uploaded_images:
+            if first_error is not None:
+                raise first_error
             detail = skip_reasons[0] if skip_reasons else "file type/size"
             return jsonify({"message": f"No valid images were uploaded ({detail})."}), 400
+        uploaded_images = [ci.to_dict() for ci in uploaded_images]
 
         log_user_action(current_user, "upload_images", "car", car.public_id)
 
@@ -715,36 +762,28 @@ def upload_car_videos(car_id: str):
                     f.filename = f"{f.filename}{inferred}"
             is_valid, msg = validate_file_upload(
                 f,
-                max_size_mb=100,
+                max_size_mb=video_max_bytes() // (1024 * 1024),
                 allowed_extensions=current_app.config["ALLOWED_VIDEO_EXTENSIONS"],
             )
             if not is_valid:
                 rejected.append({"filename": f.filename, "reason": msg})
                 continue
 
-            if _r2_ready_for_public_object_urls():
-                try:
-                    stored_url = _upload_video_file_to_r2(f)
-                except Exception as e:
-                    current_app.logger.exception("R2 video upload failed: %s", e)
-                    rejected.append(
-                        {"filename": f.filename, "reason": f"R2 upload failed: {e!s}"}
-                    )
-                    continue
-                car_video = CarVideo(car_id=car.id, video_url=stored_url)
-            else:
-                filename = generate_secure_filename(f.filename)
-                file_path = os.path.join(
-                    current_app.config["UPLOAD_FOLDER"], "car_videos", filename
-                )
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                f.save(file_path)
-                car_video = CarVideo(
-                    car_id=car.id, video_url=f"uploads/car_videos/{filename}"
-                )
-
+            try:
+                f.stream.seek(0)
+                stored_url, size = store_video(read_chunks(f.stream), filename=f.filename)
+            except (VideoTooLarge, ValueError) as e:
+                rejected.append({"filename": f.filename, "reason": str(e)})
+                continue
+            except Exception as e:
+                current_app.logger.exception("video upload failed: %s", e)
+                rejected.append({"filename": f.filename, "reason": f"Upload failed: {e!s}"})
+                continue
+            car_video = CarVideo(
+                car_id=car.id, video_url=stored_url, size_bytes=size, processing_status="processing"
+            )
             db.session.add(car_video)
-            uploaded_videos.append(car_video.to_dict())
+            uploaded_videos.append(car_video)
 
         if not uploaded_videos:
             db.session.rollback()
@@ -753,11 +792,13 @@ def upload_car_videos(car_id: str):
 
         db.session.commit()
         log_user_action(current_user, "upload_videos", "car", car.public_id)
+        videos = [v.to_dict() for v in uploaded_videos]
+        enqueue_video_processing([v.id for v in uploaded_videos])
 
         return jsonify(
             {
                 "message": f"{len(uploaded_videos)} videos uploaded successfully",
-                "videos": uploaded_videos,
+                "videos": videos,
                 "rejected": rejected,
             }
         ), 201
@@ -765,3 +806,68 @@ def upload_car_videos(car_id: str):
         db.session.rollback()
         return jsonify({"message": "Failed to upload videos"}), 500
 
+
+@bp.route("/api/cars/<car_id>/videos/stream", methods=["POST", "PUT"])
+@jwt_required()
+@rate_limit(max_requests=20, window_minutes=60, per_ip=False)
+def stream_car_video(car_id: str):
+    """
+    Upload one video as the raw request body, piped to storage in chunks.
+
+    Filename via ``X-Filename`` header or ``?filename=`` (extension picks the type).
+    Poster, probe and preview are produced in the background; poll the listing
+    or the returned video's ``processing_status``.
+    """
+    from io import BytesIO
+    from itertools import chain
+
+    from werkzeug.datastructures import FileStorage
+
+    try:
+        current_user = get_current_user()
+        verify_err = phone_verification_required_response(current_user)
+        if verify_err:
+            return verify_err
+
+        car = _get_car_by_any_id(car_id)
+        if not car:
+            return jsonify({"message": "Car not found"}), 404
+        if car.seller_id != current_user.id and not current_user.is_admin:
+            return jsonify({"message": "Not authorized to upload videos for this listing"}), 403
+
+        max_bytes = video_max_bytes()
+        if request.content_length is not None and request.content_length > max_bytes:
+            return jsonify({"message": f"File too large. Maximum size: {max_bytes // (1024 * 1024)}MB"}), 413
+
+        filename = (request.headers.get("X-Filename") or request.args.get("filename") or "").strip()
+        if "." not in filename:
+            filename = f"{filename or 'video'}.mp4"
+        # Validate name, extension and magic bytes on the first chunk only.
+        head = request.stream.read(64 * 1024)
+        is_valid, msg = validate_file_upload(
+            FileStorage(stream=BytesIO(head), filename=filename),
+            max_size_mb=max_bytes // (1024 * 1024),
+            allowed_extensions=current_app.config["ALLOWED_VIDEO_EXTENSIONS"],
+        )
+        if not is_valid:
+            return jsonify({"message": msg}), 400
+
+        try:
+            stored_url, size = store_video(chain([head], read_chunks(request.stream)), filename=filename)
+        except VideoTooLarge as e:
+            return jsonify({"message": str(e)}), 413
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+
+        car_video = CarVideo(car_id=car.id, video_url=stored_url, size_bytes=size, processing_status="processing")
+        db.session.add(car_video)
+        db.session.commit()
+        log_user_action(current_user, "upload_videos", "car", car.public_id)
+        video = car_video.to_dict()
+        enqueue_video_processing([car_video.id])
+        return jsonify({"message": "Video uploaded", "video": video}), 201
+    except Exception:
+        current_app.logger.exception("streamed video upload failed")
+        db.session.rollback()
+        return jsonify({"message": "Failed to upload video"}), 500
+
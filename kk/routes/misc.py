@@ -175,6 +175,34 @@ def health_push():
         return jsonify({"fcm_ready": False, "credentials_present": False}), 200
 
 
+@bp.route("/health/cache", methods=["GET"])
+def health_cache():
+    """Response cache hit/miss/eviction counters for this worker (no keys or payloads)."""
+    from ..response_cache import cache_stats
+
+    return jsonify(cache_stats()), 200
+
+
+@bp.route("/health/chat-push", methods=["GET"])
+def health_chat_push():
+    """Chat push queue depth, delivery counters and latency for this worker (no tokens)."""
+    from ..chat_push import chat_push_stats
+
+    return jsonify(chat_push_stats()), 200
+
+
+@bp.route("/health/db", methods=["GET"])
+def health_db():
+    """SQLAlchemy pool occupancy and checkout wait counters for this worker."""
+    from ..db_pool import pool_stats
+    from ..models import db
+
+    try:
+        return jsonify(pool_stats(db.engine)), 200
+    except Exception:
+        return jsonify({"pool": None}), 200
+
+
 @bp.route("/", methods=["GET"])
 def root():
     return jsonify({"status": "ok"}), 200
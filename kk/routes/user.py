@@ -14,6 +14,7 @@ from sqlalchemy import or_
 from sqlalchemy.orm import selectinload
 
 from ..auth import get_current_user, log_user_action, validate_user_input
+from ..listing_cards import card_query_options, parse_card_fields, serialize_cards
 from ..models import (
     Car,
     DealerApplication,
@@ -563,6 +564,7 @@ def recently_viewed():
         page = max(1, request.args.get("page", 1, type=int))
         per_page = min(50, max(1, request.args.get("per_page", 20, type=int)))
 
+        card_fields = parse_card_fields(request.args)
         q = (
             db.session.query(Car, user_viewed_listings.c.viewed_at)
             .join(user_viewed_listings, user_viewed_listings.c.car_id == Car.id)
@@ -572,11 +574,16 @@ def recently_viewed():
             )
             .order_by(user_viewed_listings.c.viewed_at.desc())
         )
+        if card_fields is not None:
+            q = q.options(*card_query_options(card_fields))
         pagination = q.paginate(page=page, per_page=per_page, error_out=False)
 
+        if card_fields is not None:
+            rows = serialize_cards([car for car, _ in pagination.items], card_fields)
+        else:
+            rows = [_with_media_compat(car) for car, _ in pagination.items]
         cars = []
-        for car, viewed_at in pagination.items:
-            d = _with_media_compat(car)
+        for d, (_car, viewed_at) in zip(rows, pagination.items):
             if viewed_at is not None:
                 try:
                     d["viewed_at"] = viewed_at.isoformat()
@@ -1061,30 +1068,40 @@ def dealer_profile(dealer_public_id: str):
         if (dealer.account_type or "").strip().lower() != "dealer":
             return jsonify({"message": "This seller is not a dealer"}), 400
 
+        card_fields = parse_card_fields(request.args)
         listings = (
             Car.query.filter(
                 Car.seller_id == dealer.id,
                 Car.is_active.is_(True),
             )
-            .options(selectinload(Car.images), selectinload(Car.videos))
+            .options(
+                *(
+                    card_query_options(card_fields)
+                    if card_fields is not None
+                    else (selectinload(Car.images), selectinload(Car.videos))
+                )
+            )
             .order_by(Car.is_featured.desc(), Car.created_at.desc())
             .all()
         )
 
-        listing_dicts = []
-        for car in listings:
-            item = car.to_dict()
-            if not item.get("image_url"):
-                imgs = item.get("images") or []
-                if isinstance(imgs, list) and imgs:
-                    first = imgs[0] or {}
-                    if isinstance(first, dict):
-                        item["image_url"] = first.get("image_url")
-            listing_dicts.append(item)
+        if card_fields is not None:
+            listing_dicts = serialize_cards(listings, card_fields)
+        else:
+            listing_dicts = []
+            for car in listings:
+                item = car.to_dict()
+                if not item.get("image_url"):
+                    imgs = item.get("images") or []
+                    if isinstance(imgs, list) and imgs:
+                        first = imgs[0] or {}
+                        if isinstance(first, dict):
+                            item["image_url"] = first.get("image_url")
+                listing_dicts.append(item)
 
         stats = {
-            "total_listings": len(listing_dicts),
-            "featured_listings": sum(1 for c in listing_dicts if c.get("is_featured") is True),
+            "total_listings": len(listings),
+            "featured_listings": sum(1 for c in listings if c.is_featured is True),
         }
 
         dealer_data = dealer.to_dict()
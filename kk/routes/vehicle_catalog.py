@@ -12,9 +12,8 @@ from ..catalog_service import seed_catalog
 from ..models import CatalogBodyType, CatalogBrand, CatalogTrim, CatalogVehicleModel, db
 from ..response_cache import (
     CATALOG_TTL_S,
-    cache_get,
-    cache_set,
     catalog_cache_key,
+    get_or_compute,
     invalidate_catalog_cache,
     public_cached_json,
 )
@@ -47,18 +46,16 @@ def _bool(val, default=None):
 
 @bp.route("/api/catalog/brands", methods=["GET"])
 def public_brands():
-    try:
-        cache_key = catalog_cache_key("brands")
-        cached = cache_get(cache_key)
-        if cached is not None:
-            return public_cached_json(cached, max_age=CATALOG_TTL_S)
+    def compute():
         rows = (
             CatalogBrand.query.filter_by(is_active=True)
             .order_by(CatalogBrand.sort_order.asc(), CatalogBrand.name.asc())
             .all()
         )
-        payload = {"brands": [b.to_dict() for b in rows]}
-        cache_set(cache_key, payload, CATALOG_TTL_S)
+        return {"brands": [b.to_dict() for b in rows]}
+
+    try:
+        payload = get_or_compute(catalog_cache_key("brands"), compute, CATALOG_TTL_S)
         return public_cached_json(payload, max_age=CATALOG_TTL_S)
     except Exception as e:
         logger.error("public catalog brands error: %s", e, exc_info=True)
@@ -67,30 +64,27 @@ def public_brands():
 
 @bp.route("/api/catalog/models", methods=["GET"])
 def public_models():
-    try:
-        brand_name = (request.args.get("brand") or "").strip()
-        brand_id = request.args.get("brand_id", type=int)
-        cache_key = catalog_cache_key(
-            "models",
-            f"id:{brand_id}" if brand_id else f"name:{brand_name or 'all'}",
-        )
-        cached = cache_get(cache_key)
-        if cached is not None:
-            return public_cached_json(cached, max_age=CATALOG_TTL_S)
+    brand_name = (request.args.get("brand") or "").strip()
+    brand_id = request.args.get("brand_id", type=int)
 
+    def compute():
         q = CatalogVehicleModel.query.filter_by(is_active=True)
         if brand_id:
             q = q.filter_by(brand_id=brand_id)
         elif brand_name:
             brand = CatalogBrand.query.filter_by(name=brand_name, is_active=True).first()
             if not brand:
-                payload = {"models": []}
-                cache_set(cache_key, payload, CATALOG_TTL_S)
-                return public_cached_json(payload, max_age=CATALOG_TTL_S)
+                return {"models": []}
             q = q.filter_by(brand_id=brand.id)
         rows = q.order_by(CatalogVehicleModel.sort_order.asc(), CatalogVehicleModel.name.asc()).all()
-        payload = {"models": [m.to_dict() for m in rows]}
-        cache_set(cache_key, payload, CATALOG_TTL_S)
+        return {"models": [m.to_dict() for m in rows]}
+
+    try:
+        cache_key = catalog_cache_key(
+            "models",
+            f"id:{brand_id}" if brand_id else f"name:{brand_name or 'all'}",
+        )
+        payload = get_or_compute(cache_key, compute, CATALOG_TTL_S)
         return public_cached_json(payload, max_age=CATALOG_TTL_S)
     except Exception as e:
         logger.error("public catalog models error: %s", e, exc_info=True)
@@ -99,18 +93,16 @@ def public_models():
 
 @bp.route("/api/catalog/body-types", methods=["GET"])
 def public_body_types():
-    try:
-        cache_key = catalog_cache_key("body-types")
-        cached = cache_get(cache_key)
-        if cached is not None:
-            return public_cached_json(cached, max_age=CATALOG_TTL_S)
+    def compute():
         rows = (
             CatalogBodyType.query.filter_by(is_active=True)
             .order_by(CatalogBodyType.sort_order.asc(), CatalogBodyType.name.asc())
             .all()
         )
-        payload = {"body_types": [b.to_dict() for b in rows]}
-        cache_set(cache_key, payload, CATALOG_TTL_S)
+        return {"body_types": [b.to_dict() for b in rows]}
+
+    try:
+        payload = get_or_compute(catalog_cache_key("body-types"), compute, CATALOG_TTL_S)
         return public_cached_json(payload, max_age=CATALOG_TTL_S)
     except Exception as e:
         logger.error("public catalog body types error: %s", e, exc_info=True)
@@ -120,34 +112,30 @@ def public_body_types():
 @bp.route("/api/catalog/trims", methods=["GET"])
 def public_trims():
     """Active trims for a brand+model (query: brand, model)."""
-    try:
-        brand_name = (request.args.get("brand") or "").strip()
-        model_name = (request.args.get("model") or "").strip()
-        if not brand_name or not model_name:
-            return jsonify({"message": "brand and model are required"}), 400
-        cache_key = catalog_cache_key("trims", brand_name, model_name)
-        cached = cache_get(cache_key)
-        if cached is not None:
-            return public_cached_json(cached, max_age=CATALOG_TTL_S)
+    brand_name = (request.args.get("brand") or "").strip()
+    model_name = (request.args.get("model") or "").strip()
+    if not brand_name or not model_name:
+        return jsonify({"message": "brand and model are required"}), 400
+
+    def compute():
         brand = CatalogBrand.query.filter_by(name=brand_name, is_active=True).first()
         if not brand:
-            payload = {"trims": []}
-            cache_set(cache_key, payload, CATALOG_TTL_S)
-            return public_cached_json(payload, max_age=CATALOG_TTL_S)
+            return {"trims": []}
         model = CatalogVehicleModel.query.filter_by(
             brand_id=brand.id, name=model_name, is_active=True
         ).first()
         if not model:
-            payload = {"trims": []}
-            cache_set(cache_key, payload, CATALOG_TTL_S)
-            return public_cached_json(payload, max_age=CATALOG_TTL_S)
+            return {"trims": []}
         rows = (
             CatalogTrim.query.filter_by(model_id=model.id, is_active=True)
             .order_by(CatalogTrim.sort_order.asc(), CatalogTrim.name.asc())
             .all()
         )
-        payload = {"trims": [t.to_dict() for t in rows]}
-        cache_set(cache_key, payload, CATALOG_TTL_S)
+        return {"trims": [t.to_dict() for t in rows]}
+
+    try:
+        cache_key = catalog_cache_key("trims", brand_name, model_name)
+        payload = get_or_compute(cache_key, compute, CATALOG_TTL_S)
         return public_cached_json(payload, max_age=CATALOG_TTL_S)
     except Exception as e:
         logger.error("public catalog trims error: %s", e, exc_info=True)
@@ -0,0 +1,397 @@
+"""Percolator-style index of saved searches for new-listing alerts.
+
+``notify_saved_searches_for_car`` used to load every ``SavedSearch`` with
+``notify=True`` and run :func:`car_matches_filters` against each one, so every
+listing create cost O(total saved searches). The index inverts that: each
+search is filed under one *anchor* derived from its filters and a new car only
+looks at the anchors it can satisfy.
+
+- Keyed anchors: ``brand`` (any of the comma-separated brands), then
+  ``body_type``, ``model``, ``location``. Brand/model/location keep the
+  substring semantics of ``_ilike_match``: a key matches when it occurs in the
+  car's value, so lookups scan the distinct keys of a dimension (a vocabulary
+  of makes / cities), not the searches.
+- Within each anchor key (and for searches with no keyed filter) searches
+  are split by their first bounded range -- price, year, mileage -- into
+  interval trees queried with the car's value (stabbing query); searches
+  without a range sit in an "open" set.
+
+Candidates are always re-checked with :func:`car_matches_filters`, so alert
+semantics are unchanged; the index only skips searches that cannot match.
+
+Each process keeps its own index. Saved-search writes are tracked by a session
+hook: the committing process marks the ids stale locally and appends them to a
+Redis change log that other processes replay on their next lookup. A full
+rebuild every ``SAVED_SEARCH_INDEX_MAX_AGE_S`` covers bulk deletes and
+processes that missed the log.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import os
+import threading
+import time
+from typing import Any, Iterable
+
+from sqlalchemy import event, select
+
+from .listing_filters import _multi_values, _norm_str, _safe_float, _safe_int, car_matches_filters
+from .models import Car, SavedSearch, db
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+_SUBSTRING_DIMS: tuple[str, ...] = ("brand", "model", "location")
+_CHANGES_KEY = "saved_search:changes"
+_CHANGES_RETENTION_S = 60 * 60
+_SESSION_KEY = "_saved_search_changes"
+
+
+def _ilike_key(value: str) -> str:
+    """Canonical form of a filter value under ``_ilike_match`` (match <=> key in ``_haystack``)."""
+    return value.lower().replace("-", " ").strip().replace(" ", "-")
+
+
+def _haystack(value: str | None) -> str:
+    return (value or "").lower().replace(" ", "-")
+
+
+def _ranges(filters: dict[str, Any]) -> dict[str, tuple[float, float]]:
+    """Bounded numeric ranges, read exactly as :func:`car_matches_filters` reads them."""
+    bounds = {
+        "price": (
+            _safe_float(filters.get("min_price") or filters.get("price_min")),
+            _safe_float(filters.get("max_price") or filters.get("price_max")),
+        ),
+        "year": (
+            _safe_int(filters.get("min_year") or filters.get("year_min")),
+            _safe_int(filters.get("max_year") or filters.get("year_max")),
+        ),
+        "mileage": (
+            _safe_int(filters.get("min_mileage")),
+            _safe_int(filters.get("max_mileage")),
+        ),
+    }
+    return {
+        dim: (-math.inf if lo is None else float(lo), math.inf if hi is None else float(hi))
+        for dim, (lo, hi) in bounds.items()
+        if lo is not None or hi is not None
+    }
+
+
+def _car_range_value(car: Car, dim: str) -> float:
+    return float(getattr(car, dim, None) or 0)
+
+
+def _anchor(filters: dict[str, Any]) -> tuple[str, list[str]] | None:
+    """(dimension, keys) a search is filed under, or None when it has no keyed filter."""
+    brands = _multi_values(filters.get("brand"))
+    if brands:
+        return "brand", sorted({_ilike_key(b) for b in brands})
+    body_types = _multi_values(filters.get("body_type"))
+    if body_types:
+        return "body_type", sorted(set(body_types))
+    model = _norm_str(filters.get("model"))
+    if model:
+        return "model", [_ilike_key(model)]
+    city = _norm_str(filters.get("city") or filters.get("location"))
+    if city:
+        return "location", [_ilike_key(city)]
+    return None
+
+
+class _IntervalTree:
+    """Centered interval tree over closed ``[lo, hi]`` intervals, rebuilt lazily after edits."""
+
+    def __init__(self):
+        self._intervals: dict[int, tuple[float, float]] = {}
+        self._root = None
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self._intervals)
+
+    def add(self, key: int, lo: float, hi: float) -> None:
+        self._intervals[key] = (lo, hi)
+        self._dirty = True
+
+    def discard(self, key: int) -> None:
+        if self._intervals.pop(key, None) is not None:
+            self._dirty = True
+
+    @staticmethod
+    def _build(items: list[tuple[int, tuple[float, float]]]):
+        if not items:
+            return None
+        endpoints = sorted(p for _, (lo, hi) in items for p in (lo, hi))
+        center = endpoints[len(endpoints) // 2]
+        left, right, here = [], [], []
+        for item in items:
+            lo, hi = item[1]
+            if hi < center:
+                left.append(item)
+            elif lo > center:
+                right.append(item)
+            else:
+                here.append(item)
+        by_lo = sorted((lo, key) for key, (lo, _) in here)
+        by_hi = sorted(((hi, key) for key, (_, hi) in here), reverse=True)
+        return center, by_lo, by_hi, _IntervalTree._build(left), _IntervalTree._build(right)
+
+    def stab(self, x: float) -> list[int]:
+        """Keys whose interval contains ``x``."""
+        if self._dirty:
+            self._root = self._build(list(self._intervals.items()))
+            self._dirty = False
+        out: list[int] = []
+        node = self._root
+        while node is not None:
+            center, by_lo, by_hi, left, right = node
+            if x < center:
+                for lo, key in by_lo:
+                    if lo > x:
+                        break
+                    out.append(key)
+                node = left
+            elif x > center:
+                for hi, key in by_hi:
+                    if hi < x:
+                        break
+                    out.append(key)
+                node = right
+            else:
+                out.extend(key for _, key in by_lo)
+                break
+        return out
+
+
+_RANGE_DIMS: tuple[str, ...] = ("price", "year", "mileage")
+
+
+class _Bucket:
+    """Searches sharing one anchor key, split by their first bounded range."""
+
+    __slots__ = ("open", "trees")
+
+    def __init__(self):
+        self.open: set[int] = set()
+        self.trees: dict[str, _IntervalTree] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.open) or any(len(t) for t in self.trees.values())
+
+    def add(self, search_id: int, ranges: dict[str, tuple[float, float]]) -> None:
+        for dim in _RANGE_DIMS:
+            if dim in ranges:
+                self.trees.setdefault(dim, _IntervalTree()).add(search_id, *ranges[dim])
+                return
+        self.open.add(search_id)
+
+    def discard(self, search_id: int) -> None:
+        self.open.discard(search_id)
+        for tree in self.trees.values():
+            tree.discard(search_id)
+
+    def collect(self, values: dict[str, float], out: set[int]) -> None:
+        out |= self.open
+        for dim, tree in self.trees.items():
+            if len(tree):
+                out.update(tree.stab(values[dim]))
+
+
+class SavedSearchIndex:
+    """In-memory percolator over notify-enabled saved searches."""
+
+    def __init__(self):
+        # search id -> (user id, filters, bounded ranges)
+        self._entries: dict[int, tuple[int, dict[str, Any], dict[str, tuple[float, float]]]] = {}
+        # search id -> (anchor dimension, keys); "" = no keyed filter (root bucket)
+        self._filed: dict[int, tuple[str, tuple[str, ...]]] = {}
+        self._postings: dict[str, dict[str, _Bucket]] = {
+            dim: {} for dim in (*_SUBSTRING_DIMS, "body_type")
+        }
+        self._root = _Bucket()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, search_id: int, user_id: int, filters: dict[str, Any] | None) -> None:
+        """Insert or replace one search."""
+        self.remove(search_id)
+        filters = filters if isinstance(filters, dict) else {}
+        ranges = _ranges(filters)
+        self._entries[search_id] = (user_id, filters, ranges)
+        if any(lo > hi for lo, hi in ranges.values()):
+            # min > max: can never match, nothing to file.
+            self._filed[search_id] = ("-", ())
+            return
+        anchor = _anchor(filters)
+        if anchor is None:
+            self._root.add(search_id, ranges)
+            self._filed[search_id] = ("", ())
+            return
+        dim, keys = anchor
+        for key in keys:
+            self._postings[dim].setdefault(key, _Bucket()).add(search_id, ranges)
+        self._filed[search_id] = (dim, tuple(keys))
+
+    def remove(self, search_id: int) -> None:
+        filed = self._filed.pop(search_id, None)
+        self._entries.pop(search_id, None)
+        if filed is None:
+            return
+        dim, keys = filed
+        if dim == "":
+            self._root.discard(search_id)
+        elif dim in self._postings:
+            postings = self._postings[dim]
+            for key in keys:
+                bucket = postings.get(key)
+                if bucket is not None:
+                    bucket.discard(search_id)
+                    if not bucket:
+                        del postings[key]
+
+    def candidates(self, car: Car) -> set[int]:
+        """Searches that may match ``car`` (a superset of the real matches)."""
+        values = {dim: _car_range_value(car, dim) for dim in _RANGE_DIMS}
+        out: set[int] = set()
+        self._root.collect(values, out)
+        for dim in _SUBSTRING_DIMS:
+            hay = _haystack(getattr(car, dim, None))
+            for key, bucket in self._postings[dim].items():
+                if key in hay:
+                    bucket.collect(values, out)
+        body = self._postings["body_type"].get(_norm_str(car.body_type))
+        if body is not None:
+            body.collect(values, out)
+        return out
+
+    def match(self, car: Car, *, exclude_user_id: int | None = None) -> list[tuple[int, int]]:
+        """``(search_id, user_id)`` for every search whose filters ``car`` satisfies."""
+        values = {dim: _car_range_value(car, dim) for dim in _RANGE_DIMS}
+        out = []
+        for search_id in sorted(self.candidates(car)):
+            user_id, filters, ranges = self._entries[search_id]
+            if exclude_user_id is not None and user_id == exclude_user_id:
+                continue
+            # Cheap range pre-check before the full filter evaluation.
+            if any(not lo <= values[dim] <= hi for dim, (lo, hi) in ranges.items()):
+                continue
+            if car_matches_filters(car, filters):
+                out.append((search_id, user_id))
+        return out
+
+
+_index = SavedSearchIndex()
+_lock = threading.Lock()
+_built_at: float | None = None
+_changes_seen_at = 0.0
+_stale_ids: set[int] = set()
+
+
+def _max_age_s() -> float:
+    try:
+        return float(os.environ.get("SAVED_SEARCH_INDEX_MAX_AGE_S") or 900)
+    except ValueError:
+        return 900.0
+
+
+def _notify_rows(ids: Iterable[int] | None = None):
+    q = select(SavedSearch.id, SavedSearch.user_id, SavedSearch.filters).where(SavedSearch.notify.is_(True))
+    if ids is not None:
+        q = q.where(SavedSearch.id.in_(list(ids)))
+    return db.session.execute(q).all()
+
+
+def _remote_changes(since: float) -> set[int]:
+    r = get_redis()
+    if r is None:
+        return set()
+    try:
+        # Small overlap so a change committed during the previous sync is not missed.
+        return {int(m) for m in r.zrangebyscore(_CHANGES_KEY, since - 5, "+inf")}
+    except Exception:
+        logger.exception("saved search change log read failed")
+        return set()
+
+
+def get_saved_search_index() -> SavedSearchIndex:
+    """This process's index, synced with saved-search writes since the last call."""
+    global _index, _built_at, _changes_seen_at
+    with _lock:
+        now = time.time()
+        if _built_at is None or now - _built_at > _max_age_s():
+            fresh = SavedSearchIndex()
+            for search_id, user_id, filters in _notify_rows():
+                fresh.add(search_id, user_id, filters)
+            _index, _built_at, _changes_seen_at = fresh, now, now
+            _stale_ids.clear()
+            return _index
+        stale = _stale_ids | _remote_changes(_changes_seen_at)
+        _stale_ids.clear()
+        _changes_seen_at = now
+        if stale:
+            for search_id in stale:
+                _index.remove(search_id)
+            for search_id, user_id, filters in _notify_rows(stale):
+                _index.add(search_id, user_id, filters)
+        return _index
+
+
+def reset_saved_search_index() -> None:
+    """Drop the in-process index; the next lookup rebuilds it (tests)."""
+    global _index, _built_at
+    with _lock:
+        _index, _built_at = SavedSearchIndex(), None
+        _stale_ids.clear()
+
+
+def note_saved_search_changes(ids: Iterable[int]) -> None:
+    """Mark searches stale here and in every other process's index."""
+    ids = {int(i) for i in ids if i}
+    if not ids:
+        return
+    with _lock:
+        _stale_ids.update(ids)
+    r = get_redis()
+    if r is None:
+        return
+    try:
+        now = time.time()
+        pipe = r.pipeline(transaction=False)
+        pipe.zadd(_CHANGES_KEY, {str(i): now for i in ids})
+        pipe.zremrangebyscore(_CHANGES_KEY, "-inf", now - _CHANGES_RETENTION_S)
+        pipe.execute()
+    except Exception:
+        logger.exception("saved search change log write failed")
+
+
+def _after_flush(session, _flush_context) -> None:
+    changed = session.info.setdefault(_SESSION_KEY, set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, SavedSearch) and obj.id is not None:
+            changed.add(obj.id)
+
+
+def _after_commit(session) -> None:
+    changed = session.info.pop(_SESSION_KEY, None)
+    if changed:
+        note_saved_search_changes(changed)
+
+
+def _after_rollback(session) -> None:
+    session.info.pop(_SESSION_KEY, None)
+
+
+def install_saved_search_index_tracking() -> None:
+    """Register the session hooks that keep saved-search indexes current (idempotent)."""
+    for name, fn in (
+        ("after_flush", _after_flush),
+        ("after_commit", _after_commit),
+        ("after_rollback", _after_rollback),
+    ):
+        if not event.contains(db.session, name, fn):
+            event.listen(db.session, name, fn)
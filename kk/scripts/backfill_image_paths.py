@@ -0,0 +1,26 @@
+"""Store the resolved image path on existing ``car_image`` rows.
+
+Run once after applying the ``car_image.resolved_url`` migration (and again
+with ``--force`` after moving files around on disk):
+
+    python -m kk.scripts.backfill_image_paths [--force]
+"""
+
+from __future__ import annotations
+
+import sys
+
+from kk.app_factory import create_app
+from kk.media_paths import backfill_resolved_image_urls
+
+
+def main() -> None:
+    force = "--force" in sys.argv[1:]
+    app, *_ = create_app()
+    with app.app_context():
+        updated = backfill_resolved_image_urls(force=force)
+    print(f"Resolved image paths for {updated} car_image rows")
+
+
+if __name__ == "__main__":
+    main()
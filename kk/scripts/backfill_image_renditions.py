@@ -0,0 +1,47 @@
+"""Generate WebP/JPEG renditions for ``car_image`` rows uploaded before they existed.
+
+Queues the ``kk.tasks.image_tasks.backfill_image_renditions`` Celery task,
+which works through the table in keyset batches and re-queues itself:
+
+    python -m kk.scripts.backfill_image_renditions [--batch-size 50]
+
+``--inline`` runs every batch in this process instead (no worker needed).
+"""
+
+from __future__ import annotations
+
+import argparse
+
+from kk.app_factory import create_app
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Backfill car_image renditions")
+    p.add_argument("--batch-size", type=int, default=50)
+    p.add_argument("--inline", action="store_true")
+    args = p.parse_args()
+
+    app, *_ = create_app()
+    with app.app_context():
+        if not args.inline:
+            from kk.tasks.image_tasks import backfill_image_renditions
+
+            res = backfill_image_renditions.delay(0, args.batch_size)
+            print(f"Queued renditions backfill (task {res.id})")
+            return
+
+        from kk.image_renditions import backfill_image_renditions
+
+        total = 0
+        last_id = 0
+        while True:
+            processed, last_id = backfill_image_renditions(after_id=last_id, batch_size=args.batch_size)
+            total += processed
+            if last_id is None:
+                break
+            print(f"  ... {total} rows")
+    print(f"Generated renditions for {total} car_image rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Benchmark plate-detection backends on a labelled fixture set.
+
+Runs each backend on the same ≤1600 px probes the upload pipeline sends and
+reports per-image latency, batched throughput, and recall / precision at an
+IoU threshold against YOLO-format labels (``<class> cx cy w h``, normalized),
+e.g. the val split written by ``tools/pseudo_label_iraqi_lp.py``:
+
+    python -m kk.scripts.bench_plate_detectors dataset_iraqi_lp/val/images --backends onnx,roboflow
+"""
+
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+from pathlib import Path
+
+from kk.image_pipeline import ImagePipeline
+from kk.license_plate_blur import PlateBox, build_plate_detector
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def _iou(a: PlateBox, b: PlateBox) -> float:
+    iw = max(0, min(a.x2, b.x2) - max(a.x1, b.x1))
+    ih = max(0, min(a.y2, b.y2) - max(a.y1, b.y1))
+    inter = iw * ih
+    if inter <= 0:
+        return 0.0
+    union = (a.x2 - a.x1) * (a.y2 - a.y1) + (b.x2 - b.x1) * (b.y2 - b.y1) - inter
+    return inter / max(union, 1e-6)
+
+
+def _labels(path: Path, width: int, height: int) -> list[PlateBox]:
+    boxes = []
+    if not path.is_file():
+        return boxes
+    for line in path.read_text().splitlines():
+        parts = line.split()
+        if len(parts) < 5:
+            continue
+        cx, cy, w, h = (float(v) for v in parts[1:5])
+        boxes.append(
+            PlateBox(
+                x1=int((cx - w / 2) * width),
+                y1=int((cy - h / 2) * height),
+                x2=int((cx + w / 2) * width),
+                y2=int((cy + h / 2) * height),
+            )
+        )
+    return boxes
+
+
+def _load_fixtures(images_dir: Path, labels_dir: Path, limit: int, detect_max_dim: int):
+    fixtures = []
+    for path in sorted(images_dir.iterdir()):
+        if path.suffix.lower() not in IMAGE_EXTS:
+            continue
+        probe = ImagePipeline.decode(path.read_bytes()).resized(detect_max_dim)
+        fixtures.append((path.name, probe, _labels(labels_dir / f"{path.stem}.txt", *probe.size)))
+        if limit and len(fixtures) >= limit:
+            break
+    return fixtures
+
+
+def _score(predicted: list[PlateBox], truth: list[PlateBox], iou: float) -> tuple[int, int]:
+    """(true positives, false positives) with greedy one-to-one matching."""
+    unmatched = list(truth)
+    tp = 0
+    for box in sorted(predicted, key=lambda b: -(b.confidence or 0)):
+        best = max(unmatched, key=lambda t: _iou(box, t), default=None)
+        if best is not None and _iou(box, best) >= iou:
+            unmatched.remove(best)
+            tp += 1
+    return tp, len(predicted) - tp
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Plate detector latency and recall")
+    p.add_argument("images", help="Folder of fixture images")
+    p.add_argument("--labels", default="", help="YOLO label folder (default: sibling 'labels' dir)")
+    p.add_argument("--backends", default="onnx,roboflow")
+    p.add_argument("--batch", type=int, default=4, help="Images per call for the throughput run")
+    p.add_argument("--iou", type=float, default=0.5)
+    p.add_argument("--limit", type=int, default=0)
+    p.add_argument("--detect-max-dim", type=int, default=1600)
+    args = p.parse_args()
+
+    images_dir = Path(args.images).expanduser().resolve()
+    labels_dir = Path(args.labels).expanduser().resolve() if args.labels else images_dir.parent / "labels"
+    fixtures = _load_fixtures(images_dir, labels_dir, args.limit, args.detect_max_dim)
+    if not fixtures:
+        raise SystemExit(f"no images in {images_dir}")
+    total_truth = sum(len(truth) for _, _, truth in fixtures)
+    print(f"{len(fixtures)} images, {total_truth} labelled plates (labels: {labels_dir})")
+
+    for name in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        detector = build_plate_detector(name)
+        if not detector.is_configured():
+            print(f"{name:9}: not configured, skipped")
+            continue
+        detector.detect_images_with_meta([fixtures[0][1]])  # warm-up / model load
+
+        latencies = []
+        tp = fp = failed = 0
+        for _, probe, truth in fixtures:
+            started = time.perf_counter()
+            boxes, meta = detector.detect_images_with_meta([probe])[0]
+            latencies.append(time.perf_counter() - started)
+            if meta.get("detect_status") != "ok":
+                failed += 1
+            t, f = _score(boxes, truth, args.iou)
+            tp += t
+            fp += f
+
+        probes = [probe for _, probe, _ in fixtures]
+        started = time.perf_counter()
+        for i in range(0, len(probes), args.batch):
+            detector.detect_images_with_meta(probes[i : i + args.batch])
+        batched_s = (time.perf_counter() - started) / len(probes)
+
+        ms = sorted(lat * 1000 for lat in latencies)
+        p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+        recall = tp / total_truth if total_truth else float("nan")
+        precision = tp / (tp + fp) if tp + fp else float("nan")
+        print(
+            f"{name:9}: p50 {statistics.median(ms):7.1f} ms  p95 {p95:7.1f} ms  "
+            f"batch={args.batch} {batched_s * 1000:7.1f} ms/img  "
+            f"recall {recall:.3f}  precision {precision:.3f}  failed {failed}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Benchmark the saved-search percolator index against the old linear scan.
+
+Generates synthetic saved searches and new listings (no database), checks
+that both paths return the same matches, and prints per-listing timings:
+
+    python -m kk.scripts.bench_saved_search_index --searches 50000 --cars 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+
+from kk.listing_filters import car_matches_filters
+from kk.models import Car
+from kk.saved_search_index import SavedSearchIndex
+
+_BRANDS = {
+    "toyota": ["camry", "corolla", "land-cruiser", "hilux", "prado"],
+    "hyundai": ["elantra", "sonata", "tucson", "santa-fe"],
+    "kia": ["sportage", "cerato", "optima", "sorento"],
+    "nissan": ["sunny", "patrol", "altima"],
+    "mercedes-benz": ["c-class", "e-class", "s-class", "g-class"],
+    "bmw": ["3-series", "5-series", "x5"],
+    "chevrolet": ["malibu", "tahoe", "silverado"],
+    "ford": ["explorer", "f-150", "mustang"],
+}
+_CITIES = ["baghdad", "erbil", "basra", "sulaymaniyah", "najaf", "karbala", "mosul", "duhok"]
+_BODIES = ["sedan", "suv", "pickup", "hatchback", "coupe"]
+
+
+def _random_filters(rng: random.Random) -> dict:
+    filters: dict = {}
+    roll = rng.random()
+    if roll < 0.85:
+        brand = rng.choice(list(_BRANDS))
+        filters["brand"] = brand
+        if rng.random() < 0.6:
+            filters["model"] = rng.choice(_BRANDS[brand])
+    elif roll < 0.93:
+        filters["body_type"] = rng.choice(_BODIES)
+    if rng.random() < 0.4:
+        filters["city"] = rng.choice(_CITIES)
+    if rng.random() < 0.7:
+        low = rng.randrange(2000, 60000, 1000)
+        filters["min_price"] = low
+        filters["max_price"] = low + rng.randrange(5000, 40000, 1000)
+    if rng.random() < 0.5:
+        filters["min_year"] = rng.randint(2005, 2020)
+    if rng.random() < 0.2:
+        filters["max_mileage"] = rng.randrange(50_000, 250_000, 10_000)
+    return filters
+
+
+def _random_car(rng: random.Random) -> Car:
+    brand = rng.choice(list(_BRANDS))
+    return Car(
+        brand=brand,
+        model=rng.choice(_BRANDS[brand]),
+        year=rng.randint(2003, 2025),
+        price=float(rng.randrange(1000, 120000, 500)),
+        mileage=rng.randrange(0, 300_000, 1000),
+        location=rng.choice(_CITIES),
+        body_type=rng.choice(_BODIES),
+        condition="used",
+        transmission="automatic",
+        engine_type="gasoline",
+        drive_type="fwd",
+    )
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Saved-search index vs linear scan")
+    p.add_argument("--searches", type=int, default=20_000)
+    p.add_argument("--cars", type=int, default=200)
+    p.add_argument("--seed", type=int, default=7)
+    args = p.parse_args()
+
+    rng = random.Random(args.seed)
+    searches = [(i, i % 997, _random_filters(rng)) for i in range(1, args.searches + 1)]
+    cars = [_random_car(rng) for _ in range(args.cars)]
+
+    started = time.perf_counter()
+    index = SavedSearchIndex()
+    for search_id, user_id, filters in searches:
+        index.add(search_id, user_id, filters)
+    build_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    linear = [[sid for sid, _, f in searches if car_matches_filters(car, f)] for car in cars]
+    linear_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    indexed = [[sid for sid, _ in index.match(car)] for car in cars]
+    indexed_s = time.perf_counter() - started
+
+    if linear != indexed:
+        raise SystemExit("index returned different matches than the linear scan")
+    candidates = sum(len(index.candidates(car)) for car in cars) / len(cars)
+    matches = sum(len(m) for m in linear) / len(cars)
+    print(f"{args.searches} searches, {args.cars} listings (build {build_s * 1000:.0f} ms)")
+    print(f"linear scan : {linear_s / len(cars) * 1000:8.3f} ms/listing")
+    print(f"index       : {indexed_s / len(cars) * 1000:8.3f} ms/listing ({linear_s / indexed_s:.1f}x)")
+    print(f"avg candidates {candidates:.0f}, avg matches {matches:.0f}")
+
+
+if __name__ == "__main__":
+    main()
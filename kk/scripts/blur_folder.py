@@ -42,7 +42,7 @@ def process_one(*, src: Path, dst: Path, expand_ratio: float) -> Tuple[str, dict
 
 
 def main() -> int:
-	parser = argparse.ArgumentParser(description="Batch blur license plates using Roboflow + OpenCV.")
+	parser = argparse.ArgumentParser(description="Batch blur license plates (local ONNX model or Roboflow) + OpenCV.")
 	parser.add_argument("input_dir", help="Input folder containing images")
 	parser.add_argument("output_dir", help="Output folder for processed images")
 	parser.add_argument("--recursive", action="store_true", help="Recurse into subfolders")
@@ -79,7 +79,7 @@ def main() -> int:
 
 	detector = get_plate_detector()
 	if not detector.is_configured():
-		print("Roboflow detector is not configured. Set ROBOFLOW_API_KEY (and optionally ROBOFLOW_PROJECT/ROBOFLOW_VERSION or ROBOFLOW_MODEL).")
+		print("Plate detector is not configured. Export the local model (tools/export_plate_model_onnx.py) or set ROBOFLOW_API_KEY (and optionally ROBOFLOW_PROJECT/ROBOFLOW_VERSION or ROBOFLOW_MODEL).")
 		return 3
 
 	output_dir.mkdir(parents=True, exist_ok=True)
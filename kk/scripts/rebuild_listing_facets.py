@@ -0,0 +1,22 @@
+"""Backfill / repair the filter facet store from the ``car`` table.
+
+Run once after applying the ``listing_facet_count`` migration:
+
+    python -m kk.scripts.rebuild_listing_facets
+"""
+
+from __future__ import annotations
+
+from kk.app_factory import create_app
+from kk.listing_facets import rebuild_listing_facets
+
+
+def main() -> None:
+    app, *_ = create_app()
+    with app.app_context():
+        counted = rebuild_listing_facets()
+    print(f"Rebuilt listing facets from {counted} public listings")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,19 @@
 Security utilities and middleware for the car listing app
 """
 
+import math
 import os
 import re
+import secrets
+import threading
 import time
+from collections import OrderedDict, deque
 from functools import wraps
-from flask import request, jsonify, current_app
+from typing import NamedTuple
+from flask import request, jsonify, current_app, g, make_response
 from flask_jwt_extended import get_jwt_identity, get_jwt
 from .models import User, UserAction, db
+from .redis_client import get_redis
 from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename as _secure_filename
 
@@ -24,22 +30,103 @@ def _client_ip() -> str:
     return (request.remote_addr or "unknown").strip() or "unknown"
 
 
-def _redis_client():
-    try:
-        import os
-
-        url = (os.environ.get("REDIS_URL") or "").strip()
-        if not url:
-            return None
-        import redis  # type: ignore
-
-        return redis.Redis.from_url(url, decode_responses=True)
-    except Exception:
-        return None
-
-
-# Fallback in-process storage (dev only). Not safe across processes/replicas.
-rate_limit_storage: dict[str, list[float]] = {}
+# ── Rate limiting ────────────────────────────────────────────────────────────
+#
+# Sliding-window log: each limit key is a Redis sorted set of request
+# timestamps. One Lua call trims, counts and (only if every limit passes)
+# records the request for all limits at once, so per-user + per-IP checks cost
+# a single atomic round-trip and boundary bursts cannot double the budget the
+# way the old fixed INCR/EXPIRE window allowed.
+
+
+class RateLimit(NamedTuple):
+    """One limit to enforce: ``max_requests`` per ``window_minutes`` per IP or per user."""
+
+    max_requests: int
+    window_minutes: float
+    per_ip: bool = True
+
+
+_SLIDING_WINDOW_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local n = #KEYS
+local allowed = 1
+local out = {}
+for i = 1, n do
+    local limit = tonumber(ARGV[2 * i - 1])
+    local window = tonumber(ARGV[2 * i])
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], 0, now - window)
+    local count = redis.call('ZCARD', KEYS[i])
+    local reset = window
+    local oldest = redis.call('ZRANGE', KEYS[i], 0, 0, 'WITHSCORES')
+    if oldest[2] then
+        reset = tonumber(oldest[2]) + window - now
+    end
+    if count >= limit then
+        allowed = 0
+    end
+    out[2 * i - 1] = count
+    out[2 * i] = reset
+end
+if allowed == 1 then
+    local member = ARGV[2 * n + 1]
+    for i = 1, n do
+        redis.call('ZADD', KEYS[i], now, member)
+        redis.call('PEXPIRE', KEYS[i], ARGV[2 * i])
+        out[2 * i - 1] = out[2 * i - 1] + 1
+    end
+end
+table.insert(out, 1, allowed)
+return out
+"""
+# (client, registered Script) — re-registered when the shared client is rebuilt.
+_sliding_window_script: tuple[object, object] | None = None
+
+_RATE_LIMIT_MEMORY_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MEMORY_MAX_KEYS", "10000"))
+
+
+class _MemorySlidingWindow:
+    """Bounded LRU of per-key timestamp deques (dev / emergency fallback, per process)."""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max(1, max_keys)
+        self._logs: OrderedDict[str, deque] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, keys: list[str], limits: list[RateLimit]) -> tuple[bool, list[tuple[int, float]]]:
+        now = time.time()
+        with self._lock:
+            logs = []
+            allowed = True
+            state = []
+            for key, lim in zip(keys, limits):
+                window_s = lim.window_minutes * 60
+                log = self._logs.get(key)
+                if log is None:
+                    log = self._logs[key] = deque()
+                self._logs.move_to_end(key)
+                while log and log[0] <= now - window_s:
+                    log.popleft()
+                if len(log) >= lim.max_requests:
+                    allowed = False
+                reset = (log[0] + window_s - now) if log else window_s
+                logs.append(log)
+                state.append((len(log), reset))
+            if allowed:
+                for log in logs:
+                    log.append(now)
+                state = [(count + 1, reset) for count, reset in state]
+            while len(self._logs) > self.max_keys:
+                self._logs.popitem(last=False)
+        return allowed, state
+
+    def clear(self) -> None:
+        with self._lock:
+            self._logs.clear()
+
+
+rate_limit_storage = _MemorySlidingWindow(_RATE_LIMIT_MEMORY_MAX_KEYS)
 
 
 def _rate_limit_key(per_ip: bool, window_s: int) -> str:
@@ -53,21 +140,34 @@ def _rate_limit_key(per_ip: bool, window_s: int) -> str:
         except Exception:
             identifier = _client_ip()
     route = (request.endpoint or request.path or "unknown").replace(" ", "_")
-    return f"rl:{route}:{identifier}:{window_s}"
+    # ``sw`` segment: sorted-set keys, distinct from the old INCR string keys.
+    return f"rl:sw:{route}:{identifier}:{window_s}"
+
 
+def _rate_limit_headers(limit: RateLimit, count: int, reset_s: float) -> dict[str, str]:
+    return {
+        "X-RateLimit-Limit": str(int(limit.max_requests)),
+        "X-RateLimit-Remaining": str(max(0, int(limit.max_requests) - int(count))),
+        "X-RateLimit-Reset": str(max(0, math.ceil(reset_s))),
+    }
 
-def _rate_limit_response(max_requests: int, window_minutes: int, retry_after: int):
+
+def _rate_limit_response(max_requests: int, window_minutes, retry_after: int, headers=None):
+    retry_after = max(0, int(retry_after))
+    headers = dict(headers or {})
+    headers["Retry-After"] = str(retry_after)
     return (
         jsonify(
             {
                 "message": (
                     f"Rate limit exceeded. Maximum {max_requests} requests "
-                    f"per {window_minutes} minutes."
+                    f"per {window_minutes:g} minutes."
                 ),
-                "retry_after": max(0, int(retry_after)),
+                "retry_after": retry_after,
             }
         ),
         429,
+        headers,
     )
 
 
@@ -95,68 +195,109 @@ def _rate_limit_unavailable_response():
     )
 
 
-def check_rate_limit(max_requests=10, window_minutes=60, per_ip=True):
+def _redis_sliding_window(r, keys: list[str], limits: list[RateLimit]):
+    global _sliding_window_script
+    if _sliding_window_script is None or _sliding_window_script[0] is not r:
+        _sliding_window_script = (r, r.register_script(_SLIDING_WINDOW_LUA))
+    script = _sliding_window_script[1]
+    args: list = []
+    for lim in limits:
+        args.extend([int(lim.max_requests), int(lim.window_minutes * 60 * 1000)])
+    args.append(f"{time.time_ns()}:{secrets.token_hex(4)}")
+    res = script(keys=keys, args=args)
+    allowed = bool(int(res[0]))
+    state = [(int(res[1 + 2 * i]), int(res[2 + 2 * i]) / 1000.0) for i in range(len(limits))]
+    return allowed, state
+
+
+def check_rate_limits(*limits: RateLimit):
     """
-    Return a Flask (response, status) tuple when rate-limited, else None.
+    Enforce several limits in one call (e.g. per-user and per-IP).
+
+    A request is recorded against every limit only when all of them allow it.
+    Returns a Flask (response, status, headers) tuple when limited, else None;
+    ``X-RateLimit-*`` headers for the tightest limit are left in
+    ``g.rate_limit_headers`` for the :func:`rate_limit` decorators to attach.
     """
     env = (os.environ.get("APP_ENV") or "").strip().lower()
-    if env == "testing" or bool(current_app.config.get("TESTING")):
+    if env == "testing" or bool(current_app.config.get("TESTING")) or not limits:
         return None
 
-    window_s = int(window_minutes * 60)
-    key = _rate_limit_key(per_ip=per_ip, window_s=window_s)
+    keys = [_rate_limit_key(per_ip=lim.per_ip, window_s=int(lim.window_minutes * 60)) for lim in limits]
     allow_memory = _allow_inmemory_rate_limits()
 
-    r = _redis_client()
+    result = None
+    r = get_redis()
     if r is not None:
         try:
-            n = r.incr(key)
-            if n == 1:
-                r.expire(key, window_s)
-            if n > int(max_requests):
-                ttl = r.ttl(key)
-                retry_after = max(0, int(ttl) if ttl is not None else window_s)
-                return _rate_limit_response(max_requests, window_minutes, retry_after)
-            return None
+            result = _redis_sliding_window(r, keys, list(limits))
         except Exception:
             # Production without escape hatch: do not silently weaken limits via memory.
             if not allow_memory:
                 return _rate_limit_unavailable_response()
-
     elif not allow_memory:
         return _rate_limit_unavailable_response()
 
-    now = time.time()
-    window_start = now - window_s
-    times = rate_limit_storage.get(key, [])
-    times = [t for t in times if t > window_start]
-    if len(times) >= max_requests:
-        oldest = min(times) if times else now
-        retry_after = max(1, int(window_s - (now - oldest)))
-        return _rate_limit_response(max_requests, window_minutes, retry_after)
-    times.append(now)
-    rate_limit_storage[key] = times
+    if result is None:
+        result = rate_limit_storage.hit(keys, list(limits))
+    allowed, state = result
+
+    if not allowed:
+        # Report the limit that blocks longest.
+        blocked = [
+            (reset, lim, count)
+            for lim, (count, reset) in zip(limits, state)
+            if count >= lim.max_requests
+        ]
+        reset, lim, count = max(blocked, key=lambda b: b[0])
+        return _rate_limit_response(
+            lim.max_requests,
+            lim.window_minutes,
+            max(1, math.ceil(reset)),
+            _rate_limit_headers(lim, count, reset),
+        )
+
+    tightest = min(zip(limits, state), key=lambda ls: ls[0].max_requests - ls[1][0])
+    lim, (count, reset) = tightest
+    g.rate_limit_headers = _rate_limit_headers(lim, count, reset)
     return None
 
 
-def rate_limit(max_requests=10, window_minutes=60, per_ip=True):
+def check_rate_limit(max_requests=10, window_minutes=60, per_ip=True):
     """
-    Rate limiting decorator
+    Return a Flask (response, status, headers) tuple when rate-limited, else None.
     """
+    return check_rate_limits(RateLimit(max_requests, window_minutes, per_ip))
+
+
+def rate_limits(*limits: RateLimit):
+    """Decorator enforcing several limits atomically (see :func:`check_rate_limits`)."""
+
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            limited = check_rate_limit(
-                max_requests=max_requests,
-                window_minutes=window_minutes,
-                per_ip=per_ip,
-            )
+            limited = check_rate_limits(*limits)
             if limited is not None:
                 return limited
-            return f(*args, **kwargs)
+            headers = g.pop("rate_limit_headers", None)
+            if not headers:
+                return f(*args, **kwargs)
+            resp = make_response(f(*args, **kwargs))
+            for name, value in headers.items():
+                resp.headers.setdefault(name, value)
+            return resp
+
         return decorated_function
+
     return decorator
 
+
+def rate_limit(max_requests=10, window_minutes=60, per_ip=True):
+    """
+    Rate limiting decorator
+    """
+    return rate_limits(RateLimit(max_requests, window_minutes, per_ip))
+
 def validate_input_sanitization(data):
     """
     Best-effort input cleanup.
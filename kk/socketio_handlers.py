@@ -9,17 +9,21 @@ from flask import request
 from flask_jwt_extended import decode_token, get_jwt_identity, verify_jwt_in_request
 from flask_socketio import emit, join_room, leave_room
 
+from . import chat_cache, presence
 from .auth import phone_verification_error_payload
+from .chat_cache import ChatIdentity
+from .chat_push import queue_chat_push
+from .chat_conversations import record_message
 from .chat_realtime import (
     emit_message_to_participants,
     mark_messages_read_for_viewer,
+    message_payloads,
     resolve_allowed_chat_receiver,
     resolve_car_for_chat,
     room_for_car_public_id,
     user_can_access_chat_room,
 )
 from .models import Message, Notification, User, db
-from .push import send_push
 from .security import validate_input_sanitization
 from .time_utils import utcnow
 
@@ -96,21 +100,87 @@ def register_socketio_handlers(socketio) -> None:
     if app_id is not None:
         setattr(socketio, "_kk_handlers_app_id", app_id)
 
+    def _broadcast_presence(user_public_id: str, online: bool) -> None:
+        # socketio.emit goes through the message queue, so subscribers on other workers hear it too.
+        try:
+            state = presence.lookup([user_public_id]).get(user_public_id) or {}
+            socketio.emit(
+                "presence",
+                {"user_id": user_public_id, "online": online, "last_seen": state.get("last_seen")},
+                room=presence.room_for_presence(user_public_id),
+            )
+        except Exception:
+            logger.exception("presence broadcast failed for %s", user_public_id)
+
+    def _touch_presence(me: User, **kwargs) -> None:
+        try:
+            if presence.touch(request.sid, me.public_id, **kwargs):
+                _broadcast_presence(me.public_id, True)
+        except Exception:
+            logger.exception("presence update failed for %s", me.public_id)
+
     @socketio.on("connect")
     def _connect():  # type: ignore[no-redef]
         """
         Accept the connection even if unauthenticated (client can connect first,
-        then login). For authenticated sockets, join a per-user room.
+        then login). For authenticated sockets, join a per-user room and mark the user online.
         """
         me = _socket_current_user(optional=True)
         user_id = me.public_id if me else None
         if user_id:
             join_room(f"user:{user_id}")
+            _touch_presence(me)
         emit("connected", {"authenticated": bool(user_id), "user_id": user_id})
 
     @socketio.on("disconnect")
     def _disconnect():  # type: ignore[no-redef]
-        return
+        try:
+            user_id, offline = presence.drop(request.sid)
+        except Exception:
+            logger.exception("presence drop failed")
+            return
+        if user_id and offline:
+            _broadcast_presence(user_id, False)
+
+    @socketio.on("presence_heartbeat")
+    def _presence_heartbeat(payload=None):  # type: ignore[no-redef]
+        """
+        Keep this socket online; ``car_id`` (listing public_id or null) and
+        ``peer_id`` (the other participant) report which chat thread is open.
+        """
+        me = _socket_current_user(optional=False)
+        if not me:
+            return
+        data = validate_input_sanitization(payload or {}) if isinstance(payload, dict) else {}
+        car = str(data.get("car_id") or "").strip() or None
+        if "car_id" in data and ("peer_id" in data or car != presence.current_chat(request.sid)):
+            _touch_presence(me, car=car, peer=str(data.get("peer_id") or "").strip() or None)
+        else:
+            _touch_presence(me)
+
+    @socketio.on("presence_subscribe")
+    def _presence_subscribe(payload):  # type: ignore[no-redef]
+        """Batched online / last-seen snapshot for a contact list, then live ``presence`` events."""
+        me = _socket_current_user(optional=False)
+        if not me:
+            emit("error", {"message": "Unauthorized"})
+            return
+        data = validate_input_sanitization(payload or {})
+        raw_ids = data.get("user_ids")
+        if not isinstance(raw_ids, list):
+            emit("error", {"message": "user_ids must be a list"})
+            return
+        visible = presence.visible_users(me, raw_ids)
+        for user_id in visible:
+            join_room(presence.room_for_presence(user_id))
+        emit("presence_snapshot", {"users": presence.lookup(visible)})
+
+    @socketio.on("presence_unsubscribe")
+    def _presence_unsubscribe(payload):  # type: ignore[no-redef]
+        data = validate_input_sanitization(payload or {})
+        raw_ids = data.get("user_ids")
+        for user_id in raw_ids if isinstance(raw_ids, list) else []:
+            leave_room(presence.room_for_presence(str(user_id)))
 
     @socketio.on("join_chat")
     def _join_chat(payload):  # type: ignore[no-redef]
@@ -152,6 +222,13 @@ def register_socketio_handlers(socketio) -> None:
 
         room = room_for_car_public_id(car.public_id)
         join_room(room)
+        # A buyer's only thread on a listing is with its seller; a seller must
+        # say which buyer's thread is open, otherwise pushes are not suppressed.
+        peer = str(data.get("peer_id") or "").strip() or None
+        if peer is None and car.seller_id != me.id:
+            seller = chat_cache.get_identity(user_id=car.seller_id)
+            peer = seller.public_id if seller else None
+        _touch_presence(me, car=car.public_id, peer=peer)
         emit(
             "joined_chat",
             {
@@ -169,11 +246,14 @@ def register_socketio_handlers(socketio) -> None:
 
     @socketio.on("leave_chat")
     def _leave_chat(payload):  # type: ignore[no-redef]
-        _socket_current_user(optional=True)
+        me = _socket_current_user(optional=True)
         data = validate_input_sanitization(payload or {})
         room = str(data.get("room") or "").strip()
         if room:
             leave_room(room)
+        # Only clear the open chat if it is the one being left (clients may join the next one first).
+        if me and room and room == room_for_car_public_id(presence.current_chat(request.sid) or ""):
+            _touch_presence(me, car=None)
         emit("left_chat", {"room": room})
 
     @socketio.on("typing_start")
@@ -302,24 +382,32 @@ def register_socketio_handlers(socketio) -> None:
             notif = None
 
         try:
+            record_message(msg, car)
+            # Build payloads before commit so nothing reloads afterwards.
+            payload_out = message_payloads(
+                [msg],
+                car,
+                users={me.id: me, receiver.id: receiver},
+                parents={reply_to.id: reply_to} if reply_to else None,
+            )[0]
+            notif_out = notif.to_dict() if notif is not None else None
+            car_public_id = car.public_id
+            sender = ChatIdentity.from_user(me)
             db.session.commit()
-            db.session.refresh(msg)
         except Exception:
             db.session.rollback()
             emit("error", {"message": "Failed to send message"})
             return
 
-        payload_out = msg.to_dict()
-
         # After the first successful message the sender becomes a participant and
         # may join the listing typing room.
-        room = room_for_car_public_id(car.public_id)
+        room = room_for_car_public_id(car_public_id)
         join_room(room)
         emit(
             "joined_chat",
             {
                 "ok": True,
-                "car_id": car.public_id,
+                "car_id": car_public_id,
                 "room": room,
             },
         )
@@ -328,44 +416,25 @@ def register_socketio_handlers(socketio) -> None:
         emit_message_to_participants(
             "new_message",
             payload_out,
-            message=msg,
-            sender=me,
+            sender=sender,
             receiver=receiver,
         )
 
-        if notif is not None:
+        if notif_out is not None:
             try:
                 emit(
                     "new_notification",
-                    notif.to_dict(),
+                    notif_out,
                     room=f"user:{receiver.public_id}",
                 )
             except Exception:
                 pass
 
-        # FCM push notification (best-effort).
-        try:
-            db.session.refresh(receiver)
-            fcm_token = getattr(receiver, "firebase_token", None)
-            if fcm_token:
-                sender_name = f"{me.first_name} {me.last_name}".strip() or "Someone"
-                ok = send_push(
-                    fcm_token,
-                    title=f"New message from {sender_name}",
-                    body=content[:200],
-                    data={"car_id": car.public_id, "sender_id": me.public_id, "type": "chat_message"},
-                )
-                if not ok:
-                    logger.info(
-                        "FCM send failed for receiver %s (check FIREBASE_SERVICE_ACCOUNT / APNs)",
-                        receiver.public_id,
-                    )
-            else:
-                logger.info(
-                    "FCM skipped: receiver %s has no firebase_token (re-login on device to register)",
-                    receiver.public_id,
-                )
-        except Exception:
-            pass
+        # FCM push is queued (coalesced, off the socket thread); the token comes from kk.chat_cache.
+        if not queue_chat_push(receiver, sender, car_public_id, content):
+            logger.info(
+                "FCM skipped: receiver %s has no firebase_token or has the chat open",
+                receiver.public_id,
+            )
 
         emit("message_sent", {"success": True, "message": payload_out})
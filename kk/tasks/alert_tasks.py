@@ -6,8 +6,15 @@ from __future__ import annotations
 import logging
 
 from ..listing_filters import car_matches_filters, summarize_filters
-from ..models import Car, Notification, SavedSearch, SavedSearchAlert, User, db, user_favorites
-from ..push import send_push
+from ..models import Car, SavedSearch, SavedSearchAlert, User, db, user_favorites
+from ..push_fanout import (
+    bulk_insert_notifications,
+    chunked,
+    insert_ignore_returning,
+    multicast_and_prune,
+    send_each_and_prune,
+)
+from ..saved_search_index import get_saved_search_index
 from sqlalchemy import update as sql_update
 
 from .celery_app import celery_app
@@ -15,86 +22,81 @@ from .celery_app import celery_app
 logger = logging.getLogger(__name__)
 
 
-def _send_retention_push(
-    user: User,
-    *,
-    title: str,
-    body: str,
-    notification_type: str,
-    data: dict | None = None,
-) -> None:
-    token = getattr(user, "firebase_token", None)
-    if token:
-        send_push(token, title=title, body=body, data=data or {})
-
-    try:
-        notif = Notification(
-            user_id=user.id,
-            title=title,
-            message=body,
-            notification_type=notification_type,
-            is_read=False,
-            data=data or {},
-        )
-        db.session.add(notif)
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
-
-
 @celery_app.task(name="kk.tasks.alert_tasks.notify_saved_searches_for_car")
 def notify_saved_searches_for_car(car_id: int) -> dict:
     car = db.session.get(Car, car_id)
     if not car or not car.is_active:
         return {"matched": 0, "skipped": "inactive_or_missing"}
 
-    searches = (
-        SavedSearch.query.filter_by(notify=True)
-        .filter(SavedSearch.user_id != car.seller_id)
-        .all()
-    )
-    matched = 0
-    for search in searches:
-        filters = search.filters if isinstance(search.filters, dict) else {}
-        if not car_matches_filters(car, filters):
-            continue
-
-        existing = SavedSearchAlert.query.filter_by(
-            saved_search_id=search.id,
-            car_id=car.id,
-        ).first()
-        if existing:
-            continue
+    # Percolator index: only searches whose anchors this car can satisfy.
+    candidate_ids = [
+        search_id
+        for search_id, _ in get_saved_search_index().match(car, exclude_user_id=car.seller_id)
+    ]
+    if not candidate_ids:
+        return {"matched": 0}
 
-        user = db.session.get(User, search.user_id)
-        if not user or not user.is_active:
-            continue
-
-        summary = summarize_filters(filters)
-        title = search.name or "Saved search"
-        body = f"{summary}: {car.brand} {car.model} {car.year}".strip()
-        _send_retention_push(
-            user,
-            title=title,
-            body=body[:200],
-            notification_type="saved_search",
-            data={
-                "car_id": car.public_id,
-                "saved_search_id": search.public_id,
-            },
+    # Searches and their recipients in one query.
+    rows = (
+        db.session.query(SavedSearch, User.firebase_token)
+        .join(User, User.id == SavedSearch.user_id)
+        .filter(
+            SavedSearch.id.in_(candidate_ids),
+            SavedSearch.notify.is_(True),
+            SavedSearch.user_id != car.seller_id,
+            User.is_active.is_(True),
         )
+        .order_by(SavedSearch.id)
+        .all()
+    )
+    # Re-check against the row: it may have been edited since it was indexed.
+    matching = [
+        (search, token)
+        for search, token in rows
+        if car_matches_filters(car, search.filters if isinstance(search.filters, dict) else {})
+    ]
+    if not matching:
+        return {"matched": 0}
 
-        db.session.add(
-            SavedSearchAlert(saved_search_id=search.id, car_id=car.id)
+    try:
+        # Claim alerts first: concurrent runs for the same car cannot double-notify.
+        claimed = set(
+            insert_ignore_returning(
+                SavedSearchAlert,
+                [{"saved_search_id": search.id, "car_id": car.id} for search, _ in matching],
+                ("saved_search_id", "car_id"),
+                SavedSearchAlert.saved_search_id,
+            )
         )
-        try:
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-            continue
-        matched += 1
+        notifications = []
+        pushes = []
+        for search, token in matching:
+            if search.id not in claimed:
+                continue
+            filters = search.filters if isinstance(search.filters, dict) else {}
+            title = search.name or "Saved search"
+            body = f"{summarize_filters(filters)}: {car.brand} {car.model} {car.year}".strip()[:200]
+            data = {"car_id": car.public_id, "saved_search_id": search.public_id}
+            notifications.append(
+                {
+                    "user_id": search.user_id,
+                    "title": title,
+                    "message": body,
+                    "notification_type": "saved_search",
+                    "data": data,
+                }
+            )
+            if token:
+                pushes.append((token, title, body, data))
+        bulk_insert_notifications(notifications)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logger.exception("saved search alert fan-out failed for car %s", car.id)
+        return {"matched": 0, "skipped": "db_error"}
 
-    return {"matched": matched}
+    result = send_each_and_prune(pushes)
+    return {"matched": len(notifications), "pushed": result.sent}
 
 
 @celery_app.task(name="kk.tasks.alert_tasks.notify_price_drop_for_car")
@@ -106,48 +108,65 @@ def notify_price_drop_for_car(car_id: int, old_price: float, new_price: float) -
     if not car or not car.is_active:
         return {"notified": 0, "skipped": "inactive_or_missing"}
 
+    # Favoriting users and their device tokens in one query.
     rows = (
-        db.session.query(user_favorites.c.user_id, user_favorites.c.price_at_favorite)
-        .filter(user_favorites.c.car_id == car.id)
+        db.session.query(user_favorites.c.user_id, user_favorites.c.price_at_favorite, User.firebase_token)
+        .join(User, User.id == user_favorites.c.user_id)
+        .filter(
+            user_favorites.c.car_id == car.id,
+            User.is_active.is_(True),
+            User.id != car.seller_id,
+        )
         .all()
     )
-    notified = 0
     currency = (car.currency or "USD").upper()
     title = "Price drop"
     body = (
         f"{car.brand} {car.model} {car.year}: "
         f"{currency} {old_price:,.0f} → {currency} {new_price:,.0f}"
-    ).replace(",", " ")
+    ).replace(",", " ")[:200]
+    data = {"car_id": car.public_id, "old_price": str(old_price), "new_price": str(new_price)}
 
-    for user_id, price_at_favorite in rows:
+    recipients = []
+    tokens = []
+    for user_id, price_at_favorite, token in rows:
         baseline = price_at_favorite if price_at_favorite is not None else old_price
         if baseline is None or new_price >= float(baseline):
             continue
+        recipients.append(user_id)
+        if token:
+            tokens.append(token)
+    if not recipients:
+        return {"notified": 0}
 
-        user = db.session.get(User, user_id)
-        if not user or not user.is_active or user.id == car.seller_id:
-            continue
-
-        _send_retention_push(
-            user,
-            title=title,
-            body=body[:200],
-            notification_type="price_drop",
-            data={"car_id": car.public_id, "old_price": str(old_price), "new_price": str(new_price)},
+    try:
+        bulk_insert_notifications(
+            [
+                {
+                    "user_id": user_id,
+                    "title": title,
+                    "message": body,
+                    "notification_type": "price_drop",
+                    "data": data,
+                }
+                for user_id in recipients
+            ]
         )
-        notified += 1
-
-        try:
+        # New baseline so the same drop is not announced twice.
+        for chunk in chunked(recipients):
             db.session.execute(
                 sql_update(user_favorites)
                 .where(
-                    user_favorites.c.user_id == user_id,
                     user_favorites.c.car_id == car.id,
+                    user_favorites.c.user_id.in_(list(chunk)),
                 )
                 .values(price_at_favorite=new_price)
             )
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logger.exception("price drop fan-out failed for car %s", car.id)
+        return {"notified": 0, "skipped": "db_error"}
 
-    return {"notified": notified}
+    result = multicast_and_prune(tokens, title=title, body=body, data=data)
+    return {"notified": len(recipients), "pushed": result.sent}
@@ -36,6 +36,15 @@ class FlaskContextTask(Task):
             return self.run(*args, **kwargs)
 
 
+def broker_configured() -> bool:
+    """
+    True when a real broker is configured (the same variables :func:`make_celery`
+    resolves). Without one Celery falls back to ``memory://``, so callers run
+    their work inline instead of queueing it.
+    """
+    return bool((os.environ.get("CELERY_BROKER_URL") or os.environ.get("REDIS_URL") or "").strip())
+
+
 def make_celery() -> Celery:
     """
     Create a Celery app configured from environment variables.
@@ -59,6 +68,9 @@ def make_celery() -> Celery:
             "kk.tasks.image_tasks",
             "kk.tasks.alert_tasks",
             "kk.tasks.notification_tasks",
+            "kk.tasks.listing_tasks",
+            "kk.tasks.video_tasks",
+            "kk.tasks.chat_tasks",
         ],
     )
     c.Task = FlaskContextTask
@@ -75,6 +87,14 @@ def make_celery() -> Celery:
                 "task": "kk.tasks.notification_tasks.process_due_scheduled_notifications",
                 "schedule": 60.0,  # every minute
             },
+            "flush-listing-counters": {
+                "task": "kk.tasks.listing_tasks.flush_listing_counters",
+                "schedule": 15.0,  # buffered view / engagement counters
+            },
+            "rebuild-listing-facets": {
+                "task": "kk.tasks.listing_tasks.rebuild_listing_facets",
+                "schedule": 24 * 60 * 60.0,  # nightly drift repair
+            },
         },
     )
     return c
@@ -0,0 +1,21 @@
+"""Celery tasks for chat side effects kept off the request path (read receipts, pushes)."""
+
+from __future__ import annotations
+
+from .celery_app import celery_app
+
+
+@celery_app.task(name="kk.tasks.chat_tasks.mark_chat_read")
+def mark_chat_read(car_id: int, viewer_id: int):
+    """Flip unread inbound messages to read in one UPDATE and emit ``messages_read``."""
+    from kk.chat_realtime import mark_read_batch
+
+    return mark_read_batch(int(car_id), int(viewer_id))
+
+
+@celery_app.task(name="kk.tasks.chat_tasks.deliver_chat_push")
+def deliver_chat_push(key: str):
+    """Send one (possibly coalesced) push for the messages queued under ``key``."""
+    from kk.chat_push import deliver
+
+    return deliver(key)
@@ -1,9 +1,7 @@
 from __future__ import annotations
 
-import base64
 import os
 
-from ..time_utils import utcnow
 from .celery_app import celery_app
 
 
@@ -13,70 +11,63 @@ def _process_image_path(
     original_filename: str,
     inline_base64: bool,
     skip_blur: bool,
-) -> dict:
-    """
-    Process an image already saved to disk at temp_abs.
-    Returns {rel_path, base64?}.
-    """
-    from kk.media_processing import blur_image_bytes, persist_jpeg_bytes
-    from kk.security import generate_secure_filename
-
-    filename = generate_secure_filename(original_filename or "upload.jpg")
-    timestamp = utcnow().strftime("%Y%m%d_%H%M%S_%f")
-
-    base_name = os.path.splitext(filename)[0]
-    final_filename = f"processed_{timestamp}_{base_name}.jpg"
+    renditions: bool = False,
+):
+    """Process an image already saved to disk at temp_abs (``ProcessedImage``)."""
+    from kk.media_processing import process_listing_image
 
     with open(temp_abs, "rb") as fp:
         raw_bytes = fp.read()
+    return process_listing_image(
+        raw_bytes,
+        original_filename,
+        inline_base64=inline_base64,
+        skip_blur=skip_blur,
+        renditions=renditions,
+    )
 
-    # Optional: blur plates (fallback to original on any failure).
-    out_bytes = blur_image_bytes(raw_bytes, ".jpg", skip_blur=skip_blur)
-
-    # Downscale/compress
-    try:
-        from io import BytesIO
-
-        from PIL import Image
-
-        im = Image.open(BytesIO(out_bytes))
-        if im.mode not in ("RGB", "L"):
-            im = im.convert("RGB")
-        max_dim = int(os.getenv("UPLOAD_IMAGE_MAX_DIM", "1200") or "1200")
-        if max(im.size) > max_dim:
-            im.thumbnail((max_dim, max_dim), Image.Resampling.LANCZOS)
-
-        buf = BytesIO()
-        quality = int(os.getenv("UPLOAD_IMAGE_JPEG_QUALITY", "80") or "80")
-        im.save(buf, format="JPEG", quality=quality, optimize=True)
-        out_bytes = buf.getvalue()
-    except Exception:
-        pass
 
-    final_rel = persist_jpeg_bytes(out_bytes, object_filename=final_filename)
-
-    b64 = None
-    if inline_base64:
-        try:
-            from io import BytesIO
-
-            from PIL import Image
-
-            im2 = Image.open(BytesIO(out_bytes))
-            if im2.mode not in ("RGB", "L"):
-                im2 = im2.convert("RGB")
-            prev_dim = int(os.getenv("INLINE_PREVIEW_MAX_DIM", "420") or "420")
-            if max(im2.size) > prev_dim:
-                im2.thumbnail((prev_dim, prev_dim), Image.Resampling.LANCZOS)
-            buf2 = BytesIO()
-            prev_q = int(os.getenv("INLINE_PREVIEW_JPEG_QUALITY", "60") or "60")
-            im2.save(buf2, format="JPEG", quality=prev_q, optimize=True)
-            encoded = base64.b64encode(buf2.getvalue()).decode("utf-8")
-            b64 = f"data:image/jpeg;base64,{encoded}"
-        except Exception:
-            b64 = None
+def _attach_to_car(car_id: int, processed, kind: str, is_primary: bool | None = None) -> dict | None:
+    """
+    Add the processed image to the listing.
 
-    return {"rel_path": final_rel, "base64": b64}
+    The upload request decides which file becomes primary (``is_primary``) so
+    parallel tasks of one upload never both claim it. A candidate is only made
+    primary while holding the car row lock and if no primary exists yet, which
+    also covers two uploads racing; ``None`` (jobs queued before the flag
+    existed) means "primary if the listing has none".
+    """
+    from sqlalchemy import select
+
+    from kk.models import Car, CarImage, db
+
+    wants_primary = kind == "listing" and is_primary is not False
+    if wants_primary:
+        car = db.session.execute(select(Car).where(Car.id == car_id).with_for_update()).scalar_one_or_none()
+    else:
+        car = db.session.get(Car, car_id)
+    if car is None:
+        return None
+    if wants_primary:
+        wants_primary = (
+            CarImage.query.filter(
+                CarImage.car_id == car.id,
+                CarImage.is_primary.is_(True),
+            ).first()
+            is None
+        )
+    car_image = CarImage(
+        car_id=car.id,
+        image_url=processed.rel_path,
+        is_primary=wants_primary,
+        kind=kind,
+        renditions=processed.renditions,
+        image_width=processed.width,
+        image_height=processed.height,
+    )
+    db.session.add(car_image)
+    db.session.commit()
+    return car_image.to_dict()
 
 
 @celery_app.task(bind=True, name="kk.process_car_image_file")
@@ -87,12 +78,17 @@ def process_car_image_file(
     inline_base64: bool = False,
     skip_blur: bool = False,
     owner_public_id: str | None = None,
+    car_id: int | None = None,
+    kind: str = "listing",
+    is_primary: bool | None = None,
 ):
     """
     Process a car image under the shared Celery Flask app context (P-06).
 
     ``owner_public_id`` is embedded in task meta/result so job polling can authorize
-    even if the enqueue-time ownership registry is unavailable.
+    even if the enqueue-time ownership registry is unavailable. With ``car_id`` the
+    result is also attached to that listing (``POST /api/cars/<id>/images?async=1``);
+    ``is_primary`` is set by the enqueuing request for the upload's first listing photo.
     """
     owner = (owner_public_id or "").strip() or None
     if owner:
@@ -102,13 +98,16 @@ def process_car_image_file(
             pass
 
     try:
-        res = _process_image_path(
+        processed = _process_image_path(
             temp_abs=temp_abs,
             original_filename=original_filename,
             inline_base64=bool(inline_base64),
             skip_blur=bool(skip_blur),
+            renditions=car_id is not None,
         )
-        out = {"ok": True, **res}
+        out = {"ok": True, "rel_path": processed.rel_path, "base64": processed.preview}
+        if car_id is not None:
+            out["image"] = _attach_to_car(int(car_id), processed, kind, is_primary)
         if owner:
             out["owner_public_id"] = owner
         return out
@@ -118,3 +117,14 @@ def process_car_image_file(
                 os.remove(temp_abs)
         except Exception:
             pass
+
+
+@celery_app.task(name="kk.tasks.image_tasks.backfill_image_renditions")
+def backfill_image_renditions(after_id: int = 0, batch_size: int = 50):
+    """Generate renditions for one batch of existing images, then queue the next batch."""
+    from kk.image_renditions import backfill_image_renditions as run_batch
+
+    processed, last_id = run_batch(after_id=after_id, batch_size=batch_size)
+    if last_id is not None and processed >= batch_size:
+        backfill_image_renditions.delay(last_id, batch_size)
+    return {"processed": processed, "last_id": last_id}
@@ -0,0 +1,30 @@
+"""Celery tasks for listing read models (filter facet store, buffered counters)."""
+
+from __future__ import annotations
+
+import logging
+
+from .celery_app import celery_app
+
+logger = logging.getLogger(__name__)
+
+
+@celery_app.task(name="kk.tasks.listing_tasks.rebuild_listing_facets")
+def rebuild_listing_facets_task():
+    """Recompute ``listing_facet_count`` from ``car`` to repair any drift."""
+    from ..listing_facets import rebuild_listing_facets
+
+    counted = rebuild_listing_facets()
+    logger.info("listing facet store rebuilt from %s public listings", counted)
+    return {"listings": counted}
+
+
+@celery_app.task(name="kk.tasks.listing_tasks.flush_listing_counters")
+def flush_listing_counters_task():
+    """Apply buffered view / engagement counter increments in one batch."""
+    from ..listing_metrics import flush_pending_counters
+
+    applied = flush_pending_counters()
+    if applied:
+        logger.info("flushed %s buffered listing counters", applied)
+    return {"applied": applied}
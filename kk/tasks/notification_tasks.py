@@ -1,4 +1,4 @@
-"""Celery tasks for scheduled admin notifications."""
+"""Celery tasks for scheduled admin notifications and broadcast chunks."""
 
 from __future__ import annotations
 
@@ -16,3 +16,11 @@ def process_due_scheduled_notifications_task(limit: int = 20):
     result = process_due_scheduled_notifications(limit=limit)
     logger.info("scheduled notifications processed: %s", result)
     return result
+
+
+@celery_app.task(name="kk.tasks.notification_tasks.send_broadcast_chunk")
+def send_broadcast_chunk(broadcast_id: int, index: int):
+    """Deliver one keyset chunk of a broadcast; failed chunks are resumed by the beat task."""
+    from ..notification_broadcast import run_broadcast_chunk
+
+    return run_broadcast_chunk(broadcast_id, index)
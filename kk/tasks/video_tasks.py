@@ -0,0 +1,13 @@
+"""Celery tasks for listing videos (probe, poster frame, low-bitrate preview)."""
+
+from __future__ import annotations
+
+from .celery_app import celery_app
+
+
+@celery_app.task(name="kk.tasks.video_tasks.process_car_video")
+def process_car_video(video_id: int):
+    """Probe an uploaded ``CarVideo`` and store its poster / preview (``kk.video_ingest``)."""
+    from kk.video_ingest import process_video
+
+    return process_video(int(video_id))
@@ -0,0 +1,82 @@
+"""Shared fixtures: a Flask app on in-memory SQLite and small model builders.
+
+Modules that need more (blueprints, env, hooks, seed rows) override ``app``
+with a fixture of the same name that requests this one and adds only that.
+"""
+
+from __future__ import annotations
+
+import itertools
+
+import pytest
+from flask import Flask
+from flask_jwt_extended import JWTManager
+
+from kk.models import Car, User, db
+
+
+@pytest.fixture()
+def app(monkeypatch):
+    """App with every table created; the app context stays pushed for the test."""
+    monkeypatch.setenv("APP_ENV", "testing")
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    monkeypatch.delenv("CELERY_BROKER_URL", raising=False)
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["JWT_SECRET_KEY"] = "test-secret-key-with-enough-length"
+    db.init_app(app)
+    JWTManager(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture()
+def make_user():
+    """``make_user(username, **fields)``: add and flush a ``User`` with placeholder defaults."""
+    phones = itertools.count()
+
+    def make(username: str, **fields) -> User:
+        values = dict(
+            phone_number=f"0799{next(phones):06d}",
+            first_name=username,
+            last_name="L",
+            password_hash="x",
+        )
+        values.update(fields)
+        user = User(username=username, **values)
+        db.session.add(user)
+        db.session.flush()
+        return user
+
+    return make
+
+
+@pytest.fixture()
+def make_car():
+    """``make_car(seller, **fields)``: add and flush a used Toyota Camry listed by ``seller`` (a user or id)."""
+
+    def make(seller, **fields) -> Car:
+        values = dict(
+            seller_id=getattr(seller, "id", seller),
+            brand="toyota",
+            model="camry",
+            year=2018,
+            mileage=1000,
+            engine_type="gasoline",
+            transmission="automatic",
+            drive_type="fwd",
+            condition="used",
+            body_type="sedan",
+            price=10_000.0,
+            location="baghdad",
+        )
+        values.update(fields)
+        car = Car(**values)
+        db.session.add(car)
+        db.session.flush()
+        return car
+
+    return make
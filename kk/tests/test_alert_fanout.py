@@ -0,0 +1,123 @@
+"""Bulk alert fan-out: one query for recipients, bulk inserts, batched FCM, token pruning."""
+
+from __future__ import annotations
+
+import pytest
+from firebase_admin import messaging
+from sqlalchemy import event
+
+import kk.push as push
+from kk.models import Car, Notification, SavedSearch, SavedSearchAlert, User, db, user_favorites
+from kk.tasks import alert_tasks
+
+
+class _Resp:
+    def __init__(self, token):
+        self.success = not token.startswith("dead")
+        self.exception = None if self.success else messaging.UnregisteredError("gone")
+
+
+class _Batch:
+    def __init__(self, tokens):
+        self.responses = [_Resp(t) for t in tokens]
+
+
+@pytest.fixture()
+def fcm(monkeypatch):
+    calls = []
+
+    def send_each(messages, app=None):
+        calls.append(("each", len(messages)))
+        return _Batch([m.token for m in messages])
+
+    def send_each_for_multicast(message, app=None):
+        calls.append(("multicast", len(message.tokens)))
+        return _Batch(message.tokens)
+
+    monkeypatch.setattr(push, "_ensure_firebase", lambda: object())
+    monkeypatch.setattr(messaging, "send_each", send_each)
+    monkeypatch.setattr(messaging, "send_each_for_multicast", send_each_for_multicast)
+    return calls
+
+
+@pytest.fixture()
+def app(app, make_user, make_car):
+    seller = make_user("seller")
+    make_car(seller, brand="Toyota", model="Camry", mileage=50000, price=15000.0, location="Baghdad")
+    db.session.commit()
+    return app
+
+
+def _add_users(n: int, dead_every: int = 0) -> list[User]:
+    users = []
+    for i in range(n):
+        token = f"dead-{i}" if dead_every and i % dead_every == 0 else f"tok-{i}"
+        users.append(
+            User(username=f"u{i}", phone_number=f"07{i:08d}", first_name="U", last_name="L", password_hash="x", firebase_token=token)
+        )
+    db.session.add_all(users)
+    db.session.flush()
+    return users
+
+
+def test_price_drop_fans_out_in_batches(app, fcm):
+    with app.app_context():
+        car = Car.query.one()
+        users = _add_users(1200, dead_every=100)
+        db.session.execute(
+            user_favorites.insert(),
+            [{"user_id": u.id, "car_id": car.id, "price_at_favorite": 15000.0} for u in users],
+        )
+        db.session.commit()
+
+        statements = []
+
+        def capture(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", capture)
+        try:
+            result = alert_tasks.notify_price_drop_for_car.run(car.id, 15000.0, 12000.0)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", capture)
+
+        assert result == {"notified": 1200, "pushed": 1188}
+        assert fcm == [("multicast", 500), ("multicast", 500), ("multicast", 200)]
+        assert Notification.query.filter_by(notification_type="price_drop").count() == 1200
+        # Dead tokens pruned, live ones kept.
+        assert User.query.filter(User.firebase_token.like("dead-%")).count() == 0
+        assert User.query.filter(User.firebase_token.like("tok-%")).count() == 1188
+        # No per-user queries: bounded statement count regardless of recipients.
+        assert len([s for s in statements if s.lstrip().upper().startswith("SELECT")]) <= 3
+
+        # Baseline moved: the same drop is not announced twice.
+        assert alert_tasks.notify_price_drop_for_car.run(car.id, 15000.0, 12000.0) == {"notified": 0}
+
+
+def test_saved_search_alerts_bulk_and_deduped(app, fcm, monkeypatch):
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    from kk import saved_search_index
+
+    saved_search_index.reset_saved_search_index()
+    with app.app_context():
+        car = Car.query.one()
+        users = _add_users(30, dead_every=10)
+        db.session.add_all(
+            [SavedSearch(user_id=u.id, name=f"s{u.id}", filters={"brand": "toyota"}) for u in users]
+            + [SavedSearch(user_id=users[0].id, name="kia", filters={"brand": "kia"})]
+        )
+        db.session.commit()
+        # One search already alerted for this car: ON CONFLICT skips it.
+        first = SavedSearch.query.filter_by(name=f"s{users[1].id}").one()
+        db.session.add(SavedSearchAlert(saved_search_id=first.id, car_id=car.id))
+        db.session.commit()
+
+        result = alert_tasks.notify_saved_searches_for_car.run(car.id)
+        assert result == {"matched": 29, "pushed": 26}
+        assert fcm == [("each", 29)]
+        assert SavedSearchAlert.query.count() == 30
+        assert Notification.query.filter_by(notification_type="saved_search").count() == 29
+        assert User.query.filter(User.firebase_token.like("dead-%")).count() == 0
+
+        assert alert_tasks.notify_saved_searches_for_car.run(car.id)["matched"] == 0
+    saved_search_index.reset_saved_search_index()
@@ -0,0 +1,118 @@
+"""Chat hot-path cache: warm sends skip repeated lookups, ORM writes invalidate."""
+
+from __future__ import annotations
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+import kk.routes.chat as chat_routes
+from kk import chat_cache
+from kk.chat_conversations import record_message
+from kk.models import BlockedUser, Conversation, Message, db
+from kk.routes.chat import bp as chat_bp
+
+
+@pytest.fixture()
+def app(app, monkeypatch):
+    chat_cache.clear_memory_cache()
+    monkeypatch.setattr(chat_routes, "emit_message_to_participants", lambda *a, **k: None)
+    monkeypatch.setattr(chat_routes, "queue_chat_push", lambda *a, **k: True)
+    app.register_blueprint(chat_bp)
+    return app
+
+
+@pytest.fixture()
+def listing(app, make_user, make_car):
+    seller = make_user("seller", first_name="Sam", last_name="Seller", is_verified=True, phone_verified=True)
+    buyer = make_user("buyer", first_name="Bo", last_name="Buyer", is_verified=True, phone_verified=True)
+    car = make_car(seller, price=1000)
+    db.session.commit()
+    return seller, buyer, car
+
+
+def _send(client, user, car, content="hi"):
+    headers = {"Authorization": f"Bearer {create_access_token(identity=user.public_id)}"}
+    return client.post(f"/api/chat/{car.public_id}/send", json={"content": content}, headers=headers)
+
+
+def _statements(fn):
+    seen = []
+
+    def _record(_conn, _cursor, statement, *_a):
+        seen.append(statement.lstrip())
+
+    engine = db.engine
+    event.listen(engine, "before_cursor_execute", _record)
+    try:
+        result = fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", _record)
+    return result, seen
+
+
+def test_warm_send_skips_receiver_block_and_thread_lookups(app, listing):
+    seller, buyer, car = listing
+    client = app.test_client()
+    assert _send(client, buyer, car).status_code == 201
+
+    headers = {"Authorization": f"Bearer {create_access_token(identity=buyer.public_id)}"}
+    url = f"/api/chat/{car.public_id}/send"
+    resp, statements = _statements(lambda: client.post(url, json={"content": "again"}, headers=headers))
+
+    assert resp.status_code == 201
+    body = resp.get_json()["message"]
+    assert body["content"] == "again" and body["receiver_id"] == seller.public_id
+    selects = [s for s in statements if s.startswith("SELECT")]
+    # Only the authenticated user and the listing are read; no message/blocked_user/conversation scans.
+    assert len(selects) == 2, selects
+    assert not any("blocked_user" in s or "FROM conversation" in s for s in selects)
+    assert Conversation.query.one().seller_unread == 2
+
+
+def test_block_and_unblock_take_effect_immediately(app, listing):
+    seller, buyer, car = listing
+    client = app.test_client()
+    assert _send(client, buyer, car).status_code == 201
+    assert chat_cache.users_blocked(buyer.id, seller.id) is False
+
+    block = BlockedUser(blocker_id=seller.id, blocked_id=buyer.id)
+    db.session.add(block)
+    db.session.commit()
+    assert _send(client, buyer, car).status_code == 400
+
+    db.session.delete(block)
+    db.session.commit()
+    assert _send(client, buyer, car).status_code == 201
+
+
+def test_profile_update_refreshes_identity(app, listing):
+    seller, _buyer, _car = listing
+    assert chat_cache.get_identity(public_id=seller.public_id).firebase_token is None
+
+    seller.firebase_token = "tok-new"
+    db.session.commit()
+
+    ident = chat_cache.get_identity(public_id=seller.public_id)
+    assert (ident.id, ident.firebase_token) == (seller.id, "tok-new")
+
+
+def test_stale_thread_id_falls_back_to_lookup(app, listing):
+    seller, buyer, car = listing
+    first = Message(sender_id=buyer.id, receiver_id=seller.id, car_id=car.id, content="a", is_read=False)
+    db.session.add(first)
+    conv_id = record_message(first, car)
+    db.session.commit()
+
+    # A bulk delete bypasses ORM events, so the cached thread id now points nowhere.
+    Conversation.query.delete(synchronize_session=False)
+    db.session.commit()
+    assert chat_cache.thread_for(car.id, buyer.id, seller.id)["id"] == conv_id
+
+    msg = Message(sender_id=buyer.id, receiver_id=seller.id, car_id=car.id, content="b", is_read=False)
+    db.session.add(msg)
+    record_message(msg, car)
+    db.session.commit()
+
+    conv = Conversation.query.one()
+    assert (conv.last_message_id, conv.seller_unread) == (msg.id, 1)
@@ -0,0 +1,100 @@
+"""Materialized chat inbox: conversation upkeep on send/delete/read and keyset inbox pages."""
+
+from __future__ import annotations
+
+from datetime import timedelta
+
+import pytest
+
+from kk.chat_cache import clear_memory_cache
+from kk.chat_conversations import (
+    inbox_page,
+    mark_conversations_read,
+    rebuild_conversations,
+    record_message,
+    record_message_deleted,
+)
+from kk.models import BlockedUser, Conversation, Message, db
+from kk.time_utils import utcnow
+
+
+@pytest.fixture()
+def app(app):
+    clear_memory_cache()
+    return app
+
+
+def _send(car, sender, receiver, content="hi", at=None):
+    msg = Message(sender_id=sender.id, receiver_id=receiver.id, car_id=car.id, content=content, is_read=False)
+    if at is not None:
+        msg.created_at = at
+    db.session.add(msg)
+    record_message(msg, car)
+    db.session.commit()
+    return msg
+
+
+def test_send_delete_and_read_keep_thread_in_step(app, make_user, make_car):
+    seller, buyer = make_user("seller"), make_user("buyer")
+    car = make_car(seller)
+
+    _send(car, buyer, seller, "is it available?")
+    _send(car, buyer, seller, "hello?")
+    reply = _send(car, seller, buyer, "yes")
+
+    conv = Conversation.query.one()
+    assert (conv.buyer_id, conv.seller_id, conv.last_message_id) == (buyer.id, seller.id, reply.id)
+    assert (conv.buyer_unread, conv.seller_unread) == (1, 2)
+
+    record_message_deleted(reply)
+    reply.is_deleted = True
+    db.session.commit()
+    assert Conversation.query.one().buyer_unread == 0
+
+    mark_conversations_read(car.id, seller.id)
+    db.session.commit()
+    conv = Conversation.query.one()
+    assert (conv.buyer_unread, conv.seller_unread) == (0, 0)
+
+
+def test_inbox_pages_by_last_message_and_hides_blocked_peers(app, make_user, make_car):
+    seller = make_user("dealer")
+    buyers = [make_user(f"b{i}") for i in range(5)]
+    cars = [make_car(seller) for _ in range(2)]
+    t0 = utcnow()
+    for i, buyer in enumerate(buyers):
+        _send(cars[i % 2], buyer, seller, at=t0 + timedelta(minutes=i))
+    # An old thread with a fresh message moves to the top.
+    _send(cars[0], seller, buyers[0], at=t0 + timedelta(minutes=10))
+    db.session.add(BlockedUser(blocker_id=seller.id, blocked_id=buyers[3].id))
+    db.session.commit()
+
+    seen, after = [], None
+    while True:
+        rows, has_more = inbox_page(seller.id, 2, after)
+        seen.extend(c.buyer_id for c in rows)
+        if not has_more:
+            break
+        after = (rows[-1].last_message_at, rows[-1].id)
+
+    assert seen == [buyers[0].id, buyers[4].id, buyers[2].id, buyers[1].id]
+    rows, _ = inbox_page(buyers[3].id, 10)
+    assert [c.seller_id for c in rows] == [seller.id]
+
+
+def test_rebuild_matches_incremental_upkeep(app, make_user, make_car):
+    seller, buyer, other = make_user("s"), make_user("bb"), make_user("ccc")
+    car = make_car(seller)
+    for sender, receiver in ((buyer, seller), (seller, buyer), (other, seller), (buyer, seller)):
+        _send(car, sender, receiver)
+    live = {
+        (c.buyer_id, c.seller_id): (c.last_message_id, c.buyer_unread, c.seller_unread)
+        for c in Conversation.query.all()
+    }
+
+    assert rebuild_conversations() == 2
+    rebuilt = {
+        (c.buyer_id, c.seller_id): (c.last_message_id, c.buyer_unread, c.seller_unread)
+        for c in Conversation.query.all()
+    }
+    assert rebuilt == live
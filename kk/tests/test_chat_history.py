@@ -0,0 +1,139 @@
+"""Chat history: keyset pages without COUNT, per-page payloads, read marking off the request path."""
+
+from __future__ import annotations
+
+from datetime import timedelta
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+import kk.chat_realtime as chat_realtime
+from kk.chat_cache import clear_memory_cache
+from kk.chat_conversations import record_message
+from kk.models import Conversation, Message, db
+from kk.routes.chat import bp as chat_bp
+from kk.time_utils import utcnow
+
+
+@pytest.fixture()
+def app(app, monkeypatch):
+    clear_memory_cache()
+    monkeypatch.setattr(chat_realtime, "emit_to_user_rooms", lambda *a, **k: None)
+    app.register_blueprint(chat_bp)
+    return app
+
+
+@pytest.fixture()
+def thread(app, make_user, make_car):
+    seller = make_user("seller", first_name="Sam", last_name="Seller")
+    buyer = make_user("buyer", first_name="Bo", last_name="Buyer")
+    car = make_car(seller, price=1000)
+    t0 = utcnow()
+    msgs = []
+    for i in range(7):
+        sender, receiver = (buyer, seller) if i % 2 == 0 else (seller, buyer)
+        msg = Message(
+            sender_id=sender.id,
+            receiver_id=receiver.id,
+            car_id=car.id,
+            content=f"m{i}",
+            is_read=False,
+            created_at=t0 + timedelta(seconds=i // 2),  # shared timestamps exercise the id tiebreak
+            reply_to_id=msgs[0].id if i == 5 else None,
+        )
+        db.session.add(msg)
+        record_message(msg, car)
+        msgs.append(msg)
+    db.session.commit()
+    return seller, buyer, car, msgs
+
+
+def _get(client, user, car, **params):
+    headers = {"Authorization": f"Bearer {create_access_token(identity=user.public_id)}"}
+    return client.get(f"/api/chat/{car.public_id}/messages", query_string=params, headers=headers)
+
+
+def test_keyset_pages_walk_history_both_ways(app, thread):
+    seller, _buyer, car, msgs = thread
+    client = app.test_client()
+
+    seen, params = [], {"per_page": 3}
+    while True:
+        body = _get(client, seller, car, **params).get_json()
+        assert "total" not in body
+        seen.extend(m["content"] for m in body["messages"])
+        if not body["has_more"]:
+            assert body["next_before_id"] is None
+            break
+        params = {"per_page": 3, "before_id": body["next_before_id"]}
+    assert seen == [f"m{i}" for i in reversed(range(7))]
+
+    body = _get(client, seller, car, per_page=4, after_id=msgs[1].public_id).get_json()
+    assert [m["content"] for m in body["messages"]] == ["m2", "m3", "m4", "m5"]
+    assert body["next_after_id"] == msgs[5].public_id
+    assert _get(client, seller, car, before_id="nope").status_code == 400
+
+    legacy = _get(client, seller, car, page=2, per_page=3).get_json()
+    assert [m["content"] for m in legacy["messages"]] == ["m3", "m4", "m5"]
+    assert legacy["page"] == 2 and legacy["has_more"] is True
+
+
+def test_page_payload_matches_message_to_dict(app, thread):
+    seller, _buyer, car, msgs = thread
+    body = _get(app.test_client(), seller, car).get_json()
+
+    by_id = {m["id"]: m for m in body["messages"]}
+    for msg in msgs:
+        db.session.expire(msg)
+        expected = msg.to_dict()
+        got = dict(by_id[msg.public_id])
+        # The payload is built before read marking flips the seller's inbound rows.
+        assert got.pop("is_read") is False
+        expected.pop("is_read")
+        assert got == expected
+    assert by_id[msgs[5].public_id]["reply_to_message"]["content"] == "m0"
+
+
+def test_fetch_marks_read_in_one_batch_and_skips_when_nothing_unread(app, thread, monkeypatch):
+    seller, buyer, car, _msgs = thread
+    client = app.test_client()
+    batches = []
+    real_batch = chat_realtime.mark_read_batch
+    monkeypatch.setattr(chat_realtime, "mark_read_batch", lambda *a: batches.append(a) or real_batch(*a))
+
+    _get(client, seller, car)
+    _get(client, seller, car)
+
+    assert batches == [(car.id, seller.id)]
+    assert Message.query.filter_by(receiver_id=seller.id, is_read=False).count() == 0
+    assert Message.query.filter_by(receiver_id=buyer.id, is_read=False).count() == 3
+    conv = Conversation.query.one()
+    assert (conv.seller_unread, conv.buyer_unread) == (0, 3)
+
+
+def test_broker_dispatch_coalesces_fetches(app, thread, monkeypatch):
+    seller, _buyer, car, _msgs = thread
+    queued = []
+
+    class _Redis:
+        def __init__(self):
+            self.keys = set()
+
+        def set(self, key, value, nx=False, px=None):
+            if key in self.keys:
+                return False
+            self.keys.add(key)
+            return True
+
+    import kk.tasks.chat_tasks as chat_tasks
+
+    monkeypatch.setenv("CELERY_BROKER_URL", "memory://")
+    monkeypatch.setattr(chat_realtime, "get_redis", lambda: _Redis.instance)
+    monkeypatch.setattr(chat_tasks.mark_chat_read, "apply_async", lambda args, countdown: queued.append(args))
+    _Redis.instance = _Redis()
+
+    assert chat_realtime.schedule_mark_read(car, seller)
+    assert chat_realtime.schedule_mark_read(car, seller)
+    assert queued == [(car.id, seller.id)]
+
+    assert chat_tasks.mark_chat_read.run(car.id, seller.id)["marked"] == 4
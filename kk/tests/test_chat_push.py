@@ -0,0 +1,235 @@
+"""Chat push queue: bursts coalesce into one push, failing tokens defer delivery, broker path uses Redis."""
+
+from __future__ import annotations
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import kk.chat_push as chat_push
+from kk.push import PushBatchResult
+
+RECEIVER = SimpleNamespace(id=2, public_id="u-buyer", firebase_token="tok-buyer")
+SENDER = SimpleNamespace(id=1, public_id="u-seller", first_name="Sam", last_name="Seller")
+
+
+@pytest.fixture()
+def pushes(monkeypatch):
+    monkeypatch.delenv("CELERY_BROKER_URL", raising=False)
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    chat_push.debug_reset_chat_push()
+    scheduled = []
+    delays = []
+    sent = []
+
+    def _schedule(key, app, delay):
+        scheduled.append(key)
+        delays.append(delay)
+
+    monkeypatch.setattr(chat_push, "_schedule_local", _schedule)
+    monkeypatch.setattr(chat_push, "fcm_is_configured", lambda: True)
+    monkeypatch.setattr(chat_push, "get_redis", lambda: None)
+
+    def _send(items):
+        sent.extend(items)
+        ok = sent_ok[0]
+        if ok == "invalid":
+            return PushBatchResult(0, 1, [items[0][0]])
+        return PushBatchResult(1 if ok else 0, 0 if ok else 1, [])
+
+    sent_ok = [True]
+    monkeypatch.setattr(chat_push, "send_each_and_prune", _send)
+    yield SimpleNamespace(scheduled=scheduled, delays=delays, sent=sent, ok=sent_ok)
+    chat_push.debug_reset_chat_push()
+
+
+def test_burst_from_one_sender_becomes_one_push(pushes):
+    for text in ("one", "two", "three"):
+        assert chat_push.queue_chat_push(RECEIVER, SENDER, "car-1", text)
+    chat_push.queue_chat_push(RECEIVER, SENDER, "car-2", "other listing")
+    assert not chat_push.queue_chat_push(SimpleNamespace(id=3, firebase_token=None), SENDER, "car-1", "x")
+
+    assert pushes.scheduled == ["2:1:car-1", "2:1:car-2"]
+    assert chat_push.chat_push_stats()["queue_depth"]["local"] == 4
+
+    for key in pushes.scheduled:
+        chat_push.deliver(key)
+
+    token, title, body, data = pushes.sent[0]
+    assert (token, title, body) == ("tok-buyer", "New messages from Sam Seller", "3 new messages")
+    assert data == {"car_id": "car-1", "sender_id": "u-seller", "type": "chat_message", "count": 3}
+    assert pushes.sent[1][1:3] == ("New message from Sam Seller", "other listing")
+
+    stats = chat_push.chat_push_stats()
+    assert stats["queue_depth"]["local"] == 0
+    assert (stats["enqueued"], stats["coalesced"], stats["sent"]) == (4, 2, 2)
+    assert stats["latency_ms_avg"] is not None
+
+
+def test_failed_token_defers_delivery_until_backoff_ends(pushes):
+    pushes.ok[0] = False
+    chat_push.queue_chat_push(RECEIVER, SENDER, "car-1", "a")
+    assert chat_push.deliver("2:1:car-1")["backoff"] is True
+    # The failed message is put back and retried when the backoff window ends.
+    assert pushes.scheduled == ["2:1:car-1", "2:1:car-1"] and pushes.delays[-1] == 5.0
+    chat_push.queue_chat_push(RECEIVER, SENDER, "car-1", "b")
+    assert chat_push.chat_push_stats()["queue_depth"]["local"] == 2
+
+    # Still backing off: nothing is sent and nothing is lost.
+    assert chat_push.deliver("2:1:car-1")["backoff"] is True
+    assert len(pushes.sent) == 1 and 0 < pushes.delays[-1] <= 5.0
+    assert chat_push.chat_push_stats()["queue_depth"]["local"] == 2
+
+    # Backoff expired: both messages go out as one push and the failure count clears.
+    chat_push._local_backoff.update({k: (v[0], 0.0) for k, v in chat_push._local_backoff.items()})
+    pushes.ok[0] = True
+    assert chat_push.deliver("2:1:car-1") == {"sent": 1, "messages": 2}
+    assert pushes.sent[-1][2] == "2 new messages"
+    assert chat_push._local_backoff == {}
+    stats = chat_push.chat_push_stats()
+    assert (stats["failed"], stats["deferred_backoff"], stats["sent"]) == (1, 1, 1)
+    assert stats["queue_depth"]["local"] == 0
+
+
+def test_invalid_token_drops_queued_messages(pushes):
+    pushes.ok[0] = "invalid"
+    chat_push.queue_chat_push(RECEIVER, SENDER, "car-1", "a")
+    assert chat_push.deliver("2:1:car-1")["invalid"] is True
+    chat_push.queue_chat_push(RECEIVER, SENDER, "car-2", "b")
+    assert chat_push.deliver("2:1:car-2") == {"sent": 0, "messages": 1, "invalid": True}
+    assert len(pushes.sent) == 1 and pushes.scheduled == ["2:1:car-1", "2:1:car-2"]
+    stats = chat_push.chat_push_stats()
+    assert (stats["invalid"], stats["dropped_invalid"], stats["queue_depth"]["local"]) == (1, 1, 0)
+
+
+class _Redis:
+    def __init__(self):
+        self.lists: dict[str, list] = {}
+        self.values: dict[str, int] = {}
+        self.sets: dict[str, set] = {}
+
+    def pipeline(self):
+        return _Pipeline(self)
+
+    def rpush(self, key, value):
+        self.lists.setdefault(key, []).append(value)
+        return len(self.lists[key])
+
+    def lpush(self, key, *values):
+        for value in values:
+            self.lists.setdefault(key, []).insert(0, value)
+        return len(self.lists[key])
+
+    def lrange(self, key, _start, _end):
+        return list(self.lists.get(key, []))
+
+    def delete(self, *keys):
+        for key in keys:
+            self.lists.pop(key, None)
+            self.values.pop(key, None)
+
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def sadd(self, key, *members):
+        self.sets.setdefault(key, set()).update(members)
+
+    def srem(self, key, *members):
+        self.sets.get(key, set()).difference_update(members)
+
+    def smembers(self, key):
+        return set(self.sets.get(key, set()))
+
+    def incr(self, key):
+        self.values[key] = self.values.get(key, 0) + 1
+        return self.values[key]
+
+    def set(self, key, _value, px=None, ex=None):
+        # Store the TTL in ms as the value so pttl can report it.
+        self.values[key] = px if px is not None else (ex or 0) * 1000
+
+    def pttl(self, key):
+        return self.values.get(key, -2)
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def exists(self, key):
+        return key in self.values
+
+    def expire(self, *_a):
+        return True
+
+
+class _Pipeline:
+    def __init__(self, r):
+        self.r, self.calls = r, []
+
+    def __getattr__(self, name):
+        return lambda *a: self.calls.append((name, a))
+
+    def execute(self):
+        return [getattr(self.r, name)(*a) for name, a in self.calls]
+
+
+def test_broker_path_queues_in_redis_and_schedules_one_task(pushes, monkeypatch):
+    import kk.tasks.chat_tasks as chat_tasks
+
+    r = _Redis()
+    queued = []
+    monkeypatch.setenv("CELERY_BROKER_URL", "memory://")
+    monkeypatch.setattr(chat_push, "get_redis", lambda: r)
+    monkeypatch.setattr(
+        chat_tasks.deliver_chat_push, "apply_async", lambda args, countdown: queued.append((args, countdown))
+    )
+
+    chat_push.queue_chat_push(RECEIVER, SENDER, "car-1", "a")
+    chat_push.queue_chat_push(RECEIVER, SENDER, "car-1", "b")
+    assert queued == [(("2:1:car-1",), 3.0)]
+    assert chat_push.chat_push_stats()["queue_depth"]["shared"] == 2
+
+    assert chat_tasks.deliver_chat_push.run("2:1:car-1") == {"sent": 1, "messages": 2}
+    assert pushes.sent[0][2] == "2 new messages"
+    assert pushes.scheduled == []
+    assert chat_push.chat_push_stats()["queue_depth"]["shared"] == 0
+
+
+def test_broker_path_requeues_in_redis_while_backing_off(pushes, monkeypatch):
+    import kk.tasks.chat_tasks as chat_tasks
+
+    r = _Redis()
+    queued = []
+    monkeypatch.setenv("CELERY_BROKER_URL", "memory://")
+    monkeypatch.setattr(chat_push, "get_redis", lambda: r)
+    monkeypatch.setattr(
+        chat_tasks.deliver_chat_push, "apply_async", lambda args, countdown: queued.append((args, countdown))
+    )
+    pushes.ok[0] = False
+
+    chat_push.queue_chat_push(RECEIVER, SENDER, "car-1", "a")
+    chat_push.queue_chat_push(RECEIVER, SENDER, "car-1", "b")
+    assert chat_tasks.deliver_chat_push.run("2:1:car-1")["backoff"] is True
+    # Put back in order and one delivery scheduled for the end of the window.
+    assert [json.loads(x)["body"] for x in r.lists["chatpush:pending:2:1:car-1"]] == ["a", "b"]
+    assert queued[-1] == (("2:1:car-1",), 5.0)
+    assert chat_push.chat_push_stats()["queue_depth"]["shared"] == 2
+    assert pushes.scheduled == []
+
+
+def test_shared_depth_follows_the_lists_when_one_expires(pushes, monkeypatch):
+    import kk.tasks.chat_tasks as chat_tasks
+
+    r = _Redis()
+    monkeypatch.setenv("CELERY_BROKER_URL", "memory://")
+    monkeypatch.setattr(chat_push, "get_redis", lambda: r)
+    monkeypatch.setattr(chat_tasks.deliver_chat_push, "apply_async", lambda args, countdown: None)
+
+    chat_push.queue_chat_push(RECEIVER, SENDER, "car-1", "a")
+    chat_push.queue_chat_push(RECEIVER, SENDER, "car-2", "b")
+    assert chat_push.chat_push_stats()["queue_depth"]["shared"] == 2
+
+    # The task for car-1 was lost and its list hit the TTL.
+    del r.lists["chatpush:pending:2:1:car-1"]
+    assert chat_push.chat_push_stats()["queue_depth"]["shared"] == 1
+    assert r.sets["chatpush:keys"] == {"2:1:car-2"}
@@ -44,6 +44,7 @@ def test_mark_messages_read_emits_to_senders():
         patch.object(chat_realtime, "User") as User,
         patch.object(chat_realtime, "db") as db,
         patch.object(chat_realtime, "emit_to_user_rooms") as emit_rooms,
+        patch.object(chat_realtime, "mark_conversations_read") as mark_conversations,
     ):
         Message.query = query
         User.query = user_query
@@ -51,6 +52,7 @@ def test_mark_messages_read_emits_to_senders():
 
     assert result["marked"] == 1
     assert result["message_ids"] == ["msg-1"]
+    mark_conversations.assert_called_once_with(1, 10)
     db.session.commit.assert_called_once()
     emit_rooms.assert_called_once()
     args, _kwargs = emit_rooms.call_args
@@ -0,0 +1,75 @@
+"""Production connection pool options, self-check fallback and metrics."""
+
+from __future__ import annotations
+
+import threading
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+import kk.db_pool as db_pool
+
+
+def test_queue_pool_sized_from_gunicorn_threads(monkeypatch):
+    monkeypatch.setenv("GUNICORN_THREADS", "6")
+    monkeypatch.delenv("DB_POOL_MODE", raising=False)
+    opts = db_pool.production_engine_options()
+    assert opts["poolclass"] is db_pool.InstrumentedQueuePool
+    assert opts["pool_size"] == 6 and opts["max_overflow"] == 6
+    assert opts["pool_pre_ping"] is True
+    assert opts["pool_recycle"] == 300
+    assert "connect_args" not in opts
+
+
+def test_pgbouncer_mode_disables_prepared_statements(monkeypatch):
+    monkeypatch.setenv("DB_POOL_MODE", "pgbouncer")
+    opts = db_pool.production_engine_options({"connect_args": {"sslmode": "require"}})
+    assert opts["connect_args"] == {"sslmode": "require", "prepare_threshold": None}
+    assert opts["poolclass"] is db_pool.InstrumentedQueuePool
+
+
+def test_null_mode_and_failed_self_check_fall_back(monkeypatch):
+    monkeypatch.setenv("DB_POOL_MODE", "null")
+    assert db_pool.production_engine_options()["poolclass"] is NullPool
+
+    monkeypatch.setenv("DB_POOL_MODE", "queue")
+    monkeypatch.setattr(
+        db_pool, "queue_pool_self_check", lambda: "RuntimeError: cannot notify on un-acquired lock"
+    )
+    opts = db_pool.production_engine_options()
+    assert opts["poolclass"] is NullPool
+    assert "pool_size" not in opts
+
+
+def test_self_check_passes_on_real_threads():
+    assert db_pool.queue_pool_self_check(threads=4, rounds=50) is None
+
+
+def test_pool_stats_record_checkout_waits(tmp_path):
+    db_pool._stats.reset()
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'p.db'}",
+        poolclass=db_pool.InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+    )
+    held = engine.connect()
+    released = threading.Event()
+
+    def waiter():
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        released.set()
+
+    t = threading.Thread(target=waiter)
+    t.start()
+    assert not released.wait(0.05)  # blocked on the single pooled connection
+    held.close()
+    t.join(5)
+
+    stats = db_pool.pool_stats(engine)
+    assert stats["pool"] == "InstrumentedQueuePool"
+    assert stats["checkouts"] == 2
+    assert stats["waits"] >= 1 and stats["wait_ms_max"] >= 40
+    assert stats["checked_out"] == 0
+    engine.dispose()
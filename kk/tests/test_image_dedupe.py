@@ -0,0 +1,111 @@
+"""Content-addressed upload dedupe: identical bytes reuse stored output; detector results cached apart."""
+
+from __future__ import annotations
+
+import os
+from io import BytesIO
+
+import pytest
+from flask import Flask
+from PIL import Image
+
+import kk.media_processing as mp
+from kk.image_dedupe import clear_memory_cache
+from kk.license_plate_blur import PlateBox
+
+
+def _jpeg(color="white", size=(1600, 900)) -> bytes:
+    buf = BytesIO()
+    Image.new("RGB", size, color).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+class _Detector:
+    name = "fake"
+
+    def __init__(self, status="ok"):
+        self.status = status
+        self.calls = 0
+
+    def is_configured(self):
+        return True
+
+    def detect_images_with_meta(self, images):
+        self.calls += 1
+        if self.status != "ok":
+            return [([], {"detect_status": self.status})]
+        return [([PlateBox(x1=100, y1=100, x2=300, y2=160, confidence=0.9)], {"detect_status": "ok"})]
+
+
+@pytest.fixture()
+def app(monkeypatch, tmp_path):
+    monkeypatch.setenv("APP_ENV", "testing")
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    monkeypatch.delenv("IMAGE_DEDUPE_ENABLED", raising=False)
+    clear_memory_cache()
+    app = Flask(__name__)
+    app.config["UPLOAD_FOLDER"] = str(tmp_path / "uploads")
+    with app.app_context():
+        yield app
+    clear_memory_cache()
+
+
+@pytest.fixture()
+def persisted(monkeypatch):
+    names = []
+    real_persist = mp.persist_jpeg_bytes
+
+    def persist(out_bytes, *, object_filename):
+        names.append(object_filename)
+        return real_persist(out_bytes, object_filename=object_filename)
+
+    monkeypatch.setattr(mp, "persist_jpeg_bytes", persist)
+    return names
+
+
+def test_identical_upload_returns_stored_result(app, monkeypatch, persisted):
+    detector = _Detector()
+    monkeypatch.setattr(mp, "_plate_detector", lambda: detector)
+    raw = _jpeg()
+
+    first = mp.process_listing_image(raw, "a.jpg", inline_base64=True, renditions=True)
+    again = mp.process_listing_image(raw, "retry.jpg", inline_base64=True, renditions=True)
+
+    assert again == first
+    assert len(persisted) == 1 and detector.calls == 1
+    assert mp.process_listing_image(_jpeg("gray"), "other.jpg").rel_path != first.rel_path
+
+
+def test_new_settings_reprocess_but_reuse_detection(app, monkeypatch, persisted):
+    detector = _Detector()
+    monkeypatch.setattr(mp, "_plate_detector", lambda: detector)
+    raw = _jpeg()
+
+    first = mp.process_listing_image(raw, "a.jpg")
+    monkeypatch.setenv("UPLOAD_IMAGE_JPEG_QUALITY", "70")
+    second = mp.process_listing_image(raw, "a.jpg")
+
+    assert second.rel_path != first.rel_path
+    assert len(persisted) == 2 and detector.calls == 1
+
+
+def test_failed_detection_is_not_remembered(app, monkeypatch, persisted):
+    detector = _Detector(status="detect_failed")
+    monkeypatch.setattr(mp, "_plate_detector", lambda: detector)
+    raw = _jpeg()
+
+    mp.process_listing_image(raw, "a.jpg")
+    mp.process_listing_image(raw, "a.jpg")
+
+    assert len(persisted) == 2 and detector.calls == 2
+
+
+def test_missing_local_object_is_a_miss(app, monkeypatch, persisted, tmp_path):
+    monkeypatch.setenv("PLATE_BLUR_ENABLED", "0")
+    raw = _jpeg()
+
+    first = mp.process_listing_image(raw, "a.jpg")
+    os.remove(tmp_path / first.rel_path)
+    second = mp.process_listing_image(raw, "a.jpg")
+
+    assert len(persisted) == 2 and (tmp_path / second.rel_path).is_file()
@@ -0,0 +1,128 @@
+"""Single-decode pipeline: draft decode, one EXIF transpose, in-place blur, one encode per size."""
+
+from __future__ import annotations
+
+from io import BytesIO
+
+import pytest
+from flask import Flask
+from PIL import Image
+
+import kk.media_processing as mp
+from kk.image_pipeline import ImagePipeline
+from kk.license_plate_blur import PlateBox, blur_license_plates
+
+
+def _jpeg(size, color="white", orientation: int | None = None) -> bytes:
+    im = Image.new("RGB", size, color)
+    buf = BytesIO()
+    if orientation:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        im.save(buf, format="JPEG", exif=exif)
+    else:
+        im.save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+class _Detector:
+    def __init__(self, box):
+        self.box = box
+        self.seen_sizes = []
+
+    def is_configured(self):
+        return True
+
+    def detect_with_meta(self, image_bytes):
+        with Image.open(BytesIO(image_bytes)) as im:
+            self.seen_sizes.append(im.size)
+        return [self.box], {"detect_status": "ok"}
+
+
+def test_jpeg_is_scaled_during_decode():
+    pipeline = ImagePipeline.decode(_jpeg((4000, 3000)), max_dim=1200)
+
+    # DCT scaling to 1/2 still covers 1200 px; the final resize happens at encode.
+    assert pipeline.size == (2000, 1500)
+    with Image.open(BytesIO(pipeline.encode(max_dim=1200))) as out:
+        assert out.size == (1200, 900)
+
+
+def test_exif_orientation_applied_once():
+    pipeline = ImagePipeline.decode(_jpeg((400, 200), orientation=6))
+
+    assert pipeline.size == (200, 400)
+    with Image.open(BytesIO(pipeline.encode())) as out:
+        assert out.size == (200, 400)
+        assert out.getexif().get(0x0112) in (None, 1)
+
+
+def test_blur_maps_probe_boxes_back_to_full_resolution():
+    pipeline = ImagePipeline.decode(_jpeg((3200, 1600)))
+    # Checkerboard region so a blur visibly changes pixels.
+    for x in range(1600, 2000):
+        for y in range(800, 1000, 2):
+            pipeline.image.putpixel((x, y), (0, 0, 0))
+    detector = _Detector(PlateBox(x1=800, y1=400, x2=1000, y2=500))
+
+    meta = pipeline.blur_plates(detector, detect_max_dim=1600)
+
+    assert detector.seen_sizes == [(1600, 800)]
+    assert meta["status"] == "blurred" and meta["applied"] == 1
+    assert pipeline.image.getpixel((1700, 900)) not in ((0, 0, 0), (255, 255, 255))
+    assert pipeline.image.getpixel((100, 100)) == (255, 255, 255)
+
+
+def test_blur_license_plates_bytes_api_encodes_requested_format():
+    raw = _jpeg((800, 400))
+    out, meta = blur_license_plates(
+        image_bytes=raw,
+        output_ext=".png",
+        detector=_Detector(PlateBox(x1=10, y1=10, x2=200, y2=100)),
+    )
+
+    assert meta["status"] == "blurred"
+    assert out[:8] == b"\x89PNG\r\n\x1a\n"
+
+
+def test_process_image_bytes_encodes_once_per_output(monkeypatch, tmp_path):
+    monkeypatch.setenv("APP_ENV", "testing")
+    monkeypatch.setenv("PLATE_BLUR_ENABLED", "0")
+    app = Flask(__name__)
+    app.config["UPLOAD_FOLDER"] = str(tmp_path)
+    raw = _jpeg((3000, 2000))
+    saves = []
+    real_save = Image.Image.save
+
+    def counting_save(self, fp, format=None, **params):
+        saves.append((format, self.size))
+        return real_save(self, fp, format=format, **params)
+
+    monkeypatch.setattr(Image.Image, "save", counting_save)
+
+    with app.app_context():
+        rel, b64 = mp.process_image_bytes(raw, "car.jpg", inline_base64=True)
+
+    assert saves == [("JPEG", (1200, 800)), ("JPEG", (420, 280))]
+    assert rel.startswith("uploads/car_photos/") and b64.startswith("data:image/jpeg;base64,")
+
+
+def test_undecodable_upload_is_stored_as_is(monkeypatch, tmp_path):
+    monkeypatch.setenv("APP_ENV", "testing")
+    app = Flask(__name__)
+    app.config["UPLOAD_FOLDER"] = str(tmp_path)
+
+    with app.app_context():
+        rel, _ = mp.process_image_bytes(b"not an image", "x.jpg", skip_blur=True)
+
+    assert (tmp_path / "car_photos" / rel.rsplit("/", 1)[-1]).read_bytes() == b"not an image"
+
+
+@pytest.mark.parametrize("mode", ["L", "RGBA"])
+def test_decode_normalizes_mode(mode):
+    buf = BytesIO()
+    Image.new(mode, (50, 40)).save(buf, format="PNG")
+
+    pipeline = ImagePipeline.decode(buf.getvalue())
+
+    assert pipeline.image.mode in ("RGB", "L")
@@ -0,0 +1,85 @@
+"""Listing photo renditions: generated at upload, exposed as srcset, backfilled in batches."""
+
+from __future__ import annotations
+
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import kk.media_processing as mp
+from kk.image_renditions import backfill_image_renditions
+from kk.listing_cards import hero_images
+from kk.models import Car, CarImage, db
+
+
+def _jpeg(size=(2400, 1600)) -> bytes:
+    buf = BytesIO()
+    Image.new("RGB", size, "navy").save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+@pytest.fixture()
+def app(app, monkeypatch, tmp_path, make_user, make_car):
+    monkeypatch.setenv("PLATE_BLUR_ENABLED", "0")
+    monkeypatch.delenv("IMAGE_RENDITION_WIDTHS", raising=False)
+    monkeypatch.delenv("IMAGE_RENDITION_FORMATS", raising=False)
+    app.config["UPLOAD_FOLDER"] = str(tmp_path / "uploads")
+    make_car(make_user("s"))
+    db.session.commit()
+    return app
+
+
+def _local(tmp_path, url: str):
+    return tmp_path / url
+
+
+def test_upload_produces_webp_widths_and_jpeg_fallback(app, tmp_path):
+    result = mp.process_listing_image(_jpeg(), "front.jpg", renditions=True)
+
+    srcset = result.renditions
+    assert set(srcset) == {"webp", "jpeg"}
+    assert set(srcset["webp"]) == {"240", "480", "1200"}
+    assert srcset["jpeg"]["1200"] == result.rel_path
+    for width in (240, 480, 1200):
+        with Image.open(_local(tmp_path, srcset["webp"][str(width)])) as im:
+            assert im.format == "WEBP" and max(im.size) == width
+    with Image.open(_local(tmp_path, srcset["jpeg"]["480"])) as im:
+        assert im.format == "JPEG" and im.size == (480, 320)
+
+
+def test_srcset_returned_by_serializers(app):
+    car = Car.query.one()
+    renditions = {"webp": {"240": "uploads/car_photos/a_w240.webp"}, "jpeg": {"240": "uploads/car_photos/a_w240.jpg"}}
+    db.session.add(CarImage(car_id=car.id, image_url="uploads/car_photos/a.jpg", is_primary=True, renditions=renditions))
+    db.session.add(CarImage(car_id=car.id, image_url="uploads/car_photos/b.jpg"))
+    db.session.commit()
+
+    assert [img.to_dict()["srcset"] for img in car.images] == [renditions, None]
+    assert hero_images([car.id])[car.id]["image_srcset"] == renditions
+
+
+def test_backfill_generates_in_batches_and_marks_unreadable_rows(app, tmp_path):
+    car = Car.query.one()
+    photos = tmp_path / "uploads" / "car_photos"
+    photos.mkdir(parents=True)
+    (photos / "old.jpg").write_bytes(_jpeg((1000, 750)))
+    db.session.add(CarImage(car_id=car.id, image_url="uploads/car_photos/old.jpg"))
+    db.session.add(CarImage(car_id=car.id, image_url="uploads/car_photos/missing.jpg"))
+    db.session.add(CarImage(car_id=car.id, image_url="uploads/car_photos/done.jpg", renditions={"webp": {}}))
+    db.session.commit()
+
+    processed, last_id = backfill_image_renditions(after_id=0, batch_size=1)
+    assert processed == 1
+    processed, last_id = backfill_image_renditions(after_id=last_id, batch_size=1)
+    assert processed == 1
+    assert backfill_image_renditions(after_id=last_id, batch_size=1) == (0, None)
+
+    old, missing, done = CarImage.query.order_by(CarImage.id).all()
+    assert set(old.renditions["webp"]) == {"240", "480", "1200"}
+    # Source is 1000 px: no upscaled JPEG, the stored image is the largest fallback.
+    assert old.renditions["jpeg"]["1200"] == "uploads/car_photos/old.jpg"
+    with Image.open(_local(tmp_path, old.renditions["webp"]["1200"])) as im:
+        assert im.size == (1000, 750)
+    assert missing.renditions == {}
+    assert done.renditions == {"webp": {}}
@@ -0,0 +1,107 @@
+"""Multi-image uploads: per-image work on the shared pool, async mode attaching via Celery."""
+
+from __future__ import annotations
+
+import threading
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import kk.media_processing as mp
+from kk.models import CarImage, db
+from kk.tasks import image_tasks
+
+
+def _jpeg(color: str, size=(1600, 900)) -> bytes:
+    buf = BytesIO()
+    Image.new("RGB", size, color).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+@pytest.fixture()
+def app(app, monkeypatch, tmp_path):
+    monkeypatch.setenv("PLATE_BLUR_ENABLED", "0")
+    monkeypatch.setenv("UPLOAD_IMAGE_WORKERS", "4")
+    app.config["UPLOAD_FOLDER"] = str(tmp_path)
+    return app
+
+
+def test_images_processed_concurrently_in_input_order(app, monkeypatch, tmp_path):
+    barrier = threading.Barrier(3, timeout=5)
+    real_persist = mp.persist_jpeg_bytes
+
+    def persist(out_bytes, *, object_filename):
+        barrier.wait()  # all three uploads in flight at once
+        return real_persist(out_bytes, object_filename=object_filename)
+
+    monkeypatch.setattr(mp, "persist_jpeg_bytes", persist)
+
+    results = mp.process_images_concurrently(
+        [(_jpeg("red"), "a.jpg"), (_jpeg("green"), "b.jpg"), (_jpeg("blue"), "c.jpg")]
+    )
+
+    assert [r.rel_path.rsplit("_", 1)[-1] for r in results] == ["a.jpg", "b.jpg", "c.jpg"]
+    for result in results:
+        assert (result.width, result.height) == (1200, 675)
+        with Image.open(tmp_path / "car_photos" / result.rel_path.rsplit("/", 1)[-1]) as im:
+            assert im.size == (1200, 675)
+
+
+def test_failed_image_is_reported_without_losing_others(app, monkeypatch):
+    real_persist = mp.persist_jpeg_bytes
+
+    def persist(out_bytes, *, object_filename):
+        if "bad" in object_filename:
+            raise RuntimeError("R2 upload failed")
+        return real_persist(out_bytes, object_filename=object_filename)
+
+    monkeypatch.setattr(mp, "persist_jpeg_bytes", persist)
+
+    ok, bad = mp.process_images_concurrently([(_jpeg("red"), "ok.jpg"), (_jpeg("blue"), "bad.jpg")])
+
+    assert ok.rel_path.endswith("ok.jpg")
+    assert isinstance(bad, RuntimeError)
+
+
+def test_streams_are_read_by_the_workers(app):
+    readers = []
+
+    class _Upload(BytesIO):
+        def read(self, *args):
+            readers.append(threading.current_thread().name)
+            return super().read(*args)
+
+    results = mp.process_images_concurrently([(_Upload(_jpeg("red")), "a.jpg"), (_Upload(_jpeg("blue")), "b.jpg")])
+
+    assert [r.rel_path.rsplit("_", 1)[-1] for r in results] == ["a.jpg", "b.jpg"]
+    assert len(readers) == 2 and all(name.startswith("image-upload") for name in readers)
+
+
+def test_async_job_attaches_image_to_listing(app, tmp_path, make_user, make_car):
+    seller = make_user("s")
+    car = make_car(seller)
+    db.session.commit()
+
+    temp = tmp_path / "temp.jpg"
+    temp.write_bytes(_jpeg("red"))
+    out = image_tasks.process_car_image_file.run(
+        str(temp), "front.jpg", False, True, owner_public_id=seller.public_id, car_id=car.id
+    )
+    temp2 = tmp_path / "temp2.jpg"
+    temp2.write_bytes(_jpeg("blue"))
+    image_tasks.process_car_image_file.run(str(temp2), "back.jpg", False, True, car_id=car.id)
+    # The enqueuing request picked another upload's file: this one is never primary...
+    temp3 = tmp_path / "temp3.jpg"
+    temp3.write_bytes(_jpeg("green"))
+    image_tasks.process_car_image_file.run(str(temp3), "side.jpg", False, True, car_id=car.id, is_primary=False)
+    # ...and a second upload's candidate loses to the primary already attached.
+    temp4 = tmp_path / "temp4.jpg"
+    temp4.write_bytes(_jpeg("white"))
+    image_tasks.process_car_image_file.run(str(temp4), "rear.jpg", False, True, car_id=car.id, is_primary=True)
+
+    assert out["ok"] and out["owner_public_id"] == seller.public_id
+    assert out["image"]["image_url"] == out["rel_path"]
+    assert not temp.exists()
+    images = CarImage.query.filter_by(car_id=car.id).order_by(CarImage.id).all()
+    assert [img.is_primary for img in images] == [True, False, False, False]
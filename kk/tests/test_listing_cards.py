@@ -0,0 +1,117 @@
+"""Compact card projection for listing feeds."""
+
+from __future__ import annotations
+
+import pytest
+from sqlalchemy import event
+
+from kk import media_paths
+from kk.listing_cards import (
+    CARD_FIELDS,
+    card_query_options,
+    parse_card_fields,
+    serialize_cards,
+)
+from kk.models import Car, CarImage, db
+
+
+@pytest.fixture()
+def static_root(tmp_path, monkeypatch):
+    (tmp_path / "uploads").mkdir()
+    for name in ("a.jpg", "b.jpg"):
+        (tmp_path / "uploads" / name).write_bytes(b"x")
+    monkeypatch.setattr(media_paths, "STATIC_ROOTS", (str(tmp_path),))
+    media_paths.clear_static_path_cache()
+    yield tmp_path
+    media_paths.clear_static_path_cache()
+
+
+@pytest.fixture()
+def app(app, static_root, make_user, make_car):
+    seller = make_user("s")
+    for i in range(3):
+        car = make_car(
+            seller,
+            brand="Toyota",
+            model="Camry",
+            year=2015 + i,
+            price=10_000.0 + i,
+            location="Baghdad",
+            description="long text " * 50,
+        )
+        if i == 0:
+            db.session.add_all(
+                [
+                    CarImage(car_id=car.id, image_url="/uploads/a.jpg", order=0),
+                    CarImage(
+                        car_id=car.id,
+                        image_url="uploads/b.jpg",
+                        is_primary=True,
+                        image_width=800,
+                        image_height=600,
+                    ),
+                    # Damage photos are never the hero, even when flagged primary.
+                    CarImage(car_id=car.id, image_url="uploads/d.jpg", is_primary=True, kind="damage"),
+                ]
+            )
+        elif i == 1:
+            db.session.add(CarImage(car_id=car.id, image_url="https://cdn.example/x.jpg"))
+    db.session.commit()
+    return app
+
+
+def test_parse_card_fields():
+    assert parse_card_fields({}) is None
+    assert parse_card_fields({"view": "card"}) == CARD_FIELDS
+    assert parse_card_fields({"fields": "price,bogus,image_url,price"}) == ("id", "price", "image_url")
+    assert parse_card_fields({"fields": "seller,ai_detected_brand"}) == CARD_FIELDS
+
+
+def test_cards_pick_hero_image_and_skip_heavy_fields(app):
+    with app.app_context():
+        cars = Car.query.options(*card_query_options(CARD_FIELDS)).order_by(Car.id).all()
+        cards = serialize_cards(cars, CARD_FIELDS)
+        assert [c["image_url"] for c in cards] == ["uploads/b.jpg", "https://cdn.example/x.jpg", ""]
+        assert (cards[0]["image_width"], cards[0]["image_height"]) == (800, 600)
+        assert cards[0]["city"] == "Baghdad"
+        assert cards[0]["id"] == cars[0].public_id
+        assert set(cards[0]) == set(CARD_FIELDS)
+        for heavy in ("description", "images", "videos", "seller", "ai_analyzed"):
+            assert heavy not in cards[0]
+
+
+def test_cards_cost_two_queries_per_page(app):
+    fields = parse_card_fields({"fields": "title,price,image_url,images_count"})
+    with app.app_context():
+        db.session.expire_all()
+        statements: list[str] = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            cars = Car.query.options(*card_query_options(fields)).order_by(Car.id).all()
+            cards = serialize_cards(cars, fields)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+
+        assert len(statements) == 2  # car page + one windowed hero-image query
+        assert "description" not in statements[0]
+        assert [c["images_count"] for c in cards] == [2, 1, 0]
+        assert set(cards[0]) == {"id", "title", "price", "image_url", "images_count"}
+
+
+def test_card_and_detail_agree_when_the_hero_file_is_missing(app, static_root):
+    (static_root / "uploads" / "b.jpg").unlink()
+    media_paths.clear_static_path_cache()
+    with app.app_context():
+        # Unresolved rows (the mapper hook may be installed by other test modules).
+        db.session.execute(db.update(CarImage).values(resolved_url=None))
+        db.session.commit()
+        car = Car.query.order_by(Car.id).first()
+        card = serialize_cards([car], ("id", "image_url"))[0]
+        # Same resolver as the detail view: the missing primary is skipped, not served raw.
+        resolved = [media_paths.image_display_url(i) for i in car.images if i.kind != "damage"]
+        assert resolved == ["uploads/a.jpg", ""]
+        assert card["image_url"] == "uploads/a.jpg"
@@ -0,0 +1,175 @@
+"""Buffered listing counters (per-process accumulator path) and batched flush."""
+
+from __future__ import annotations
+
+import pytest
+from sqlalchemy import event
+
+import kk.listing_metrics as lm
+from kk.models import Car, ListingAnalytics, ListingCounterFlush, User, db
+
+
+@pytest.fixture()
+def app(app, monkeypatch, make_user, make_car):
+    monkeypatch.setenv("COUNTER_LOCAL_FLUSH_S", "3600")
+    lm.clear_pending_counters_for_tests()
+    lm.clear_engagement_claims_for_tests()
+    seller = make_user("s")
+    for i in range(3):
+        make_car(seller, brand="Toyota", model="Camry", year=2015 + i, location="Baghdad")
+    db.session.commit()
+    yield app
+    lm.clear_pending_counters_for_tests()
+
+
+def _updates(statements):
+    return [s for s in statements if s.lstrip().upper().startswith("UPDATE")]
+
+
+def test_increments_are_buffered_and_merged_on_read(app):
+    with app.app_context():
+        cars = Car.query.order_by(Car.id).all()
+        for _ in range(3):
+            lm.buffer_counter(cars[0].id, "views_count")
+        lm.buffer_counter(cars[1].id, "views_count")
+
+        db.session.expire_all()
+        assert [c.views_count or 0 for c in Car.query.order_by(Car.id)] == [0, 0, 0]
+        rows = lm.merge_pending_views([c.to_dict() for c in cars], cars)
+        assert [r["views_count"] for r in rows] == [3, 1, 0]
+
+
+def test_flush_applies_one_update_per_table(app):
+    with app.app_context():
+        cars = Car.query.order_by(Car.id).all()
+        for car in cars:
+            lm.buffer_counter(car.id, "views_count", n=car.id)
+            lm.bump_listing_metric(car, "messages")
+        lm.bump_listing_metric(cars[0], "favorites")
+
+        statements: list[str] = []
+
+        def capture(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", capture)
+        try:
+            assert lm.flush_pending_counters() == 7
+        finally:
+            event.remove(db.engine, "before_cursor_execute", capture)
+        assert len(_updates(statements)) == 2
+
+        db.session.expire_all()
+        assert [c.views_count for c in Car.query.order_by(Car.id)] == [c.id for c in cars]
+        analytics = {a.car_id: a for a in ListingAnalytics.query.all()}
+        assert sorted(analytics) == [c.id for c in cars]
+        assert analytics[cars[0].id].messages == 1
+        assert analytics[cars[0].id].favorites == 1
+        assert analytics[cars[1].id].favorites == 0
+
+        # Nothing left to apply, nothing left to merge.
+        assert lm.flush_pending_counters() == 0
+        assert lm.pending_counter_deltas([c.id for c in cars], ["views_count", "messages"]) == {}
+
+
+def test_failed_flush_keeps_deltas(app, monkeypatch):
+    with app.app_context():
+        car = Car.query.first()
+        lm.buffer_counter(car.id, "views_count", n=2)
+
+        def boom(deltas):
+            raise RuntimeError("db down")
+
+        monkeypatch.setattr(lm, "_apply_deltas", boom)
+        with pytest.raises(RuntimeError):
+            lm.flush_pending_counters()
+        assert lm.pending_counter_deltas([car.id], ["views_count"]) == {"views_count": {car.id: 2}}
+
+
+def test_local_accumulator_flushes_inline_when_due(app, monkeypatch):
+    monkeypatch.setenv("COUNTER_LOCAL_FLUSH_S", "0")
+    with app.app_context():
+        car = Car.query.first()
+        lm.buffer_counter(car.id, "views_count")
+        db.session.expire_all()
+        assert db.session.get(Car, car.id).views_count == 1
+
+
+def test_inline_flush_leaves_the_request_session_alone(app, monkeypatch):
+    monkeypatch.setenv("COUNTER_LOCAL_FLUSH_S", "0")
+    with app.app_context():
+        car = Car.query.first()
+        car.price = 1.0
+        lm.record_favorite_add(car, User(id=999))
+        # The caller's unflushed change was neither committed nor rolled back.
+        assert car in db.session.dirty and car.price == 1.0
+        db.session.rollback()
+        assert car.price == 10_000.0
+        assert ListingAnalytics.query.filter_by(car_id=car.id).one().favorites == 1
+
+
+def test_anonymous_view_claimed_once_per_ip(app):
+    assert lm.claim_anonymous_view("1.2.3.4", 7)
+    assert not lm.claim_anonymous_view("1.2.3.4", 7)
+    assert lm.claim_anonymous_view("1.2.3.4", 8)
+    assert lm.claim_anonymous_view("5.6.7.8", 7)
+
+
+class _Redis:
+    """Hashes and strings, with ``eval`` doing what ``_DRAIN_LUA`` does."""
+
+    def __init__(self):
+        self.hashes: dict[str, dict[str, int]] = {}
+        self.values: dict[str, str] = {}
+        self.crash_on_clear = False
+
+    def hincrby(self, key, field, n):
+        bucket = self.hashes.setdefault(key, {})
+        bucket[field] = bucket.get(field, 0) + n
+
+    def eval(self, _script, _n, pending, flushing, id_key, new_id):
+        if flushing not in self.hashes:
+            if pending not in self.hashes:
+                return []
+            self.hashes[flushing] = self.hashes.pop(pending)
+            self.values[id_key] = new_id
+        flush_id = self.values.setdefault(id_key, new_id)
+        return [flush_id, [x for field, n in self.hashes[flushing].items() for x in (field, str(n))]]
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return False
+        self.values[key] = value
+        return True
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def delete(self, *keys):
+        if self.crash_on_clear and lm._FLUSHING_KEY in keys:
+            self.crash_on_clear = False
+            raise ConnectionError("worker died")
+        for key in keys:
+            self.hashes.pop(key, None)
+            self.values.pop(key, None)
+
+
+def test_batch_committed_before_a_crash_is_not_applied_again(app):
+    r = _Redis()
+    with app.app_context():
+        car = Car.query.first()
+        r.hincrby(lm._PENDING_KEY, f"views_count:{car.id}", 2)
+        r.crash_on_clear = True
+        with pytest.raises(ConnectionError):
+            lm.flush_pending_counters(redis_client=r)
+        assert lm._FLUSHING_KEY in r.hashes
+
+        # Newer increments wait for the run after the leftover is cleared.
+        r.hincrby(lm._PENDING_KEY, f"views_count:{car.id}", 5)
+        assert lm.flush_pending_counters(redis_client=r) == 0
+        assert lm._FLUSHING_KEY not in r.hashes
+        assert lm.flush_pending_counters(redis_client=r) == 1
+
+        db.session.expire_all()
+        assert db.session.get(Car, car.id).views_count == 7
+        assert db.session.query(ListingCounterFlush).count() == 2
@@ -0,0 +1,133 @@
+"""Incrementally maintained filter facet store."""
+
+from __future__ import annotations
+
+import pytest
+
+from kk.listing_facets import (
+    apply_facet_deltas,
+    install_listing_facet_tracking,
+    read_listing_facets,
+    rebuild_listing_facets,
+    resolve_facet_scope,
+    retract_seller_listings,
+)
+from kk.models import Car, ListingFacetCount, db
+
+
+@pytest.fixture()
+def app(app, make_user):
+    install_listing_facet_tracking()
+    app.config["SELLER_ID"] = make_user("s").id
+    db.session.commit()
+    return app
+
+
+def _snapshot() -> set[tuple[str, str, str, int]]:
+    return {
+        (r.scope, r.facet, r.value_key, r.count)
+        for r in ListingFacetCount.query.filter(ListingFacetCount.count != 0)
+    }
+
+
+def test_counts_follow_create_update_and_delete(app, make_car):
+    with app.app_context():
+        sid = app.config["SELLER_ID"]
+        a = make_car(sid)
+        b = make_car(sid, location="erbil", price=20_000.0, year=2020)
+        db.session.commit()
+
+        facets = read_listing_facets()
+        assert facets["brands"] == ["toyota"]
+        assert facets["counts"]["brands"] == {"toyota": 2}
+        assert facets["counts"]["locations"] == {"baghdad": 1, "erbil": 1}
+        assert (facets["year_min"], facets["year_max"]) == (2018, 2020)
+        assert (facets["price_min"], facets["price_max"]) == (10_000.0, 20_000.0)
+
+        b.location = "baghdad"
+        db.session.commit()
+        assert read_listing_facets()["counts"]["locations"] == {"baghdad": 2}
+        assert "prices" not in read_listing_facets()["counts"]
+
+        # Bounds ignore prices whose count dropped back to zero.
+        b.price = 15_000.0
+        db.session.commit()
+        assert read_listing_facets()["price_max"] == 15_000.0
+
+        # Sold listings stay public; hidden ones drop out.
+        a.status = "sold"
+        db.session.commit()
+        assert read_listing_facets()["counts"]["brands"] == {"toyota": 2}
+        a.is_active = False
+        db.session.commit()
+        assert read_listing_facets()["counts"]["brands"] == {"toyota": 1}
+
+        db.session.delete(b)
+        db.session.commit()
+        facets = read_listing_facets()
+        assert facets["brands"] == []
+        assert facets["year_min"] is None
+
+
+def test_scoped_counts(app, make_car):
+    with app.app_context():
+        sid = app.config["SELLER_ID"]
+        make_car(sid)
+        make_car(sid, location="erbil")
+        make_car(sid, brand="kia", model="rio")
+        db.session.commit()
+
+        scope = resolve_facet_scope({"brand": "toyota"})
+        assert scope == "brand:toyota"
+        facets = read_listing_facets(scope)
+        assert facets["scope"] == "brand:toyota"
+        assert facets["counts"]["locations"] == {"baghdad": 1, "erbil": 1}
+        assert facets["models"] == ["camry"]
+
+        by_city = read_listing_facets(resolve_facet_scope({"city": "Baghdad"}))
+        assert by_city["counts"]["brands"] == {"kia": 1, "toyota": 1}
+        # Multi-valued filters are not scoped.
+        assert resolve_facet_scope({"brand": "toyota,kia"}) == ""
+
+
+def test_retract_and_rebuild_match_incremental_state(app, make_car):
+    with app.app_context():
+        sid = app.config["SELLER_ID"]
+        make_car(sid)
+        make_car(sid, brand="kia", color="red")
+        db.session.commit()
+        incremental = _snapshot()
+
+        ListingFacetCount.query.delete()
+        db.session.commit()
+        assert rebuild_listing_facets() == 2
+        assert _snapshot() == incremental
+
+        retract_seller_listings(sid)
+        Car.query.filter_by(seller_id=sid).update({"is_active": False}, synchronize_session=False)
+        db.session.commit()
+        assert _snapshot() == set()
+
+
+def test_upserts_run_in_key_order(app):
+    seen = []
+
+    class _Recorder:
+        dialect = type("D", (), {"name": "other"})()
+
+        def execute(self, stmt):
+            params = stmt.compile().params
+            seen.append((params["scope_1"], params["facet_1"], params["value_key_1"]))
+            return type("R", (), {"rowcount": 1})()
+
+    apply_facet_deltas(
+        _Recorder(),
+        {
+            ("", "brands", "toyota"): ("Toyota", None, 1),
+            ("", "brands", "kia"): ("Kia", None, -1),
+            ("", "bodies", "sedan"): ("sedan", None, 1),
+            ("brand:kia", "brands", "kia"): ("Kia", None, -1),
+        },
+    )
+    assert seen == sorted(seen)
+    assert len(seen) == 4
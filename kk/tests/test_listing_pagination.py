@@ -0,0 +1,117 @@
+"""Keyset (cursor) pagination for public listing feeds."""
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from kk.listing_pagination import (
+    _KEYSET_SORTS,
+    InvalidCursor,
+    _parse_key_value,
+    _seek_predicate,
+    decode_cursor,
+    encode_cursor,
+    paginate_keyset,
+    paginate_offset_cursor,
+    supports_keyset,
+)
+from kk.models import Car, db
+
+
+@pytest.fixture()
+def app(app, make_user, make_car):
+    seller = make_user("s")
+    base = datetime(2026, 1, 1)
+    for i in range(7):
+        make_car(
+            seller,
+            year=2010 + (i % 3),
+            mileage=1000 * i,
+            price=float(10_000 + 500 * (i % 2)),
+            location="Baghdad",
+            is_featured=(i == 3),
+            # Two rows share a timestamp so the id tiebreaker matters.
+            created_at=base + timedelta(days=min(i, 5)),
+        )
+    db.session.commit()
+    return app
+
+
+def _walk(sort_by: str, per_page: int) -> list[int]:
+    seen: list[int] = []
+    cursor = None
+    for _ in range(20):
+        items, next_cursor = paginate_keyset(Car.query, sort_by, cursor, per_page)
+        seen.extend(c.id for c in items)
+        if next_cursor is None:
+            return seen
+        cursor = decode_cursor(next_cursor)
+    raise AssertionError("cursor walk did not terminate")
+
+
+@pytest.mark.parametrize(
+    "sort_by", ["", "newest", "price_asc", "price_desc", "year_asc", "mileage_desc"]
+)
+def test_keyset_walk_matches_full_ordering(app, sort_by):
+    with app.app_context():
+        full, _ = paginate_keyset(Car.query, sort_by, None, 100)
+        expected = [c.id for c in full]
+        assert len(expected) == 7
+        assert _walk(sort_by, 2) == expected
+        assert _walk(sort_by, 3) == expected
+
+
+def test_keyset_featured_first(app):
+    with app.app_context():
+        items, _ = paginate_keyset(Car.query, "price_asc", None, 1)
+        assert items[0].is_featured is True
+
+
+def test_newest_seek_uses_featured_created_index(app):
+    spec = _KEYSET_SORTS["newest"]
+    with app.app_context():
+        query = Car.query.filter(Car.is_active == True)  # noqa: E712
+        _, next_cursor = paginate_keyset(query, "newest", None, 2)
+        raw = decode_cursor(next_cursor)["k"]
+        values = [_parse_key_value(name, v) for (name, _k, _d), v in zip(spec, raw)]
+        stmt = (
+            query.filter(_seek_predicate(spec, values))
+            .order_by(*[key().desc() for _n, key, _d in spec])
+            .limit(3)
+            .statement
+        )
+        sql = str(stmt.compile(db.engine, compile_kwargs={"literal_binds": True}))
+        assert "coalesce" not in sql.lower()
+        plan = " ".join(str(r[-1]) for r in db.session.execute(text("EXPLAIN QUERY PLAN " + sql)))
+        # Both the seek and the ORDER BY come straight off the composite index.
+        assert "ix_car_active_featured_created_at" in plan and "TEMP B-TREE" not in plan
+
+
+def test_cursor_roundtrip_and_validation():
+    token = encode_cursor({"s": "newest", "k": [True, "2026-01-01T00:00:00", 5]})
+    assert decode_cursor(token)["k"][2] == 5
+    assert decode_cursor("") is None
+    with pytest.raises(InvalidCursor):
+        decode_cursor("not-base64-json!")
+    with pytest.raises(InvalidCursor):
+        decode_cursor("x" * 600)
+
+
+def test_cursor_rejects_other_sort(app):
+    with app.app_context():
+        _, next_cursor = paginate_keyset(Car.query, "newest", None, 2)
+        with pytest.raises(InvalidCursor):
+            paginate_keyset(Car.query, "price_asc", decode_cursor(next_cursor), 2)
+
+
+def test_offset_cursor_for_unkeyed_sorts(app):
+    assert not supports_keyset("random")
+    with app.app_context():
+        ordered = Car.query.order_by(Car.id.asc())
+        first, cursor = paginate_offset_cursor(ordered, "random", None, 4)
+        second, last_cursor = paginate_offset_cursor(ordered, "random", decode_cursor(cursor), 4)
+        assert [c.id for c in first + second] == [c.id for c in ordered.all()]
+        assert last_cursor is None
@@ -0,0 +1,109 @@
+"""Image paths resolved at write time + cached static lookups."""
+
+from __future__ import annotations
+
+import pytest
+
+from kk import media_paths
+from kk.models import Car, CarImage, db
+
+
+@pytest.fixture()
+def static_root(tmp_path, monkeypatch):
+    (tmp_path / "uploads" / "car_photos").mkdir(parents=True)
+    (tmp_path / "uploads" / "car_photos" / "a.jpg").write_bytes(b"x")
+    monkeypatch.setattr(media_paths, "STATIC_ROOTS", (str(tmp_path),))
+    media_paths.clear_static_path_cache()
+    yield tmp_path
+    media_paths.clear_static_path_cache()
+
+
+@pytest.fixture()
+def app(app, static_root, make_user, make_car):
+    media_paths.install_image_path_resolution()
+    make_car(make_user("s"), brand="Toyota", model="Camry", year=2015, location="Baghdad")
+    db.session.commit()
+    return app
+
+
+def test_resolve_image_rel_fallbacks(static_root):
+    assert media_paths.resolve_image_rel("/uploads/car_photos/a.jpg") == "uploads/car_photos/a.jpg"
+    # Legacy rows stored uploads/<name> for files that live under car_photos.
+    assert media_paths.resolve_image_rel("uploads/a.jpg") == "uploads/car_photos/a.jpg"
+    assert media_paths.resolve_image_rel("https://cdn.example/x.jpg") == "https://cdn.example/x.jpg"
+    assert media_paths.resolve_image_rel("uploads/missing.jpg") == ""
+
+
+def test_static_exists_caches_hits_and_misses(static_root, monkeypatch):
+    calls = []
+    real_isfile = media_paths.os.path.isfile
+
+    def counting_isfile(path):
+        calls.append(path)
+        return real_isfile(path)
+
+    monkeypatch.setattr(media_paths.os.path, "isfile", counting_isfile)
+    for _ in range(3):
+        assert media_paths.static_exists("uploads/car_photos/a.jpg")
+        assert not media_paths.static_exists("uploads/car_photos/nope.jpg")
+    assert len(calls) == 2
+
+    # Misses expire sooner so a late upload becomes visible.
+    monkeypatch.setattr(media_paths, "_NEGATIVE_TTL_S", 0.0)
+    media_paths.clear_static_path_cache()
+    assert not media_paths.static_exists("uploads/car_photos/late.jpg")
+    (static_root / "uploads" / "car_photos" / "late.jpg").write_bytes(b"x")
+    assert media_paths.static_exists("uploads/car_photos/late.jpg")
+
+
+def test_resolved_url_set_on_insert_and_path_change(app, static_root, monkeypatch):
+    monkeypatch.setattr(media_paths, "_NEGATIVE_TTL_S", 0.0)  # misses re-checked immediately
+    with app.app_context():
+        car = Car.query.first()
+        img = CarImage(car_id=car.id, image_url="uploads/a.jpg")
+        db.session.add(img)
+        db.session.commit()
+        assert img.resolved_url == "uploads/car_photos/a.jpg"
+
+        img.image_url = "uploads/gone.jpg"
+        db.session.commit()
+        # A miss is stored as NULL so the image is re-checked, not hidden for good.
+        assert img.resolved_url is None
+        assert media_paths.image_display_url(img) == ""
+
+        (static_root / "uploads" / "car_photos" / "gone.jpg").write_bytes(b"x")
+        assert media_paths.image_display_url(img) == "uploads/car_photos/gone.jpg"
+        img.order = 1
+        db.session.commit()
+        assert img.resolved_url == "uploads/car_photos/gone.jpg"
+
+
+def test_backfill_fills_unresolved_rows(app, static_root):
+    with app.app_context():
+        car = Car.query.first()
+        db.session.add_all(
+            [
+                CarImage(car_id=car.id, image_url="uploads/a.jpg"),
+                CarImage(car_id=car.id, image_url="https://cdn.example/b.jpg"),
+                CarImage(car_id=car.id, image_url="uploads/c.jpg"),
+            ]
+        )
+        db.session.commit()
+        # Older backfills stored "" for missing files; those rows are retried too.
+        db.session.execute(db.update(CarImage).values(resolved_url=""))
+        db.session.commit()
+
+        assert media_paths.backfill_resolved_image_urls(batch_size=1) == 3
+        assert media_paths.backfill_resolved_image_urls() == 1
+        db.session.expire_all()
+        assert [i.resolved_url for i in CarImage.query.order_by(CarImage.id)] == [
+            "uploads/car_photos/a.jpg",
+            "https://cdn.example/b.jpg",
+            None,
+        ]
+
+
+def test_display_url_prefers_stored_resolution(static_root, monkeypatch):
+    monkeypatch.setattr(media_paths, "static_exists", lambda rel: pytest.fail("touched filesystem"))
+    assert media_paths.image_display_url(CarImage(image_url="uploads/a.jpg", resolved_url="x/a.jpg")) == "x/a.jpg"
+    assert media_paths.display_url("uploads/a.jpg", "https://cdn.example/a.jpg") == "https://cdn.example/a.jpg"
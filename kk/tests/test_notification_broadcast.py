@@ -0,0 +1,229 @@
+"""Chunked admin broadcasts: keyset chunks, checkpointed progress, resume after a crash."""
+
+from __future__ import annotations
+
+from datetime import timedelta
+
+import pytest
+from firebase_admin import messaging
+
+import kk.notification_broadcast as nb
+import kk.push as push
+from kk.models import Notification, ScheduledNotification, ScheduledNotificationChunk, User, db
+from kk.time_utils import utcnow
+
+
+class _Resp:
+    def __init__(self, token):
+        self.success = not token.startswith("dead")
+        self.exception = None if self.success else messaging.UnregisteredError("gone")
+
+
+class _Batch:
+    def __init__(self, tokens):
+        self.responses = [_Resp(t) for t in tokens]
+
+
+@pytest.fixture()
+def fcm(monkeypatch):
+    calls = []
+
+    def send_each_for_multicast(message, app=None):
+        calls.append(len(message.tokens))
+        return _Batch(message.tokens)
+
+    monkeypatch.setattr(push, "_ensure_firebase", lambda: object())
+    monkeypatch.setattr(nb, "fcm_is_configured", lambda: True)
+    monkeypatch.setattr(messaging, "send_each_for_multicast", send_each_for_multicast)
+    return calls
+
+
+@pytest.fixture()
+def app(app, monkeypatch, make_user):
+    monkeypatch.setenv("BROADCAST_CHUNK_SIZE", "3")
+    for i in range(8):
+        make_user(
+            f"u{i}",
+            account_type="dealer" if i % 4 == 0 else "individual",
+            is_active=i != 7,
+            firebase_token="dead-token" if i == 1 else f"tok-{i}",
+        )
+    db.session.commit()
+    return app
+
+
+def _chunks(row):
+    return ScheduledNotificationChunk.query.filter_by(notification_id=row.id).order_by(
+        ScheduledNotificationChunk.chunk_index
+    ).all()
+
+
+def _states(row):
+    db.session.expire_all()
+    return [c.state for c in _chunks(row)]
+
+
+def _age_chunks(row, *indexes, hours=1):
+    """Backdate the dispatch/claim stamp of ``indexes`` (all chunks by default)."""
+    for chunk in _chunks(row):
+        if not indexes or chunk.chunk_index in indexes:
+            chunk.updated_at = utcnow() - timedelta(hours=hours)
+    db.session.commit()
+
+
+def test_broadcast_runs_all_chunks_and_records_progress(app, fcm):
+    with app.app_context():
+        out = nb.execute_broadcast(title="Hi", message="Hello", audience="all")
+
+        assert out["status"] == "sent"
+        assert out["total"] == 7
+        assert out["created"] == 7
+        assert out["chunks_total"] == 3 and out["chunks_done"] == 3
+        assert out["pushed"] == 6
+        assert sorted(fcm) == [1, 3, 3]
+        assert Notification.query.count() == 7
+        # Inactive user skipped; dead token pruned.
+        assert db.session.get(User, 2).firebase_token is None
+
+        row = db.session.get(ScheduledNotification, out["broadcast_id"])
+        assert row.sent_at is not None
+        assert row.result["created"] == 7 and row.result["pushed"] == 6
+        assert [(c.after_id, c.upto_id) for c in _chunks(row)] == [(0, 3), (3, 6), (6, 7)]
+
+
+def test_audience_filters_chunks(app, fcm):
+    with app.app_context():
+        out = nb.execute_broadcast(title="Hi", message="Hello", audience="dealers", send_push_flag=False)
+
+        assert out["total"] == 2
+        assert out["chunks_total"] == 1
+        assert fcm == []
+        assert {n.user_id for n in Notification.query.all()} == {1, 5}
+
+
+def test_crashed_broadcast_resumes_without_duplicates(app, fcm, monkeypatch):
+    with app.app_context():
+        real_run = nb.run_broadcast_chunk
+
+        def crash_after_first(row_id, index):
+            if index > 0:
+                raise RuntimeError("worker died")
+            return real_run(row_id, index)
+
+        monkeypatch.setattr(nb, "run_broadcast_chunk", crash_after_first)
+        with pytest.raises(RuntimeError):
+            nb.execute_broadcast(title="Hi", message="Hello", audience="all")
+        monkeypatch.setattr(nb, "run_broadcast_chunk", real_run)
+
+        row = ScheduledNotification.query.one()
+        assert row.status == "sending"
+        assert _states(row) == ["done", "pending", "pending"]
+        assert nb.broadcast_progress(row)["created"] == 3
+
+        # Not stalled yet: left alone.
+        assert nb.process_due_scheduled_notifications()["resumed"] == 0
+
+        _age_chunks(row)
+        out = nb.process_due_scheduled_notifications()
+
+        assert out["resumed"] == 1
+        db.session.refresh(row)
+        assert row.status == "sent"
+        assert row.result["created"] == 7
+        assert Notification.query.count() == 7
+
+
+def test_stored_chunk_is_not_inserted_twice(app, fcm):
+    with app.app_context():
+        row = ScheduledNotification(
+            title="Hi",
+            message="Hello",
+            audience="all",
+            notification_type="admin",
+            send_push=True,
+            scheduled_at=utcnow() - timedelta(minutes=1),
+            status="pending",
+        )
+        db.session.add(row)
+        db.session.commit()
+
+        out = nb.process_due_scheduled_notifications()
+
+        assert out["processed"] == 1 and out["sent"] == 1
+        nb.run_broadcast_chunk(row.id, 0)
+        assert Notification.query.count() == 7
+
+
+def test_claimed_push_is_sent_once_and_only_stale_chunks_resume(app, fcm, monkeypatch):
+    with app.app_context():
+        monkeypatch.setattr(nb, "_dispatch_chunks", lambda row_id, indexes: None)
+        out = nb.execute_broadcast(title="Hi", message="Hello", audience="all")
+        row = db.session.get(ScheduledNotification, out["broadcast_id"])
+
+        # A worker stores chunk 0 and claims its push, then dies before FCM answers.
+        real_multicast = nb.multicast_and_prune
+
+        def die(*_a, **_k):
+            raise RuntimeError("worker died")
+
+        monkeypatch.setattr(nb, "multicast_and_prune", die)
+        with pytest.raises(RuntimeError):
+            nb.run_broadcast_chunk(row.id, 0)
+        monkeypatch.setattr(nb, "multicast_and_prune", real_multicast)
+        db.session.rollback()
+        assert _states(row)[0] == "pushing"
+
+        # A duplicate task for the claimed chunk does not push again.
+        assert nb.run_broadcast_chunk(row.id, 0) == {"skipped": "push_claimed"}
+        assert fcm == []
+
+        # Only chunks whose own stamp expired are re-dispatched, even though the row is old.
+        dispatched = []
+        monkeypatch.setattr(nb, "_dispatch_chunks", lambda row_id, indexes: dispatched.append(indexes))
+        row.updated_at = utcnow() - timedelta(hours=1)
+        _age_chunks(row, 0, 2)
+        assert nb.process_due_scheduled_notifications()["resumed"] == 1
+        assert dispatched == [[0, 2]]
+        assert _states(row) == ["stored", "pending", "pending"]
+        assert nb.process_due_scheduled_notifications()["resumed"] == 0
+
+        for index in (0, 1, 2):
+            nb.run_broadcast_chunk(row.id, index)
+        db.session.refresh(row)
+        assert row.status == "sent" and sorted(fcm) == [1, 3, 3]
+        assert Notification.query.count() == 7
+
+
+def test_stale_store_claim_is_rolled_back_and_retried(app, fcm, monkeypatch):
+    with app.app_context():
+        monkeypatch.setattr(nb, "_dispatch_chunks", lambda row_id, indexes: None)
+        out = nb.execute_broadcast(title="Hi", message="Hello", audience="all", send_push_flag=False)
+        row = db.session.get(ScheduledNotification, out["broadcast_id"])
+
+        # A slow worker claims chunk 0, but by the time its insert is done the
+        # claim has been handed to another task: its rows must not be kept.
+        real_transition = nb._transition
+
+        def claim_lost(row_id, index, state, **kwargs):
+            if state == "stored":
+                return False
+            return real_transition(row_id, index, state, **kwargs)
+
+        monkeypatch.setattr(nb, "_transition", claim_lost)
+        assert nb.run_broadcast_chunk(row.id, 0) == {"skipped": "store_claimed"}
+        monkeypatch.setattr(nb, "_transition", real_transition)
+        assert Notification.query.count() == 0
+        assert _states(row)[0] == "storing"
+
+        # The expired claim goes back to pending and is dispatched again.
+        dispatched = []
+        monkeypatch.setattr(nb, "_dispatch_chunks", lambda row_id, indexes: dispatched.append(indexes))
+        _age_chunks(row, 0)
+        assert nb.process_due_scheduled_notifications()["resumed"] == 1
+        assert dispatched == [[0]] and _states(row)[0] == "pending"
+
+        for index in (0, 1, 2):
+            nb.run_broadcast_chunk(row.id, index)
+        db.session.refresh(row)
+        assert row.status == "sent" and Notification.query.count() == 7
+        assert nb.broadcast_progress(row)["chunks_done"] == 3
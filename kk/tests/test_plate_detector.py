@@ -0,0 +1,136 @@
+"""Local ONNX plate detector: letterbox/NMS decoding, micro-batching, backend selection."""
+
+from __future__ import annotations
+
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from kk.license_plate_blur import OnnxPlateDetector, PlateDetector, RoboflowPlateDetector, build_plate_detector
+
+
+def _yolo_output(*anchors):
+    """YOLOv8 head layout (4 + classes, anchors) from (cx, cy, w, h, score) in input pixels."""
+    background = [(0, 0, 0, 0, 0.0)] * 32
+    return np.array([*anchors, *background], dtype=np.float32).T
+
+
+@pytest.fixture()
+def detector(tmp_path):
+    model = tmp_path / "plates.onnx"
+    model.write_bytes(b"onnx")
+    det = OnnxPlateDetector(model_path=str(model), input_size=640, max_batch=2)
+    det.backend = "fake"  # skip loading a real model
+    det.calls = []
+    return det
+
+
+def _fake_forward(det, output, hook=None):
+    def forward(blob):
+        det.calls.append(blob.shape[0])
+        if hook:
+            hook()
+        return np.stack([output] * blob.shape[0])
+
+    det._forward = forward
+
+
+def test_boxes_mapped_from_letterbox_and_suppressed(detector):
+    # 1280x640 -> scale 0.5, 640x320 content padded 160 px top and bottom.
+    _fake_forward(
+        detector,
+        _yolo_output(
+            (150, 235, 100, 50, 0.9),  # plate at (200,100)-(400,200) in the source
+            (152, 236, 100, 50, 0.8),  # duplicate, removed by NMS
+            (500, 300, 40, 20, 0.1),  # below confidence
+        ),
+    )
+
+    boxes, meta = detector.detect_images_with_meta([Image.new("RGB", (1280, 640))])[0]
+
+    assert meta["detect_status"] == "ok" and meta["backend"] == "fake"
+    assert [(b.x1, b.y1, b.x2, b.y2) for b in boxes] == [(200, 100, 400, 200)]
+    assert boxes[0].confidence == pytest.approx(0.9)
+
+
+def test_images_run_in_batches_of_max_batch(detector):
+    _fake_forward(detector, _yolo_output((320, 320, 64, 32, 0.9)))
+
+    results = detector.detect_images_with_meta([Image.new("RGB", (640, 640))] * 3)
+
+    assert detector.calls == [2, 1]
+    assert [len(boxes) for boxes, _ in results] == [1, 1, 1]
+    assert [meta["batch"] for _, meta in results] == [2, 2, 1]
+
+
+def test_concurrent_callers_share_a_forward_pass(detector):
+    queued = threading.Event()
+
+    def wait_for_followers():
+        if len(detector.calls) == 1:
+            # First caller is inside the model; the other two queue up behind it.
+            assert queued.wait(5)
+
+    _fake_forward(detector, _yolo_output((320, 320, 64, 32, 0.9)), hook=wait_for_followers)
+    image = Image.new("RGB", (640, 640))
+    results = []
+
+    def call():
+        results.append(detector.detect_images_with_meta([image])[0])
+
+    first = threading.Thread(target=call)
+    first.start()
+    while not detector.calls:
+        pass
+    others = [threading.Thread(target=call) for _ in range(2)]
+    for t in others:
+        t.start()
+    while len(detector._pending) < 2:
+        pass
+    queued.set()
+    for t in [first, *others]:
+        t.join(5)
+
+    assert detector.calls == [1, 2]
+    assert len(results) == 3 and all(meta["detect_status"] == "ok" for _, meta in results)
+
+
+def test_fixed_batch_model_falls_back_to_single_images(detector):
+    output = _yolo_output((320, 320, 64, 32, 0.9))
+
+    def forward(blob):
+        detector.calls.append(blob.shape[0])
+        if blob.shape[0] != 1:
+            raise RuntimeError("expected batch 1")
+        return output[None]
+
+    detector._forward = forward
+
+    results = detector.detect_images_with_meta([Image.new("RGB", (640, 640))] * 2)
+
+    assert detector.calls == [2, 1, 1]
+    assert all(len(boxes) == 1 for boxes, _ in results)
+    detector.detect_images_with_meta([Image.new("RGB", (640, 640))] * 2)
+    assert detector.calls[3:] == [1, 1]
+
+
+def test_auto_backend_prefers_local_model(monkeypatch, tmp_path):
+    model = tmp_path / "plates.onnx"
+    monkeypatch.setenv("PLATE_DETECTOR", "auto")
+    monkeypatch.setenv("PLATE_MODEL_PATH", str(model))
+
+    assert isinstance(build_plate_detector(), RoboflowPlateDetector)
+    model.write_bytes(b"onnx")
+    assert isinstance(build_plate_detector(), OnnxPlateDetector)
+    assert isinstance(build_plate_detector("roboflow"), RoboflowPlateDetector)
+
+
+def test_backend_without_detect_with_meta_cannot_be_built():
+    class Incomplete(PlateDetector):
+        def is_configured(self):
+            return True
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,292 @@
+"""Presence: socket heartbeats with TTL, open-chat tracking, batched last-seen lookups."""
+
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+import pytest
+from flask_jwt_extended import create_access_token
+from flask_socketio import SocketIO
+
+import kk.chat_push as chat_push
+import kk.chat_realtime as chat_realtime
+from kk import presence
+from kk.models import BlockedUser, Conversation, db
+from kk.routes.chat import bp as chat_bp
+from kk.socketio_handlers import register_socketio_handlers
+
+
+@pytest.fixture()
+def app(app):
+    presence.debug_reset_presence()
+    app.register_blueprint(chat_bp)
+    yield app
+    presence.debug_reset_presence()
+
+
+@pytest.fixture()
+def people(app, make_user, make_car):
+    users = [make_user(name, is_verified=True, phone_verified=True) for name in ("seller", "buyer", "stranger")]
+    car = make_car(users[0])
+    # Seller and buyer have a thread; the stranger has never chatted with either.
+    db.session.add(Conversation(car_id=car.id, buyer_id=users[1].id, seller_id=users[0].id))
+    db.session.commit()
+    return users, car
+
+
+def test_sockets_keep_user_online_until_the_last_one_drops():
+    presence.debug_reset_presence()
+    assert presence.touch("sid-1", "u1") is True
+    assert presence.touch("sid-2", "u1", "car-9", "u2") is False
+    assert presence.is_viewing("u1", "car-9", "u2") and not presence.is_viewing("u1", "car-1", "u2")
+    # Another buyer's thread on the same listing is not the one being viewed.
+    assert not presence.is_viewing("u1", "car-9", "u3")
+    assert presence.current_chat("sid-2") == "car-9"
+
+    # A heartbeat without car_id keeps the open chat; car=None closes it.
+    presence.touch("sid-2", "u1")
+    assert presence.is_viewing("u1", "car-9", "u2")
+    presence.touch("sid-2", "u1", None)
+    assert not presence.is_viewing("u1", "car-9", "u2")
+
+    # An open chat whose peer is unknown never counts as viewing.
+    presence.touch("sid-2", "u1", "car-9")
+    assert not presence.is_viewing("u1", "car-9", "u2")
+
+    assert presence.drop("sid-1") == ("u1", False)
+    assert presence.lookup(["u1"])["u1"]["online"] is True
+    assert presence.drop("sid-2") == ("u1", True)
+    state = presence.lookup(["u1", "nobody"])
+    assert state["u1"]["online"] is False and state["u1"]["last_seen"]
+    assert state["nobody"] == {"online": False, "last_seen": None}
+    assert presence.drop("sid-unknown") == (None, False)
+
+
+def test_missed_heartbeats_expire_the_socket():
+    presence.debug_reset_presence()
+    presence.touch("sid-1", "u1", "car-1", "u2")
+    presence._local_sockets["sid-1"] = ("u1", "car-1", "u2", 0.0)
+    assert presence.lookup(["u1"])["u1"]["online"] is False
+    assert not presence.is_viewing("u1", "car-1", "u2")
+
+
+class _Redis:
+    """Just enough of redis-py (sorted sets, hashes, strings, pipelines) for presence."""
+
+    def __init__(self):
+        self.zsets: dict[str, dict] = {}
+        self.hashes: dict[str, dict] = {}
+        self.strings: dict[str, str] = {}
+
+    def pipeline(self):
+        return _Pipeline(self)
+
+    def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    def zrem(self, key, member):
+        self.zsets.get(key, {}).pop(member, None)
+
+    def zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    def zcount(self, key, low, _high):
+        return sum(1 for score in self.zsets.get(key, {}).values() if score >= low)
+
+    def zremrangebyscore(self, key, _low, high):
+        z = self.zsets.get(key, {})
+        for member in [m for m, score in z.items() if score <= high]:
+            z.pop(member)
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = str(value)
+
+    def hmget(self, key, fields):
+        return [self.hashes.get(key, {}).get(f) for f in fields]
+
+    def get(self, key):
+        return self.strings.get(key)
+
+    def set(self, key, value, ex=None):
+        self.strings[key] = value
+
+    def delete(self, key):
+        self.strings.pop(key, None)
+
+    def expire(self, *_a):
+        return True
+
+
+class _Pipeline:
+    def __init__(self, r):
+        self.r, self.calls = r, []
+
+    def __getattr__(self, name):
+        return lambda *a, **k: self.calls.append((name, a, k))
+
+    def execute(self):
+        return [getattr(self.r, name)(*a, **k) for name, a, k in self.calls]
+
+
+def test_redis_state_is_shared_and_last_seen_is_sharded(monkeypatch):
+    r = _Redis()
+    monkeypatch.setattr(presence, "get_redis", lambda: r)
+    monkeypatch.setenv("PRESENCE_SHARDS", "4")
+    presence.debug_reset_presence()
+
+    # Two sockets (e.g. two gunicorn workers) for one user, one with the chat open.
+    assert presence.touch("sid-a", "u1") is True
+    assert presence.touch("sid-b", "u1", "car-1", "u2") is False
+    presence.touch("sid-c", "u2")
+    assert presence.is_viewing("u1", "car-1", "u2")
+    assert "presence:v:u1:car-1:u2" in r.zsets
+    assert presence._local_sockets == {}
+
+    # Switching threads on the same listing moves the socket to the new peer.
+    presence.touch("sid-b", "u1", "car-1", "u3")
+    assert not presence.is_viewing("u1", "car-1", "u2") and presence.is_viewing("u1", "car-1", "u3")
+
+    assert presence.drop("sid-b") == ("u1", False)
+    assert not presence.is_viewing("u1", "car-1", "u3")
+    assert presence.drop("sid-a") == ("u1", True)
+
+    state = presence.lookup(["u1", "u2", "u3"])
+    assert [state[u]["online"] for u in ("u1", "u2", "u3")] == [False, True, False]
+    assert state["u1"]["last_seen"] and state["u3"]["last_seen"] is None
+    assert all(key.startswith("presence:seen:") for key in r.hashes) and len(r.hashes) <= 4
+
+
+def test_open_chat_suppresses_push(monkeypatch):
+    presence.debug_reset_presence()
+    chat_push.debug_reset_chat_push()
+    queued = []
+    monkeypatch.setattr(chat_push, "_enqueue_local", lambda key, item: queued.append(key))
+    receiver = SimpleNamespace(id=2, public_id="u2", firebase_token="tok")
+    sender = SimpleNamespace(id=1, public_id="u1", first_name="A", last_name="B")
+
+    other = SimpleNamespace(id=3, public_id="u3", first_name="C", last_name="D")
+
+    presence.touch("sid-1", "u2", "car-1", "u1")
+    assert chat_push.queue_chat_push(receiver, sender, "car-1", "hi") is False
+    assert chat_push.queue_chat_push(receiver, sender, "car-2", "hi") is True
+    # Same listing, different thread: the receiver is not looking at it.
+    assert chat_push.queue_chat_push(receiver, other, "car-1", "hi") is True
+    # An open chat whose peer was never reported does not suppress anything.
+    presence.touch("sid-1", "u2", "car-1")
+    assert chat_push.queue_chat_push(receiver, sender, "car-1", "hi") is True
+    assert queued == ["2:1:car-2", "2:3:car-1", "2:1:car-1"]
+    assert chat_push.chat_push_stats()["skipped_viewing"] == 1
+    chat_push.debug_reset_chat_push()
+
+
+def test_presence_endpoint_only_shows_unblocked_chat_partners(app, people):
+    (seller, buyer, stranger), car = people
+    presence.touch("sid-s", seller.public_id)
+    headers = {"Authorization": f"Bearer {create_access_token(identity=buyer.public_id)}"}
+
+    def visible():
+        resp = app.test_client().post(
+            "/api/users/presence",
+            json={"user_ids": [seller.public_id, stranger.public_id, "missing"]},
+            headers=headers,
+        )
+        assert resp.status_code == 200
+        return resp.get_json()["users"]
+
+    users = visible()
+    assert list(users) == [seller.public_id] and users[seller.public_id]["online"] is True
+
+    # A thread alone is not enough when the other side blocked the caller...
+    db.session.add(Conversation(car_id=car.id, buyer_id=buyer.id, seller_id=stranger.id))
+    db.session.add(BlockedUser(blocker_id=stranger.id, blocked_id=buyer.id))
+    db.session.commit()
+    assert list(visible()) == [seller.public_id]
+    # ...or the caller blocked them.
+    db.session.add(BlockedUser(blocker_id=buyer.id, blocked_id=seller.id))
+    db.session.commit()
+    assert visible() == {}
+    assert app.test_client().post("/api/users/presence", json={"user_ids": "x"}, headers=headers).status_code == 400
+
+
+def test_socket_connect_join_and_disconnect_drive_presence(app, people):
+    (seller, buyer, _stranger), car = people
+    socketio = SocketIO(app, async_mode="threading")
+    register_socketio_handlers(socketio)
+    flask_client = app.test_client()
+
+    def connect(user):
+        client = socketio.test_client(
+            app,
+            flask_test_client=flask_client,
+            query_string=f"token={create_access_token(identity=user.public_id)}",
+        )
+        client.get_received()
+        return client
+
+    watcher = connect(buyer)
+    watcher.emit("presence_subscribe", {"user_ids": [seller.public_id]})
+    snapshot = [e for e in watcher.get_received() if e["name"] == "presence_snapshot"][0]["args"][0]
+    assert snapshot["users"][seller.public_id]["online"] is False
+
+    seller_socket = connect(seller)
+    events = [e["args"][0] for e in watcher.get_received() if e["name"] == "presence"]
+    assert events == [{"user_id": seller.public_id, "online": True, "last_seen": events[0]["last_seen"]}]
+
+    # A seller without peer_id has not said which buyer's thread is open.
+    seller_socket.emit("join_chat", {"car_id": car.public_id})
+    assert not presence.is_viewing(seller.public_id, car.public_id, buyer.public_id)
+    seller_socket.emit("join_chat", {"car_id": car.public_id, "peer_id": buyer.public_id})
+    assert presence.is_viewing(seller.public_id, car.public_id, buyer.public_id)
+    seller_socket.emit("leave_chat", {"room": f"chat:{car.public_id}"})
+    assert not presence.is_viewing(seller.public_id, car.public_id, buyer.public_id)
+    seller_socket.emit("presence_heartbeat", {"car_id": car.public_id, "peer_id": buyer.public_id})
+    assert presence.is_viewing(seller.public_id, car.public_id, buyer.public_id)
+    # A heartbeat for the same listing without peer_id keeps the open thread.
+    seller_socket.emit("presence_heartbeat", {"car_id": car.public_id})
+    assert presence.is_viewing(seller.public_id, car.public_id, buyer.public_id)
+
+    # The buyer's peer is the listing's seller.
+    buyer_socket = connect(buyer)
+    buyer_socket.emit("join_chat", {"car_id": car.public_id})
+    assert presence.is_viewing(buyer.public_id, car.public_id, seller.public_id)
+    buyer_socket.disconnect()
+    watcher.get_received()
+
+    seller_socket.disconnect()
+    events = [e["args"][0] for e in watcher.get_received() if e["name"] == "presence"]
+    assert [e["online"] for e in events] == [False]
+    assert not presence.is_viewing(seller.public_id, car.public_id, buyer.public_id)
+    watcher.disconnect()
+
+
+def test_block_drops_presence_subscription(app, people, monkeypatch):
+    (seller, buyer, stranger), _car = people
+    socketio = SocketIO(app, async_mode="threading")
+    register_socketio_handlers(socketio)
+    monkeypatch.setattr(chat_realtime, "socketio", socketio)
+    flask_client = app.test_client()
+
+    def connect(user):
+        client = socketio.test_client(
+            app,
+            flask_test_client=flask_client,
+            query_string=f"token={create_access_token(identity=user.public_id)}",
+        )
+        client.get_received()
+        return client
+
+    watcher = connect(buyer)
+    watcher.emit("presence_subscribe", {"user_ids": [seller.public_id, stranger.public_id]})
+    snapshot = [e for e in watcher.get_received() if e["name"] == "presence_snapshot"][0]["args"][0]
+    assert list(snapshot["users"]) == [seller.public_id]
+
+    headers = {"Authorization": f"Bearer {create_access_token(identity=seller.public_id)}"}
+    assert flask_client.post(f"/api/users/{buyer.public_id}/block", headers=headers).status_code == 201
+
+    seller_socket = connect(seller)
+    assert [e for e in watcher.get_received() if e["name"] == "presence"] == []
+    watcher.emit("presence_subscribe", {"user_ids": [seller.public_id]})
+    snapshot = [e for e in watcher.get_received() if e["name"] == "presence_snapshot"][0]["args"][0]
+    assert snapshot["users"] == {}
+    seller_socket.disconnect()
+    watcher.disconnect()
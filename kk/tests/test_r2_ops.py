@@ -0,0 +1,155 @@
+"""R2 helpers: local SigV4 presign, pooled in-process client, helper-process fallback."""
+
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+import pytest
+from flask import Flask
+
+import kk.r2_ops as r2_ops
+
+_NOW = datetime(2026, 10, 17, 2, 34, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture()
+def app(monkeypatch):
+    monkeypatch.delenv("R2_CLIENT_MODE", raising=False)
+    app = Flask(__name__)
+    app.config.update(
+        R2_ACCOUNT_ID="acct",
+        R2_BUCKET_NAME="bkt",
+        R2_ACCESS_KEY_ID="AK",
+        R2_SECRET_ACCESS_KEY="SK",
+    )
+    with app.app_context():
+        yield app
+    r2_ops.reset_r2_clients()
+
+
+@pytest.mark.parametrize(
+    ("key", "content_length"),
+    [("car_photos/x.jpg", None), ("car_videos/a b+c é.mp4", 123)],
+)
+def test_local_presign_matches_boto3(monkeypatch, key, content_length):
+    boto3 = pytest.importorskip("boto3")
+    import botocore.auth
+    from botocore.config import Config
+
+    monkeypatch.setattr(botocore.auth, "get_current_datetime", lambda: _NOW.replace(tzinfo=None))
+    client = boto3.client(
+        "s3",
+        region_name="auto",
+        endpoint_url="https://acct.r2.cloudflarestorage.com",
+        aws_access_key_id="AK",
+        aws_secret_access_key="SK",
+        config=Config(signature_version="s3v4"),
+    )
+    params = {"Bucket": "bkt", "Key": key, "ContentType": "image/jpeg"}
+    if content_length is not None:
+        params["ContentLength"] = content_length
+    expected = client.generate_presigned_url("put_object", Params=params, ExpiresIn=900)
+
+    assert (
+        r2_ops.presign_put_url(
+            account_id="acct",
+            bucket="bkt",
+            access_key="AK",
+            secret_key="SK",
+            key=key,
+            content_type="image/jpeg",
+            content_length=content_length,
+            now=_NOW,
+        )
+        == expected
+    )
+
+
+def test_presign_never_spawns_a_process(app, monkeypatch):
+    monkeypatch.setattr(r2_ops.subprocess, "Popen", lambda *a, **k: pytest.fail("spawned"))
+    monkeypatch.setattr(r2_ops.subprocess, "run", lambda *a, **k: pytest.fail("spawned"))
+
+    url = r2_ops.r2_presign_put(key="car_photos/x.jpg", content_type="image/jpeg")
+
+    assert url.startswith("https://acct.r2.cloudflarestorage.com/bkt/car_photos/x.jpg?")
+    assert "X-Amz-Signature=" in url
+
+
+def test_put_bytes_reuses_one_pooled_client(app, monkeypatch):
+    pytest.importorskip("boto3")
+    puts = []
+    clients = []
+    real = r2_ops._s3_client
+
+    def tracking_client(creds):
+        client = real(creds)
+        if client not in clients:
+            clients.append(client)
+            monkeypatch.setattr(client, "put_object", lambda **kw: puts.append(kw))
+        return client
+
+    monkeypatch.setattr(r2_ops, "_s3_client", tracking_client)
+    monkeypatch.setattr(r2_ops.subprocess, "Popen", lambda *a, **k: pytest.fail("spawned"))
+
+    r2_ops.r2_put_bytes(key="a.jpg", body=b"one", content_type="image/jpeg")
+    r2_ops.r2_put_bytes(key="b.jpg", body=b"two", content_type="image/jpeg")
+
+    assert len(clients) == 1
+    assert [(p["Key"], p["Body"]) for p in puts] == [("a.jpg", b"one"), ("b.jpg", b"two")]
+    max_pool = clients[0].meta.config.max_pool_connections
+    assert max_pool == 32
+
+
+class _FakeHelper:
+    spawned = 0
+
+    def __init__(self, script_path):
+        type(self).spawned += 1
+        self.pid = r2_ops.os.getpid()
+        self.requests = []
+
+    def alive(self):
+        return True
+
+    def request(self, payload, body, *, timeout):
+        self.requests.append((payload["op"], payload["key"], body))
+        return {"ok": True}
+
+    def close(self):
+        pass
+
+
+def test_helper_pool_is_reused_under_subprocess_mode(app, monkeypatch):
+    monkeypatch.setenv("R2_CLIENT_MODE", "subprocess")
+    monkeypatch.setattr(r2_ops, "_Helper", _FakeHelper)
+    monkeypatch.setattr(r2_ops, "_s3_client", lambda creds: pytest.fail("in-process client used"))
+    _FakeHelper.spawned = 0
+
+    for i in range(3):
+        r2_ops.r2_put_bytes(key=f"k{i}", body=b"x" * (i + 1))
+
+    assert _FakeHelper.spawned == 1
+
+
+def test_helper_streams_body_over_pipe(app, monkeypatch, tmp_path):
+    """Real ``--serve`` helper round trip with boto3's put_object stubbed in the child."""
+    pytest.importorskip("boto3")
+    script = tmp_path / "fake_r2_op.py"
+    script.write_text(
+        "import json, sys\n"
+        "stdin, stdout = sys.stdin.buffer, sys.stdout.buffer\n"
+        "for line in iter(stdin.readline, b''):\n"
+        "    inp = json.loads(line)\n"
+        "    body = stdin.read(inp['body_len'])\n"
+        "    stdout.write(json.dumps({'ok': True, 'key': inp['key'], 'bytes': len(body)}).encode() + b'\\n')\n"
+        "    stdout.flush()\n"
+    )
+    helper = r2_ops._Helper(str(script))
+    try:
+        out = helper.request({"op": "put_object", "key": "k"}, b"\x00\n" * 5000, timeout=10)
+        again = helper.request({"op": "put_object", "key": "k2"}, b"abc", timeout=10)
+    finally:
+        helper.close()
+
+    assert out == {"ok": True, "key": "k", "bytes": 10000}
+    assert again["bytes"] == 3
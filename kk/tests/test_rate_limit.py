@@ -0,0 +1,84 @@
+"""Sliding-window rate limiter (in-memory fallback path) and X-RateLimit headers."""
+
+from __future__ import annotations
+
+import pytest
+from flask import Flask, jsonify
+
+import kk.security as security
+from kk.security import RateLimit, rate_limit, rate_limits
+
+
+@pytest.fixture()
+def client(monkeypatch):
+    monkeypatch.setenv("APP_ENV", "development")
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    security.rate_limit_storage.clear()
+
+    app = Flask(__name__)
+
+    @app.get("/one")
+    @rate_limit(max_requests=2, window_minutes=1)
+    def one():
+        return jsonify({"ok": True})
+
+    @app.get("/multi")
+    @rate_limits(RateLimit(5, 1), RateLimit(3, 60, per_ip=False))
+    def multi():
+        return jsonify({"ok": True}), 201
+
+    return app.test_client()
+
+
+def test_headers_and_429_with_retry_after(client):
+    r1 = client.get("/one")
+    assert r1.status_code == 200
+    assert r1.headers["X-RateLimit-Limit"] == "2"
+    assert r1.headers["X-RateLimit-Remaining"] == "1"
+    assert int(r1.headers["X-RateLimit-Reset"]) == 60
+
+    assert client.get("/one").headers["X-RateLimit-Remaining"] == "0"
+
+    r3 = client.get("/one")
+    assert r3.status_code == 429
+    assert r3.headers["X-RateLimit-Remaining"] == "0"
+    assert 1 <= int(r3.headers["Retry-After"]) <= 60
+    assert r3.get_json()["retry_after"] == int(r3.headers["Retry-After"])
+
+
+def test_sliding_window_frees_slots_as_requests_age(client, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(security.time, "time", lambda: now[0])
+    assert client.get("/one").status_code == 200
+    now[0] += 40
+    assert client.get("/one").status_code == 200
+    now[0] += 10
+    assert client.get("/one").status_code == 429
+    now[0] += 11  # first request is now older than 60s
+    assert client.get("/one").status_code == 200
+    assert client.get("/one").status_code == 429
+
+
+def test_multi_limit_reports_tightest_and_records_only_when_all_pass(client):
+    for remaining in ("2", "1", "0"):
+        r = client.get("/multi")
+        assert r.status_code == 201
+        assert r.headers["X-RateLimit-Limit"] == "3"
+        assert r.headers["X-RateLimit-Remaining"] == remaining
+    blocked = client.get("/multi")
+    assert blocked.status_code == 429
+    # Rejected request was not counted against the looser per-IP limit.
+    allowed, state = security.rate_limit_storage.hit(
+        ["rl:sw:multi:127.0.0.1:60"], [RateLimit(5, 1)]
+    )
+    assert allowed and state[0][0] == 4
+
+
+def test_memory_fallback_is_bounded_lru():
+    store = security._MemorySlidingWindow(max_keys=2)
+    lim = [RateLimit(10, 1)]
+    store.hit(["a"], lim)
+    store.hit(["b"], lim)
+    store.hit(["a"], lim)
+    store.hit(["c"], lim)
+    assert list(store._logs) == ["a", "c"]
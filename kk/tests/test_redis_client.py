@@ -0,0 +1,57 @@
+"""Process-wide pooled Redis client: reuse, circuit breaker, fork safety."""
+
+from __future__ import annotations
+
+import pytest
+import redis
+
+import kk.redis_client as rc
+
+
+@pytest.fixture(autouse=True)
+def _unreachable_redis(monkeypatch):
+    # Nothing listens on port 1: connects fail fast with ConnectionError.
+    monkeypatch.setenv("REDIS_URL", "redis://127.0.0.1:1/0")
+    monkeypatch.setenv("REDIS_BREAKER_FAILURES", "2")
+    monkeypatch.setenv("REDIS_BREAKER_COOLDOWN_S", "10")
+    rc.reset_redis_client()
+    yield
+    rc.reset_redis_client()
+
+
+def test_unset_url_returns_none(monkeypatch):
+    monkeypatch.delenv("REDIS_URL")
+    assert rc.get_redis() is None
+
+
+def test_client_is_shared_per_process():
+    a = rc.get_redis()
+    b = rc.get_redis()
+    assert a is not None and a is b
+    assert a.connection_pool is b.connection_pool
+
+
+def test_breaker_opens_after_failures_and_recovers(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rc.time, "monotonic", lambda: now[0])
+    for _ in range(2):
+        with pytest.raises(redis.ConnectionError):
+            rc.get_redis().ping()
+    assert rc.breaker_open()
+    assert rc.get_redis() is None
+
+    now[0] += 11  # cooldown elapsed: next call is a trial
+    client = rc.get_redis()
+    assert client is not None
+    monkeypatch.setattr(redis.Redis, "execute_command", lambda self, *a, **k: True)
+    assert client.ping() is True
+    assert not rc.breaker_open()
+    assert rc._failures == 0
+
+
+def test_new_pool_after_fork(monkeypatch):
+    parent = rc.get_redis()
+    monkeypatch.setattr(rc.os, "getpid", lambda: -1)
+    child = rc.get_redis()
+    assert child is not parent
+    assert child.connection_pool is not parent.connection_pool
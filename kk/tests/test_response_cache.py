@@ -51,3 +51,124 @@ def test_cache_delete_prefix():
     cache_delete_prefix("api_resp:demo:")
     assert cache_get("api_resp:demo:a") is None
     assert cache_get("api_resp:demo:b") is None
+
+
+def test_get_or_compute_single_flight_across_threads():
+    import threading
+    import time
+
+    from kk.response_cache import get_or_compute
+
+    calls = []
+    barrier = threading.Barrier(8)
+    results = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"n": len(calls)}
+
+    def worker():
+        barrier.wait()
+        results.append(get_or_compute("api_resp:demo:sf", slow, ttl_s=60))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert results == [{"n": 1}] * 8
+
+
+def test_get_or_compute_serves_stale_while_one_caller_refreshes(monkeypatch):
+    import kk.response_cache as rc
+
+    rc.get_or_compute("api_resp:demo:swr", lambda: "v1", ttl_s=10)
+    now = rc.time.time()
+    monkeypatch.setattr(rc.time, "time", lambda: now + 15)  # past ttl, inside stale window
+
+    # Someone else holds the refresh lock: stale value, no recompute.
+    assert rc._local_acquire("api_resp:demo:swr")
+    try:
+        assert rc.get_or_compute("api_resp:demo:swr", lambda: "v2", ttl_s=10) == "v1"
+    finally:
+        rc._local_release("api_resp:demo:swr")
+    assert rc.get_or_compute("api_resp:demo:swr", lambda: "v2", ttl_s=10) == "v2"
+    # Released keys leave nothing behind, whatever the key space.
+    assert rc._local_locks == set()
+
+
+def test_get_or_compute_keeps_stale_value_when_refresh_fails(monkeypatch):
+    import kk.response_cache as rc
+
+    rc.get_or_compute("api_resp:demo:err", lambda: "ok", ttl_s=10)
+    now = rc.time.time()
+    monkeypatch.setattr(rc.time, "time", lambda: now + 15)
+
+    def boom():
+        raise RuntimeError("db down")
+
+    assert rc.get_or_compute("api_resp:demo:err", boom, ttl_s=10) == "ok"
+
+
+def test_early_expiry_probability_rises_near_deadline(monkeypatch):
+    import kk.response_cache as rc
+
+    now = rc.time.time()
+    monkeypatch.setattr(rc.time, "time", lambda: now)
+    far = {"v": 1, "x": now + 3600, "d": 0.5}
+    near = {"v": 1, "x": now + 0.01, "d": 0.5}
+    assert all(rc._is_fresh(far, 1.0) for _ in range(200))
+    assert not all(rc._is_fresh(near, 1.0) for _ in range(200))
+
+
+def test_l1_evicts_least_recently_used(monkeypatch):
+    import kk.response_cache as rc
+
+    lru = rc._LRUCache(max_entries=2, max_bytes=10_000)
+    monkeypatch.setattr(rc, "_l1", lru)
+    cache_set("api_resp:demo:a", 1, ttl_s=60)
+    cache_set("api_resp:demo:b", 2, ttl_s=60)
+    assert cache_get("api_resp:demo:a") == 1  # a is now most recent
+    cache_set("api_resp:demo:c", 3, ttl_s=60)
+    assert cache_get("api_resp:demo:b") is None
+    assert cache_get("api_resp:demo:a") == 1
+    stats = rc.cache_stats()["l1"]
+    assert stats["evictions"] == 1
+    assert stats["entries"] == 2
+    assert stats["hits"] == 2 and stats["misses"] == 1
+
+
+def test_l1_byte_bound(monkeypatch):
+    import kk.response_cache as rc
+
+    lru = rc._LRUCache(max_entries=100, max_bytes=30)
+    monkeypatch.setattr(rc, "_l1", lru)
+    cache_set("api_resp:demo:a", "x" * 15, ttl_s=60)
+    cache_set("api_resp:demo:b", "y" * 15, ttl_s=60)
+    assert lru.usage() == (1, 17)
+    cache_set("api_resp:demo:huge", "z" * 100, ttl_s=60)  # larger than the whole tier
+    assert cache_get("api_resp:demo:huge") is None
+    assert cache_get("api_resp:demo:b") == "y" * 15
+    # An oversized overwrite drops the old value instead of leaving it to be served.
+    cache_set("api_resp:demo:b", "w" * 100, ttl_s=60)
+    assert cache_get("api_resp:demo:b") is None
+
+
+def test_remote_invalidation_clears_l1_but_ignores_own_messages():
+    import json
+
+    import kk.response_cache as rc
+
+    cache_set("api_resp:catalog:brands", {"brands": []}, ttl_s=60)
+    cache_set("api_resp:demo:k", 1, ttl_s=60)
+
+    rc._apply_invalidation(json.dumps({"src": rc._node_id(), "prefix": "api_resp:catalog:"}))
+    assert cache_get("api_resp:catalog:brands") == {"brands": []}
+
+    rc._apply_invalidation(json.dumps({"src": "other:1", "prefix": "api_resp:catalog:"}))
+    rc._apply_invalidation(json.dumps({"src": "other:1", "keys": ["api_resp:demo:k"]}))
+    assert cache_get("api_resp:catalog:brands") is None
+    assert cache_get("api_resp:demo:k") is None
+    assert rc.cache_stats()["l1"]["remote_invalidations"] == 2
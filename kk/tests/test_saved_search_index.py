@@ -0,0 +1,141 @@
+"""Saved-search percolator index: same matches as the linear scan, kept current on writes."""
+
+from __future__ import annotations
+
+import random
+
+import pytest
+
+import kk.saved_search_index as ssi
+from kk.listing_filters import car_matches_filters
+from kk.models import Car, SavedSearch, SavedSearchAlert, User, db
+from kk.push import PushBatchResult
+from kk.scripts.bench_saved_search_index import _random_car, _random_filters
+from kk.saved_search_index import SavedSearchIndex, _IntervalTree
+
+_EDGE_FILTERS = [
+    {},
+    {"brand": "toyota,kia"},
+    {"brand": "Mercedes Benz", "min_price": 5000},
+    {"brand": "any"},
+    {"model": "land cruiser"},
+    {"city": "bagh"},
+    {"location": "Erbil", "max_year": 2010},
+    {"body_type": "SUV,pickup", "max_mileage": 100000},
+    {"min_price": 30000, "max_price": 10000},
+    {"min_year": 2015},
+    {"max_mileage": 20000},
+    {"brand": "toyota", "condition": "new"},
+]
+
+
+def test_interval_tree_stab_matches_brute_force():
+    rng = random.Random(3)
+    tree = _IntervalTree()
+    intervals = {}
+    for key in range(300):
+        lo = rng.choice([float("-inf"), rng.uniform(0, 100)])
+        hi = rng.choice([float("inf"), (lo if lo > 0 else 0) + rng.uniform(0, 40)])
+        intervals[key] = (lo, hi)
+        tree.add(key, lo, hi)
+    for key in range(0, 300, 7):
+        tree.discard(key)
+        intervals.pop(key)
+    for x in [-5.0, 0.0, 12.5, 50.0, 99.9, 140.0, *[rng.uniform(-10, 150) for _ in range(50)]]:
+        expected = sorted(k for k, (lo, hi) in intervals.items() if lo <= x <= hi)
+        assert sorted(tree.stab(x)) == expected
+
+
+def test_index_matches_linear_scan():
+    rng = random.Random(11)
+    searches = [(i, i % 13, _random_filters(rng)) for i in range(1, 1500)]
+    searches += [(5000 + i, 1, f) for i, f in enumerate(_EDGE_FILTERS)]
+    index = SavedSearchIndex()
+    for search_id, user_id, filters in searches:
+        index.add(search_id, user_id, filters)
+
+    cars = [_random_car(rng) for _ in range(60)]
+    cars.append(Car(brand="Mercedes-Benz", model="Land Cruiser", location="Baghdad", body_type="suv",
+                    year=2012, price=8000.0, mileage=10000, condition="new"))
+    cars.append(Car(brand=None, model=None, location=None, body_type=None, year=None, price=None, mileage=None))
+    for car in cars:
+        expected = [sid for sid, _, f in searches if car_matches_filters(car, f)]
+        assert [sid for sid, _ in index.match(car)] == expected
+        assert [sid for sid, _ in index.match(car, exclude_user_id=1)] == [
+            sid for sid, uid, f in searches if uid != 1 and car_matches_filters(car, f)
+        ]
+    # Nothing left behind once every search is removed.
+    for search_id, _, _ in searches:
+        index.remove(search_id)
+    assert len(index) == 0
+    assert all(not buckets for buckets in index._postings.values())
+
+
+@pytest.fixture()
+def app(app, make_user):
+    ssi.install_saved_search_index_tracking()
+    ssi.reset_saved_search_index()
+    make_user("seller")
+    make_user("buyer")
+    db.session.commit()
+    yield app
+    ssi.reset_saved_search_index()
+
+
+def _matched_ids(car: Car) -> list[int]:
+    return [sid for sid, _ in ssi.get_saved_search_index().match(car)]
+
+
+def test_index_tracks_saved_search_writes(app, make_car):
+    with app.app_context():
+        buyer = User.query.filter_by(username="buyer").one()
+        assert len(ssi.get_saved_search_index()) == 0
+        car = make_car(1)
+
+        search = SavedSearch(user_id=buyer.id, name="t", filters={"brand": "toyota", "max_price": 20000})
+        db.session.add(search)
+        db.session.commit()
+        assert _matched_ids(car) == [search.id]
+
+        search.filters = {"brand": "kia"}
+        db.session.commit()
+        assert _matched_ids(car) == []
+
+        search.filters = {"brand": "toyota"}
+        search.notify = False
+        db.session.commit()
+        assert _matched_ids(car) == []
+
+        search.notify = True
+        db.session.commit()
+        assert _matched_ids(car) == [search.id]
+
+        db.session.delete(search)
+        db.session.commit()
+        assert _matched_ids(car) == []
+
+        # Rolled-back writes never reach the index.
+        db.session.add(SavedSearch(user_id=buyer.id, name="x", filters={}))
+        db.session.flush()
+        db.session.rollback()
+        assert _matched_ids(car) == []
+
+
+def test_notify_task_alerts_only_matching_searches(app, monkeypatch, make_car):
+    from kk.tasks import alert_tasks
+
+    with app.app_context():
+        seller = User.query.filter_by(username="seller").one()
+        buyer = User.query.filter_by(username="buyer").one()
+        hit = SavedSearch(user_id=buyer.id, name="hit", filters={"brand": "toyota", "min_year": 2015})
+        miss = SavedSearch(user_id=buyer.id, name="miss", filters={"brand": "toyota", "min_year": 2020})
+        own = SavedSearch(user_id=seller.id, name="own", filters={"brand": "toyota"})
+        db.session.add_all([hit, miss, own])
+        car = make_car(seller)
+        db.session.commit()
+
+        monkeypatch.setattr(alert_tasks, "send_each_and_prune", lambda items: PushBatchResult(len(items), 0, []))
+        assert alert_tasks.notify_saved_searches_for_car.run(car.id)["matched"] == 1
+        assert [a.saved_search_id for a in SavedSearchAlert.query.all()] == [hit.id]
+        # Already alerted: no duplicate.
+        assert alert_tasks.notify_saved_searches_for_car.run(car.id)["matched"] == 0
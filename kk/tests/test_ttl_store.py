@@ -0,0 +1,58 @@
+"""Shared TTL store: Redis SETEX with a bounded per-process fallback."""
+
+from __future__ import annotations
+
+import kk.ttl_store as ttl_store
+from kk.ttl_store import TTLStore
+
+
+class _Redis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+class _DownRedis:
+    def __getattr__(self, _name):
+        def fail(*_a, **_k):
+            raise ConnectionError("redis down")
+
+        return fail
+
+
+def test_memory_fallback_expires_and_evicts(monkeypatch):
+    monkeypatch.setattr(ttl_store, "get_redis", lambda: None)
+    store = TTLStore("t:", max_entries=2)
+    store.set("a", {"n": 1}, 60)
+    store.set("b", 2, 60)
+    assert store.get("a") == {"n": 1}  # a is now most recently used
+    store.set("c", 3, 60)
+    assert store.get("b", "miss") == "miss" and store.get("c") == 3
+
+    store.set("gone", True, 0)
+    assert store.get("gone") is None
+    store.delete(["a", "c"])
+    assert store.get("a") is None and store.get("c") is None
+
+
+def test_redis_is_used_when_available_and_failures_fall_back(monkeypatch):
+    r = _Redis()
+    monkeypatch.setattr(ttl_store, "get_redis", lambda: r)
+    store = TTLStore("t:", max_entries=8)
+    store.set("a", [1, 2], 60)
+    assert r.data == {"t:a": "[1,2]"} and store.get("a") == [1, 2]
+    store.delete(["a"])
+    assert store.get("a", "miss") == "miss"
+
+    monkeypatch.setattr(ttl_store, "get_redis", lambda: _DownRedis())
+    store.set("b", "x", 60)
+    assert store.get("b") == "x"
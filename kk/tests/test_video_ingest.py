@@ -0,0 +1,166 @@
+"""Video ingest: chunked storage with a size cap, R2 multipart streaming, probe + poster."""
+
+from __future__ import annotations
+
+import io
+
+import pytest
+
+import kk.r2_ops as r2_ops
+import kk.video_ingest as vi
+from kk.models import Car, CarVideo, User, db
+
+
+def _mp4(path, frames=20, fps=10, size=(320, 240)):
+    cv2 = pytest.importorskip("cv2")
+    import numpy as np
+
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    for i in range(frames):
+        writer.write(np.full((size[1], size[0], 3), 40 + i * 5, np.uint8))
+    writer.release()
+    return path
+
+
+@pytest.fixture()
+def app(app, monkeypatch, tmp_path):
+    monkeypatch.setenv("PLATE_BLUR_ENABLED", "0")
+    # No ffmpeg on PATH: probe and poster go through OpenCV, no preview.
+    monkeypatch.setattr(vi.shutil, "which", lambda name: None)
+    app.config["UPLOAD_FOLDER"] = str(tmp_path / "uploads")
+    return app
+
+
+def test_store_video_streams_chunks_and_enforces_cap(app, tmp_path):
+    url, size = vi.store_video(vi.read_chunks(io.BytesIO(b"x" * 3000), chunk_size=1000), filename="clip.MOV")
+
+    assert url.startswith("uploads/car_videos/") and url.endswith(".mov") and size == 3000
+    assert (tmp_path / url).read_bytes() == b"x" * 3000
+
+    with pytest.raises(vi.VideoTooLarge):
+        vi.store_video(vi.read_chunks(io.BytesIO(b"x" * 3000), chunk_size=1000), filename="big.mp4", max_bytes=2500)
+    assert len(list((tmp_path / "uploads" / "car_videos").iterdir())) == 1
+
+
+class _FakeS3:
+    def __init__(self, fail_on_part=None):
+        self.calls = []
+        self.fail_on_part = fail_on_part
+
+    def create_multipart_upload(self, **kw):
+        self.calls.append(("create", kw["Key"]))
+        return {"UploadId": "u1"}
+
+    def upload_part(self, **kw):
+        self.calls.append(("part", kw["PartNumber"], len(kw["Body"])))
+        if kw["PartNumber"] == self.fail_on_part:
+            raise RuntimeError("boom")
+        return {"ETag": f"e{kw['PartNumber']}"}
+
+    def complete_multipart_upload(self, **kw):
+        self.calls.append(("complete", [p["PartNumber"] for p in kw["MultipartUpload"]["Parts"]]))
+
+    def abort_multipart_upload(self, **kw):
+        self.calls.append(("abort", kw["UploadId"]))
+
+    def put_object(self, **kw):
+        self.calls.append(("put", len(kw["Body"])))
+
+
+@pytest.fixture()
+def fake_s3(monkeypatch):
+    monkeypatch.setattr(r2_ops, "_use_subprocess", lambda: False)
+    monkeypatch.setattr(r2_ops, "_cred_payload", lambda: {"bucket": "b"})
+    client = _FakeS3()
+    monkeypatch.setattr(r2_ops, "_s3_client", lambda creds: client)
+    return client
+
+
+def test_r2_upload_stream_sends_parts_as_they_fill(fake_s3):
+    mib = 1024 * 1024
+    chunks = (b"v" * mib for _ in range(11))
+
+    total = r2_ops.r2_upload_stream(key="car_videos/a.mp4", chunks=chunks, content_type="video/mp4", part_size=5 * mib)
+
+    assert total == 11 * mib
+    assert fake_s3.calls == [
+        ("create", "car_videos/a.mp4"),
+        ("part", 1, 5 * mib),
+        ("part", 2, 5 * mib),
+        ("part", 3, mib),
+        ("complete", [1, 2, 3]),
+    ]
+
+
+def test_r2_upload_stream_small_body_is_one_put_and_failures_abort(fake_s3):
+    mib = 1024 * 1024
+    assert r2_ops.r2_upload_stream(key="k", chunks=[b"abc"]) == 3
+    assert fake_s3.calls == [("put", 3)]
+
+    fake_s3.calls.clear()
+    fake_s3.fail_on_part = 2
+    with pytest.raises(RuntimeError):
+        r2_ops.r2_upload_stream(key="k", chunks=(b"v" * mib for _ in range(12)), part_size=5 * mib)
+    assert fake_s3.calls[-1] == ("abort", "u1")
+
+
+def test_store_video_rejects_empty_body_before_r2_put(app, fake_s3, monkeypatch):
+    monkeypatch.setattr(vi, "_r2_public_base", lambda: "https://cdn.example")
+
+    with pytest.raises(ValueError):
+        vi.store_video(iter([b"", b""]), filename="empty.mp4")
+    assert fake_s3.calls == []
+
+    url, size = vi.store_video(iter([b"", b"abc"]), filename="a.mp4")
+    assert url.startswith("https://cdn.example/car_videos/") and size == 3
+    assert fake_s3.calls == [("put", 3)]
+
+
+def test_process_video_probes_and_stores_poster(app, tmp_path):
+    seller = User(username="s", phone_number="0700", first_name="S", last_name="L", password_hash="x")
+    db.session.add(seller)
+    db.session.flush()
+    car = Car(
+        seller_id=seller.id,
+        brand="toyota",
+        model="camry",
+        year=2018,
+        mileage=1,
+        engine_type="gasoline",
+        transmission="automatic",
+        drive_type="fwd",
+        condition="used",
+        body_type="sedan",
+        price=1000,
+        location="baghdad",
+    )
+    db.session.add(car)
+    db.session.flush()
+    source = _mp4(tmp_path / "src.mp4")
+    with open(source, "rb") as fp:
+        url, size = vi.store_video(vi.read_chunks(fp), filename="walkaround.mp4")
+    video = CarVideo(car_id=car.id, video_url=url, size_bytes=size, processing_status="processing")
+    db.session.add(video)
+    db.session.commit()
+
+    out = vi.process_video(video.id)
+
+    assert out["ok"]
+    d = out["video"]
+    assert (d["duration"], d["width"], d["height"], d["processing_status"]) == (2, 320, 240, "ready")
+    assert d["poster_url"].endswith("_poster.jpg") and (tmp_path / d["poster_url"]).is_file()
+    assert d["preview_url"] is None
+
+    missing = CarVideo(car_id=car.id, video_url="uploads/car_videos/gone.mp4")
+    db.session.add(missing)
+    db.session.commit()
+    assert vi.process_video(missing.id)["video"]["processing_status"] == "failed"
+
+
+def test_enqueue_video_processing_runs_inline_without_broker(app, monkeypatch):
+    seen = []
+    monkeypatch.setattr(vi, "process_video", seen.append)
+
+    vi.enqueue_video_processing([3, 4])
+
+    assert seen == [3, 4]
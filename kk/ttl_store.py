@@ -0,0 +1,84 @@
+"""JSON values with a TTL: Redis ``SETEX`` first, a bounded per-process LRU without it.
+
+Shared by the small caches that only need get / set / delete with expiry
+(``kk.chat_cache``, ``kk.image_dedupe``). When Redis is not configured, or a
+call to it fails, values go to an in-process ``OrderedDict`` capped at
+``max_entries`` (least recently used dropped first) with the same TTL, so
+callers never have to handle the outage themselves.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Iterable
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class TTLStore:
+    """Keys live under ``prefix`` in Redis; the per-process fallback holds at most ``max_entries``."""
+
+    def __init__(self, prefix: str, *, max_entries: int) -> None:
+        self.prefix = prefix
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Decoded value for ``key``, or ``default`` when missing or expired."""
+        r = get_redis()
+        if r is not None:
+            try:
+                raw = r.get(self.prefix + key)
+                return json.loads(raw) if raw is not None else default
+            except Exception as e:
+                logger.warning("%s redis get failed: %s", self.prefix, e)
+        with self._lock:
+            row = self._memory.get(key)
+            if not row:
+                return default
+            if row[0] <= time.time():
+                self._memory.pop(key, None)
+                return default
+            self._memory.move_to_end(key)
+        return json.loads(row[1])
+
+    def set(self, key: str, value: Any, ttl_s: int) -> None:
+        payload = json.dumps(value, separators=(",", ":"))
+        r = get_redis()
+        if r is not None:
+            try:
+                r.setex(self.prefix + key, ttl_s, payload)
+                return
+            except Exception as e:
+                logger.warning("%s redis set failed: %s", self.prefix, e)
+        with self._lock:
+            self._memory[key] = (time.time() + ttl_s, payload)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def delete(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        if not keys:
+            return
+        with self._lock:
+            for key in keys:
+                self._memory.pop(key, None)
+        r = get_redis()
+        if r is not None:
+            try:
+                r.delete(*[self.prefix + k for k in keys])
+            except Exception as e:
+                logger.warning("%s redis delete failed: %s", self.prefix, e)
+
+    def clear_memory(self) -> None:
+        """Drop the per-process entries (tests; Redis is left alone)."""
+        with self._lock:
+            self._memory.clear()
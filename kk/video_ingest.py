@@ -0,0 +1,345 @@
+"""Listing video ingest: streamed storage, then probe, poster and preview off-request.
+
+``upload_car_videos`` used to read each file (up to 100 MB) into memory after
+Werkzeug had already spooled it, and hand the bytes to R2 in one PUT. Nothing
+looked inside the video, so clients downloaded it just to render a thumbnail.
+
+Bodies are now copied in ``VIDEO_STREAM_CHUNK_KB`` chunks straight into an R2
+multipart upload (:func:`kk.r2_ops.r2_upload_stream`) or a local file, with the
+``VIDEO_MAX_UPLOAD_MB`` cap enforced while reading. New ``CarVideo`` rows start
+as ``processing``; :func:`process_video` (Celery task
+``kk.tasks.video_tasks.process_car_video``) probes duration, resolution and
+codec, stores a plate-blurred poster JPEG on ``thumbnail_url`` and, when ffmpeg
+is installed, a short low-bitrate MP4 preview on ``preview_url``. ffprobe /
+ffmpeg are used when on PATH; otherwise OpenCV reads the container (probe and
+poster, no preview).
+"""
+
+from __future__ import annotations
+
+import itertools
+import json
+import logging
+import math
+import os
+import secrets
+import shutil
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from flask import current_app
+
+from .config import env_float, env_int
+from .models import CarVideo, db
+from .tasks.celery_app import broker_configured
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".webm")
+_CONTENT_TYPES = {
+    ".mp4": "video/mp4",
+    ".mov": "video/quicktime",
+    ".webm": "video/webm",
+    ".mkv": "video/x-matroska",
+    ".avi": "video/x-msvideo",
+}
+
+
+class VideoTooLarge(ValueError):
+    """The body exceeded ``VIDEO_MAX_UPLOAD_MB`` while streaming."""
+
+
+def video_max_bytes() -> int:
+    return env_int("VIDEO_MAX_UPLOAD_MB", 100) * 1024 * 1024
+
+
+def video_content_type(ext: str) -> str:
+    ext = (ext or "").lower()
+    if not ext.startswith("."):
+        ext = "." + ext
+    return _CONTENT_TYPES.get(ext, "application/octet-stream")
+
+
+def video_ext(filename: str) -> str:
+    ext = os.path.splitext((filename or "").strip())[1].lower()
+    return ext if ext in VIDEO_EXTENSIONS else ".mp4"
+
+
+def read_chunks(stream, chunk_size: int | None = None) -> Iterator[bytes]:
+    """Yield ``stream`` in chunks of ``VIDEO_STREAM_CHUNK_KB`` (default 1024)."""
+    chunk_size = chunk_size or env_int("VIDEO_STREAM_CHUNK_KB", 1024) * 1024
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _capped(chunks: Iterable[bytes], max_bytes: int) -> Iterator[bytes]:
+    total = 0
+    for chunk in chunks:
+        total += len(chunk)
+        if total > max_bytes:
+            raise VideoTooLarge(f"File too large. Maximum size: {max_bytes // (1024 * 1024)}MB")
+        yield chunk
+
+
+def _non_empty(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Pull the first non-empty chunk now; ``ValueError`` before anything is stored when there is none."""
+    it = iter(chunks)
+    for first in it:
+        if first:
+            return itertools.chain((first,), it)
+    raise ValueError("Empty file body")
+
+
+def _r2_public_base() -> str:
+    from .media_processing import _r2_configured, _r2_public_base as public_base
+
+    return public_base() if _r2_configured() else ""
+
+
+def store_video(chunks: Iterable[bytes], *, filename: str, max_bytes: int | None = None) -> Tuple[str, int]:
+    """
+    Stream ``chunks`` to R2 (public URL) or ``UPLOAD_FOLDER/car_videos``.
+
+    Returns (stored URL or ``uploads/car_videos/...`` path, byte count). Raises
+    :class:`VideoTooLarge` past the cap and ``ValueError`` for an empty body; nothing
+    is left behind on failure.
+    """
+    ext = video_ext(filename)
+    name = f"{secrets.token_hex(16)}{ext}"
+    capped = _non_empty(_capped(chunks, max_bytes or video_max_bytes()))
+    public_base = _r2_public_base()
+    if public_base:
+        from .r2_ops import r2_upload_stream
+
+        key = f"car_videos/{name}"
+        size = r2_upload_stream(key=key, chunks=capped, content_type=video_content_type(ext))
+        return f"{public_base}/{key}", size
+
+    path = os.path.join(current_app.config["UPLOAD_FOLDER"], "car_videos", name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    size = 0
+    try:
+        with open(path, "wb") as fp:
+            for chunk in capped:
+                fp.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+    return f"uploads/car_videos/{name}", size
+
+
+def enqueue_video_processing(video_ids: Iterable[int]) -> None:
+    """Queue :func:`process_video` per video; run inline when there is no broker."""
+    ids = list(video_ids)
+    if broker_configured():
+        try:
+            from .tasks.video_tasks import process_car_video
+
+            for video_id in ids:
+                process_car_video.delay(video_id)
+            return
+        except Exception as exc:
+            logger.warning("video processing: Celery dispatch failed, running inline: %s", exc)
+    for video_id in ids:
+        process_video(video_id)
+
+
+# ---------------------------------------------------------------------------
+# Probe / poster / preview
+# ---------------------------------------------------------------------------
+
+
+def _fourcc(value: float) -> Optional[str]:
+    code = int(value or 0)
+    text = "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4)).strip("\x00 ").lower()
+    return text or None
+
+
+def probe_video(path: str) -> Dict[str, Any]:
+    """Duration (s), width, height and codec of the first video stream."""
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe:
+        proc = subprocess.run(
+            [
+                ffprobe, "-v", "error", "-select_streams", "v:0",
+                "-show_entries", "stream=codec_name,width,height:format=duration",
+                "-of", "json", path,
+            ],
+            capture_output=True,
+            timeout=60,
+            check=True,
+        )
+        data = json.loads(proc.stdout or b"{}")
+        stream = (data.get("streams") or [{}])[0]
+        duration = float((data.get("format") or {}).get("duration") or 0)
+        return {
+            "duration": duration or None,
+            "width": stream.get("width"),
+            "height": stream.get("height"),
+            "codec": stream.get("codec_name"),
+        }
+
+    import cv2  # type: ignore
+
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            raise ValueError("unreadable video")
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0
+        frames = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0
+        return {
+            "duration": frames / fps if fps > 0 and frames > 0 else None,
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or None,
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or None,
+            "codec": _fourcc(cap.get(cv2.CAP_PROP_FOURCC)),
+        }
+    finally:
+        cap.release()
+
+
+def poster_frame(path: str, at_s: float):
+    """One decoded frame near ``at_s`` seconds as an RGB PIL image."""
+    from PIL import Image
+
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg:
+        proc = subprocess.run(
+            [ffmpeg, "-v", "error", "-ss", f"{at_s:.2f}", "-i", path, "-frames:v", "1", "-f", "image2pipe", "-vcodec", "png", "-"],
+            capture_output=True,
+            timeout=60,
+            check=True,
+        )
+        return Image.open(BytesIO(proc.stdout)).convert("RGB")
+
+    import cv2  # type: ignore
+
+    cap = cv2.VideoCapture(path)
+    try:
+        cap.set(cv2.CAP_PROP_POS_MSEC, at_s * 1000.0)
+        ok, frame = cap.read()
+        if not ok:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = cap.read()
+        if not ok:
+            raise ValueError("no decodable frame")
+        return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    finally:
+        cap.release()
+
+
+def _store_poster(image, video_id: int) -> str:
+    from .image_pipeline import ImagePipeline
+    from .media_processing import _plate_detector, persist_image_bytes
+
+    pipeline = ImagePipeline(image)
+    try:
+        detector = _plate_detector()
+        if detector is not None:
+            pipeline.blur_plates(detector, expand_ratio=env_float("PLATE_BLUR_EXPAND", 0.0))
+    except Exception:
+        logger.warning("poster plate blur failed for car_video %s", video_id, exc_info=True)
+    body = pipeline.encode(max_dim=env_int("VIDEO_POSTER_MAX_DIM", 720), quality=75)
+    return persist_image_bytes(
+        body,
+        object_filename=f"video_{video_id}_{secrets.token_hex(4)}_poster.jpg",
+        content_type="image/jpeg",
+    )
+
+
+def _store_preview(path: str) -> Optional[str]:
+    """Transcode the first ``VIDEO_PREVIEW_SECONDS`` to a small H.264 MP4 (ffmpeg only)."""
+    ffmpeg = shutil.which("ffmpeg")
+    seconds = env_int("VIDEO_PREVIEW_SECONDS", 15)
+    if not ffmpeg or seconds <= 0:
+        return None
+    height = env_int("VIDEO_PREVIEW_HEIGHT", 360)
+    bitrate = env_int("VIDEO_PREVIEW_KBPS", 400)
+    fd, out = tempfile.mkstemp(suffix=".mp4")
+    os.close(fd)
+    try:
+        subprocess.run(
+            [
+                ffmpeg, "-v", "error", "-y", "-i", path, "-t", str(seconds),
+                "-vf", f"scale=-2:'min({height},ih)'",
+                "-c:v", "libx264", "-preset", "veryfast", "-b:v", f"{bitrate}k",
+                "-maxrate", f"{bitrate * 5 // 4}k", "-bufsize", f"{bitrate * 2}k",
+                "-an", "-movflags", "+faststart", out,
+            ],
+            capture_output=True,
+            timeout=300,
+            check=True,
+        )
+        with open(out, "rb") as fp:
+            url, _ = store_video(read_chunks(fp), filename="preview.mp4")
+        return url
+    finally:
+        try:
+            os.remove(out)
+        except OSError:
+            pass
+
+
+@contextmanager
+def _local_copy(video: CarVideo) -> Iterator[Optional[str]]:
+    """Path of the stored video on disk (downloaded to a temp file for remote URLs)."""
+    url = (video.video_url or "").strip()
+    if url.startswith("http://") or url.startswith("https://"):
+        import requests
+
+        fd, tmp = tempfile.mkstemp(suffix=video_ext(url.split("?", 1)[0]))
+        try:
+            with os.fdopen(fd, "wb") as fp, requests.get(url, stream=True, timeout=(5, 60)) as resp:
+                resp.raise_for_status()
+                for chunk in resp.iter_content(chunk_size=1024 * 1024):
+                    fp.write(chunk)
+            yield tmp
+        finally:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+        return
+    upload_root = (current_app.config.get("UPLOAD_FOLDER") or "").strip()
+    path = os.path.join(os.path.dirname(os.path.abspath(upload_root)), url.lstrip("/")) if upload_root else ""
+    yield path if path and os.path.isfile(path) else None
+
+
+def process_video(video_id: int) -> Dict[str, Any]:
+    """Probe ``CarVideo`` ``video_id`` and store its poster and preview; marks it ready or failed."""
+    video = db.session.get(CarVideo, video_id)
+    if video is None:
+        return {"ok": False, "error": "not_found"}
+    try:
+        with _local_copy(video) as path:
+            if not path:
+                raise FileNotFoundError(video.video_url)
+            info = probe_video(path)
+            if info.get("duration"):
+                video.duration = int(math.ceil(info["duration"]))
+            video.width = info.get("width") or video.width
+            video.height = info.get("height") or video.height
+            video.codec = (info.get("codec") or "")[:32] or video.codec
+            at_s = env_float("VIDEO_POSTER_AT_S", 1.0)
+            if info.get("duration"):
+                at_s = min(at_s, info["duration"] / 2.0)
+            video.thumbnail_url = _store_poster(poster_frame(path, at_s), video.id)
+            try:
+                video.preview_url = _store_preview(path) or video.preview_url
+            except Exception:
+                logger.warning("preview transcode failed for car_video %s", video.id, exc_info=True)
+        video.processing_status = "ready"
+    except Exception:
+        logger.exception("video processing failed for car_video %s", video_id)
+        video.processing_status = "failed"
+    db.session.commit()
+    return {"ok": video.processing_status == "ready", "video": video.to_dict()}
@@ -0,0 +1,56 @@
+"""add listing_facet_count store for incrementally maintained filter facets
+
+Revision ID: h1i2j3k4l5m6
+Revises: g7h8i9j0k1l2
+Create Date: 2026-10-17
+
+``/api/filters/facets`` reads per-value counts from this table instead of
+running SELECT DISTINCT over ``car``. Counts are kept up to date from Car
+writes; populate existing rows once after upgrading with
+``python -m kk.scripts.rebuild_listing_facets``.
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = "h1i2j3k4l5m6"
+down_revision = "g7h8i9j0k1l2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if inspector.has_table("listing_facet_count"):
+        return
+    op.create_table(
+        "listing_facet_count",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("scope", sa.String(length=160), nullable=False, server_default=""),
+        sa.Column("facet", sa.String(length=40), nullable=False),
+        sa.Column("value_key", sa.String(length=160), nullable=False),
+        sa.Column("label", sa.String(length=160), nullable=False),
+        sa.Column("num_value", sa.Float(), nullable=True),
+        sa.Column("count", sa.Integer(), nullable=False, server_default="0"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("scope", "facet", "value_key", name="uq_listing_facet_count"),
+    )
+    op.create_index(
+        "ix_listing_facet_count_scope_facet",
+        "listing_facet_count",
+        ["scope", "facet"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if not inspector.has_table("listing_facet_count"):
+        return
+    op.drop_index("ix_listing_facet_count_scope_facet", table_name="listing_facet_count")
+    op.drop_table("listing_facet_count")
@@ -0,0 +1,41 @@
+"""add car_image.resolved_url (image path resolved at upload time)
+
+Revision ID: i2j3k4l5m6n7
+Revises: h1i2j3k4l5m6
+Create Date: 2026-10-17
+
+Listing serialization used to stat() every image on disk per response. The
+servable path is now stored when the row is written; fill existing rows once
+after upgrading with ``python -m kk.scripts.backfill_image_paths``.
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = "i2j3k4l5m6n7"
+down_revision = "h1i2j3k4l5m6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if not inspector.has_table("car_image"):
+        return
+    cols = {c["name"] for c in inspector.get_columns("car_image")}
+    if "resolved_url" not in cols:
+        op.add_column("car_image", sa.Column("resolved_url", sa.String(length=2048), nullable=True))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if not inspector.has_table("car_image"):
+        return
+    cols = {c["name"] for c in inspector.get_columns("car_image")}
+    if "resolved_url" in cols:
+        op.drop_column("car_image", "resolved_url")
@@ -0,0 +1,41 @@
+"""add car_image.renditions (multi-resolution WebP/JPEG srcset map)
+
+Revision ID: j3k4l5m6n7o8
+Revises: i2j3k4l5m6n7
+Create Date: 2026-10-17
+
+New uploads record their renditions at upload time. Existing rows are filled
+in batches by the ``kk.tasks.image_tasks.backfill_image_renditions`` Celery
+task (``python -m kk.scripts.backfill_image_renditions``).
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = "j3k4l5m6n7o8"
+down_revision = "i2j3k4l5m6n7"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if not inspector.has_table("car_image"):
+        return
+    cols = {c["name"] for c in inspector.get_columns("car_image")}
+    if "renditions" not in cols:
+        op.add_column("car_image", sa.Column("renditions", sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if not inspector.has_table("car_image"):
+        return
+    cols = {c["name"] for c in inspector.get_columns("car_image")}
+    if "renditions" in cols:
+        op.drop_column("car_image", "renditions")
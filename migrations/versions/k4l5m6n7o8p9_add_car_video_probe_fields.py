@@ -0,0 +1,52 @@
+"""add car_video probe, preview and processing-status columns
+
+Revision ID: k4l5m6n7o8p9
+Revises: j3k4l5m6n7o8
+Create Date: 2026-10-17
+
+Videos are probed after upload by ``kk.tasks.video_tasks.process_car_video``,
+which fills dimensions, codec, the poster (``thumbnail_url``) and a short
+low-bitrate preview. Existing rows keep NULLs.
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = "k4l5m6n7o8p9"
+down_revision = "j3k4l5m6n7o8"
+branch_labels = None
+depends_on = None
+
+_COLUMNS = (
+    ("width", sa.Integer()),
+    ("height", sa.Integer()),
+    ("codec", sa.String(length=32)),
+    ("size_bytes", sa.BigInteger()),
+    ("preview_url", sa.String(length=2048)),
+    ("processing_status", sa.String(length=16)),
+)
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if not inspector.has_table("car_video"):
+        return
+    cols = {c["name"] for c in inspector.get_columns("car_video")}
+    for name, type_ in _COLUMNS:
+        if name not in cols:
+            op.add_column("car_video", sa.Column(name, type_, nullable=True))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if not inspector.has_table("car_video"):
+        return
+    cols = {c["name"] for c in inspector.get_columns("car_video")}
+    for name, _ in reversed(_COLUMNS):
+        if name in cols:
+            op.drop_column("car_video", name)
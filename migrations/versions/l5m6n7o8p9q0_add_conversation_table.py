@@ -0,0 +1,126 @@
+"""add conversation table (materialized chat inbox) and backfill from message
+
+Revision ID: l5m6n7o8p9q0
+Revises: k4l5m6n7o8p9
+Create Date: 2026-10-17
+
+``GET /api/chats`` reads one row per (car, buyer, seller) thread instead of
+folding the caller's latest messages. Existing threads are rebuilt from
+``message``: the listing owner is the seller, the last message by
+``created_at`` is the preview, and unread counters count unread, undeleted
+messages per receiving side. Messages without a car are not part of any thread.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = "l5m6n7o8p9q0"
+down_revision = "k4l5m6n7o8p9"
+branch_labels = None
+depends_on = None
+
+_INDEXES = (
+    ("ix_conversation_car_id", ["car_id"]),
+    ("ix_conversation_buyer_last_message", ["buyer_id", "last_message_at", "id"]),
+    ("ix_conversation_seller_last_message", ["seller_id", "last_message_at", "id"]),
+)
+
+
+def _backfill(conn) -> None:
+    rows = conn.execute(
+        sa.text(
+            "SELECT m.id, m.car_id, m.sender_id, m.receiver_id, m.created_at, m.is_read, m.is_deleted, c.seller_id "
+            "FROM message m JOIN car c ON c.id = m.car_id "
+            "ORDER BY m.created_at, m.id"
+        )
+    )
+    threads = {}
+    for msg_id, car_id, sender_id, receiver_id, created_at, is_read, is_deleted, seller_id in rows:
+        key = (car_id, min(sender_id, receiver_id), max(sender_id, receiver_id))
+        t = threads.get(key)
+        if t is None:
+            if seller_id == sender_id:
+                buyer, seller = receiver_id, sender_id
+            else:
+                buyer, seller = sender_id, receiver_id
+            t = threads[key] = {
+                "car_id": car_id,
+                "buyer_id": buyer,
+                "seller_id": seller,
+                "last_message_at": created_at,
+                "buyer_unread": 0,
+                "seller_unread": 0,
+            }
+        t["last_message_id"] = msg_id
+        t["last_message_at"] = created_at or t["last_message_at"]
+        if not is_read and not is_deleted:
+            t["buyer_unread" if receiver_id == t["buyer_id"] else "seller_unread"] += 1
+    if not threads:
+        return
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    table = sa.table(
+        "conversation",
+        sa.column("car_id"),
+        sa.column("buyer_id"),
+        sa.column("seller_id"),
+        sa.column("last_message_id"),
+        sa.column("last_message_at"),
+        sa.column("buyer_unread"),
+        sa.column("seller_unread"),
+        sa.column("created_at"),
+        sa.column("updated_at"),
+    )
+    batch = []
+    for t in threads.values():
+        batch.append({**t, "last_message_at": t["last_message_at"] or now, "created_at": now, "updated_at": now})
+        if len(batch) >= 1000:
+            op.bulk_insert(table, batch)
+            batch = []
+    if batch:
+        op.bulk_insert(table, batch)
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if inspector.has_table("conversation"):
+        return
+    op.create_table(
+        "conversation",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("car_id", sa.Integer(), nullable=False),
+        sa.Column("buyer_id", sa.Integer(), nullable=False),
+        sa.Column("seller_id", sa.Integer(), nullable=False),
+        sa.Column("last_message_id", sa.Integer(), nullable=True),
+        sa.Column("last_message_at", sa.DateTime(), nullable=False),
+        sa.Column("buyer_unread", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("seller_unread", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["car_id"], ["car.id"]),
+        sa.ForeignKeyConstraint(["buyer_id"], ["user.id"]),
+        sa.ForeignKeyConstraint(["seller_id"], ["user.id"]),
+        sa.ForeignKeyConstraint(["last_message_id"], ["message.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("car_id", "buyer_id", "seller_id", name="uq_conversation_car_buyer_seller"),
+    )
+    for name, cols in _INDEXES:
+        op.create_index(name, "conversation", cols)
+    if inspector.has_table("message") and inspector.has_table("car"):
+        _backfill(conn)
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if not inspector.has_table("conversation"):
+        return
+    for name, _ in reversed(_INDEXES):
+        op.drop_index(name, table_name="conversation")
+    op.drop_table("conversation")
@@ -0,0 +1,53 @@
+"""backfill car.is_featured / car.created_at and make them NOT NULL
+
+Revision ID: m6n7o8p9q0r1
+Revises: l5m6n7o8p9q0
+Create Date: 2026-10-17
+
+The listing feed orders and seeks on ``(is_featured, created_at, id)``. With
+nullable columns the keyset code had to wrap them in ``COALESCE``, which keeps
+``ix_car_active_featured_created_at`` from serving the sort. Legacy NULLs are
+backfilled (not featured; created at ``updated_at`` or now) so the raw columns
+can be used directly.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = "m6n7o8p9q0r1"
+down_revision = "l5m6n7o8p9q0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if not inspector.has_table("car"):
+        return
+    cols = {c["name"] for c in inspector.get_columns("car")}
+    if not {"is_featured", "created_at"} <= cols:
+        return
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    conn.execute(sa.text("UPDATE car SET is_featured = :f WHERE is_featured IS NULL"), {"f": False})
+    if "updated_at" in cols:
+        conn.execute(sa.text("UPDATE car SET created_at = updated_at WHERE created_at IS NULL"))
+    conn.execute(sa.text("UPDATE car SET created_at = :now WHERE created_at IS NULL"), {"now": now})
+    with op.batch_alter_table("car", schema=None) as batch_op:
+        batch_op.alter_column("is_featured", existing_type=sa.Boolean(), nullable=False)
+        batch_op.alter_column("created_at", existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if not inspector.has_table("car"):
+        return
+    with op.batch_alter_table("car", schema=None) as batch_op:
+        batch_op.alter_column("created_at", existing_type=sa.DateTime(), nullable=True)
+        batch_op.alter_column("is_featured", existing_type=sa.Boolean(), nullable=True)
@@ -0,0 +1,42 @@
+"""index listing_facet_count (scope, facet, num_value) for year/price bounds
+
+Revision ID: n7o8p9q0r1s2
+Revises: m6n7o8p9q0r1
+Create Date: 2026-10-17
+
+``read_listing_facets`` takes year/price bounds with ``min(num_value)`` /
+``max(num_value)`` per scope instead of loading every per-price row; this
+index lets both ends be read from the index.
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = "n7o8p9q0r1s2"
+down_revision = "m6n7o8p9q0r1"
+branch_labels = None
+depends_on = None
+
+_INDEX = "ix_listing_facet_count_scope_facet_num"
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if not inspector.has_table("listing_facet_count"):
+        return
+    if _INDEX in {ix["name"] for ix in inspector.get_indexes("listing_facet_count")}:
+        return
+    op.create_index(_INDEX, "listing_facet_count", ["scope", "facet", "num_value"], unique=False)
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if not inspector.has_table("listing_facet_count"):
+        return
+    if _INDEX in {ix["name"] for ix in inspector.get_indexes("listing_facet_count")}:
+        op.drop_index(_INDEX, table_name="listing_facet_count")
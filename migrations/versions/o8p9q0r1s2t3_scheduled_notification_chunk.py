@@ -0,0 +1,104 @@
+"""scheduled_notification_chunk: one row per broadcast chunk
+
+Revision ID: o8p9q0r1s2t3
+Revises: n7o8p9q0r1s2
+Create Date: 2026-10-17
+
+Broadcast chunk state used to live in ``scheduled_notification.result`` as a
+``chunks`` list, so every chunk transition locked the broadcast row and
+rewrote the whole document. Each chunk is now its own row, updated on its
+own. Existing ``chunks`` lists are copied into the table (an in-flight
+``pushing`` claim goes back to ``stored``) and removed from ``result``.
+"""
+
+from __future__ import annotations
+
+import json
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = "o8p9q0r1s2t3"
+down_revision = "n7o8p9q0r1s2"
+branch_labels = None
+depends_on = None
+
+_RESUME_STATE = {"pushing": "stored"}
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if not inspector.has_table("scheduled_notification_chunk"):
+        op.create_table(
+            "scheduled_notification_chunk",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column(
+                "notification_id",
+                sa.Integer(),
+                sa.ForeignKey("scheduled_notification.id", ondelete="CASCADE"),
+                nullable=False,
+            ),
+            sa.Column("chunk_index", sa.Integer(), nullable=False),
+            sa.Column("after_id", sa.Integer(), nullable=False),
+            sa.Column("upto_id", sa.Integer(), nullable=False),
+            sa.Column("state", sa.String(length=20), nullable=False, server_default="pending"),
+            sa.Column("created_count", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("pushed_count", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("updated_at", sa.DateTime(), nullable=False),
+            sa.UniqueConstraint("notification_id", "chunk_index", name="uq_scheduled_notification_chunk"),
+        )
+    if not inspector.has_table("scheduled_notification"):
+        return
+
+    notifications = sa.table(
+        "scheduled_notification",
+        sa.column("id", sa.Integer()),
+        sa.column("result", sa.JSON()),
+        sa.column("updated_at", sa.DateTime()),
+    )
+    chunks = sa.table(
+        "scheduled_notification_chunk",
+        sa.column("notification_id", sa.Integer()),
+        sa.column("chunk_index", sa.Integer()),
+        sa.column("after_id", sa.Integer()),
+        sa.column("upto_id", sa.Integer()),
+        sa.column("state", sa.String()),
+        sa.column("created_count", sa.Integer()),
+        sa.column("pushed_count", sa.Integer()),
+        sa.column("updated_at", sa.DateTime()),
+    )
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    for row_id, result, updated_at in conn.execute(
+        sa.select(notifications.c.id, notifications.c.result, notifications.c.updated_at)
+    ).all():
+        if isinstance(result, str):
+            result = json.loads(result)
+        if not isinstance(result, dict) or "chunks" not in result:
+            continue
+        rows = [
+            {
+                "notification_id": row_id,
+                "chunk_index": i,
+                "after_id": int(c.get("after") or 0),
+                "upto_id": int(c.get("upto") or 0),
+                "state": _RESUME_STATE.get(c.get("state"), c.get("state") or "pending"),
+                "created_count": int(c.get("created") or 0),
+                "pushed_count": int(c.get("pushed") or 0),
+                "updated_at": updated_at or now,
+            }
+            for i, c in enumerate(result["chunks"])
+        ]
+        if rows:
+            conn.execute(sa.insert(chunks), rows)
+        result = {k: v for k, v in result.items() if k != "chunks"}
+        conn.execute(sa.update(notifications).where(notifications.c.id == row_id).values(result=result))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if inspector.has_table("scheduled_notification_chunk"):
+        op.drop_table("scheduled_notification_chunk")
@@ -0,0 +1,43 @@
+"""listing_counter_flush: ids of counter batches already applied
+
+Revision ID: p9q0r1s2t3u4
+Revises: o8p9q0r1s2t3
+Create Date: 2026-10-17
+
+The counter flush applied a drained Redis batch and only then cleared it, so
+a worker dying between the two made the next run apply the batch again. Each
+batch now has an id that is inserted here in the same transaction as its
+UPDATEs; a retried batch whose id is present is just cleared.
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = "p9q0r1s2t3u4"
+down_revision = "o8p9q0r1s2t3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if inspector.has_table("listing_counter_flush"):
+        return
+    op.create_table(
+        "listing_counter_flush",
+        sa.Column("flush_id", sa.String(length=64), primary_key=True),
+        sa.Column("applied_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_listing_counter_flush_applied_at", "listing_counter_flush", ["applied_at"])
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if inspector.has_table("listing_counter_flush"):
+        op.drop_index("ix_listing_counter_flush_applied_at", table_name="listing_counter_flush")
+        op.drop_table("listing_counter_flush")
@@ -28,6 +28,8 @@ class BackendFactorySmokeTest(unittest.TestCase):
         os.environ["SMS_PROVIDER"] = "console"
         os.environ.pop("LISTING_REQUIRE_APPROVAL", None)
         os.environ["DB_PATH"] = os.path.join(self._tmp.name, "t.db")
+        # Keep processed photos and other upload output out of kk/static/uploads.
+        os.environ["UPLOAD_FOLDER"] = os.path.join(self._tmp.name, "uploads")
 
         from kk.app_factory import create_app
 
@@ -151,6 +153,7 @@ class BackendFactorySmokeTest(unittest.TestCase):
                 except Exception:
                     pass
         finally:
+            os.environ.pop("UPLOAD_FOLDER", None)
             self._tmp.cleanup()
 
     def _login(self, username: str, password: str, account_scope: str | None = None) -> str:
@@ -377,7 +380,7 @@ class BackendFactorySmokeTest(unittest.TestCase):
         self.assertIn("expired", response.get_json()["message"].lower())
 
     def test_analytics_track_and_list(self):
-        from kk.listing_metrics import clear_engagement_claims_for_tests
+        from kk.listing_metrics import clear_engagement_claims_for_tests, flush_pending_counters
         from kk.models import ListingAnalytics
 
         clear_engagement_claims_for_tests()
@@ -411,6 +414,7 @@ class BackendFactorySmokeTest(unittest.TestCase):
         self.assertFalse((r_msg.get_json() or {}).get("counted"))
 
         with self.app.app_context():
+            flush_pending_counters()
             a = ListingAnalytics.query.filter_by(car_id=self.car_id).first()
             self.assertIsNotNone(a)
             self.assertEqual(int(a.views or 0), 1)
@@ -425,6 +429,7 @@ class BackendFactorySmokeTest(unittest.TestCase):
         self.assertEqual(send.status_code, 201, send.data)
 
         with self.app.app_context():
+            flush_pending_counters()
             a = ListingAnalytics.query.filter_by(car_id=self.car_id).first()
             self.assertEqual(int(a.messages or 0), 1)
 
@@ -449,6 +454,7 @@ class BackendFactorySmokeTest(unittest.TestCase):
         self.assertIsInstance(r2.get_json(), list)
 
     def test_analytics_favorite_bound_to_toggle(self):
+        from kk.listing_metrics import flush_pending_counters
         from kk.models import ListingAnalytics
 
         hint = self.client.post(
@@ -460,6 +466,7 @@ class BackendFactorySmokeTest(unittest.TestCase):
         self.assertFalse((hint.get_json() or {}).get("counted"))
 
         with self.app.app_context():
+            flush_pending_counters()
             before = ListingAnalytics.query.filter_by(car_id=self.car_id).first()
             fav_before = int(before.favorites or 0) if before else 0
 
@@ -471,6 +478,7 @@ class BackendFactorySmokeTest(unittest.TestCase):
         self.assertTrue((fav.get_json() or {}).get("is_favorited"))
 
         with self.app.app_context():
+            flush_pending_counters()
             a = ListingAnalytics.query.filter_by(car_id=self.car_id).first()
             self.assertIsNotNone(a)
             self.assertEqual(int(a.favorites or 0), fav_before + 1)
@@ -53,7 +53,7 @@ def main() -> int:
 
 	detector = get_plate_detector()
 	if not detector.is_configured():
-		print("Roboflow is not configured. Set ROBOFLOW_API_KEY (and optionally ROBOFLOW_PROJECT/ROBOFLOW_VERSION).")
+		print("Plate detector is not configured. Export the local model (tools/export_plate_model_onnx.py) or set ROBOFLOW_API_KEY.")
 		return 4
 
 	images = _iter_images(in_dir, args.recursive)
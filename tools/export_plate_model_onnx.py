@@ -0,0 +1,46 @@
+"""
+Export the plate model to ONNX for the local detector (kk.license_plate_blur.OnnxPlateDetector).
+
+Usage:
+	python tools/export_plate_model_onnx.py [weights.pt] [--imgsz 640]
+
+Writes kk/weights/yolov8l-iraqi-license-plate.onnx next to the .pt by default, with a
+dynamic batch axis so the detector can run several images per forward pass.
+Requires ultralytics (export only; the API needs onnxruntime or just OpenCV).
+"""
+import argparse
+import os
+import shutil
+import sys
+
+
+def main():
+	root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+	parser = argparse.ArgumentParser(description="Export the YOLOv8 plate model to ONNX.")
+	parser.add_argument("weights", nargs="?", default=os.path.join(root, "kk", "weights", "yolov8l-iraqi-license-plate.pt"))
+	parser.add_argument("--imgsz", type=int, default=int(os.environ.get("PLATE_MODEL_IMGSZ", "640")))
+	parser.add_argument("--opset", type=int, default=12)
+	parser.add_argument("--out", default="", help="Output path (default: weights path with .onnx)")
+	args = parser.parse_args()
+
+	try:
+		from ultralytics import YOLO
+	except Exception:
+		print("Export: ERROR -> ultralytics not installed. Install with: pip install ultralytics onnx")
+		sys.exit(1)
+	if not os.path.exists(args.weights):
+		print(f"Export: weights not found at {args.weights} (train with tools/train_iraqi_lp.py)")
+		sys.exit(1)
+
+	print(f"Export: {args.weights} -> onnx imgsz={args.imgsz} opset={args.opset}")
+	exported = YOLO(args.weights).export(format="onnx", imgsz=args.imgsz, opset=args.opset, dynamic=True, simplify=True)
+	target = args.out or os.path.splitext(args.weights)[0] + ".onnx"
+	if os.path.abspath(str(exported)) != os.path.abspath(target):
+		os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+		shutil.move(str(exported), target)
+	print(f"Export: wrote {target}")
+	print("Export: set PLATE_DETECTOR=onnx (or leave auto) and PLATE_MODEL_IMGSZ to the same imgsz.")
+
+
+if __name__ == "__main__":
+	main()
@@ -13,6 +13,15 @@ Stdin JSON:
   presign_put: expires_in (optional), content_length (optional)
 
 Stdout: {"ok": true, ...} or {"error": "..."}
+
+``--serve``: stay alive and handle one request per stdin line (same fields,
+plus ``body_len`` followed by that many raw body bytes instead of
+``body_path``), replying with one JSON line each. ``kk/r2_ops.py`` keeps a
+small pool of these under eventlet, so the boto3 client and its TLS
+connections are reused across uploads. ``--serve`` also handles the multipart
+steps behind ``r2_upload_stream``: create_multipart, upload_part (body =
+part bytes; upload_id, part_number), complete_multipart (upload_id, parts)
+and abort_multipart (upload_id).
 """
 from __future__ import annotations
 
@@ -20,7 +29,96 @@ import json
 import sys
 
 
+_clients: dict[tuple, object] = {}
+
+
+def _client(account_id: str, access_key: str, secret_key: str, region: str):
+    cache_key = (account_id, access_key, secret_key, region)
+    client = _clients.get(cache_key)
+    if client is None:
+        import boto3
+        from botocore.config import Config
+
+        _clients.clear()
+        client = boto3.client(
+            "s3",
+            region_name=region,
+            endpoint_url=f"https://{account_id}.r2.cloudflarestorage.com",
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            config=Config(signature_version="s3v4", tcp_keepalive=True),
+        )
+        _clients[cache_key] = client
+    return client
+
+
+def serve() -> None:
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    while True:
+        line = stdin.readline()
+        if not line:
+            return
+        try:
+            inp = json.loads(line)
+            body = stdin.read(int(inp.get("body_len") or 0))
+            client = _client(
+                (inp.get("account_id") or "").strip(),
+                (inp.get("access_key") or "").strip(),
+                (inp.get("secret_key") or "").strip(),
+                (inp.get("region") or "auto").strip() or "auto",
+            )
+            op = (inp.get("op") or "").strip()
+            bucket = (inp.get("bucket") or "").strip()
+            key = (inp.get("key") or "").strip()
+            if op == "put_object":
+                client.put_object(
+                    Bucket=bucket,
+                    Key=key,
+                    Body=body,
+                    ContentType=(inp.get("content_type") or "application/octet-stream").strip(),
+                )
+                out = {"ok": True, "key": inp.get("key"), "bytes": len(body)}
+            elif op == "create_multipart":
+                resp = client.create_multipart_upload(
+                    Bucket=bucket,
+                    Key=key,
+                    ContentType=(inp.get("content_type") or "application/octet-stream").strip(),
+                )
+                out = {"ok": True, "upload_id": resp["UploadId"]}
+            elif op == "upload_part":
+                resp = client.upload_part(
+                    Bucket=bucket,
+                    Key=key,
+                    UploadId=inp["upload_id"],
+                    PartNumber=int(inp["part_number"]),
+                    Body=body,
+                )
+                out = {"ok": True, "etag": resp["ETag"]}
+            elif op == "complete_multipart":
+                client.complete_multipart_upload(
+                    Bucket=bucket,
+                    Key=key,
+                    UploadId=inp["upload_id"],
+                    MultipartUpload={"Parts": inp["parts"]},
+                )
+                out = {"ok": True}
+            elif op == "abort_multipart":
+                client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=inp["upload_id"])
+                out = {"ok": True}
+            else:
+                out = {"error": f"unknown op: {op}"}
+        except Exception as e:
+            out = {"error": str(e)}
+        stdout.write(json.dumps(out).encode() + b"\n")
+        stdout.flush()
+
+
 def main() -> None:
+    if "--serve" in sys.argv[1:]:
+        serve()
+        return
+
     try:
         inp = json.load(sys.stdin)
     except Exception as e: